@@ -1,16 +1,19 @@
 ﻿# app.py
 import os
+import sys
 import threading
 import time
 import urllib.request
 import webbrowser
 
-from cato_helper import create_app
-
 # ポート番号やデバッグモードは環境変数から変更できるようにしておく
 PORT = int(os.environ.get("CATO_HELPER_PORT", 5000))
 DEBUG = os.environ.get("CATO_HELPER_DEBUG", "1") == "1"
 
+# "server" なら共用サーバー向けのサーバーモード（cato_helper.server）で起動する。
+# `app.py --server` でも同じ。ワーカー数 / スレッド数などは cato_helper/server.py を参照
+SERVER_MODE = os.environ.get("CATO_HELPER_MODE", "") == "server" or "--server" in sys.argv
+
 
 def open_browser_when_ready(timeout: int = 30) -> None:
     """Flask サーバが立ち上がるまで待ってからブラウザを開く。
@@ -34,6 +37,22 @@ def open_browser_when_ready(timeout: int = 30) -> None:
 
 
 if __name__ == "__main__":
+    # 起動時間の診断（PyInstaller 版でも使えるように app.py から受け付ける）
+    #   例: app.py --diagnose startup / app.py --diagnose importtime
+    if "--diagnose" in sys.argv:
+        from cato_helper.diagnostics import main as diagnose
+
+        sys.exit(diagnose(sys.argv[sys.argv.index("--diagnose") + 1:]))
+
+    if SERVER_MODE:
+        # 各オペレーターが自分のブラウザで開くので、ブラウザの自動起動はしない
+        from cato_helper.server import serve
+
+        serve(port=PORT)
+        sys.exit(0)
+
+    from cato_helper import create_app
+
     app = create_app()
 
     # サーバ起動を待ちつつ、準備できたらブラウザを開くスレッドを起動
@@ -1,16 +1,29 @@
 ﻿# cato_helper/__init__.py
 from __future__ import annotations
 
-from flask import Flask, jsonify, request
+import time
+from typing import TYPE_CHECKING
 
 from .config import Config
 
+if TYPE_CHECKING:
+    from flask import Flask
+
 
 def create_app(config_class: type[Config] = Config) -> Flask:
     """Flask アプリ本体を生成するファクトリ関数。"""
+    # cato_helper.diagnostics などパッケージ内の軽いモジュールだけを使う場合に
+    # Flask まで読み込まないよう、ここで import する
+    from flask import Flask, Response, g, jsonify, request
+
     app = Flask(__name__)
     app.config.from_object(config_class)
 
+    # jsonify / request.get_json は orjson があれば orjson で処理する（Site 数千件の応答用）
+    from .modules.json_provider import FastJSONProvider
+
+    app.json = FastJSONProvider(app)
+
     # --- Blueprint 登録 ---
     from .modules.core import bp as core_bp
     from .modules.network import bp as network_bp
@@ -24,7 +37,67 @@ def create_app(config_class: type[Config] = Config) -> Flask:
     # API 系（/api/* 配下）
     app.register_blueprint(api_bp, url_prefix="/api")
 
+    # --- メトリクス ---
+    from .services.metrics import HTTP_LATENCY, HTTP_REQUESTS, PROMETHEUS_CONTENT_TYPE, registry
+
+    if app.config["SERVER_MODE"]:
+        # メトリクスはワーカープロセスごとに持つので、どのワーカーの値か分かるようにする
+        import os
+
+        registry.const_labels["worker"] = str(os.getpid())
+
+    @app.before_request
+    def _start_request_timer() -> None:
+        g.request_started_at = time.perf_counter()
+
+    @app.after_request
+    def _record_request_metrics(response: Response) -> Response:
+        started_at = g.pop("request_started_at", None)
+        if started_at is not None:
+            # URL そのものではなくルールで集計する（/static/<path> などを 1 系列にまとめる）
+            route = request.url_rule.rule if request.url_rule else "<unmatched>"
+            HTTP_REQUESTS.inc(route=route, method=request.method, status=response.status_code)
+            # ストリーミング応答はヘッダーを返すまでの時間になる
+            HTTP_LATENCY.observe(time.perf_counter() - started_at, route=route, method=request.method)
+        return response
+
+    @app.route("/metrics", methods=["GET"])
+    def metrics() -> Response:
+        """Prometheus 形式のメトリクスを返す。
+
+        値は応答したワーカープロセスのものだけ（複数ワーカーの合算ではない）。
+        サーバーモードでは worker ラベル（pid）が付くので、Prometheus 側で合算する。
+        """
+        return Response(registry.render_prometheus(), content_type=PROMETHEUS_CONTENT_TYPE)
+
+    @app.route("/metrics/summary", methods=["GET"])
+    def metrics_summary():
+        """所要時間の p50 / p95 / p99 を系列ごとにまとめた JSON を返す（応答したワーカーの分だけ）。"""
+        return jsonify(registry.summary())
+
+    # --- CMA セッションの裏での更新 / 複数ワーカー間の state の同期 ---
+    from .services.cma_session import start_session_refresher, sync_shared_state
+
+    start_session_refresher()
+
+    @app.before_request
+    def _sync_shared_state() -> None:
+        # 他のワーカーでログイン / ログアウトされていたら、手元のキャッシュを捨てる
+        sync_shared_state()
+
     # --- 終了処理関連 ---
+    # サーバーモードでは登録しない（全オペレーターの CMA state を消してワーカーを落としてしまうため。
+    # 各自のログアウトは CMA ログアウトボタンで行う）
+    if not app.config["SERVER_MODE"]:
+        _register_shutdown(app)
+
+    return app
+
+
+def _register_shutdown(app: Flask) -> None:
+    """1 人で使うデスクトップモード用の /shutdown を登録する。"""
+    from flask import jsonify, request
+
     from .services.cma_session import cleanup_cma_state
     from .services.response_store import cleanup_response_store
 
@@ -44,5 +117,3 @@ def create_app(config_class: type[Config] = Config) -> Flask:
             os._exit(0)
         func()
         return jsonify({"status": "ok"})
-
-    return app
@@ -21,3 +21,21 @@ class Config:
         # デフォルト値は将来調整しやすいように一応プレースホルダにしておく
         "https://cc.catonetworks.com/api/gql",
     )
+
+    # siteInfo などを Site ごとに取得するときの同時実行数
+    CMA_SITE_INFO_WORKERS: int = int(os.environ.get("CMA_SITE_INFO_WORKERS", 8))
+
+    # siteInfo をエイリアス付きクエリでまとめて取得するときの 1 リクエストあたりの Site 数
+    # （1 を指定すると従来どおり 1 Site ずつ取得する）
+    CMA_SITE_INFO_BATCH_SIZE: int = int(os.environ.get("CMA_SITE_INFO_BATCH_SIZE", 25))
+
+    # --- 起動モード ---
+    # True: 共用サーバーで複数オペレーターが使うサーバーモード（cato_helper.server / wsgi.py）。
+    # /shutdown と画面の終了ボタンを無効にする（1 人の操作で全員がログアウトし、サーバーが落ちるため）
+    SERVER_MODE: bool = False
+
+
+class ServerConfig(Config):
+    """サーバーモード（cato_helper.server / wsgi.py）用の設定。"""
+
+    SERVER_MODE: bool = True
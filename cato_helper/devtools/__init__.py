@@ -0,0 +1 @@
+"""cato_helper.devtools パッケージ。性能計測などの開発用ツールをまとめる。"""
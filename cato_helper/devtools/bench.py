@@ -0,0 +1,329 @@
+﻿# cato_helper/devtools/bench.py
+"""CMA 周りのサービス層のマイクロベンチマーク。
+
+services/ や modules/api/ を変更したときに、性能への影響をデプロイ前に確認するためのもの。
+外部パッケージに頼らない素朴なランナーで、結果は JSON で出力する。
+
+使い方::
+
+    # 計測して結果を表示（ベースラインより閾値以上遅くなったら終了コード 1）
+    python -m cato_helper.devtools.bench
+
+    # 一部だけ計測する / 結果を JSON ファイルに書き出す
+    python -m cato_helper.devtools.bench --filter flatten --output bench_result.json
+
+    # 現在の結果をベースラインとして保存する
+    python -m cato_helper.devtools.bench --update-baseline
+"""
+
+from __future__ import annotations
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Callable, Iterator
+
+BASELINE_FILE = Path(__file__).with_name("bench_baseline.json")
+
+# ベースラインの中央値から何割遅くなったら「劣化」とみなすか
+DEFAULT_THRESHOLD = 0.25
+
+# 1 回の計測で最低これだけの時間は回す（秒）
+_MIN_MEASURE_SECONDS = 0.05
+
+# name -> (説明, セットアップ関数)。セットアップ関数は計測対象の呼び出し可能オブジェクトを返す
+_BENCHMARKS: dict[str, tuple[str, Callable[[contextlib.ExitStack], Callable[[], Any]]]] = {}
+
+
+def benchmark(name: str, description: str):
+    def register(setup: Callable[[contextlib.ExitStack], Callable[[], Any]]):
+        _BENCHMARKS[name] = (description, setup)
+        return setup
+
+    return register
+
+
+@contextlib.contextmanager
+def _patched(obj: Any, attr: str, value: Any) -> Iterator[None]:
+    original = getattr(obj, attr)
+    setattr(obj, attr, value)
+    try:
+        yield
+    finally:
+        setattr(obj, attr, original)
+
+
+def _quiet(func: Callable[[], Any]) -> Callable[[], Any]:
+    """計測対象の print を捨てる（端末への出力時間を計測に含めない）。"""
+
+    def run() -> Any:
+        with contextlib.redirect_stdout(io.StringIO()):
+            return func()
+
+    return run
+
+
+# --- 計測対象 ---
+
+
+def _register_build_session(cookie_count: int) -> None:
+    @benchmark(
+        f"build_session_{cookie_count}_cookies",
+        f"_build_requests_session_from_state（Cookie {cookie_count} 個の state ファイル）",
+    )
+    def setup(stack: contextlib.ExitStack) -> Callable[[], Any]:
+        from ..services import cma_session
+
+        tmp_dir = Path(stack.enter_context(tempfile.TemporaryDirectory()))
+        state_file = tmp_dir / "cato_state.json"
+        tenant_host = f"{cma_session.TENANT}.cc.catonetworks.com"
+        domains = [tenant_host, ".catonetworks.com", f".{tenant_host}", ".example.com"]
+        state = {
+            "cookies": [
+                {
+                    "name": f"cookie_{i}",
+                    "value": "x" * 64,
+                    "domain": domains[i % len(domains)],
+                    "path": "/",
+                    "expires": -1,
+                }
+                for i in range(cookie_count)
+            ],
+            "origins": [],
+        }
+        state_file.write_text(json.dumps(state), encoding="utf-8")
+        stack.enter_context(_patched(cma_session, "STATE_FILE", state_file))
+        return _quiet(cma_session._build_requests_session_from_state)
+
+
+for _count in (50, 500):
+    _register_build_session(_count)
+
+
+@benchmark("graphql_payload_login_state", "loginState の payload 組み立て + JSON エンコード")
+def _setup_payload_login_state(stack: contextlib.ExitStack) -> Callable[[], Any]:
+    from ..services.cma_queries import LOGIN_STATE_QUERY
+    from ..services.query_registry import template_for
+
+    def run() -> bytes:
+        template = template_for("loginState", LOGIN_STATE_QUERY)
+        return template.encode({"authcode": None, "authstate": None})
+
+    return run
+
+
+@benchmark("graphql_payload_site_info_batch_25", "siteInfo 25 件分のエイリアス付き payload 組み立て")
+def _setup_payload_batch(stack: contextlib.ExitStack) -> Callable[[], Any]:
+    from ..modules.api.network_static import SITE_INFO_QUERY
+    from ..services.cma_queries import build_aliased_batch_query
+    from ..services.query_registry import template_for
+
+    site_ids = [str(100000 + i) for i in range(25)]
+
+    def run() -> bytes:
+        query = build_aliased_batch_query(SITE_INFO_QUERY, "siteInfoBatch", "siteId", "ID!", len(site_ids))
+        template = template_for("siteInfoBatch", query)
+        return template.encode({f"id{i}": site_id for i, site_id in enumerate(site_ids)})
+
+    return run
+
+
+@benchmark("graphql_response_decode_sites_500", "Site 500 件分の GraphQL レスポンスのデコード")
+def _setup_response_decode(stack: contextlib.ExitStack) -> Callable[[], Any]:
+    from ..services.json_codec import loads
+
+    sites = [
+        {"id": str(100000 + i), "name": f"site-{i}", "ipRanges": [f"10.{i // 256}.{i % 256}.0/24"]}
+        for i in range(500)
+    ]
+    body = json.dumps({"data": {"accountSnapshot": {"sites": sites}}}).encode("utf-8")
+
+    def run() -> Any:
+        return loads(body)
+
+    return run
+
+
+def _register_flatten(site_count: int) -> None:
+    @benchmark(
+        f"flatten_sites_{site_count}",
+        f"static_route_init の Interface / Subnet 平坦化（{site_count} Site × 2 IF × 4 Subnet）",
+    )
+    def setup(stack: contextlib.ExitStack) -> Callable[[], Any]:
+        from ..modules.api.network_static import _build_site_record
+        from .cma_simulator import SyntheticTopology
+
+        topology = SyntheticTopology(site_count, 2, 4)
+        site_infos = [
+            (str(100000 + i), f"SIM-Site-{i:04d}", topology.site_info(str(100000 + i)))
+            for i in range(site_count)
+        ]
+
+        def run() -> list[dict[str, Any]]:
+            return [_build_site_record(site_id, name, info) for site_id, name, info in site_infos]
+
+        return run
+
+
+for _count in (10, 100, 1000, 5000):
+    _register_flatten(_count)
+
+
+@benchmark("save_response_sync_100", "save_response を同期モードで 100 件（siteInfo 相当のサイズ）")
+def _setup_save_response(stack: contextlib.ExitStack) -> Callable[[], Any]:
+    from ..services import response_store
+    from .cma_simulator import SyntheticTopology
+
+    tmp_dir = Path(stack.enter_context(tempfile.TemporaryDirectory()))
+    stack.enter_context(_patched(response_store, "RESPONSE_DIR", tmp_dir))
+    stack.enter_context(_patched(response_store, "RESPONSE_STORE_ASYNC", False))
+    # 一時ディレクトリで数えたサイズ管理の情報を、計測後に持ち越さない
+    stack.callback(response_store._writer.reset)
+    body = {"data": {"siteInfo": SyntheticTopology(1, 4, 8).site_info("100000")}}
+
+    def run() -> None:
+        for i in range(100):
+            response_store.save_response(f"siteInfo_{i}", body)
+
+    return _quiet(run)
+
+
+@benchmark("resolve_account_display_name_100k", "resolve_account_display_name（10 万件のマップ）")
+def _setup_resolve_name(stack: contextlib.ExitStack) -> Callable[[], Any]:
+    from ..services import cma_account_map
+
+    large_map = {f"E{i:09d}": f"E{i:09d}（顧客 {i}）" for i in range(100_000)}
+    stack.enter_context(_patched(cma_account_map, "ACCOUNT_NAME_MAP", large_map))
+    names = [f"E{i:09d}" for i in range(0, 200_000, 1000)]
+
+    def run() -> None:
+        for name in names:
+            cma_account_map.resolve_account_display_name(name)
+
+    return run
+
+
+# --- ランナー ---
+
+
+def _measure(func: Callable[[], Any], repeat: int) -> dict[str, float]:
+    func()  # ウォームアップ
+
+    # 1 回の計測が _MIN_MEASURE_SECONDS 以上になるよう、ループ回数を決める
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = time.perf_counter() - start
+        if elapsed >= _MIN_MEASURE_SECONDS or number >= 1_000_000:
+            break
+        number *= 10 if elapsed < _MIN_MEASURE_SECONDS / 10 else 2
+
+    samples: list[float] = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        samples.append((time.perf_counter() - start) / number)
+
+    return {
+        "median_us": statistics.median(samples) * 1e6,
+        "min_us": min(samples) * 1e6,
+        "loops": number,
+        "repeat": repeat,
+    }
+
+
+def run_benchmarks(name_filter: str | None = None, repeat: int = 5) -> dict[str, Any]:
+    results: dict[str, Any] = {}
+    for name, (description, setup) in _BENCHMARKS.items():
+        if name_filter and name_filter not in name:
+            continue
+        with contextlib.ExitStack() as stack:
+            func = setup(stack)
+            result = _measure(func, repeat)
+        result["description"] = description
+        results[name] = result
+        print(f"  {name:<40s} median {result['median_us']:>12.1f} us", file=sys.stderr)
+
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+
+
+def compare_with_baseline(
+    report: dict[str, Any], baseline: dict[str, Any], threshold: float
+) -> list[str]:
+    """ベースラインより threshold 以上遅くなったベンチマークの説明を返す。"""
+    regressions: list[str] = []
+    base_results = baseline.get("results", {})
+    for name, result in report["results"].items():
+        base = base_results.get(name)
+        if not base:
+            continue
+        ratio = result["median_us"] / base["median_us"] if base["median_us"] else 1.0
+        result["baseline_median_us"] = base["median_us"]
+        result["ratio"] = ratio
+        if ratio > 1.0 + threshold:
+            regressions.append(
+                f"{name}: {base['median_us']:.1f} us -> {result['median_us']:.1f} us ({ratio:.2f}x)"
+            )
+    return regressions
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m cato_helper.devtools.bench",
+        description="CMA サービス層のマイクロベンチマーク",
+    )
+    parser.add_argument("--filter", help="名前にこの文字列を含むベンチマークだけ実行する")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", type=Path, help="結果 JSON の出力先（省略時は標準出力）")
+    parser.add_argument("--baseline", type=Path, default=BASELINE_FILE)
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=float(os.getenv("CATO_BENCH_THRESHOLD", DEFAULT_THRESHOLD)),
+        help="ベースラインから何割遅くなったら失敗にするか（既定 0.25 = 25%%）",
+    )
+    parser.add_argument("--update-baseline", action="store_true", help="結果をベースラインとして保存する")
+    args = parser.parse_args(argv)
+
+    report = run_benchmarks(args.filter, args.repeat)
+
+    regressions: list[str] = []
+    if args.update_baseline:
+        args.baseline.write_text(json.dumps(report, ensure_ascii=False, indent=2) + "\n", encoding="utf-8")
+        print(f"baseline updated: {args.baseline}", file=sys.stderr)
+    elif args.baseline.exists():
+        baseline = json.loads(args.baseline.read_text(encoding="utf-8"))
+        regressions = compare_with_baseline(report, baseline, args.threshold)
+
+    report["regressions"] = regressions
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        args.output.write_text(text + "\n", encoding="utf-8")
+    else:
+        print(text)
+
+    if regressions:
+        print("performance regression detected:", file=sys.stderr)
+        for line in regressions:
+            print(f"  {line}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,428 @@
+﻿# cato_helper/devtools/cma_simulator.py
+"""CMA GraphQL の代わりに応答するローカル用のシミュレータ。
+
+本番の https://{TENANT}.cc.catonetworks.com/api/v1/graphql には負荷試験をかけられないため、
+手元の PC で性能改善の効果を同じ条件で繰り返し測れるようにする。
+
+- loginState / accountSnapshotSites / siteInfo（エイリアス付きの一括取得を含む）/ account に応答する
+- addNetworkRange（エイリアス付きの一括追加を含む）で追加した Network Range は、以降の siteInfo に含める
+- Site 数 × Interface 数 × Subnet 数を指定して、合成したトポロジを返す
+- 応答遅延とゆらぎ、エラー率、HTTP 429 の発生率を指定できる
+- cma_responses/ に保存したレスポンスを再生することもできる
+
+使い方::
+
+    python -m cato_helper.devtools.cma_simulator --sites 300 --latency-ms 150 --write-state cato_state.json
+
+    # 別のターミナルでツール本体をシミュレータに向けて起動する
+    CATO_CMA_GRAPHQL_URL=http://127.0.0.1:5055/api/v1/graphql python app.py
+"""
+
+from __future__ import annotations
+
+import argparse
+import gzip
+import ipaddress
+import json
+import random
+import re
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Any
+
+from flask import Flask, jsonify, request
+
+from ..services.capture_log import iter_index, list_segments, read_capture
+
+DEFAULT_PORT = 5055
+
+# エイリアス付き一括取得の変数名（id0, id1, ...）
+_BATCH_VAR_PATTERN = re.compile(r"^id(\d+)$")
+
+# エイリアス付き一括追加の変数名（if0 / in0, if1 / in1, ...）
+_RANGE_VAR_PATTERN = re.compile(r"^if(\d+)$")
+
+
+class SyntheticTopology:
+    """指定した規模の Site / Interface / Subnet を決まった規則で生成する。"""
+
+    SUBNET_TYPES = ("Direct", "Routed", "VLAN")
+    DHCP_TYPES = ("DHCP_DISABLED", "DHCP_RANGE", "DHCP_RELAY")
+
+    def __init__(self, sites: int, interfaces: int, subnets: int, account_id: str = "10000") -> None:
+        self.site_count = sites
+        self.interface_count = interfaces
+        self.subnet_count = subnets
+        self.account_id = account_id
+        self._base = int(ipaddress.IPv4Address("10.0.0.0"))
+
+    def _site_id(self, index: int) -> str:
+        return str(100000 + index)
+
+    def _site_index(self, site_id: str) -> int | None:
+        try:
+            index = int(site_id) - 100000
+        except ValueError:
+            return None
+        return index if 0 <= index < self.site_count else None
+
+    def login_state(self) -> dict[str, Any]:
+        return {
+            "id": "1",
+            "accountID": self.account_id,
+            "accountName": "SIMULATOR",
+            "elevatedAccountIds": [],
+            "username": "simulator@example.com",
+            "__typename": "LoginState",
+        }
+
+    def snapshot_sites(self) -> dict[str, Any]:
+        return {
+            "id": self.account_id,
+            "sites": [
+                {"id": self._site_id(i), "info": {"name": f"SIM-Site-{i:04d}"}}
+                for i in range(self.site_count)
+            ],
+        }
+
+    def site_info(self, site_id: str) -> dict[str, Any] | None:
+        index = self._site_index(site_id)
+        if index is None:
+            return None
+
+        interfaces: list[dict[str, Any]] = []
+        for j in range(self.interface_count):
+            subnets: list[dict[str, Any]] = []
+            for k in range(self.subnet_count):
+                # Site / Interface / Subnet ごとに重ならない /24 を割り当てる
+                serial = (index * self.interface_count + j) * self.subnet_count + k
+                network = ipaddress.IPv4Address(self._base + serial * 256)
+                subnets.append(
+                    {
+                        "id": f"{site_id}-{j}-{k}",
+                        "name": f"NET-{j:02d}-{k:02d}",
+                        "type": self.SUBNET_TYPES[k % len(self.SUBNET_TYPES)],
+                        "subnet": {"id": f"{network}/24"},
+                        "gateway": {"id": str(network + 1)},
+                        "vlanTag": 100 + k if k % 3 == 2 else None,
+                        "dhcpSettings": {"dhcpType": self.DHCP_TYPES[k % len(self.DHCP_TYPES)]},
+                    }
+                )
+            interfaces.append({"id": f"{site_id}-{j}", "name": f"LAN {j + 1:02d}", "subnets": subnets})
+
+        return {"id": site_id, "name": f"SIM-Site-{index:04d}", "interfaces": interfaces}
+
+    def site_for_interface(self, interface_id: str) -> str | None:
+        site_id, _, j = interface_id.rpartition("-")
+        if self._site_index(site_id) is None or not j.isdigit() or int(j) >= self.interface_count:
+            return None
+        return site_id
+
+    def account(self) -> dict[str, Any]:
+        return {
+            "id": self.account_id,
+            "vpnRange": {"id": "172.16.0.0/16"},
+            "vpnRangeForDynamicIPAllocation": {"id": "172.17.0.0/16"},
+            "accessSettings": {"staticIpRange": {"id": "172.18.0.0/24"}},
+        }
+
+
+class ReplayTopology:
+    """cma_responses/ に保存したレスポンスから応答を組み立てる。
+
+    files 形式（*.json / *.json.gz）と segments 形式（capture_log）の両方を読む。
+    同じ種類のレスポンスが複数ある場合は新しいものを使う。
+    """
+
+    def __init__(self, directory: Path) -> None:
+        self._login_state: dict[str, Any] = {}
+        self._snapshot: dict[str, Any] = {"id": None, "sites": []}
+        self._account: dict[str, Any] = {}
+        self._sites: dict[str, dict[str, Any]] = {}
+
+        for name, body in self._iter_captures(directory):
+            self._ingest(name, body)
+
+        print(
+            f"[cma_simulator] replay: {len(self._sites)} site(s) loaded from {directory}",
+            flush=True,
+        )
+
+    @staticmethod
+    def _iter_captures(directory: Path):
+        files = sorted(
+            (p for p in directory.glob("*.json*") if not p.name.startswith("captures_")),
+            key=lambda p: p.stat().st_mtime,
+        )
+        for p in files:
+            try:
+                raw = p.read_bytes()
+                if p.suffix == ".gz":
+                    raw = gzip.decompress(raw)
+                elif p.suffix == ".zst":
+                    import zstandard  # type: ignore[import-not-found]
+
+                    raw = zstandard.ZstdDecompressor().decompress(raw)
+                yield p.name, json.loads(raw.decode("utf-8"))
+            except Exception as e:  # noqa: BLE001
+                print(f"[cma_simulator] skip {p.name}: {e!r}")
+
+        if list_segments(directory):
+            for entry in iter_index(directory):
+                yield entry.name, read_capture(directory, entry)["data"]
+
+    def _ingest(self, name: str, body: Any) -> None:
+        if not isinstance(body, dict):
+            return
+        data = body.get("data")
+        if not isinstance(data, dict):
+            return
+
+        if "loginState" in data and isinstance(data["loginState"], dict):
+            self._login_state = data["loginState"]
+        if "accountSnapshot" in data and isinstance(data["accountSnapshot"], dict):
+            self._snapshot = data["accountSnapshot"]
+        if "account" in data and isinstance(data["account"], dict):
+            self._account = data["account"]
+        if "siteInfo" in data and isinstance(data["siteInfo"], dict):
+            self._add_site(data["siteInfo"], name)
+        if name.startswith("siteInfoBatch"):
+            for value in data.values():
+                if isinstance(value, dict):
+                    self._add_site(value, name)
+
+    def _add_site(self, site_info: dict[str, Any], name: str) -> None:
+        site_id = site_info.get("id")
+        if site_id is None:
+            # 古いキャプチャには id が無いことがあるので、ファイル名（siteInfo_<id>_...）から拾う
+            m = re.match(r"^siteInfo_([^_]+)_", name)
+            site_id = m.group(1) if m else None
+        if site_id is not None:
+            self._sites[str(site_id)] = site_info
+
+    def login_state(self) -> dict[str, Any]:
+        return self._login_state
+
+    def snapshot_sites(self) -> dict[str, Any]:
+        return self._snapshot
+
+    def site_info(self, site_id: str) -> dict[str, Any] | None:
+        return self._sites.get(site_id)
+
+    def site_for_interface(self, interface_id: str) -> str | None:
+        for site_id, site_info in self._sites.items():
+            if any(str(iface.get("id")) == interface_id for iface in site_info.get("interfaces") or []):
+                return site_id
+        return None
+
+    def account(self) -> dict[str, Any]:
+        return self._account
+
+
+def create_simulator_app(
+    topology: SyntheticTopology | ReplayTopology,
+    latency_ms: float = 0.0,
+    jitter_ms: float = 0.0,
+    error_rate: float = 0.0,
+    rate_limit_rate: float = 0.0,
+    site_error_rate: float = 0.0,
+    seed: int | None = None,
+) -> Flask:
+    """シミュレータの Flask アプリを生成する。"""
+    app = Flask(__name__)
+    rng = random.Random(seed)
+    rng_lock = threading.Lock()
+    stats = {"requests": 0, "errors": 0, "rate_limited": 0, "ranges_added": 0}
+    # addNetworkRange で追加した Network Range（site_id -> interface_id -> subnets）
+    added_ranges: dict[str, dict[str, list[dict[str, Any]]]] = {}
+    added_lock = threading.Lock()
+
+    def roll(rate: float) -> bool:
+        if rate <= 0:
+            return False
+        with rng_lock:
+            return rng.random() < rate
+
+    def delay() -> None:
+        with rng_lock:
+            wait_ms = latency_ms + rng.uniform(-jitter_ms, jitter_ms)
+        if wait_ms > 0:
+            time.sleep(wait_ms / 1000.0)
+
+    def resolve_site(site_id: Any, alias: str, errors: list[dict[str, Any]]) -> dict[str, Any] | None:
+        if roll(site_error_rate):
+            errors.append({"message": "simulated site error", "path": [alias]})
+            return None
+        site_info = topology.site_info(str(site_id))
+        if site_info is None:
+            errors.append({"message": f"site {site_id} not found", "path": [alias]})
+            return None
+        with added_lock:
+            extra = {iface_id: list(subnets) for iface_id, subnets in added_ranges.get(str(site_id), {}).items()}
+        if not extra:
+            return site_info
+        return {
+            **site_info,
+            "interfaces": [
+                {**iface, "subnets": list(iface.get("subnets") or []) + extra.get(str(iface.get("id")), [])}
+                for iface in site_info.get("interfaces") or []
+            ],
+        }
+
+    def add_range(interface_id: Any, range_input: Any, alias: str, errors: list[dict[str, Any]]) -> dict[str, Any] | None:
+        path = ["site", alias]
+        if roll(site_error_rate):
+            errors.append({"message": "simulated mutation error", "path": path})
+            return None
+        site_id = topology.site_for_interface(str(interface_id))
+        if site_id is None or not isinstance(range_input, dict):
+            errors.append({"message": f"interface {interface_id} not found", "path": path})
+            return None
+        try:
+            subnet = str(ipaddress.ip_network(str(range_input.get("subnet")), strict=True))
+        except ValueError:
+            errors.append({"message": f"invalid subnet: {range_input.get('subnet')}", "path": path})
+            return None
+
+        current = resolve_site(site_id, alias, [])
+        existing = {
+            (s.get("subnet") or {}).get("id")
+            for iface in (current or {}).get("interfaces") or []
+            for s in iface.get("subnets") or []
+        }
+        with added_lock:
+            if subnet in existing:
+                errors.append({"message": f"network range {subnet} already exists", "path": path})
+                return None
+            stats["ranges_added"] += 1
+            range_id = f"{interface_id}-r{stats['ranges_added']}"
+            added_ranges.setdefault(site_id, {}).setdefault(str(interface_id), []).append(
+                {
+                    "id": range_id,
+                    "name": range_input.get("name"),
+                    "type": range_input.get("rangeType") or "Routed",
+                    "subnet": {"id": subnet},
+                    "gateway": {"id": range_input.get("gateway")},
+                    "vlanTag": range_input.get("vlan"),
+                    "dhcpSettings": {"dhcpType": "DHCP_DISABLED"},
+                }
+            )
+        return {"networkRangeId": range_id}
+
+    @app.route("/api/v1/graphql", methods=["POST"])
+    def graphql():
+        stats["requests"] += 1
+        delay()
+
+        if roll(rate_limit_rate):
+            stats["rate_limited"] += 1
+            return jsonify({"errors": [{"message": "Too Many Requests"}]}), 429, {"Retry-After": "1"}
+        if roll(error_rate):
+            stats["errors"] += 1
+            return jsonify({"errors": [{"message": "simulated internal error"}]}), 500
+
+        body = request.get_json(force=True, silent=True) or {}
+        operation = body.get("operationName") or ""
+        variables = body.get("variables") or {}
+        errors: list[dict[str, Any]] = []
+
+        if operation == "loginState":
+            data: dict[str, Any] = {"loginState": topology.login_state()}
+        elif operation == "accountSnapshotSites":
+            data = {"accountSnapshot": topology.snapshot_sites()}
+        elif operation == "siteInfo":
+            data = {"siteInfo": resolve_site(variables.get("siteId"), "siteInfo", errors)}
+        elif operation == "siteInfoBatch":
+            data = {}
+            for var_name, site_id in variables.items():
+                m = _BATCH_VAR_PATTERN.match(var_name)
+                if m:
+                    alias = f"s{m.group(1)}"
+                    data[alias] = resolve_site(site_id, alias, errors)
+        elif operation == "account":
+            data = {"account": topology.account()}
+        elif operation == "addNetworkRange":
+            added = add_range(variables.get("lanSocketInterfaceId"), variables.get("input"), "addNetworkRange", errors)
+            data = {"site": {"addNetworkRange": added}}
+        elif operation == "addNetworkRangeBatch":
+            site_data: dict[str, Any] = {}
+            for var_name, interface_id in variables.items():
+                m = _RANGE_VAR_PATTERN.match(var_name)
+                if m:
+                    alias = f"r{m.group(1)}"
+                    site_data[alias] = add_range(interface_id, variables.get(f"in{m.group(1)}"), alias, errors)
+            data = {"site": site_data}
+        else:
+            return jsonify({"errors": [{"message": f"unsupported operation: {operation}"}]}), 400
+
+        response: dict[str, Any] = {"data": data}
+        if errors:
+            response["errors"] = errors
+        return jsonify(response)
+
+    @app.route("/stats", methods=["GET"])
+    def simulator_stats():
+        return jsonify(stats)
+
+    return app
+
+
+def _write_state_file(path: Path) -> None:
+    """ツール本体が「ログイン済み」と判定できるよう、最小限の state ファイルを書く。"""
+    state = {
+        "cookies": [
+            {"name": "simulator", "value": "1", "domain": ".catonetworks.com", "path": "/"},
+        ],
+        "origins": [],
+    }
+    path.write_text(json.dumps(state), encoding="utf-8")
+    print(f"[cma_simulator] wrote dummy state file: {path}")
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m cato_helper.devtools.cma_simulator",
+        description="CMA GraphQL のローカル用シミュレータ",
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--sites", type=int, default=100, help="Site 数")
+    parser.add_argument("--interfaces", type=int, default=2, help="Site あたりの Interface 数")
+    parser.add_argument("--subnets", type=int, default=4, help="Interface あたりの Subnet 数")
+    parser.add_argument("--latency-ms", type=float, default=100.0, help="応答遅延（ミリ秒）")
+    parser.add_argument("--jitter-ms", type=float, default=20.0, help="応答遅延のゆらぎ（±ミリ秒）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="HTTP 500 を返す割合")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="HTTP 429 を返す割合")
+    parser.add_argument("--site-error-rate", type=float, default=0.0, help="Site 単位で GraphQL エラーにする割合")
+    parser.add_argument("--seed", type=int, default=None, help="乱数シード（再現性が必要な場合）")
+    parser.add_argument("--replay", type=Path, default=None, help="このディレクトリの保存済みレスポンスを再生する")
+    parser.add_argument("--write-state", type=Path, default=None, help="ダミーの cato_state.json を書き出す")
+    args = parser.parse_args(argv)
+
+    if args.replay:
+        topology: SyntheticTopology | ReplayTopology = ReplayTopology(args.replay)
+    else:
+        topology = SyntheticTopology(args.sites, args.interfaces, args.subnets)
+
+    if args.write_state:
+        _write_state_file(args.write_state)
+
+    app = create_simulator_app(
+        topology,
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        site_error_rate=args.site_error_rate,
+        seed=args.seed,
+    )
+
+    print(f"[cma_simulator] CATO_CMA_GRAPHQL_URL=http://{args.host}:{args.port}/api/v1/graphql")
+    app.run(host=args.host, port=args.port, threaded=True, use_reloader=False)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,269 @@
+﻿# cato_helper/diagnostics.py
+"""起動時間の診断コマンド。
+
+別プロセスでアプリを一から起動し（import → create_app → 最初の画面の描画）、
+
+- importtime : モジュールごとの import 時間（``-X importtime`` 相当）を表示する
+- startup    : コールドスタートの所要時間を測り、予算（ミリ秒）を超えたら終了コード 1
+
+を行う。``-X importtime`` が使えない PyInstaller 版でも動くよう、
+import 時間は meta path に差し込んだフックで計測する。
+
+使い方::
+
+    python -m cato_helper.diagnostics importtime --top 30
+    python -m cato_helper.diagnostics startup --runs 5 --budget-ms 2500
+
+    # PyInstaller でビルドした実行ファイルの場合
+    cato_helper.exe --diagnose startup
+
+このモジュールは計測対象を汚さないよう、トップレベルでは標準ライブラリだけを import する。
+"""
+
+from __future__ import annotations
+
+import argparse
+import contextlib
+import importlib.abc
+import io
+import json
+import os
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from typing import Any, Final
+
+# コールドスタートの予算（ミリ秒）。インタプリタ起動から最初の画面を返すまで
+STARTUP_BUDGET_MS: Final[float] = float(os.getenv("CATO_STARTUP_BUDGET_MS", "3000"))
+
+# 計測結果を子プロセスの標準出力から見つけるための目印
+_RESULT_MARKER: Final[str] = "CATO_DIAGNOSTICS_RESULT "
+
+
+class _TimedLoader(importlib.abc.Loader):
+    """元の loader に処理を任せつつ、exec_module の前後で時間を測る。"""
+
+    def __init__(self, loader: Any, timer: ImportTimer, name: str, find_seconds: float) -> None:
+        self._loader = loader
+        self._timer = timer
+        self._name = name
+        self._find_seconds = find_seconds
+
+    def __getattr__(self, attr: str) -> Any:
+        # get_filename / get_data / is_package などは元の loader に任せる
+        return getattr(self._loader, attr)
+
+    def create_module(self, spec: Any) -> Any:
+        return self._loader.create_module(spec)
+
+    def exec_module(self, module: Any) -> None:
+        # 読み込み後に参照される loader は元のものに戻しておく
+        if module.__spec__ is not None:
+            module.__spec__.loader = self._loader
+        module.__loader__ = self._loader
+
+        self._timer._enter(self._find_seconds)
+        try:
+            self._loader.exec_module(module)
+        finally:
+            self._timer._exit(self._name)
+
+
+class ImportTimer(importlib.abc.MetaPathFinder):
+    """import されたモジュールごとに self / cumulative の時間（マイクロ秒）を記録する。
+
+    records は ``-X importtime`` と同じく、読み込みが終わった順に
+    (モジュール名, self_us, cumulative_us, 入れ子の深さ) を持つ。
+    """
+
+    def __init__(self) -> None:
+        self.records: list[tuple[str, int, int, int]] = []
+        self._local = threading.local()
+
+    def install(self) -> None:
+        sys.meta_path.insert(0, self)
+
+    def uninstall(self) -> None:
+        with contextlib.suppress(ValueError):
+            sys.meta_path.remove(self)
+
+    def find_spec(self, fullname: str, path: Any, target: Any = None) -> Any:
+        if getattr(self._local, "finding", False):
+            return None
+        self._local.finding = True
+        start = time.perf_counter()
+        try:
+            for finder in sys.meta_path:
+                if finder is self or not hasattr(finder, "find_spec"):
+                    continue
+                spec = finder.find_spec(fullname, path, target)
+                if spec is not None:
+                    break
+            else:
+                return None
+        finally:
+            self._local.finding = False
+
+        if spec.loader is None or not hasattr(spec.loader, "exec_module"):
+            return spec
+        spec.loader = _TimedLoader(spec.loader, self, fullname, time.perf_counter() - start)
+        return spec
+
+    def _stack(self) -> list[list[float]]:
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def _enter(self, find_seconds: float) -> None:
+        # [開始時刻, 子の合計時間]。find にかかった時間は開始時刻を前にずらして含める
+        self._stack().append([time.perf_counter() - find_seconds, 0.0])
+
+    def _exit(self, name: str) -> None:
+        stack = self._stack()
+        start, children = stack.pop()
+        cumulative = time.perf_counter() - start
+        if stack:
+            stack[-1][1] += cumulative
+        self.records.append(
+            (name, int((cumulative - children) * 1e6), int(cumulative * 1e6), len(stack))
+        )
+
+
+def _probe() -> int:
+    """（子プロセス側）アプリを起動して最初の画面を返すまでを計測し、結果を JSON で出力する。"""
+    timer = ImportTimer()
+    timer.install()
+
+    real_stdout = sys.stdout
+    # アプリ側の print が結果の JSON に混ざらないよう、計測中の出力は捨てる
+    with contextlib.redirect_stdout(io.StringIO()):
+        # パッケージ本体（__init__）は軽く、ここまでに読み込み済み。
+        # Flask や各 Blueprint は create_app の中で import される
+        from cato_helper import create_app
+
+        t1 = time.perf_counter()
+        app = create_app()
+        t2 = time.perf_counter()
+        status = app.test_client().get("/").status_code
+        t3 = time.perf_counter()
+
+    timer.uninstall()
+    result = {
+        "create_app_ms": (t2 - t1) * 1e3,
+        "first_request_ms": (t3 - t2) * 1e3,
+        "first_request_status": status,
+        "imports": timer.records,
+    }
+    real_stdout.write(_RESULT_MARKER + json.dumps(result) + "\n")
+    real_stdout.flush()
+    return 0
+
+
+def _probe_command() -> list[str]:
+    if getattr(sys, "frozen", False):
+        # PyInstaller 版は app.py の --diagnose 経由で自分自身を起動する
+        return [sys.executable, "--diagnose", "_probe"]
+    return [sys.executable, "-m", "cato_helper.diagnostics", "_probe"]
+
+
+def run_probe() -> dict[str, Any]:
+    """別プロセスでアプリを起動し、計測結果（プロセス起動からの wall time を含む）を返す。"""
+    env = dict(os.environ)
+    # 計測用のプロセスではセッション更新のスレッドを起動しない
+    env["CMA_SILENT_REFRESH"] = "0"
+    if not getattr(sys, "frozen", False):
+        package_parent = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        env["PYTHONPATH"] = os.pathsep.join(filter(None, [package_parent, env.get("PYTHONPATH")]))
+
+    start = time.perf_counter()
+    proc = subprocess.run(_probe_command(), capture_output=True, text=True, env=env, timeout=300)
+    wall_ms = (time.perf_counter() - start) * 1e3
+
+    for line in proc.stdout.splitlines():
+        if line.startswith(_RESULT_MARKER):
+            result = json.loads(line[len(_RESULT_MARKER):])
+            result["wall_ms"] = wall_ms
+            return result
+    raise RuntimeError(
+        f"probe failed (exit code {proc.returncode}):\n{proc.stderr[-4000:]}"
+    )
+
+
+def _print_importtime(result: dict[str, Any], top: int) -> None:
+    records = result["imports"]
+    print("import time: self [us] | cumulative | imported package")
+    for name, self_us, cumulative_us, depth in records:
+        print(f"import time: {self_us:>9d} | {cumulative_us:>10d} | {'  ' * depth}{name}")
+
+    print()
+    print(f"slowest {top} modules by cumulative time (top-level imports only):")
+    top_level = sorted((r for r in records if r[3] == 0), key=lambda r: r[2], reverse=True)
+    for name, _self_us, cumulative_us, _depth in top_level[:top]:
+        print(f"  {cumulative_us / 1000:>9.1f} ms  {name}")
+    print()
+    _print_phases(result)
+
+
+def _print_phases(result: dict[str, Any]) -> None:
+    print(
+        f"create_app {result['create_app_ms']:.1f} ms / "
+        f"first request {result['first_request_ms']:.1f} ms "
+        f"(status {result['first_request_status']}) / process wall {result['wall_ms']:.1f} ms"
+    )
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m cato_helper.diagnostics",
+        description="起動時間の診断",
+    )
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_import = sub.add_parser("importtime", help="モジュールごとの import 時間を表示する")
+    p_import.add_argument("--top", type=int, default=20)
+    p_import.add_argument("--json", action="store_true", help="計測結果を JSON で出力する")
+
+    p_startup = sub.add_parser("startup", help="コールドスタート時間が予算内か確認する")
+    p_startup.add_argument("--runs", type=int, default=3)
+    p_startup.add_argument(
+        "--budget-ms",
+        type=float,
+        default=STARTUP_BUDGET_MS,
+        help="中央値がこれを超えたら終了コード 1（既定: 環境変数 CATO_STARTUP_BUDGET_MS または 3000）",
+    )
+
+    sub.add_parser("_probe", help=argparse.SUPPRESS)
+
+    args = parser.parse_args(argv)
+
+    if args.command == "_probe":
+        return _probe()
+
+    if args.command == "importtime":
+        result = run_probe()
+        if args.json:
+            print(json.dumps(result, ensure_ascii=False, indent=2))
+        else:
+            _print_importtime(result, args.top)
+        return 0
+
+    walls: list[float] = []
+    for i in range(args.runs):
+        result = run_probe()
+        walls.append(result["wall_ms"])
+        print(f"run {i + 1}: ", end="")
+        _print_phases(result)
+
+    median = statistics.median(walls)
+    print(f"cold start median {median:.1f} ms (budget {args.budget_ms:.0f} ms)")
+    if median > args.budget_ms:
+        print("startup time budget exceeded", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
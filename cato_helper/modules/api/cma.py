@@ -1,13 +1,19 @@
 ﻿# cato_helper/modules/api/cma.py
 from __future__ import annotations
 
+import asyncio
+from typing import Any
+
 from flask import jsonify, request
 
 from . import bp
+from ..cma_target import cma_target_from_request
+from ...services.async_loop import run_async
+from ...services.cma_graphql_client import get_graphql_client
 from ...services.cma_session import (
+    CmaTarget,
     has_cma_state,
-    _build_requests_session_from_state,  # 内部ヘルパーだが、ここでは割り切って利用する
-    CMA_GRAPHQL_URL,
+    get_login_state,
 )
 from ...services.cma_queries import LOGIN_STATE_QUERY
 from ...services.response_store import save_response
@@ -23,37 +29,55 @@ def execute_cma_query():
     リクエストボディ例:
     {
         "name": "loginState",
-        "variables": { ... }  # 省略可
+        "variables": { ... },  # 省略可
+        "refresh": false,      # 省略可。true ならキャッシュを使わず取り直す
+        "profile": "ops-a"     # 省略可。tenant / profile でセッションを選ぶ（cma_target 参照）
     }
     """
 
-    if not has_cma_state():
+    try:
+        target = cma_target_from_request()
+    except RuntimeError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+    if not has_cma_state(target):
         return jsonify({"status": "error", "message": "CMA にログインしていません。"}), 401
 
     body = request.get_json(force=True, silent=True) or {}
     query_name = body.get("name") or "loginState"
     variables = body.get("variables") or {}
+    force_refresh = bool(body.get("refresh"))
 
     # まずは loginState のみサポート
     if query_name != "loginState":
         return jsonify({"status": "error", "message": f"unsupported query: {query_name}"}), 400
 
-    sess = _build_requests_session_from_state()
+    result, status_code = run_async(
+        _execute_cma_query_async(target, query_name, variables, force_refresh)
+    )
+    return jsonify(result), status_code
 
-    payload = {
-        "operationName": "loginState",
-        "variables": variables or {"authcode": None, "authstate": None},
-        "query": LOGIN_STATE_QUERY,
-    }
+
+async def _execute_cma_query_async(
+    target: CmaTarget, query_name: str, variables: dict[str, Any], force_refresh: bool
+) -> tuple[dict[str, Any], int]:
+    """execute_cma_query の本体（共有のイベントループ上で実行する）。"""
+    if not variables:
+        # 既定の variables なら、共有の loginState キャッシュから返す
+        try:
+            login_state = await asyncio.to_thread(get_login_state, force_refresh, target)
+        except Exception as e:  # noqa: BLE001
+            return {"status": "error", "message": str(e)}, 500
+        return {"status": "ok", "data": {"data": {"loginState": login_state}}}, 200
 
     try:
-        resp = sess.post(CMA_GRAPHQL_URL, json=payload, timeout=30)
-        resp.raise_for_status()
-        result = resp.json()
+        result = await get_graphql_client(target).execute(
+            LOGIN_STATE_QUERY, variables, "loginState", raise_on_errors=False
+        )
     except Exception as e:  # noqa: BLE001
-        return jsonify({"status": "error", "message": str(e)}), 500
+        return {"status": "error", "message": str(e)}, 500
 
     # デバッグ / 解析用にレスポンスを保存
-    save_response(query_name, result)
+    await asyncio.to_thread(save_response, query_name, result)
 
-    return jsonify({"status": "ok", "data": result})
+    return {"status": "ok", "data": result}, 200
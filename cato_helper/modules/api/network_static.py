@@ -1,18 +1,56 @@
 ﻿# cato_helper/modules/api/network_static.py
 from __future__ import annotations
 
-from typing import Any
+import asyncio
+import re
+import shutil
+import tempfile
+import time
+from functools import lru_cache
+from typing import IO, Any, AsyncIterator, Iterator
 
-from flask import jsonify
+from flask import Response, current_app, jsonify, request
 
 from . import bp
+from ..cma_target import cma_target_from_request
 from ...services.cma_session import (
+    CmaTarget,
     has_cma_state,
-    _build_requests_session_from_state,  # 内部ヘルパーだが、ここでは割り切って利用する
-    CMA_GRAPHQL_URL,
+    get_cma_session,
+    get_login_context,
 )
-from ...services.cma_queries import LOGIN_STATE_QUERY
+from ...services.async_loop import iter_async, run_async
+from ...services.cma_cache import invalidate_cma_cache, make_cache_key, response_cache
+from ...services.cma_graphql_client import get_graphql_client
+from ...services.cma_queries import build_aliased_batch_query
+from ...services.json_codec import dumps
+from ...services.prefix_index import PrefixIndex, prefix_indexes
+from ...services.query_registry import register_query
 from ...services.response_store import save_response
+from ...services.route_import import (
+    ROUTE_IMPORT_MAX_ROWS,
+    ROUTE_IMPORT_VALIDATE_CHUNK,
+    ImportRowValidator,
+    RouteImportJob,
+    apply_job,
+    detect_import_format,
+    iter_import_rows,
+    network_range_input,
+    route_imports,
+)
+from ...services.route_validation import MAX_ROUTES_PER_CHECK, checker_for
+from ...services.site_topology import site_topology
+from ...services.topology_snapshot import topology_snapshots
+
+
+# stream パラメータで指定できる形式と Content-Type
+STREAM_MIMETYPES: dict[str, str] = {
+    "ndjson": "application/x-ndjson",
+    "sse": "text/event-stream",
+}
+
+# siteInfo などを並行取得するときの同時実行数のデフォルト値（CMA_SITE_INFO_WORKERS が無い場合）
+DEFAULT_MAX_WORKERS: int = 8
 
 
 # --- GraphQL クエリ定義（必要な項目だけの軽量版） ---
@@ -78,28 +116,88 @@ ACCOUNT_IP_RANGES_QUERY = """query account($accountID: ID!) {
 }
 """
 
+# Static Route は Interface 上の Routed な Network Range（gateway が次ホップ）として追加する
+ADD_NETWORK_RANGE_MUTATION = """mutation addNetworkRange($accountId: ID!, $lanSocketInterfaceId: ID!, $input: AddNetworkRangeInput!) {
+  site(accountId: $accountId) {
+    addNetworkRange(lanSocketInterfaceId: $lanSocketInterfaceId, input: $input) {
+      networkRangeId
+    }
+  }
+}
+"""
+
+# payload の query 部分を事前にエンコードしておく（query_registry 参照）
+register_query("accountSnapshotSites", ACCOUNT_SNAPSHOT_SITES_QUERY)
+register_query("siteInfo", SITE_INFO_QUERY)
+register_query("account", ACCOUNT_IP_RANGES_QUERY)
+register_query("addNetworkRange", ADD_NETWORK_RANGE_MUTATION)
 
-def _post_graphql(
-    sess, query: str, variables: dict[str, Any] | None, operation_name: str, save_name: str
+# addNetworkRangeBatch のエイリアス（r0, r1, ...）
+_RANGE_ALIAS_PATTERN = re.compile(r"^r\d+$")
+
+
+@lru_cache(maxsize=64)
+def _build_add_network_range_batch(count: int) -> str:
+    """addNetworkRange を count 件、エイリアス付きで 1 本の mutation にまとめる。
+
+    レスポンスの data は {"site": {"r0": {"networkRangeId": ...}, "r1": ...}} の形になる。
+    """
+    var_defs = ["$accountId: ID!"]
+    fields: list[str] = []
+    for i in range(count):
+        var_defs.append(f"$if{i}: ID!, $in{i}: AddNetworkRangeInput!")
+        fields.append(
+            f"    r{i}: addNetworkRange(lanSocketInterfaceId: $if{i}, input: $in{i}) {{\n"
+            "      networkRangeId\n"
+            "    }"
+        )
+    return (
+        f"mutation addNetworkRangeBatch({', '.join(var_defs)}) {{\n"
+        "  site(accountId: $accountId) {\n"
+        + "\n".join(fields)
+        + "\n  }\n}\n"
+    )
+
+
+async def _post_graphql_raw(
+    cma_target: CmaTarget,
+    query: str,
+    variables: dict[str, Any] | None,
+    operation_name: str,
+    save_name: str,
+    *,
+    cache_scope: str | None = None,
+    force_refresh: bool = False,
 ) -> dict[str, Any]:
-    """共通の GraphQL POST ヘルパー。
+    """GraphQL を叩いてレスポンス全体（data / errors を含む）を返す。
 
-    - CMA の既存セッションを使って GraphQL を叩く
+    - CMA の既存セッションを使って、非同期クライアント（cma_graphql_client）で GraphQL を叩く
     - デバッグ用にレスポンスを response_store に保存する
+    - 読み取り系なので、(CmaTarget.key, cache_scope, operationName, variables) 単位で
+      cma_cache にキャッシュする。force_refresh=True ならキャッシュを使わない。
     """
-    payload: dict[str, Any] = {
-        "operationName": operation_name,
-        "variables": variables or {},
-        "query": query,
-    }
+    key = make_cache_key(cma_target.key, cache_scope, operation_name, variables)
+    return await response_cache.aget_or_load(
+        key,
+        operation_name,
+        lambda: _post_graphql_uncached(cma_target, query, variables, operation_name, save_name),
+        force_refresh=force_refresh,
+        # 一部 Site のエラーを含む応答はキャッシュせず、次回また取り直す
+        should_cache=lambda body: not body.get("errors"),
+    )
+
 
-    resp = sess.post(CMA_GRAPHQL_URL, json=payload, timeout=30)
-    resp.raise_for_status()
-    data = resp.json()
+async def _post_graphql_uncached(
+    cma_target: CmaTarget, query: str, variables: dict[str, Any] | None, operation_name: str, save_name: str
+) -> dict[str, Any]:
+    """キャッシュを通さずに GraphQL を叩く。"""
+    client = get_graphql_client(cma_target)
+    # errors は呼び出し側（バッチ取得の Site ごとの振り分けなど）で扱う
+    data = await client.execute(query, variables, operation_name, raise_on_errors=False)
 
-    # 解析用に保存（失敗/成功に関わらず）
+    # 解析用に保存（失敗/成功に関わらず）。ファイル書き込みでループを止めないよう別スレッドで
     try:
-        save_response(save_name, data)
+        await asyncio.to_thread(save_response, save_name, data)
     except Exception:
         # 保存に失敗しても API 自体は継続する
         pass
@@ -107,59 +205,143 @@ def _post_graphql(
     if not isinstance(data, dict) or "data" not in data:
         raise RuntimeError("Unexpected GraphQL response format")
 
-    return data["data"]
+    return data
 
 
-@bp.route("/network/static-route/init", methods=["GET"])
-def static_route_init() -> tuple[Any, int] | Any:
-    """Static Route 追加画面の初期データを返す API。
+async def _post_graphql(
+    cma_target: CmaTarget,
+    query: str,
+    variables: dict[str, Any] | None,
+    operation_name: str,
+    save_name: str,
+    *,
+    cache_scope: str | None = None,
+    force_refresh: bool = False,
+) -> dict[str, Any]:
+    """共通の GraphQL POST ヘルパー。data 部分だけを返す。"""
+    body = await _post_graphql_raw(
+        cma_target,
+        query,
+        variables,
+        operation_name,
+        save_name,
+        cache_scope=cache_scope,
+        force_refresh=force_refresh,
+    )
+    return body["data"]
 
-    - Site 一覧 + 各 Site の Network 情報
-    - SDP リモートユーザー用 IP Range（Default / Dynamic / Static）
-    """  # noqa: D401
-    if not has_cma_state():
-        # CMA 未ログイン
-        return jsonify({"status": "error", "message": "CMA not logged in"}), 401
 
-    # Playwright で保存された state から requests.Session を構築
-    try:
-        sess = _build_requests_session_from_state()
-    except Exception as e:  # noqa: BLE001
-        return jsonify({"status": "error", "message": str(e)}), 500
+async def _fetch_site_info_batch(
+    cma_target: CmaTarget, site_ids: list[str], account_id: str | None = None, force_refresh: bool = False
+) -> dict[str, dict[str, Any] | Exception]:
+    """複数 Site の siteInfo をエイリアス付きの 1 リクエストでまとめて取得する。
 
-    # --- 1) loginState から accountID を取得 ---
-    try:
-        login_data = _post_graphql(
-            sess,
-            LOGIN_STATE_QUERY,
-            {"authcode": None, "authstate": None},
-            "loginState",
-            "loginState_for_static_route",
+    戻り値は site_id -> siteInfo（失敗した Site は例外オブジェクト）。
+    GraphQL の errors は path の先頭（エイリアス）で Site に振り分けるので、
+    1 Site のエラーでチャンク全体が失敗扱いになることはない。
+    """
+    if len(site_ids) == 1:
+        # 1 件だけなら通常の siteInfo クエリで十分（data.siteInfo を 1 件分のエイリアスとして扱う）
+        query, operation_name = SITE_INFO_QUERY, "siteInfo"
+        variables = {"siteId": site_ids[0]}
+        aliases = ["siteInfo"]
+    else:
+        query = build_aliased_batch_query(
+            SITE_INFO_QUERY, "siteInfoBatch", "siteId", "ID!", len(site_ids)
         )
-        login_state = login_data.get("loginState", {}) if isinstance(login_data, dict) else {}
-        account_id = login_state.get("accountID")
-        if not account_id:
-            raise RuntimeError("accountID not found in loginState response")
-    except Exception as e:  # noqa: BLE001
-        return jsonify({"status": "error", "message": f"loginState error: {e}"}), 500
+        operation_name = "siteInfoBatch"
+        variables = {f"id{i}": site_id for i, site_id in enumerate(site_ids)}
+        aliases = [f"s{i}" for i in range(len(site_ids))]
+    body = await _post_graphql_raw(
+        cma_target,
+        query,
+        variables,
+        operation_name,
+        f"{operation_name}_{site_ids[0]}",
+        cache_scope=account_id,
+        force_refresh=force_refresh,
+    )
+
+    data = body.get("data") or {}
+    alias_errors: dict[str, str] = {}
+    global_errors: list[str] = []
+    for err in body.get("errors") or []:
+        if not isinstance(err, dict):
+            continue
+        message = err.get("message") or "GraphQL error"
+        path = err.get("path") or []
+        if path:
+            alias_errors.setdefault(str(path[0]), message)
+        else:
+            global_errors.append(message)
+
+    results: dict[str, dict[str, Any] | Exception] = {}
+    for alias, site_id in zip(aliases, site_ids):
+        site_info = data.get(alias)
+        if alias in alias_errors and not site_info:
+            results[site_id] = RuntimeError(alias_errors[alias])
+        elif isinstance(site_info, dict):
+            results[site_id] = site_info
+        else:
+            message = global_errors[0] if global_errors else "siteInfo not found in response"
+            results[site_id] = RuntimeError(message)
+    return results
+
+
+def _flatten_site_networks(site_info: dict[str, Any]) -> list[dict[str, Any]]:
+    """siteInfo の interfaces / subnets を画面表示用の 1 行 1 Network に平坦化する。"""
+    networks: list[dict[str, Any]] = []
+    for iface in site_info.get("interfaces", []) or []:
+        iface_name = iface.get("name") or ""
+        for subnet in iface.get("subnets", []) or []:
+            subnet_obj = subnet.get("subnet") or {}
+            gw_obj = subnet.get("gateway") or {}
+            dhcp_settings = subnet.get("dhcpSettings") or {}
+
+            networks.append(
+                {
+                    "interface_id": iface.get("id"),
+                    "interface_name": iface_name,
+                    "subnet_name": subnet.get("name"),
+                    "type": subnet.get("type"),
+                    "cidr": subnet_obj.get("id"),
+                    "gateway": gw_obj.get("id"),
+                    "vlan": subnet.get("vlanTag"),
+                    "dhcp_type": dhcp_settings.get("dhcpType"),
+                }
+            )
+    return networks
+
+
+def _build_site_record(site_id: str, site_name: str, site_info: Any) -> dict[str, Any]:
+    """画面に返す 1 Site 分のレコードを組み立てる。"""
+    if isinstance(site_info, Exception) or site_info is None:
+        # 1 Site だけ失敗しても他の Site は返す
+        site_name = f"{site_name} (取得エラー: {site_info})"
+        site_info = {"interfaces": []}
+
+    return {
+        "id": site_id,
+        "name": site_name,
+        "networks": _flatten_site_networks(site_info),
+    }
 
-    # --- 2) Site 一覧を取得 ---
-    try:
-        snapshot_data = _post_graphql(
-            sess,
-            ACCOUNT_SNAPSHOT_SITES_QUERY,
-            {"accountID": str(account_id)},
-            "accountSnapshotSites",
-            "accountSnapshotSites_for_static_route",
-        )
-        snapshot = snapshot_data.get("accountSnapshot", {}) if isinstance(snapshot_data, dict) else {}
-        raw_sites = snapshot.get("sites", []) or []
-    except Exception as e:  # noqa: BLE001
-        return jsonify({"status": "error", "message": f"accountSnapshotSites error: {e}"}), 500
 
-    # --- 3) 各 Site ごとの Network 情報を取得 ---
-    sites_with_networks: list[dict[str, Any]] = []
+async def _list_sites(cma_target: CmaTarget, account_id: str, force_refresh: bool) -> list[tuple[str, str]]:
+    """accountSnapshotSites から (site_id, site_name) の一覧を取得する。"""
+    snapshot_data = await _post_graphql(
+        cma_target,
+        ACCOUNT_SNAPSHOT_SITES_QUERY,
+        {"accountID": account_id},
+        "accountSnapshotSites",
+        "accountSnapshotSites_for_static_route",
+        cache_scope=account_id,
+        force_refresh=force_refresh,
+    )
+    snapshot = snapshot_data.get("accountSnapshot", {}) if isinstance(snapshot_data, dict) else {}
+    raw_sites = snapshot.get("sites", []) or []
 
+    targets: list[tuple[str, str]] = []
     for site in raw_sites:
         site_id = site.get("id")
         info = site.get("info", {}) or {}
@@ -169,76 +351,839 @@ def static_route_init() -> tuple[Any, int] | Any:
             # ID が取れない場合はスキップ
             continue
 
+        targets.append((str(site_id), site_name))
+    return targets
+
+
+def _parse_refresh_mode(value: str | None) -> str:
+    """refresh パラメータを "" / "incremental" / "full" のいずれかに正規化する。"""
+    value = (value or "").lower()
+    if value in ("", "0", "false"):
+        return ""
+    if value == "full":
+        return "full"
+    return "incremental"
+
+
+async def _iter_site_records(
+    cma_target: CmaTarget,
+    account_id: str,
+    targets: list[tuple[str, str]],
+    refresh_mode: str,
+    max_workers: int,
+    batch_size: int,
+    changes: dict[str, list[str]],
+) -> AsyncIterator[tuple[int, dict[str, Any], bool]]:
+    """各 Site の Network 情報を返す。戻り値は (並び順, レコード, 前回から変わったか)。
+
+    - 前回取得から鮮度内の Site は、保持中の siteInfo をそのまま使う（先に返す）
+    - 追加・鮮度切れの Site だけを並行に取得し（同時実行数は max_workers まで）、取得できた順に返す
+    - refresh_mode="full" の場合は全 Site を取り直す
+
+    changes には追加 / 削除 / 内容が変わった Site の ID を詰めて返す。
+    """
+    scope = (cma_target.key, account_id)
+    if not site_topology.has_scope(scope):
+        # 再起動・再ログイン直後は、前回保存したトポロジで埋めてから差分を取る
         try:
-            site_info_data = _post_graphql(
-                sess,
-                SITE_INFO_QUERY,
-                {"siteId": str(site_id)},
-                "siteInfo",
-                f"siteInfo_{site_id}",
-            )
-            site_info = site_info_data.get("siteInfo", {}) if isinstance(site_info_data, dict) else {}
+            entries = await asyncio.to_thread(topology_snapshots.site_entries, cma_target.key, account_id)
+            site_topology.seed(scope, entries)
         except Exception as e:  # noqa: BLE001
-            # 1 Site だけ失敗しても他の Site は返す
-            site_info = {"interfaces": []}
-            site_name = f"{site_name} (取得エラー: {e})"
-
-        networks: list[dict[str, Any]] = []
-        for iface in site_info.get("interfaces", []) or []:
-            iface_name = iface.get("name") or ""
-            for subnet in iface.get("subnets", []) or []:
-                subnet_obj = subnet.get("subnet") or {}
-                gw_obj = subnet.get("gateway") or {}
-                dhcp_settings = subnet.get("dhcpSettings") or {}
-
-                networks.append(
-                    {
-                        "interface_name": iface_name,
-                        "subnet_name": subnet.get("name"),
-                        "type": subnet.get("type"),
-                        "cidr": subnet_obj.get("id"),
-                        "gateway": gw_obj.get("id"),
-                        "vlan": subnet.get("vlanTag"),
-                        "dhcp_type": dhcp_settings.get("dhcpType"),
-                    }
-                )
-
-        sites_with_networks.append(
-            {
-                "id": site_id,
-                "name": site_name,
-                "networks": networks,
-            }
-        )
+            print(f"[network_static] topology snapshot load failed: {e!r}")
+    plan = site_topology.plan(scope, targets, refetch_all=refresh_mode == "full")
+    changes["added"] = plan.added
+    changes["removed"] = plan.removed
+    changes["updated"] = []
+
+    index_by_id = {site_id: index for index, (site_id, _) in enumerate(targets)}
+
+    for site_id, site_name in plan.reuse:
+        site_info = site_topology.get(scope, site_id)
+        if site_info is None:
+            # 取得計画を立てた直後にログアウト等で破棄された場合
+            site_info = RuntimeError("cached siteInfo was discarded")
+        yield index_by_id[site_id], _build_site_record(site_id, site_name, site_info), False
 
-    # --- 4) アカウントの SDP IP Range を取得 ---
+    # 再読み込み時は、取り直す Site について cma_cache も使わない
+    force_refresh = bool(refresh_mode)
+    batch_size = max(1, batch_size)
+    fetch_ids = [site_id for site_id, _ in plan.fetch]
+    chunks = [fetch_ids[i : i + batch_size] for i in range(0, len(fetch_ids), batch_size)]
+
+    semaphore = asyncio.Semaphore(max(1, max_workers))
+
+    async def fetch_chunk(
+        chunk: list[str],
+    ) -> tuple[list[str], dict[str, dict[str, Any] | Exception] | Exception]:
+        async with semaphore:
+            try:
+                return chunk, await _fetch_site_info_batch(cma_target, chunk, account_id, force_refresh)
+            except Exception as e:  # noqa: BLE001
+                return chunk, e
+
+    tasks = [asyncio.ensure_future(fetch_chunk(chunk)) for chunk in chunks]
     try:
-        account_data_root = _post_graphql(
-            sess,
-            ACCOUNT_IP_RANGES_QUERY,
-            {"accountID": str(account_id)},
-            "account",
-            "account_for_static_route",
-        )
-        account_data = account_data_root.get("account", {}) if isinstance(account_data_root, dict) else {}
-    except Exception as e:  # noqa: BLE001
-        return jsonify({"status": "error", "message": f"account (IP ranges) error: {e}"}), 500
+        for next_done in asyncio.as_completed(tasks):
+            chunk, result = await next_done
+            for site_id in chunk:
+                index = index_by_id[site_id]
+                site_name = targets[index][1]
+                if isinstance(result, Exception):
+                    # チャンクごと失敗した場合は、そのチャンクの全 Site をエラー扱いにする
+                    site_info: Any = result
+                else:
+                    site_info = result.get(site_id)
+
+                changed = True
+                if isinstance(site_info, dict):
+                    changed = site_topology.record(scope, site_id, site_name, site_info)
+                    if changed and site_id not in plan.added:
+                        changes["updated"].append(site_id)
+
+                yield index, _build_site_record(site_id, site_name, site_info), changed
+    finally:
+        # クライアントが切断した場合などは、残りの取得を止める
+        for task in tasks:
+            task.cancel()
+
+
+async def _fetch_remote_ip_ranges(cma_target: CmaTarget, account_id: str, force_refresh: bool) -> dict[str, Any]:
+    """アカウントの SDP IP Range（Default / Dynamic / Static）を取得する。"""
+    account_data_root = await _post_graphql(
+        cma_target,
+        ACCOUNT_IP_RANGES_QUERY,
+        {"accountID": account_id},
+        "account",
+        "account_for_static_route",
+        cache_scope=account_id,
+        force_refresh=force_refresh,
+    )
+    account_data = account_data_root.get("account", {}) if isinstance(account_data_root, dict) else {}
 
     vpn_range = account_data.get("vpnRange") or {}
     vpn_range_dyn = account_data.get("vpnRangeForDynamicIPAllocation") or {}
     access_settings = account_data.get("accessSettings") or {}
     static_ip_range = access_settings.get("staticIpRange") or {}
 
-    remote_ip_ranges = {
+    return {
         "default": vpn_range.get("id"),
         "dynamic": vpn_range_dyn.get("id"),
         "static": static_ip_range.get("id"),
     }
 
-    return jsonify(
+
+async def _save_topology_snapshot(
+    cma_target: CmaTarget,
+    account_id: str,
+    site_records: list[dict[str, Any]],
+    remote_ip_ranges: dict[str, Any] | None,
+) -> None:
+    """取得し終えたトポロジを、次回の起動時にすぐ表示できるよう SQLite に保存する。
+
+    今回の取得に失敗した Site も、前に取得できていれば site_topology の内容で保存する。
+    """
+    entries = site_topology.export((cma_target.key, account_id))
+    records = [
+        _build_site_record(record["id"], entries[record["id"]][0], entries[record["id"]][1])
+        if record.get("id") in entries
+        else record
+        for record in site_records
+    ]
+    try:
+        await asyncio.to_thread(
+            topology_snapshots.save, cma_target.key, account_id, records, remote_ip_ranges, entries
+        )
+    except Exception as e:  # noqa: BLE001
+        # 保存に失敗しても API 自体は継続する
+        print(f"[network_static] topology snapshot save failed: {e!r}")
+
+
+def _format_stream_record(record: dict[str, Any], stream_format: str) -> str:
+    """ストリーミング応答の 1 レコードを NDJSON / SSE の 1 行（1 イベント）にする。"""
+    text = dumps(record).decode("utf-8")
+    if stream_format == "sse":
+        return f"event: {record['type']}\ndata: {text}\n\n"
+    return text + "\n"
+
+
+async def _stream_static_route_init(
+    cma_target: CmaTarget,
+    account_id: str,
+    targets: list[tuple[str, str]],
+    refresh_mode: str,
+    max_workers: int,
+    batch_size: int,
+    stream_format: str,
+) -> AsyncIterator[str]:
+    """IP Range → 各 Site（取得できた順）→ done の順にレコードを流す。
+
+    site レコードの changed が false の Site は前回から変わっていないので、
+    画面側は描画済みのブロックをそのまま使ってよい。
+    """
+    force_refresh = bool(refresh_mode)
+    yield _format_stream_record(
+        {
+            "type": "meta",
+            "siteCount": len(targets),
+            "sites": [{"id": site_id, "name": site_name} for site_id, site_name in targets],
+        },
+        stream_format,
+    )
+
+    remote_ip_ranges: dict[str, Any] | None = None
+    try:
+        remote_ip_ranges = await _fetch_remote_ip_ranges(cma_target, account_id, force_refresh)
+        yield _format_stream_record(
+            {"type": "ipRanges", "remoteIpRanges": remote_ip_ranges}, stream_format
+        )
+    except Exception as e:  # noqa: BLE001
+        # IP Range が取れなくても Site 情報は流し続ける
+        yield _format_stream_record(
+            {"type": "error", "message": f"account (IP ranges) error: {e}"}, stream_format
+        )
+
+    changes: dict[str, list[str]] = {}
+    site_records: list[dict[str, Any]] = [{} for _ in targets]
+    async for index, site_record, changed in _iter_site_records(
+        cma_target, account_id, targets, refresh_mode, max_workers, batch_size, changes
+    ):
+        site_records[index] = site_record
+        yield _format_stream_record(
+            {"type": "site", "index": index, "site": site_record, "changed": changed},
+            stream_format,
+        )
+
+    # 全 Site を流し終えたら、CIDR 検索用の索引の元データを差し替えて、次回用に保存する
+    prefix_indexes.update((cma_target.key, account_id), site_records, remote_ip_ranges)
+    await _save_topology_snapshot(cma_target, account_id, site_records, remote_ip_ranges)
+    yield _format_stream_record({"type": "done", "changes": changes}, stream_format)
+
+
+@bp.route("/network/static-route/init", methods=["GET"])
+def static_route_init() -> tuple[Any, int] | Any:
+    """Static Route 追加画面の初期データを返す API。
+
+    - Site 一覧 + 各 Site の Network 情報
+    - SDP リモートユーザー用 IP Range（Default / Dynamic / Static）
+
+    クエリパラメータ:
+    - refresh=1: キャッシュを使わずに取り直す。siteInfo は追加された Site と
+      鮮度切れの Site だけを取り直す（refresh=full なら全 Site を取り直す）
+    - stream=ndjson / stream=sse: 全 Site の取得完了を待たず、
+      IP Range → 各 Site（取得できた順）を 1 レコードずつ流す
+    - tenant / profile: 使う CMA セッション（省略時は最後にログインしたもの）
+
+    リクエストの解釈だけをここで行い、CMA への問い合わせは
+    共有のイベントループ上の非同期ハンドラ（_static_route_init_async）で行う。
+    """  # noqa: D401
+    try:
+        cma_target = cma_target_from_request()
+    except RuntimeError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+    if not has_cma_state(cma_target):
+        # CMA 未ログイン
+        return jsonify({"status": "error", "message": "CMA not logged in"}), 401
+
+    # Playwright で保存された state から作った requests.Session を使い回す
+    # （ここで作っておき、state ファイルが壊れている場合などはすぐにエラーを返す）
+    try:
+        get_cma_session(cma_target)
+    except Exception as e:  # noqa: BLE001
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+    refresh_mode = _parse_refresh_mode(request.args.get("refresh"))
+    stream_format = request.args.get("stream", "").lower()
+    if stream_format and stream_format not in STREAM_MIMETYPES:
+        return jsonify({"status": "error", "message": f"unsupported stream format: {stream_format}"}), 400
+
+    max_workers = int(current_app.config.get("CMA_SITE_INFO_WORKERS", DEFAULT_MAX_WORKERS))
+    batch_size = int(current_app.config.get("CMA_SITE_INFO_BATCH_SIZE", 25))
+
+    result, status_code = run_async(
+        _static_route_init_async(cma_target, refresh_mode, stream_format, max_workers, batch_size)
+    )
+    if isinstance(result, dict):
+        return jsonify(result), status_code
+
+    # --- 3') IP Range と各 Site の情報を、取得できたものから順に流す ---
+    return Response(
+        iter_async(result),
+        mimetype=STREAM_MIMETYPES[stream_format],
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+async def _static_route_init_async(
+    cma_target: CmaTarget,
+    refresh_mode: str,
+    stream_format: str,
+    max_workers: int,
+    batch_size: int,
+) -> tuple[dict[str, Any] | AsyncIterator[str], int]:
+    """static_route_init の本体。(応答の JSON またはストリーム, ステータスコード) を返す。"""
+    force_refresh = bool(refresh_mode)
+
+    # --- 1) キャッシュ済みの loginState から accountID を取得 ---
+    # （再読み込み時もアカウントは変わらないので、loginState はキャッシュを使う）
+    try:
+        login_context = await asyncio.to_thread(get_login_context, target=cma_target)
+        account_id = login_context["accountID"]
+        if not account_id:
+            raise RuntimeError("accountID not found in loginState response")
+        account_id = str(account_id)
+    except Exception as e:  # noqa: BLE001
+        return {"status": "error", "message": f"loginState error: {e}"}, 500
+
+    # --- 2) Site 一覧を取得 ---
+    try:
+        targets = await _list_sites(cma_target, account_id, force_refresh)
+    except Exception as e:  # noqa: BLE001
+        return {"status": "error", "message": f"accountSnapshotSites error: {e}"}, 500
+
+    if stream_format:
+        stream = _stream_static_route_init(
+            cma_target, account_id, targets, refresh_mode, max_workers, batch_size, stream_format
+        )
+        return stream, 200
+
+    # --- 3) 各 Site ごとの Network 情報と、アカウントの SDP IP Range を並行に取得 ---
+    ip_ranges_task = asyncio.ensure_future(
+        _fetch_remote_ip_ranges(cma_target, account_id, force_refresh)
+    )
+    sites_with_networks: list[dict[str, Any]] = [{} for _ in targets]
+    changes: dict[str, list[str]] = {}
+    try:
+        async for index, site_record, _changed in _iter_site_records(
+            cma_target, account_id, targets, refresh_mode, max_workers, batch_size, changes
+        ):
+            sites_with_networks[index] = site_record
+    except BaseException:
+        ip_ranges_task.cancel()
+        raise
+
+    # --- 4) アカウントの SDP IP Range ---
+    try:
+        remote_ip_ranges = await ip_ranges_task
+    except Exception as e:  # noqa: BLE001
+        return {"status": "error", "message": f"account (IP ranges) error: {e}"}, 500
+
+    prefix_indexes.update((cma_target.key, account_id), sites_with_networks, remote_ip_ranges)
+    await _save_topology_snapshot(cma_target, account_id, sites_with_networks, remote_ip_ranges)
+    return (
         {
             "status": "ok",
             "sites": sites_with_networks,
             "remoteIpRanges": remote_ip_ranges,
+            "changes": changes,
+        },
+        200,
+    )
+
+
+@bp.route("/network/static-route/snapshot", methods=["GET"])
+def static_route_snapshot() -> tuple[Any, int] | Any:
+    """前回取得して保存したトポロジ（static_route_init と同じ形）を、CMA に問い合わせずに返す API。
+
+    画面表示時にまずこれを表示し（snapshot.ageSeconds で古さを示す）、
+    続けて static_route_init で最新の情報に差し替える想定。
+    保存されていない場合は 404。
+    """
+    try:
+        cma_target = cma_target_from_request()
+    except RuntimeError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+    if not has_cma_state(cma_target):
+        return jsonify({"status": "error", "message": "CMA not logged in"}), 401
+
+    snapshot = topology_snapshots.load(cma_target.key)
+    if snapshot is None:
+        return jsonify({"status": "error", "message": "no saved topology"}), 404
+
+    return jsonify(
+        {
+            "status": "ok",
+            "sites": snapshot["sites"],
+            "remoteIpRanges": snapshot["remoteIpRanges"],
+            "snapshot": {
+                "accountId": snapshot["accountId"],
+                "savedAt": snapshot["savedAt"],
+                "ageSeconds": max(0.0, time.time() - snapshot["savedAt"]),
+                "siteCount": len(snapshot["sites"]),
+            },
+        }
+    )
+
+
+@bp.route("/network/prefix-lookup", methods=["GET"])
+def prefix_lookup() -> tuple[Any, int] | Any:
+    """IP アドレス / CIDR が、どの Site の Subnet・Gateway や SDP IP Range と重なるかを返す API。
+
+    クエリパラメータ:
+    - q: 調べる IP アドレスまたは CIDR（複数指定可）
+    - tenant / profile: 使う CMA セッション（省略時は最後にログインしたもの）
+
+    q ごとに longest（最長一致）/ covering（含むもの）/ covered（含まれるもの）/
+    overlaps（重なるもの全部）を返す。索引は static_route_init で最後に取得した内容から作る
+    （まだ取得していなければ、ここで static_route_init と同じ内容を取得する）。
+    """
+    queries = [q.strip() for q in request.args.getlist("q") if q.strip()]
+    if not queries:
+        return jsonify({"status": "error", "message": "q is required"}), 400
+
+    try:
+        cma_target = cma_target_from_request()
+    except RuntimeError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+    if not has_cma_state(cma_target):
+        return jsonify({"status": "error", "message": "CMA not logged in"}), 401
+
+    max_workers = int(current_app.config.get("CMA_SITE_INFO_WORKERS", DEFAULT_MAX_WORKERS))
+    batch_size = int(current_app.config.get("CMA_SITE_INFO_BATCH_SIZE", 25))
+
+    result, status_code = run_async(_prefix_lookup_async(cma_target, queries, max_workers, batch_size))
+    return jsonify(result), status_code
+
+
+async def _load_prefix_index(
+    cma_target: CmaTarget, max_workers: int, batch_size: int
+) -> tuple[PrefixIndex | None, dict[str, Any], int]:
+    """ログイン中のアカウントの CIDR 索引を返す。(索引, エラー時の応答, ステータスコード)。
+
+    索引は static_route_init で最後に取得した内容から作る。
+    まだ取得していなければ（Static Route 画面を開く前など）、キャッシュを使って一覧を取得する。
+    """
+    try:
+        login_context = await asyncio.to_thread(get_login_context, target=cma_target)
+        account_id = str(login_context["accountID"] or "")
+        if not account_id:
+            raise RuntimeError("accountID not found in loginState response")
+    except Exception as e:  # noqa: BLE001
+        return None, {"status": "error", "message": f"loginState error: {e}"}, 500
+
+    scope = (cma_target.key, account_id)
+    index = await asyncio.to_thread(prefix_indexes.get, scope)
+    if index is None:
+        body, status_code = await _static_route_init_async(cma_target, "", "", max_workers, batch_size)
+        if status_code != 200:
+            return None, body, status_code  # type: ignore[return-value]
+        index = await asyncio.to_thread(prefix_indexes.get, scope)
+        if index is None:
+            return None, {"status": "error", "message": "prefix index is not available"}, 500
+    return index, {}, 200
+
+
+async def _prefix_lookup_async(
+    cma_target: CmaTarget,
+    queries: list[str],
+    max_workers: int,
+    batch_size: int,
+) -> tuple[dict[str, Any], int]:
+    """prefix_lookup の本体。(応答の JSON, ステータスコード) を返す。"""
+    index, error_body, status_code = await _load_prefix_index(cma_target, max_workers, batch_size)
+    if index is None:
+        return error_body, status_code
+
+    results: list[dict[str, Any]] = []
+    for query in queries:
+        try:
+            results.append(index.lookup(query))
+        except ValueError:
+            return {"status": "error", "message": f"invalid IP address or CIDR: {query}"}, 400
+
+    return (
+        {
+            "status": "ok",
+            "entryCount": len(index),
+            "builtAt": index.built_at,
+            "results": results,
+        },
+        200,
+    )
+
+
+@bp.route("/network/static-route/validate", methods=["POST"])
+def static_route_validate() -> tuple[Any, int] | Any:
+    """追加予定の Static Route をまとめて検証する API。
+
+    リクエスト（JSON）::
+
+        {
+            "routes": [
+                {"destination": "192.168.50.0/24", "nextHop": "10.0.1.254", "siteId": "100000", "name": "..."},
+                ...
+            ],
+            "profile": "ops-a"   # 省略可（tenant / profile はクエリパラメータでも可）
+        }
+
+    既存の Site の Subnet / Gateway、SDP IP Range（Default / Dynamic / Static）、
+    同じリクエスト内の他の Route との重なり・重複と、次ホップがどの Site の Subnet にも
+    無い場合などを検出し、Route ごとの判定（ok / warning / error）と理由を返す。
+    """
+    body = request.get_json(silent=True) or {}
+    routes = body.get("routes") if isinstance(body, dict) else None
+    if not isinstance(routes, list):
+        return jsonify({"status": "error", "message": "routes must be a list"}), 400
+    if len(routes) > MAX_ROUTES_PER_CHECK:
+        return (
+            jsonify({"status": "error", "message": f"too many routes (max {MAX_ROUTES_PER_CHECK})"}),
+            413,
+        )
+
+    try:
+        cma_target = cma_target_from_request()
+    except RuntimeError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+    if not has_cma_state(cma_target):
+        return jsonify({"status": "error", "message": "CMA not logged in"}), 401
+
+    max_workers = int(current_app.config.get("CMA_SITE_INFO_WORKERS", DEFAULT_MAX_WORKERS))
+    batch_size = int(current_app.config.get("CMA_SITE_INFO_BATCH_SIZE", 25))
+
+    result, status_code = run_async(_static_route_validate_async(cma_target, routes, max_workers, batch_size))
+    return jsonify(result), status_code
+
+
+async def _static_route_validate_async(
+    cma_target: CmaTarget,
+    routes: list[Any],
+    max_workers: int,
+    batch_size: int,
+) -> tuple[dict[str, Any], int]:
+    """static_route_validate の本体。(応答の JSON, ステータスコード) を返す。"""
+    index, error_body, status_code = await _load_prefix_index(cma_target, max_workers, batch_size)
+    if index is None:
+        return error_body, status_code
+
+    # 数千件の判定は CPU を使うので、共有ループを止めないよう別スレッドで行う
+    report = await asyncio.to_thread(lambda: checker_for(index).check(routes))
+    return {"status": "ok", "indexBuiltAt": index.built_at, **report}, 200
+
+
+async def _add_network_ranges(
+    cma_target: CmaTarget, account_id: str, rows: list[dict[str, Any]]
+) -> list[tuple[str | None, str | None]]:
+    """1 Site 分の Route をまとめて追加する。戻り値は行ごとの (networkRangeId, エラーメッセージ)。
+
+    GraphQL の errors は path のエイリアス（r0, r1, ...）で行に振り分けるので、
+    1 行のエラーでバッチ全体が失敗扱いになることはない。
+    mutation なのでキャッシュは通さず、送信後の通信エラーではリトライしない（resilience）。
+    """
+    client = get_graphql_client(cma_target)
+    if len(rows) == 1:
+        query, operation_name = ADD_NETWORK_RANGE_MUTATION, "addNetworkRange"
+        variables: dict[str, Any] = {
+            "accountId": account_id,
+            "lanSocketInterfaceId": rows[0]["interfaceId"],
+            "input": network_range_input(rows[0]),
         }
+        aliases = ["addNetworkRange"]
+    else:
+        query, operation_name = _build_add_network_range_batch(len(rows)), "addNetworkRangeBatch"
+        variables = {"accountId": account_id}
+        for i, row in enumerate(rows):
+            variables[f"if{i}"] = row["interfaceId"]
+            variables[f"in{i}"] = network_range_input(row)
+        aliases = [f"r{i}" for i in range(len(rows))]
+
+    body = await client.execute(query, variables, operation_name, raise_on_errors=False)
+    try:
+        await asyncio.to_thread(save_response, f"{operation_name}_{rows[0]['targetSiteId']}", body)
+    except Exception:
+        pass
+
+    site_data = (body.get("data") or {}).get("site") or {}
+    alias_errors: dict[str, str] = {}
+    global_errors: list[str] = []
+    for err in body.get("errors") or []:
+        if not isinstance(err, dict):
+            continue
+        message = err.get("message") or "GraphQL error"
+        path = [str(p) for p in err.get("path") or []]
+        alias = next((p for p in path if p in aliases), None)
+        if alias is not None:
+            alias_errors.setdefault(alias, message)
+        else:
+            global_errors.append(message)
+
+    results: list[tuple[str | None, str | None]] = []
+    for alias in aliases:
+        added = site_data.get(alias)
+        if alias in alias_errors:
+            results.append((None, alias_errors[alias]))
+        elif isinstance(added, dict):
+            results.append((added.get("networkRangeId"), None))
+        else:
+            results.append((None, global_errors[0] if global_errors else "networkRangeId not found in response"))
+    return results
+
+
+def _invalidate_topology(cma_target: CmaTarget) -> None:
+    """Route を追加した後、次の取得で Site の Network を取り直すよう保持中の情報を破棄する。"""
+    invalidate_cma_cache(cma_target.key)
+    site_topology.invalidate(cma_target.key)
+    prefix_indexes.invalidate(cma_target.key)
+
+
+async def _iter_apply_records(
+    cma_target: CmaTarget, job: RouteImportJob, max_workers: int, batch_size: int
+) -> AsyncIterator[dict[str, Any]]:
+    """ジョブの残りを適用し、進捗のレコードを返す（同じジョブを同時に適用しないようロックを持つ）。"""
+    lock = route_imports.lock(job.job_id)
+    if not await asyncio.to_thread(lock.acquire, False):
+        yield {"type": "error", "message": "this import job is already being applied", "statusCode": 409}
+        return
+    try:
+        # 前回の適用で追加された Route も含めた、最新の Subnet で再開判定する
+        index, error_body, status_code = await _load_prefix_index(cma_target, max_workers, batch_size)
+        if index is None:
+            yield {"type": "error", "message": error_body.get("message"), "statusCode": status_code}
+            return
+
+        async def send_batch(_site_id: str, rows: list[dict[str, Any]]) -> list[tuple[str | None, str | None]]:
+            return await _add_network_ranges(cma_target, job.account_id, rows)
+
+        try:
+            async for record in apply_job(job, index, send_batch):
+                yield record
+        finally:
+            _invalidate_topology(cma_target)
+            # 保存済みのトポロジも、次の取得で取り直す（画面表示用にはそのまま残す）
+            await asyncio.to_thread(topology_snapshots.expire, cma_target.key)
+    finally:
+        lock.release()
+
+
+async def _stream_import_records(records: AsyncIterator[dict[str, Any]], stream_format: str) -> AsyncIterator[str]:
+    async for record in records:
+        yield _format_stream_record(record, stream_format)
+
+
+async def _import_records(
+    cma_target: CmaTarget,
+    job: RouteImportJob,
+    stream: IO[bytes],
+    fmt: str,
+    apply: bool,
+    max_workers: int,
+    batch_size: int,
+) -> AsyncIterator[dict[str, Any]]:
+    """アップロードを読みながら検証し（チャンクごとに rows レコードを返す）、
+    読み終えたらジョブを保存して、apply=True ならそのまま適用する。"""
+    try:
+        index, error_body, status_code = await _load_prefix_index(cma_target, max_workers, batch_size)
+        if index is None:
+            yield {"type": "error", "message": error_body.get("message"), "statusCode": status_code}
+            return
+
+        validator = ImportRowValidator(index, strict=job.strict)
+        async for record in _validate_upload(job, validator, iter_import_rows(stream, fmt)):
+            yield record
+            if record["type"] == "error":
+                return
+    finally:
+        stream.close()
+
+    job.updated_at = time.time()
+    await asyncio.to_thread(route_imports.save, job)
+    await asyncio.to_thread(route_imports.prune)
+    yield {"type": "validated", "job": job.summary()}
+
+    if apply:
+        async for record in _iter_apply_records(cma_target, job, max_workers, batch_size):
+            yield record
+
+
+async def _validate_upload(
+    job: RouteImportJob, validator: ImportRowValidator, rows: Iterator[tuple[int, dict[str, Any] | None, str | None]]
+) -> AsyncIterator[dict[str, Any]]:
+    """アップロードを ROUTE_IMPORT_VALIDATE_CHUNK 行ずつ読んで検証し、チャンクごとに rows レコードを返す。"""
+
+    def read_and_validate() -> list[dict[str, Any]]:
+        # 上限を 1 行超えるところまで読めば、多すぎることが分かる
+        limit = min(ROUTE_IMPORT_VALIDATE_CHUNK, ROUTE_IMPORT_MAX_ROWS + 1 - len(job.rows))
+        added = job.read_rows(rows, max(1, limit))
+        if len(job.rows) <= ROUTE_IMPORT_MAX_ROWS:
+            validator.validate(added)
+        return added
+
+    while True:
+        # 読み込みと判定（CPU を使う）は、共有ループを止めないよう別スレッドで行う
+        try:
+            added = await asyncio.to_thread(read_and_validate)
+        except (UnicodeDecodeError, ValueError) as e:
+            yield {"type": "error", "message": str(e), "statusCode": 400}
+            return
+        if len(job.rows) > ROUTE_IMPORT_MAX_ROWS:
+            yield {"type": "error", "message": f"too many routes (max {ROUTE_IMPORT_MAX_ROWS})", "statusCode": 413}
+            return
+        if not added:
+            break
+        yield {"type": "rows", "rows": added, "progress": {"validated": len(job.rows)}}
+
+    if not job.rows:
+        yield {"type": "error", "message": "no routes in upload", "statusCode": 400}
+
+
+async def _collect_records(records: AsyncIterator[dict[str, Any]]) -> tuple[dict[str, Any], int]:
+    """ストリームを使わない場合に、進捗のレコードを 1 つの応答にまとめる。"""
+    body: dict[str, Any] = {"status": "ok"}
+    async for record in records:
+        kind = record["type"]
+        if kind == "error":
+            return {"status": "error", "message": record.get("message")}, record.get("statusCode", 500)
+        if kind == "rows":
+            body.setdefault("rows", []).extend(record["rows"])
+        elif kind == "validated":
+            body["job"] = record["job"]
+        elif kind == "plan":
+            body["plan"] = {k: v for k, v in record.items() if k != "type"}
+        elif kind == "done":
+            body["job"] = record["job"]
+            body["stopped"] = record["stopped"]
+    return body, 200
+
+
+def _import_response(records: AsyncIterator[dict[str, Any]], stream_format: str) -> tuple[Any, int] | Any:
+    if not stream_format:
+        result, status_code = run_async(_collect_records(records))
+        return jsonify(result), status_code
+    return Response(
+        iter_async(_stream_import_records(records, stream_format)),
+        mimetype=STREAM_MIMETYPES[stream_format],
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+def _import_request_options() -> tuple[CmaTarget, str, int, int]:
+    """import / apply 共通のパラメータ。
+
+    Raises:
+        ValueError: stream の形式が正しくない場合。
+        RuntimeError: CMA セッションを決められない場合。
+    """
+    stream_format = request.args.get("stream", "").lower()
+    if stream_format and stream_format not in STREAM_MIMETYPES:
+        raise ValueError(f"unsupported stream format: {stream_format}")
+    cma_target = cma_target_from_request()
+    max_workers = int(current_app.config.get("CMA_SITE_INFO_WORKERS", DEFAULT_MAX_WORKERS))
+    batch_size = int(current_app.config.get("CMA_SITE_INFO_BATCH_SIZE", 25))
+    return cma_target, stream_format, max_workers, batch_size
+
+
+@bp.route("/network/static-route/import", methods=["POST"])
+def static_route_import() -> tuple[Any, int] | Any:
+    """Static Route を CSV / NDJSON / JSON のファイルからまとめて取り込む API。
+
+    本文はファイルそのもの（Content-Type で形式を判定）か、multipart の file フィールド。
+    CSV の列は destination, nextHop, siteId（または siteName）, name。
+
+    クエリパラメータ:
+    - format=csv / ndjson / json: 形式を明示する（省略時は拡張子 / Content-Type で判定）
+    - apply=1: 検証後にそのまま適用する（省略時は検証してジョブを作るだけ）
+    - strict=1: warning の行も適用しない
+    - stream=ndjson / stream=sse: 検証結果（読み込んだ行のチャンクごと）→ 適用の進捗（バッチごと）を
+      1 レコードずつ流す
+    - tenant / profile: 使う CMA セッション（省略時は最後にログインしたもの）
+
+    行は全体を読み終えるのを待たず、ROUTE_IMPORT_VALIDATE_CHUNK 行読むごとに検証する。
+    読み終えたら検証結果と適用状態をジョブとして保存する。
+    途中で失敗・切断しても、/import/<jobId>/apply で残りから再開できる。
+    """
+    try:
+        cma_target, stream_format, max_workers, batch_size = _import_request_options()
+    except (RuntimeError, ValueError) as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+    if not has_cma_state(cma_target):
+        return jsonify({"status": "error", "message": "CMA not logged in"}), 401
+
+    upload = request.files.get("file")
+    if upload is not None:
+        # multipart のファイルはリクエストの終了時に閉じられ、応答を流しながらでは読めないので、
+        # 受信済みの一時ファイルから自前の一時ファイルに移す（読み込みと検証は応答を返しながら行う）
+        stream = tempfile.SpooledTemporaryFile(max_size=1024 * 1024)
+        shutil.copyfileobj(upload.stream, stream)
+        stream.seek(0)
+        filename, content_type = upload.filename, upload.mimetype
+    else:
+        stream, filename, content_type = request.stream, request.args.get("filename"), request.mimetype
+
+    try:
+        login_context = get_login_context(target=cma_target)
+        account_id = str(login_context["accountID"] or "")
+        if not account_id:
+            raise RuntimeError("accountID not found in loginState response")
+    except Exception as e:  # noqa: BLE001
+        return jsonify({"status": "error", "message": f"loginState error: {e}"}), 500
+
+    job = RouteImportJob(
+        route_imports.new_job_id(),
+        cma_target.key,
+        account_id,
+        source=filename or "",
+        strict=request.args.get("strict", "") in ("1", "true"),
+    )
+    try:
+        fmt = detect_import_format(content_type, filename, request.args.get("format"))
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+    apply = request.args.get("apply", "") in ("1", "true")
+    return _import_response(
+        _import_records(cma_target, job, stream, fmt, apply, max_workers, batch_size), stream_format
     )
+
+
+@bp.route("/network/static-route/import/<job_id>/apply", methods=["POST"])
+def static_route_import_apply(job_id: str) -> tuple[Any, int] | Any:
+    """取り込み済みのジョブの残り（pending / failed の行）を適用する API。途中からの再開にも使う。
+
+    クエリパラメータは static_route_import の stream / tenant / profile と同じ。
+    """
+    try:
+        cma_target, stream_format, max_workers, batch_size = _import_request_options()
+    except (RuntimeError, ValueError) as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+    if not has_cma_state(cma_target):
+        return jsonify({"status": "error", "message": "CMA not logged in"}), 401
+
+    try:
+        job = route_imports.load(job_id)
+    except KeyError:
+        return jsonify({"status": "error", "message": f"import job not found: {job_id}"}), 404
+    if job.target_key != cma_target.key:
+        return jsonify({"status": "error", "message": "import job belongs to another CMA session"}), 409
+
+    return _import_response(_iter_apply_records(cma_target, job, max_workers, batch_size), stream_format)
+
+
+@bp.route("/network/static-route/import/<job_id>", methods=["GET"])
+def static_route_import_status(job_id: str) -> tuple[Any, int] | Any:
+    """ジョブの集計と行ごとの検証結果・適用状態を返す API。"""
+    try:
+        cma_target = cma_target_from_request()
+    except RuntimeError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+    try:
+        job = route_imports.load(job_id)
+    except KeyError:
+        return jsonify({"status": "error", "message": f"import job not found: {job_id}"}), 404
+    if job.target_key != cma_target.key:
+        return jsonify({"status": "error", "message": f"import job not found: {job_id}"}), 404
+    return jsonify({"status": "ok", "job": job.summary(), "rows": job.rows})
+
+
+@bp.route("/network/static-route/imports", methods=["GET"])
+def static_route_imports() -> tuple[Any, int] | Any:
+    """ログイン中の CMA セッションで作ったジョブの一覧（新しい順）を返す API。"""
+    try:
+        cma_target = cma_target_from_request()
+    except RuntimeError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    return jsonify({"status": "ok", "jobs": route_imports.list_jobs(cma_target.key)})
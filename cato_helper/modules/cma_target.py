@@ -0,0 +1,57 @@
+﻿# cato_helper/modules/cma_target.py
+"""リクエストから操作対象の CMA セッション（テナント + ログインプロファイル）を決める。
+
+各エンドポイントは、次のいずれかで tenant / profile を受け取る（先にあるものを優先）。
+
+- クエリパラメータ: ``?tenant=kevoits&profile=ops-a``
+- JSON ボディ: ``{"tenant": "kevoits", "profile": "ops-a"}``
+- ヘッダー: ``X-Cato-Tenant`` / ``X-Cato-Profile``
+
+どちらも省略した場合は、最後にログインしたセッションを使う。
+ただしサーバーモード（Config.SERVER_MODE）では複数のオペレーターが同じサーバーを使うので、
+省略はエラーにし、tenant だけの指定でも他のプロファイルのセッションは選ばない。
+"""
+
+from __future__ import annotations
+
+from typing import Any
+
+from flask import current_app, request
+
+from ..services.cma_session import CmaTarget, resolve_target
+
+
+def _selector_value(name: str, body: dict[str, Any]) -> str | None:
+    value = request.args.get(name) or body.get(name) or request.headers.get(f"X-Cato-{name.capitalize()}")
+    return str(value).strip() or None if value else None
+
+
+def _request_body() -> dict[str, Any]:
+    body = request.get_json(silent=True) if request.is_json else None
+    return body if isinstance(body, dict) else {}
+
+
+def requires_target_selector() -> bool:
+    """tenant / profile の指定を必須にするか（サーバーモードのとき）。"""
+    return bool(current_app.config.get("SERVER_MODE"))
+
+
+def has_target_selector() -> bool:
+    """リクエストに tenant / profile の指定があるかどうか。"""
+    body = _request_body()
+    return any(_selector_value(name, body) for name in ("tenant", "profile"))
+
+
+def cma_target_from_request() -> CmaTarget:
+    """リクエストの tenant / profile 指定から CmaTarget を決める。
+
+    Raises:
+        RuntimeError: 存在しないプロファイルを指定した場合。
+            サーバーモードで tenant / profile のどちらも指定が無い場合。
+    """
+    body = _request_body()
+    return resolve_target(
+        _selector_value("tenant", body),
+        _selector_value("profile", body),
+        latest_fallback=not requires_target_selector(),
+    )
@@ -1,18 +1,34 @@
 ﻿# cato_helper/modules/core/routes.py
 from . import bp
-from flask import render_template, jsonify, request
+from flask import Response, render_template, jsonify, request, stream_with_context
 
 import threading
+import time
+from typing import Any, Iterator
+from ..cma_target import cma_target_from_request, has_target_selector, requires_target_selector
 from ...services.cma_session import (
     get_cma_status,
     has_cma_state,
+    list_cma_targets,
     load_login_profiles,
     login_via_playwright,
     resolve_login_profile,
+    resolve_target,
     cleanup_cma_state,
+    sync_shared_state,
 )
 
+from ...services.cma_cache import invalidate_cma_cache
+from ...services.cma_events import (
+    CMA_EVENTS_HEARTBEAT_SECONDS,
+    CMA_EVENTS_POLL_TIMEOUT,
+    CMA_EVENTS_STREAM_SECONDS,
+    cma_events,
+)
+from ...services.json_codec import dumps
+from ...services.prefix_index import prefix_indexes
 from ...services.response_store import cleanup_response_store
+from ...services.site_topology import site_topology
 
 @bp.route("/")
 def index():
@@ -23,21 +39,27 @@ def index():
 
 @bp.route("/cma/login", methods=["POST"])
 def cma_login():
-    """CMA ログインを Playwright で開始するエンドポイント。"""
-    if has_cma_state():
-        return jsonify({"status": "already_logged_in"})
+    """CMA ログインを Playwright で開始するエンドポイント。
 
+    プロファイル（と省略可のテナント）ごとに別のセッションとしてログインするので、
+    別のテナントにログイン済みでも、そのまま追加でログインできる。
+    """
     body = request.get_json(silent=True) or {} # type: ignore[reportUnknownMemberType]
     profile_name = body.get("profile") or body.get("profile_name") # type: ignore[reportUnknownMemberType]
+    tenant = body.get("tenant") or None # type: ignore[reportUnknownMemberType]
 
     try:
         resolve_login_profile(profile_name) # type: ignore[reportUnknownMemberType]
+        target = resolve_target(tenant, profile_name) # type: ignore[reportUnknownMemberType]
     except RuntimeError as e:
         return jsonify({"status": "error", "message": str(e)}), 400
 
+    if has_cma_state(target):
+        return jsonify({"status": "already_logged_in"})
+
     def worker():
         try:
-            login_via_playwright(profile_name) # type: ignore[reportUnknownMemberType]
+            login_via_playwright(profile_name, tenant) # type: ignore[reportUnknownMemberType]
         except Exception as e:  # noqa: BLE001
             print(f"[CMA LOGIN] エラー: {e}")
 
@@ -48,20 +70,123 @@ def cma_login():
 
 @bp.route("/cma/status", methods=["GET"])
 def cma_status():
-    """CMA ログイン状態とアカウント名を返すエンドポイント。"""
-    status = get_cma_status()
+    """CMA ログイン状態とアカウント名を返すエンドポイント（tenant / profile で選択）。"""
+    try:
+        target = cma_target_from_request()
+    except RuntimeError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    status = get_cma_status(target)
     return jsonify(status)
 
 
+@bp.route("/cma/sessions", methods=["GET"])
+def cma_sessions():
+    """ログイン済みの CMA セッション（テナント + プロファイル）を新しい順に返す。"""
+    return jsonify({
+        "status": "ok",
+        "sessions": [
+            {"tenant": t.tenant, "profile": t.profile, "key": t.key} for t in list_cma_targets()
+        ],
+    })
+
+
 @bp.route("/cma/logout", methods=["POST"])
 def cma_logout():
-    """CMA からログアウトし、セッション情報と保存済みレスポンスを削除する。"""
+    """CMA からログアウトし、セッション情報と保存済みレスポンスを削除する。
+
+    tenant / profile を指定した場合はそのセッションだけ、無ければ全セッションからログアウトする。
+    サーバーモードでは他のオペレーターのセッションまで消さないよう、指定が無ければ 400 を返す。
+    """
+    if not has_target_selector() and requires_target_selector():
+        return jsonify({"status": "error", "message": "tenant または profile を指定してください。"}), 400
+    if has_target_selector():
+        try:
+            target = cma_target_from_request()
+        except RuntimeError as e:
+            return jsonify({"status": "error", "message": str(e)}), 400
+        # このセッションの state ファイルと、loginState・GraphQL キャッシュなどを削除
+        cleanup_cma_state(target)
+        return jsonify({"status": "ok"})
+
     # Playwright の state ファイルを削除
     cleanup_cma_state()
+    # GraphQL レスポンスのキャッシュを破棄（別アカウントで再ログインする場合に備える）
+    invalidate_cma_cache()
+    site_topology.invalidate()
+    prefix_indexes.invalidate()
     # loginState など GraphQL のレスポンス保存ディレクトリを削除
     cleanup_response_store()
     return jsonify({"status": "ok"})
 
+def _last_event_id(value: str | None) -> int:
+    try:
+        last_id = int(value or 0)
+    except ValueError:
+        return 0
+    # サーバーが再起動して id が振り直された場合は、保持している分を全て送る
+    return last_id if last_id <= cma_events.last_id else 0
+
+
+def _iter_cma_event_stream(last_id: int) -> Iterator[str]:
+    # 切断後はこの間隔（ミリ秒）でブラウザが繋ぎ直す
+    yield "retry: 3000\n\n"
+    deadline = time.monotonic() + CMA_EVENTS_STREAM_SECONDS
+    while time.monotonic() < deadline:
+        events = cma_events.wait(last_id, CMA_EVENTS_HEARTBEAT_SECONDS)
+        if not events:
+            # 他のワーカープロセスでのログイン / ログアウトもここで拾う（state_changed になる）
+            sync_shared_state()
+            yield ": keepalive\n\n"
+            continue
+        for event in events:
+            last_id = event.id
+            data = dumps(event.to_dict()).decode("utf-8")
+            yield f"id: {event.id}\nevent: {event.type}\ndata: {data}\n\n"
+
+
+@bp.route("/cma/events", methods=["GET"])
+def cma_events_stream():
+    """CMA のログイン状態の変化を Server-Sent Events で push する。
+
+    接続中はワーカーのスレッドを 1 本占有するので、画面はログインの開始から完了（失敗）までの
+    間だけ繋ぐ。それ以外のときは /cma/events/poll?wait=0 を間隔を空けて叩く。
+    """
+    last_id = _last_event_id(request.headers.get("Last-Event-ID") or request.args.get("since"))
+    return Response(
+        stream_with_context(_iter_cma_event_stream(last_id)),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@bp.route("/cma/events/poll", methods=["GET"])
+def cma_events_poll():
+    """ポーリング版（ログイン中以外の画面と、EventSource が使えない環境向け）。
+
+    ?since=<最後に受け取った id> を付けると、それより後のイベントが来るまで最大
+    CMA_EVENTS_POLL_TIMEOUT 秒待って返す。?wait=<秒> で待ち時間を短くでき、wait=0 なら
+    待たずに返す（スレッドを握らないので、開きっぱなしのタブはこちらを使う）。
+    since を省略すると待たずに現在の id を返す。
+    """
+    since = request.args.get("since")
+    try:
+        wait = min(max(float(request.args.get("wait", CMA_EVENTS_POLL_TIMEOUT)), 0.0), CMA_EVENTS_POLL_TIMEOUT)
+    except ValueError:
+        wait = CMA_EVENTS_POLL_TIMEOUT
+    events: list[Any] = []
+    if since is not None:
+        last_id = _last_event_id(since)
+        events = cma_events.wait(last_id, wait)
+        if not events:
+            sync_shared_state()
+            events = cma_events.since(last_id)
+    return jsonify({
+        "status": "ok",
+        "last_id": cma_events.last_id,
+        "events": [event.to_dict() for event in events],
+    })
+
+
 @bp.route("/cma/profiles", methods=["GET"])
 def cma_profiles():
     """利用可能な CMA ログインプロファイル一覧を返す。"""
@@ -0,0 +1,36 @@
+﻿# cato_helper/modules/json_provider.py
+"""jsonify / request.get_json で services.json_codec（orjson があれば orjson）を使う Flask の JSON プロバイダー。"""
+
+from __future__ import annotations
+
+from typing import Any
+
+from flask import Response
+from flask.json.provider import DefaultJSONProvider
+
+from ..services import json_codec
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """sort_keys・日付などの変換（default）・debug 時の整形は Flask の既定と同じ。
+
+    非 ASCII 文字はエスケープせず UTF-8 のまま返す。
+    """
+
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        if not json_codec.HAVE_FAST_JSON or kwargs:
+            return super().dumps(obj, **kwargs)
+        return json_codec.dumps(obj, sort_keys=self.sort_keys, default=self.default).decode("utf-8")
+
+    def loads(self, s: str | bytes, **kwargs: Any) -> Any:
+        if not json_codec.HAVE_FAST_JSON or kwargs:
+            return super().loads(s, **kwargs)
+        return json_codec.loads(s)
+
+    def response(self, *args: Any, **kwargs: Any) -> Response:
+        if not json_codec.HAVE_FAST_JSON:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = self.compact is False or (self.compact is None and self._app.debug)
+        body = json_codec.dumps(obj, sort_keys=self.sort_keys, indent=indent, default=self.default)
+        return self._app.response_class(body + b"\n", mimetype=self.mimetype)
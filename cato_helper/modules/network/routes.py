@@ -6,5 +6,5 @@ from . import bp
 
 @bp.route("/static-route")
 def static_route_add():
-    """Site に Static Route を追加するツール（画面ひな型のみ）。"""
+    """Site に Static Route を追加するツール（参照データの表示と、CSV 等からの一括追加）。"""
     return render_template("network/static_route.html")
@@ -0,0 +1,98 @@
+﻿# cato_helper/server.py
+"""共用の踏み台サーバーなどで、複数のオペレーターから同時に使うためのサーバーモード。
+
+開発用の Werkzeug サーバーの代わりに、次の順で WSGI サーバーを選んで起動する。
+
+1. ワーカー数が 2 以上で gunicorn がある（Linux など）: gunicorn（マルチプロセス + スレッド）
+2. waitress がある（Windows でも可）: waitress（1 プロセス + スレッド）
+3. どちらも無い: Werkzeug のスレッド付きサーバー（警告を出す）
+
+ワーカー間の loginState / セッション / キャッシュの整合は
+cma_session の state 世代ファイルとファイルロックで取る。
+
+gunicorn などを直接使う場合は、リポジトリ直下の wsgi.py を指定する::
+
+    gunicorn -w 4 --threads 8 -b 0.0.0.0:5000 wsgi:app
+"""
+
+from __future__ import annotations
+
+import os
+from typing import Any, Final
+
+# 待ち受けアドレス。共用サーバーで他の端末から使う場合は 0.0.0.0 などにする
+SERVER_HOST: Final[str] = os.getenv("CATO_HELPER_HOST", "127.0.0.1")
+
+# ワーカープロセス数（gunicorn を使う場合のみ有効）
+SERVER_WORKERS: Final[int] = int(os.getenv("CATO_HELPER_WORKERS", "1"))
+
+# 1 プロセスあたりのスレッド数
+SERVER_THREADS: Final[int] = int(os.getenv("CATO_HELPER_THREADS", "8"))
+
+
+def _serve_gunicorn(host: str, port: int, workers: int, threads: int) -> None:
+    from gunicorn.app.base import BaseApplication  # type: ignore[import-not-found]
+
+    class _Application(BaseApplication):  # type: ignore[misc]
+        def load_config(self) -> None:
+            self.cfg.set("bind", f"{host}:{port}")
+            self.cfg.set("workers", workers)
+            self.cfg.set("threads", threads)
+            # 静的ファイルやストリーミング応答があるので、gthread ワーカーを使う
+            self.cfg.set("worker_class", "gthread")
+            # 大量の Site の読み込みはストリーミングで数十秒かかることがある
+            self.cfg.set("timeout", 300)
+
+        def load(self) -> Any:
+            # 各ワーカーの中で create_app する（fork 前に作るとスレッドが引き継がれない）
+            from . import create_app
+            from .config import ServerConfig
+
+            return create_app(ServerConfig)
+
+    _Application().run()
+
+
+def serve(
+    host: str = SERVER_HOST,
+    port: int = 5000,
+    workers: int = SERVER_WORKERS,
+    threads: int = SERVER_THREADS,
+) -> None:
+    """サーバーモードでアプリを起動する（戻らない）。"""
+    if workers > 1:
+        try:
+            import gunicorn  # type: ignore[import-not-found]  # noqa: F401
+        except ImportError:
+            print(
+                f"[server] gunicorn が無いため、ワーカー数 {workers} は使えません。"
+                "1 プロセス + スレッドで起動します。"
+            )
+        else:
+            print(f"[server] gunicorn: http://{host}:{port}/ (workers={workers}, threads={threads})")
+            _serve_gunicorn(host, port, workers, threads)
+            return
+
+    from . import create_app
+    from .config import ServerConfig
+
+    app = create_app(ServerConfig)
+
+    try:
+        from waitress import serve as waitress_serve  # type: ignore[import-not-found]
+    except ImportError:
+        waitress_serve = None
+
+    if waitress_serve is not None:
+        print(f"[server] waitress: http://{host}:{port}/ (threads={threads})")
+        waitress_serve(app, host=host, port=port, threads=threads)
+        return
+
+    from werkzeug.serving import run_simple
+
+    print(
+        "[server] waitress / gunicorn が無いため、Werkzeug のスレッド付きサーバーで起動します。"
+        "（pip install waitress を推奨）"
+    )
+    print(f"[server] werkzeug: http://{host}:{port}/")
+    run_simple(host, port, app, threaded=True, use_reloader=False, use_debugger=False)
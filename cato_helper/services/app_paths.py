@@ -0,0 +1,39 @@
+﻿# cato_helper/services/app_paths.py
+"""ツールが読み書きするファイルの置き場所をまとめるモジュール。"""
+
+from __future__ import annotations
+
+import sys
+from pathlib import Path
+
+
+def get_base_dir() -> Path:
+    """
+    レスポンスなどを保存するベースディレクトリを返す。
+
+    - 通常の Python 実行時: プロジェクトルート（このファイルの親の親の親）
+        ROOT/
+          cato_helper/
+            services/
+              app_paths.py  ← ここ
+    - PyInstaller --onefile 実行時:
+        実行ファイルと同じディレクトリ
+    """
+    # PyInstaller などで「凍結」している場合
+    if getattr(sys, "frozen", False):
+        # 実行ファイルのある場所
+        return Path(sys.executable).resolve().parent
+
+    # 通常のスクリプト実行時: プロジェクトルートを推定
+    # app_paths.py -> services -> cato_helper -> ROOT
+    return Path(__file__).resolve().parents[2]
+
+
+# 例: <プロジェクトルート>/cma_responses
+RESPONSE_DIR = get_base_dir() / "cma_responses"
+
+# Static Route 一括インポートのジョブ（途中から再開できるよう進捗ごと保存する）
+ROUTE_IMPORT_DIR = get_base_dir() / "route_imports"
+
+# CatoClient の GET 応答（ETag 付き）のキャッシュ
+API_CACHE_DIR = get_base_dir() / "api_cache"
@@ -0,0 +1,75 @@
+﻿# cato_helper/services/async_loop.py
+"""プロセスに 1 本だけ持つ asyncio のイベントループ（専用スレッドで動かす）。
+
+Flask（WSGI）のリクエスト処理スレッドから、非同期のハンドラをこのループに投げて実行する。
+CMA への GraphQL 呼び出しはこのループ上で重ねて待つので、
+何百件の同時呼び出しでも 1 件 1 スレッドにはならない。
+
+リクエストごとにイベントループを作る（Flask の async ビュー）と、
+ループに紐づく HTTP クライアントの接続プールをリクエストをまたいで使い回せないため、
+ループはプロセス全体で共有する。
+"""
+
+from __future__ import annotations
+
+import asyncio
+import threading
+from typing import Any, AsyncIterator, Awaitable, Iterator, TypeVar
+
+T = TypeVar("T")
+
+_loop: asyncio.AbstractEventLoop | None = None
+_loop_lock = threading.Lock()
+
+
+def get_loop() -> asyncio.AbstractEventLoop:
+    """共有のイベントループを返す（初回呼び出し時にスレッドを起動する）。"""
+    global _loop
+    loop = _loop
+    if loop is not None:
+        return loop
+
+    with _loop_lock:
+        if _loop is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(
+                target=loop.run_forever, daemon=True, name="cma-async-loop"
+            ).start()
+            _loop = loop
+        return _loop
+
+
+def run_async(awaitable: Awaitable[T], timeout: float | None = None) -> T:
+    """共有ループで awaitable を実行し、終わるまで待って結果を返す（同期コードから呼ぶ）。"""
+    async def _wrap() -> T:
+        return await awaitable
+
+    future = asyncio.run_coroutine_threadsafe(_wrap(), get_loop())
+    try:
+        return future.result(timeout)
+    except BaseException:
+        future.cancel()
+        raise
+
+
+def iter_async(agen: AsyncIterator[T]) -> Iterator[T]:
+    """共有ループ上の非同期イテレータを、同期のイテレータとして読む。
+
+    Flask のストリーミング応答（同期のジェネレータ）から非同期ジェネレータを流すために使う。
+    クライアントが途中で切断した場合は、非同期ジェネレータも閉じる。
+    """
+    loop = get_loop()
+    try:
+        while True:
+            try:
+                yield asyncio.run_coroutine_threadsafe(_anext(agen), loop).result()
+            except StopAsyncIteration:
+                return
+    finally:
+        aclose = getattr(agen, "aclose", None)
+        if aclose is not None:
+            asyncio.run_coroutine_threadsafe(aclose(), loop)
+
+
+async def _anext(agen: AsyncIterator[Any]) -> Any:
+    return await agen.__anext__()
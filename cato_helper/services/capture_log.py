@@ -0,0 +1,317 @@
+﻿# cato_helper/services/capture_log.py
+"""GraphQL レスポンスを追記専用のセグメントファイルにまとめて保存するモジュール。
+
+レスポンスごとに 1 ファイル作る方式だと、共有フォルダやウイルス対策ソフトの
+スキャン対象ディレクトリではファイル作成のコストが大きく、探すのも大変になる。
+そこで、
+
+- captures_000001.jsonl     : 1 行 1 レスポンスの追記専用ログ（セグメント）
+- captures_000001.idx.jsonl : 各レスポンスの名前・時刻・バイト位置・長さの索引
+
+の組で保存し、一定サイズを超えたら次のセグメントに切り替える。
+特定のレスポンスは索引から位置を引いて seek するだけで読み出せる。
+
+コマンドラインからも一覧・抽出できる::
+
+    python -m cato_helper.services.capture_log list --name siteInfo
+    python -m cato_helper.services.capture_log extract --segment 1 --offset 0 -o out.json
+    python -m cato_helper.services.capture_log extract --latest loginState
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import re
+import sys
+import threading
+from dataclasses import asdict, dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import IO, Any, Final, Iterator
+
+# response_store を import すると終了時に保存ディレクトリが消されるので、
+# CLI から使う場合に備えてパスだけを参照する
+from .app_paths import RESPONSE_DIR
+from .file_lock import FileLock
+
+# 1 セグメントの最大サイズ（バイト）。超えたら次のセグメントに切り替える
+CAPTURE_SEGMENT_MAX_BYTES: Final[int] = int(
+    os.getenv("CMA_CAPTURE_SEGMENT_MAX_BYTES", str(16 * 1024 * 1024))
+)
+
+_SEGMENT_PATTERN: Final = re.compile(r"^captures_(\d{6})\.jsonl$")
+
+
+def _segment_path(directory: Path, segment: int) -> Path:
+    return directory / f"captures_{segment:06d}.jsonl"
+
+
+def _index_path(directory: Path, segment: int) -> Path:
+    return directory / f"captures_{segment:06d}.idx.jsonl"
+
+
+def _lock_path(directory: Path) -> Path:
+    return directory / "captures.lock"
+
+
+def list_segments(directory: Path) -> list[int]:
+    """ディレクトリ内のセグメント番号を古い順に返す。"""
+    if not directory.exists():
+        return []
+    segments: list[int] = []
+    for p in directory.iterdir():
+        m = _SEGMENT_PATTERN.match(p.name)
+        if m:
+            segments.append(int(m.group(1)))
+    return sorted(segments)
+
+
+@dataclass
+class CaptureIndexEntry:
+    """索引の 1 行分。segment / offset / length でレスポンス本体の位置を表す。"""
+
+    name: str
+    ts: str
+    segment: int
+    offset: int
+    length: int
+
+
+class CaptureLogWriter:
+    """セグメントファイルへの追記を担当するクラス（スレッドセーフ）。
+
+    サーバーモードでは複数のワーカープロセスが同じディレクトリに追記するので、
+    追記のたびにファイルロック（captures.lock）を取り、実際のファイル末尾から offset を求める。
+    """
+
+    def __init__(self, directory: Path, max_segment_bytes: int = CAPTURE_SEGMENT_MAX_BYTES) -> None:
+        self.directory = directory
+        self.max_segment_bytes = max_segment_bytes
+        self._lock = threading.Lock()
+        self._segment: int | None = None
+        self._data_file: IO[bytes] | None = None
+        self._index_file: IO[bytes] | None = None
+
+    @property
+    def current_segment_path(self) -> Path:
+        segment = self._segment or (list_segments(self.directory) or [1])[-1]
+        return _segment_path(self.directory, segment)
+
+    def append(self, name: str, data: Any, ts: str | None = None) -> CaptureIndexEntry:
+        """レスポンスを 1 件追記し、その索引エントリを返す。"""
+        ts = ts or datetime.now().isoformat(timespec="microseconds")
+        line = json.dumps(
+            {"name": name, "ts": ts, "data": data},
+            ensure_ascii=False,
+            separators=(",", ":"),
+        ).encode("utf-8") + b"\n"
+
+        with self._lock:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            with FileLock(_lock_path(self.directory)):
+                offset = self._open_for_append(len(line))
+                assert self._data_file is not None and self._index_file is not None
+
+                entry = CaptureIndexEntry(
+                    name=name,
+                    ts=ts,
+                    segment=self._segment or 1,
+                    offset=offset,
+                    length=len(line),
+                )
+                self._data_file.write(line)
+                self._data_file.flush()
+                self._index_file.write(
+                    json.dumps(asdict(entry), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+                    + b"\n"
+                )
+                self._index_file.flush()
+            return entry
+
+    def total_bytes(self) -> int:
+        """全セグメント（索引を含む）の合計サイズ。"""
+        total = 0
+        for segment in list_segments(self.directory):
+            for p in (_segment_path(self.directory, segment), _index_path(self.directory, segment)):
+                try:
+                    total += p.stat().st_size
+                except FileNotFoundError:
+                    pass
+        return total
+
+    def enforce_limit(self, max_bytes: int) -> None:
+        """合計サイズが max_bytes を超えていたら、書き込み中以外の古いセグメントから消す。"""
+        if max_bytes <= 0:
+            return
+        with self._lock, FileLock(_lock_path(self.directory)):
+            segments = list_segments(self.directory)
+            total = self.total_bytes()
+            for segment in segments:
+                # 最新のセグメントは他のワーカーが書き込み中かもしれないので残す
+                if total <= max_bytes or segment == self._segment or segment == segments[-1]:
+                    break
+                for p in (_segment_path(self.directory, segment), _index_path(self.directory, segment)):
+                    try:
+                        total -= p.stat().st_size
+                        p.unlink()
+                    except FileNotFoundError:
+                        pass
+
+    def close(self) -> None:
+        with self._lock:
+            self._close_files()
+            self._segment = None
+
+    def _open_for_append(self, incoming: int) -> int:
+        """書き込み先のセグメントを開き、追記する位置（ファイル末尾）を返す。ファイルロックを取った状態で呼ぶ。"""
+        segments = list_segments(self.directory)
+        latest = segments[-1] if segments else 1
+        if self._data_file is None or (self._segment or 0) < latest:
+            # 初回、または他のワーカーが次のセグメントに切り替えていた場合
+            self._close_files()
+            self._segment = max(latest, self._segment or 0)
+            self._open_segment()
+
+        assert self._data_file is not None
+        offset = self._data_file.seek(0, os.SEEK_END)
+        if offset > 0 and offset + incoming > self.max_segment_bytes:
+            # セグメントが一杯になったら次のファイルへ
+            self._close_files()
+            self._segment = (self._segment or 0) + 1
+            self._open_segment()
+            offset = self._data_file.seek(0, os.SEEK_END)
+        return offset
+
+    def _open_segment(self) -> None:
+        assert self._segment is not None
+        self._data_file = _segment_path(self.directory, self._segment).open("ab")
+        self._index_file = _index_path(self.directory, self._segment).open("ab")
+
+    def _close_files(self) -> None:
+        for f in (self._data_file, self._index_file):
+            if f is not None:
+                try:
+                    f.close()
+                except Exception:
+                    pass
+        self._data_file = None
+        self._index_file = None
+
+
+# --- 読み出し API ---
+
+
+def iter_index(
+    directory: Path,
+    name: str | None = None,
+    since: str | None = None,
+    until: str | None = None,
+) -> Iterator[CaptureIndexEntry]:
+    """索引を古い順に返す。name は前方一致、since / until は ISO 形式の時刻で絞り込む。"""
+    for segment in list_segments(directory):
+        index_path = _index_path(directory, segment)
+        if not index_path.exists():
+            continue
+        with index_path.open("r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    entry = CaptureIndexEntry(**json.loads(line))
+                except (ValueError, TypeError):
+                    # 書き込み途中で落ちた行などは読み飛ばす
+                    continue
+                if name and not entry.name.startswith(name):
+                    continue
+                if since and entry.ts < since:
+                    continue
+                if until and entry.ts > until:
+                    continue
+                yield entry
+
+
+def read_capture(directory: Path, entry: CaptureIndexEntry) -> dict[str, Any]:
+    """索引エントリが指すレスポンスを seek して読み出す。
+
+    戻り値は {"name": ..., "ts": ..., "data": ...}。
+    """
+    with _segment_path(directory, entry.segment).open("rb") as f:
+        f.seek(entry.offset)
+        raw = f.read(entry.length)
+    return json.loads(raw.decode("utf-8"))
+
+
+def find_latest(directory: Path, name: str) -> CaptureIndexEntry | None:
+    """name に前方一致する最新のエントリを返す。"""
+    latest: CaptureIndexEntry | None = None
+    for entry in iter_index(directory, name=name):
+        latest = entry
+    return latest
+
+
+# --- CLI ---
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m cato_helper.services.capture_log",
+        description="セグメント形式で保存した CMA レスポンスの一覧表示・抽出",
+    )
+    parser.add_argument("--dir", type=Path, default=None, help="保存ディレクトリ（既定: cma_responses）")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_list = sub.add_parser("list", help="保存済みレスポンスの一覧")
+    p_list.add_argument("--name", help="operation 名などで前方一致検索")
+    p_list.add_argument("--since", help="この時刻以降（ISO 形式）")
+    p_list.add_argument("--until", help="この時刻以前（ISO 形式）")
+    p_list.add_argument("--json", action="store_true", help="JSON Lines で出力")
+
+    p_extract = sub.add_parser("extract", help="1 件を取り出す")
+    p_extract.add_argument("--segment", type=int)
+    p_extract.add_argument("--offset", type=int)
+    p_extract.add_argument("--latest", metavar="NAME", help="NAME に一致する最新の 1 件")
+    p_extract.add_argument("-o", "--output", type=Path, help="出力先ファイル（省略時は標準出力）")
+
+    args = parser.parse_args(argv)
+    directory: Path = args.dir or RESPONSE_DIR
+
+    if args.command == "list":
+        for entry in iter_index(directory, name=args.name, since=args.since, until=args.until):
+            if args.json:
+                print(json.dumps(asdict(entry), ensure_ascii=False))
+            else:
+                print(f"{entry.ts}  seg={entry.segment:<4d} off={entry.offset:<10d} len={entry.length:<8d} {entry.name}")
+        return 0
+
+    entry: CaptureIndexEntry | None = None
+    if args.latest:
+        entry = find_latest(directory, args.latest)
+    elif args.segment is not None and args.offset is not None:
+        entry = next(
+            (
+                e
+                for e in iter_index(directory)
+                if e.segment == args.segment and e.offset == args.offset
+            ),
+            None,
+        )
+    else:
+        parser.error("extract には --latest か --segment/--offset を指定してください")
+
+    if entry is None:
+        print("該当するレスポンスが見つかりませんでした。", file=sys.stderr)
+        return 1
+
+    text = json.dumps(read_capture(directory, entry)["data"], ensure_ascii=False, indent=2)
+    if args.output:
+        args.output.write_text(text, encoding="utf-8")
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
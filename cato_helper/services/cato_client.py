@@ -1,48 +1,409 @@
 ﻿# cato_helper/services/cato_client.py
 from __future__ import annotations
 
-from typing import Any, Dict, Optional
+import gzip
+import hashlib
+import os
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, Final, Iterator, List, Optional, Tuple, Union
+from urllib.parse import urlencode, urlsplit
 
 import requests
 
+from .app_paths import API_CACHE_DIR
+from .json_codec import dumps, loads, parse_response
+from .resilience import call_with_retry
+
+# JSON の本文がこのバイト数以上なら gzip で送る（0 以下で圧縮しない）
+API_GZIP_MIN_BYTES: Final[int] = int(os.getenv("CATO_API_GZIP_MIN_BYTES", "1024"))
+
+# iter_items の既定の 1 ページの件数
+API_PAGE_SIZE: Final[int] = int(os.getenv("CATO_API_PAGE_SIZE", "100"))
+
+# "0" で ETag キャッシュを使わない
+API_ETAG_CACHE_ENABLED: Final[bool] = os.getenv("CATO_API_ETAG_CACHE", "1") == "1"
+
+# ETag キャッシュに残す応答の数と、1 応答あたりの最大サイズ（これより大きい応答は保存しない）
+API_ETAG_CACHE_ENTRIES: Final[int] = int(os.getenv("CATO_API_ETAG_CACHE_ENTRIES", "256"))
+API_ETAG_CACHE_MAX_BYTES: Final[int] = int(os.getenv("CATO_API_ETAG_CACHE_MAX_BYTES", str(5 * 1024 * 1024)))
+
+# 本文を送らないことを表す印（json=None は JSON の null を送る）
+_NO_BODY: Final[Any] = object()
+
+
+class ETagCache:
+    """GET の応答を ETag と一緒にディスクへ保存し、If-None-Match で再検証するための小さなキャッシュ。
+
+    1 応答 1 ファイル（1 行目が ETag、残りが gzip 圧縮した本文）。
+    保存した内容をそのまま返すことはなく、必ずサーバーに 304 を確認してから使う。
+    件数が上限を超えたら、最後に使った時刻（mtime）が古いものから消す。
+    """
+
+    def __init__(
+        self,
+        directory: Path,
+        max_entries: int = API_ETAG_CACHE_ENTRIES,
+        max_body_bytes: int = API_ETAG_CACHE_MAX_BYTES,
+    ) -> None:
+        self.directory = directory
+        self.max_entries = max_entries
+        self.max_body_bytes = max_body_bytes
+
+    @staticmethod
+    def make_key(scope: str, url: str, params: Optional[Dict[str, Any]] = None) -> str:
+        """(scope, URL, クエリパラメータ) からキャッシュのキーを作る。scope には API キーのハッシュなどを渡す。"""
+        query = urlencode(sorted((str(k), str(v)) for k, v in (params or {}).items()))
+        return hashlib.sha1(f"{scope}\n{url}?{query}".encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.directory / f"{key}.etag.gz"
+
+    def lookup(self, key: str) -> Optional[Tuple[str, bytes]]:
+        """保存済みの (ETag, 本文) を返す。無い・読めない場合は None。"""
+        try:
+            raw = self._path(key).read_bytes()
+            etag, _, compressed = raw.partition(b"\n")
+            return etag.decode("utf-8"), gzip.decompress(compressed)
+        except (OSError, EOFError, UnicodeDecodeError):
+            return None
+
+    def touch(self, key: str) -> None:
+        """304 で再利用したエントリを「最近使った」ことにする。"""
+        try:
+            os.utime(self._path(key))
+        except OSError:
+            pass
+
+    def store(self, key: str, etag: str, body: bytes) -> None:
+        if len(body) > self.max_body_bytes or "\n" in etag:
+            return
+        path = self._path(key)
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_suffix(f".{os.getpid()}.tmp")
+            tmp.write_bytes(etag.encode("utf-8") + b"\n" + gzip.compress(body, compresslevel=5))
+            os.replace(tmp, path)
+        except OSError as e:
+            # 保存に失敗しても API 呼び出し自体は継続する
+            print(f"[cato_client] etag cache store failed: {e!r}")
+            return
+        self.prune()
+
+    def prune(self) -> None:
+        try:
+            entries = sorted(self.directory.glob("*.etag.gz"), key=lambda p: p.stat().st_mtime, reverse=True)
+        except OSError:
+            return
+        for path in entries[max(0, self.max_entries) :]:
+            path.unlink(missing_ok=True)
+
+
+# プロセス全体で共有するキャッシュ
+etag_cache = ETagCache(API_CACHE_DIR)
+
+
+def _dig(body: Any, key: Optional[str]) -> Any:
+    """"data.items" のようなドット区切りのキーで body の中をたどる（key=None なら body そのもの）。"""
+    if key is None:
+        return body
+    for part in key.split("."):
+        if not isinstance(body, dict):
+            return None
+        body = body.get(part)
+    return body
+
+
+class OffsetPagination:
+    """limit / offset でページを進める。返ってきた件数が page_size 未満なら最後のページとみなす。"""
+
+    def __init__(
+        self,
+        page_size: int = API_PAGE_SIZE,
+        limit_param: str = "limit",
+        offset_param: str = "offset",
+    ) -> None:
+        self.page_size = page_size
+        self.limit_param = limit_param
+        self.offset_param = offset_param
+
+    def first(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        return {**params, self.limit_param: self.page_size, self.offset_param: int(params.get(self.offset_param, 0))}
+
+    def next(self, body: Any, items: List[Any], params: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        if len(items) < self.page_size:
+            return None
+        return {**params, self.offset_param: int(params[self.offset_param]) + len(items)}
+
+
+class CursorPagination:
+    """応答に含まれる次ページのカーソル（トークン）でページを進める。カーソルが無ければ最後のページ。"""
+
+    def __init__(
+        self,
+        cursor_key: str = "nextCursor",
+        cursor_param: str = "cursor",
+        page_size: Optional[int] = API_PAGE_SIZE,
+        limit_param: str = "limit",
+    ) -> None:
+        self.cursor_key = cursor_key
+        self.cursor_param = cursor_param
+        self.page_size = page_size
+        self.limit_param = limit_param
+
+    def first(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        if self.page_size is None:
+            return dict(params)
+        return {**params, self.limit_param: self.page_size}
+
+    def next(self, body: Any, items: List[Any], params: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        cursor = _dig(body, self.cursor_key)
+        if not cursor:
+            return None
+        return {**params, self.cursor_param: cursor}
+
+
+Pagination = Union[OffsetPagination, CursorPagination]
+
 
 class CatoClient:
     """Cato API を叩くための薄いラッパークラス。
 
-    実際のエンドポイントやレスポンス形式は公式ドキュメントに合わせて
-    get/post などのメソッドを追加していく想定。
+    - get / post / put / delete は JSON をやり取りする（応答が空なら None）
+    - 一時的な 5xx / 429 / 接続エラーは resilience でリトライする（post は送信後の通信エラーではリトライしない）
+    - 大きな JSON は gzip で送り、応答も gzip で受け取る
+    - get は ETag キャッシュ（If-None-Match）で、変わっていない応答の転送を省く
+    - iter_items はページ送りの一覧を 1 件ずつ返し、次のページは裏で先に取得しておく
+
+    使い方::
+
+        with CatoClient("https://api.example.com/v1", api_key) as client:
+            for event in client.iter_items("/events", items_key="data.events",
+                                           paginate=CursorPagination("data.nextCursor")):
+                ...
     """
 
-    def __init__(self, base_url: str, api_key: str, timeout: int = 10) -> None:
+    def __init__(
+        self,
+        base_url: str,
+        api_key: str,
+        timeout: int = 10,
+        *,
+        gzip_min_bytes: int = API_GZIP_MIN_BYTES,
+        cache: Optional[ETagCache] = etag_cache if API_ETAG_CACHE_ENABLED else None,
+    ) -> None:
         self.base_url = base_url.rstrip("/")
         self.api_key = api_key
         self.timeout = timeout
+        self.gzip_min_bytes = gzip_min_bytes
+        self.cache = cache
         self._session = requests.Session()
+        # レート制限・サーキットブレーカーはホスト単位で掛ける
+        self._resilience_key = urlsplit(self.base_url).netloc or self.base_url
+        # 別の API キー（アカウント）のキャッシュを使わないよう、キャッシュのキーに含める
+        self._cache_scope = hashlib.sha1(api_key.encode("utf-8")).hexdigest()
+
+    def __enter__(self) -> CatoClient:
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self._session.close()
 
     def _headers(self) -> Dict[str, str]:
         return {
             "Authorization": f"token {self.api_key}",
-            "Content-Type": "application/json",
+            "Accept": "application/json",
+            "Accept-Encoding": "gzip",
         }
 
-    def get(
+    def _url(self, path: str) -> str:
+        return f"{self.base_url}/{path.lstrip('/')}"
+
+    def _request(
         self,
+        method: str,
         path: str,
         *,
         params: Optional[Dict[str, Any]] = None,
+        json: Any = _NO_BODY,
+        headers: Optional[Dict[str, str]] = None,
         timeout: Optional[int] = None,
-    ) -> Any:
-        """GET リクエスト用の共通メソッド。"""
-        url = f"{self.base_url}/{path.lstrip('/')}"
-        resp = self._session.get(
-            url,
-            headers=self._headers(),
-            params=params,
-            timeout=timeout or self.timeout,
+        idempotent: bool = True,
+    ) -> requests.Response:
+        """リクエストを送り、レスポンスをそのまま返す（ステータスの確認は呼び出し側で行う）。"""
+        request_headers = self._headers()
+        data: Optional[bytes] = None
+        if json is not _NO_BODY:
+            data = dumps(json)
+            request_headers["Content-Type"] = "application/json"
+            if 0 < self.gzip_min_bytes <= len(data):
+                data = gzip.compress(data, compresslevel=5)
+                request_headers["Content-Encoding"] = "gzip"
+        if headers:
+            request_headers.update(headers)
+
+        url = self._url(path)
+        return call_with_retry(
+            lambda _attempt: self._session.request(
+                method,
+                url,
+                headers=request_headers,
+                params=params,
+                data=data,
+                timeout=timeout or self.timeout,
+            ),
+            key=self._resilience_key,
+            retry_on=(requests.ConnectionError, requests.Timeout),
+            idempotent=idempotent,
         )
+
+    @staticmethod
+    def _decode(resp: requests.Response) -> Any:
         resp.raise_for_status()
-        return resp.json()
+        if resp.status_code == 204 or not resp.content:
+            return None
+        return parse_response(resp)
+
+    def get(
+        self,
+        path: str,
+        *,
+        params: Optional[Dict[str, Any]] = None,
+        timeout: Optional[int] = None,
+        use_cache: bool = True,
+    ) -> Any:
+        """GET リクエスト用の共通メソッド。
+
+        前回の応答に ETag があれば If-None-Match を付けて送り、
+        304（変更なし）なら保存しておいた本文を返す。
+        """
+        cache = self.cache if use_cache else None
+        key: Optional[str] = None
+        cached: Optional[Tuple[str, bytes]] = None
+        headers: Dict[str, str] = {}
+        if cache is not None:
+            key = cache.make_key(self._cache_scope, self._url(path), params)
+            cached = cache.lookup(key)
+            if cached is not None:
+                headers["If-None-Match"] = cached[0]
+
+        resp = self._request("GET", path, params=params, headers=headers, timeout=timeout)
+        if resp.status_code == 304 and cache is not None and key is not None and cached is not None:
+            cache.touch(key)
+            return loads(cached[1])
+
+        body = self._decode(resp)
+        etag = resp.headers.get("ETag")
+        if cache is not None and key is not None and etag:
+            cache.store(key, etag, resp.content)
+        return body
+
+    def post(
+        self,
+        path: str,
+        json: Any = None,
+        *,
+        params: Optional[Dict[str, Any]] = None,
+        timeout: Optional[int] = None,
+    ) -> Any:
+        """POST リクエスト。冪等でないので、送信後の通信エラーではリトライしない（429 / 503 のみ）。"""
+        resp = self._request("POST", path, params=params, json=json, timeout=timeout, idempotent=False)
+        return self._decode(resp)
+
+    def put(
+        self,
+        path: str,
+        json: Any = None,
+        *,
+        params: Optional[Dict[str, Any]] = None,
+        timeout: Optional[int] = None,
+    ) -> Any:
+        """PUT リクエスト（同じ内容で置き換えるだけなので、get と同じくリトライする）。"""
+        resp = self._request("PUT", path, params=params, json=json, timeout=timeout)
+        return self._decode(resp)
+
+    def delete(
+        self,
+        path: str,
+        *,
+        params: Optional[Dict[str, Any]] = None,
+        timeout: Optional[int] = None,
+    ) -> Any:
+        """DELETE リクエスト。"""
+        resp = self._request("DELETE", path, params=params, timeout=timeout)
+        return self._decode(resp)
+
+    def iter_pages(
+        self,
+        path: str,
+        *,
+        items_key: Optional[str] = "items",
+        params: Optional[Dict[str, Any]] = None,
+        paginate: Optional[Pagination] = None,
+        timeout: Optional[int] = None,
+        prefetch: bool = True,
+    ) -> Iterator[Tuple[Any, List[Any]]]:
+        """ページ送りの GET を 1 ページずつ (応答の本文, items_key で取り出した配列) で返す。
+
+        items_key は "data.items" のようなドット区切りで指定できる（None なら本文そのものが配列）。
+        配列が空のページで終わる（カーソルを返し続ける API でも止まるように）。
+
+        prefetch=True の場合、1 ページ受け取った時点で次のページの取得を別スレッドで始めるので、
+        呼び出し側の処理と次のページの通信が重なる。メモリに載るのは最大 2 ページ分。
+        ページ送りの応答は変わりやすいので ETag キャッシュは使わない。
+        """
+        paginate = paginate or OffsetPagination()
+
+        def fetch(page: Dict[str, Any]) -> Tuple[Any, List[Any]]:
+            body = self.get(path, params=page, timeout=timeout, use_cache=False)
+            items = _dig(body, items_key)
+            return body, items if isinstance(items, list) else []
+
+        def next_params(body: Any, items: List[Any], page: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+            return paginate.next(body, items, page) if items else None
+
+        page_params: Optional[Dict[str, Any]] = paginate.first(dict(params or {}))
+        if not prefetch:
+            while page_params is not None:
+                body, items = fetch(page_params)
+                page_params = next_params(body, items, page_params)
+                yield body, items
+            return
+
+        executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="cato-client-prefetch")
+        future: Optional[Future[Tuple[Any, List[Any]]]] = executor.submit(fetch, page_params)
+        try:
+            while future is not None:
+                body, items = future.result()
+                future = None
+                page_params = next_params(body, items, page_params)
+                if page_params is not None:
+                    future = executor.submit(fetch, page_params)
+                yield body, items
+        finally:
+            # 途中でやめた場合、取得中のページは待たずに捨てる
+            if future is not None:
+                future.cancel()
+            executor.shutdown(wait=False)
+
+    def iter_items(
+        self,
+        path: str,
+        *,
+        items_key: Optional[str] = "items",
+        params: Optional[Dict[str, Any]] = None,
+        paginate: Optional[Pagination] = None,
+        timeout: Optional[int] = None,
+        prefetch: bool = True,
+    ) -> Iterator[Any]:
+        """ページ送りの一覧を 1 件ずつ返す（引数は iter_pages と同じ）。
 
-    # 将来的に:
-    # def post(...), def put(...), def delete(...)
-    # みたいなメソッドを追加していく
+        大量のイベントや Site の一覧も、全件をリストに溜めずにページ単位のメモリで順に処理できる。
+        """
+        for _body, items in self.iter_pages(
+            path, items_key=items_key, params=params, paginate=paginate, timeout=timeout, prefetch=prefetch
+        ):
+            yield from items
@@ -0,0 +1,252 @@
+﻿# cato_helper/services/cma_cache.py
+"""CMA GraphQL の読み取り系レスポンスをキャッシュするモジュール。
+
+Site 構成や IP Range は数分単位ではほとんど変わらないため、
+画面を開き直すたびに全 Site 分の GraphQL を叩き直さなくて済むようにする。
+
+- キーは (テナント, アカウント, operationName, 正規化した variables)
+- operationName ごとに TTL を設定できる
+- エントリ数・合計サイズ（JSON にしたときのバイト数の概算）の上限を超えたら、
+  最も使われていないものから捨てる（LRU）
+- TTL 切れ直後の一定時間は古い値をそのまま返しつつ、裏で取り直す
+  （stale-while-revalidate）
+- ログアウト時などに明示的に全消去（またはテナント単位で消去）できる
+"""
+
+from __future__ import annotations
+
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Final, Hashable, Mapping
+
+from .json_codec import dumps
+
+# --- 設定値 ---
+
+# "0" でキャッシュを無効化（常に GraphQL を叩く）
+CMA_CACHE_ENABLED: Final[bool] = os.getenv("CMA_CACHE_ENABLED", "1") == "1"
+
+# 保持するエントリ数の上限（これを超えたら LRU で捨てる）
+CMA_CACHE_MAX_ENTRIES: Final[int] = int(os.getenv("CMA_CACHE_MAX_ENTRIES", "2048"))
+
+# 保持する値の合計サイズの上限（バイト。値を JSON にしたときの長さで数える）。
+# siteInfoBatch のように 1 件が大きい値もあるので、件数だけでなくサイズでも抑える（0 以下で無制限）
+CMA_CACHE_MAX_BYTES: Final[int] = int(os.getenv("CMA_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+
+# TTL 切れ後、古い値を返しつつ裏で更新してよい時間（秒）
+CMA_CACHE_STALE_SECONDS: Final[float] = float(os.getenv("CMA_CACHE_STALE_SECONDS", "600"))
+
+# operationName ごとの TTL（秒）。未定義の operationName は DEFAULT_TTL_SECONDS を使う。
+DEFAULT_TTL_SECONDS: Final[float] = 120.0
+DEFAULT_OPERATION_TTLS: Final[dict[str, float]] = {
+    "loginState": 300.0,
+    "accountSnapshotSites": 120.0,
+    "siteInfo": 300.0,
+    "siteInfoBatch": 300.0,
+    "account": 600.0,
+}
+
+
+def _load_operation_ttls() -> dict[str, float]:
+    """環境変数 CMA_CACHE_TTLS（例: "siteInfo=60,account=900"）で TTL を上書きする。"""
+    ttls = dict(DEFAULT_OPERATION_TTLS)
+    raw = os.getenv("CMA_CACHE_TTLS", "")
+    for part in raw.split(","):
+        name, sep, value = part.partition("=")
+        if not sep:
+            continue
+        try:
+            ttls[name.strip()] = float(value)
+        except ValueError:
+            print(f"[cma_cache] CMA_CACHE_TTLS の値が不正なので無視します: {part!r}")
+    return ttls
+
+
+def _tenant_of(key: Hashable) -> str | None:
+    """make_cache_key で作ったキーならテナントを返す。"""
+    return key[0] if isinstance(key, tuple) and key else None
+
+
+def _value_size(value: Any) -> int:
+    """値を JSON にしたときのバイト数（合計サイズの上限用の概算）。"""
+    try:
+        return len(dumps(value, default=str))
+    except (TypeError, ValueError):
+        return 0
+
+
+def make_cache_key(
+    tenant: str,
+    account_id: str | None,
+    operation_name: str,
+    variables: Mapping[str, Any] | None,
+) -> tuple[str, str, str, str]:
+    """キャッシュキーを作る。variables はキー順を揃えた JSON 文字列に正規化する。"""
+    normalized = dumps(variables or {}, sort_keys=True, default=str).decode("utf-8")
+    return (tenant, account_id or "", operation_name, normalized)
+
+
+@dataclass
+class _CacheEntry:
+    value: Any
+    stored_at: float
+    ttl: float
+    size: int
+
+
+class GraphQLResponseCache:
+    """TTL + LRU + stale-while-revalidate なスレッドセーフキャッシュ。"""
+
+    def __init__(
+        self,
+        max_entries: int = CMA_CACHE_MAX_ENTRIES,
+        max_bytes: int = CMA_CACHE_MAX_BYTES,
+        operation_ttls: Mapping[str, float] | None = None,
+        stale_seconds: float = CMA_CACHE_STALE_SECONDS,
+        enabled: bool = CMA_CACHE_ENABLED,
+    ) -> None:
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.operation_ttls = dict(operation_ttls or DEFAULT_OPERATION_TTLS)
+        self.stale_seconds = stale_seconds
+        self.enabled = enabled
+
+        self._entries: OrderedDict[Hashable, _CacheEntry] = OrderedDict()
+        self._refreshing: set[Hashable] = set()
+        self._refresh_tasks: set[asyncio.Task[None]] = set()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        # invalidate() のたびに進める世代番号（全体用と、テナントごと）。
+        # 裏で取得中だった古い結果が、消去後のキャッシュに戻ってこないようにする。
+        # テナント単位の消去では、他のテナントの取得中の結果は捨てない。
+        self._generation = 0
+        self._tenant_generations: dict[str, int] = {}
+
+    def ttl_for(self, operation_name: str) -> float:
+        return self.operation_ttls.get(operation_name, DEFAULT_TTL_SECONDS)
+
+    async def aget_or_load(
+        self,
+        key: Hashable,
+        operation_name: str,
+        loader: Callable[[], Awaitable[Any]],
+        force_refresh: bool = False,
+        should_cache: Callable[[Any], bool] | None = None,
+    ) -> Any:
+        """キャッシュがあれば返し、無ければ await loader() で取得して保存する。
+
+        force_refresh=True の場合はキャッシュを見ずに取り直す（再読み込みボタン用）。
+        should_cache を渡した場合、False を返した値（エラー応答など）は保存しない。
+        stale-while-revalidate の裏の取り直しは、同じループのタスクで行う。
+        """
+        if not self.enabled:
+            return await loader()
+
+        ttl = self.ttl_for(operation_name)
+        if ttl <= 0:
+            return await loader()
+
+        if not force_refresh:
+            now = time.monotonic()
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    age = now - entry.stored_at
+                    if age < entry.ttl:
+                        self._entries.move_to_end(key)
+                        return entry.value
+                    if age < entry.ttl + self.stale_seconds:
+                        # 古い値を返しつつ、裏で取り直す
+                        self._entries.move_to_end(key)
+                        self._schedule_async_refresh_locked(key, ttl, loader, should_cache)
+                        return entry.value
+
+        with self._lock:
+            generation = self._generation_locked(key)
+        value = await loader()
+        if should_cache is None or should_cache(value):
+            self._store(key, value, ttl, generation)
+        return value
+
+    def invalidate(self, tenant: str | None = None) -> None:
+        """キャッシュを消去する（ログアウト・再ログイン時用）。
+
+        tenant を指定した場合は、キーの先頭（テナント）が一致するものだけを消す
+        （他のテナントの取得中の値はそのまま保存される）。
+        """
+        with self._lock:
+            # 取得中の値が消去前の情報で書き戻されないようにする
+            if tenant is None:
+                self._entries.clear()
+                self._total_bytes = 0
+                self._generation += 1
+            else:
+                for key in [k for k in self._entries if _tenant_of(k) == tenant]:
+                    self._total_bytes -= self._entries.pop(key).size
+                self._tenant_generations[tenant] = self._tenant_generations.get(tenant, 0) + 1
+
+    def _generation_locked(self, key: Hashable) -> tuple[int, int]:
+        """key の現在の世代（全体の世代, テナントの世代）を返す（ロック取得済みで呼ぶ）。"""
+        tenant = _tenant_of(key)
+        return self._generation, 0 if tenant is None else self._tenant_generations.get(tenant, 0)
+
+    def _store(self, key: Hashable, value: Any, ttl: float, generation: tuple[int, int]) -> None:
+        size = _value_size(value) if self.max_bytes > 0 else 0
+        if 0 < self.max_bytes < size:
+            # 1 件で上限を超える値は保存しない
+            return
+        with self._lock:
+            if generation != self._generation_locked(key):
+                # 取得中に invalidate() された場合は保存しない
+                return
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._total_bytes -= old.size
+            self._entries[key] = _CacheEntry(value=value, stored_at=time.monotonic(), ttl=ttl, size=size)
+            self._total_bytes += size
+            while len(self._entries) > self.max_entries or (0 < self.max_bytes < self._total_bytes):
+                _, evicted = self._entries.popitem(last=False)
+                self._total_bytes -= evicted.size
+
+    def _schedule_async_refresh_locked(
+        self,
+        key: Hashable,
+        ttl: float,
+        loader: Callable[[], Awaitable[Any]],
+        should_cache: Callable[[Any], bool] | None,
+    ) -> None:
+        """バックグラウンド更新を 1 キーにつき 1 本だけ、実行中のループにタスクとして積む（ロック取得済みで呼ぶ）。"""
+        if key in self._refreshing:
+            return
+        self._refreshing.add(key)
+        generation = self._generation_locked(key)
+
+        async def worker() -> None:
+            try:
+                value = await loader()
+                if should_cache is None or should_cache(value):
+                    self._store(key, value, ttl, generation)
+            except Exception as e:  # noqa: BLE001
+                # 更新に失敗しても、古い値はそのまま残しておく
+                print(f"[cma_cache] background refresh failed: {e!r}")
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        task = asyncio.get_running_loop().create_task(worker())
+        # タスクが途中で GC されないよう、終わるまで参照を持っておく
+        self._refresh_tasks.add(task)
+        task.add_done_callback(self._refresh_tasks.discard)
+
+
+# プロセス全体で共有するキャッシュ
+response_cache = GraphQLResponseCache(operation_ttls=_load_operation_ttls())
+
+
+def invalidate_cma_cache(tenant: str | None = None) -> None:
+    """共有キャッシュを消去する（tenant を指定した場合はそのテナント分だけ）。"""
+    response_cache.invalidate(tenant)
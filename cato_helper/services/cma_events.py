@@ -0,0 +1,105 @@
+﻿# cato_helper/services/cma_events.py
+"""CMA のログイン状態の変化を画面に push するための、プロセス内のイベントバス。
+
+login_via_playwright / cleanup_cma_state などが状態の変化を publish し、
+/cma/events（Server-Sent Events）や /cma/events/poll（ロングポーリング）が
+それを待ち受けて画面に届ける。画面側は定期的に /cma/status を叩かなくて済む。
+
+イベントの種類:
+
+- login_started    : ログイン（Playwright）を開始した
+- state_saved      : ログイン済みセッションを state ファイルに保存した（サイレント更新では refreshed=True）
+- account_resolved : loginState からアカウント名が分かった（data.status に get_cma_status の結果）
+- login_failed     : ログインに失敗した
+- expired          : セッションの有効期限が切れ、更新もできなかった
+- logged_out       : ログアウトした（state ファイルを削除した）
+- state_changed    : 他のワーカープロセスで state が更新された
+
+各イベントには連番の id が付き、直近 CMA_EVENTS_BACKLOG 件を保持する。
+再接続した画面は最後に受け取った id 以降を受け取り直せる。
+"""
+
+from __future__ import annotations
+
+import os
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Final
+
+# 再接続時に受け取り直せるよう保持しておくイベントの件数
+CMA_EVENTS_BACKLOG: Final[int] = int(os.getenv("CMA_EVENTS_BACKLOG", "256"))
+
+# SSE で何も無いときに keepalive のコメントを送る間隔（秒）
+CMA_EVENTS_HEARTBEAT_SECONDS: Final[float] = float(os.getenv("CMA_EVENTS_HEARTBEAT_SECONDS", "15"))
+
+# 1 本の SSE 接続を保つ最大時間（秒）。過ぎたら閉じ、ブラウザの EventSource に繋ぎ直させる。
+# SSE はログイン中の画面だけが繋ぐ（それ以外は /cma/events/poll?wait=0 を間隔を空けて叩く）
+CMA_EVENTS_STREAM_SECONDS: Final[float] = float(os.getenv("CMA_EVENTS_STREAM_SECONDS", "300"))
+
+# ロングポーリングで 1 回に待つ最大時間（秒）
+CMA_EVENTS_POLL_TIMEOUT: Final[float] = float(os.getenv("CMA_EVENTS_POLL_TIMEOUT", "25"))
+
+
+@dataclass(frozen=True)
+class CmaEvent:
+    id: int
+    type: str
+    tenant: str | None
+    profile: str | None
+    data: dict[str, Any] = field(default_factory=dict)
+    time: float = 0.0
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "id": self.id,
+            "type": self.type,
+            "tenant": self.tenant,
+            "profile": self.profile,
+            "time": self.time,
+            **self.data,
+        }
+
+
+class CmaEventBus:
+    """スレッド間でイベントを配る。待ち受け側は wait で次のイベントまでブロックする。"""
+
+    def __init__(self, backlog: int = CMA_EVENTS_BACKLOG) -> None:
+        self._events: deque[CmaEvent] = deque(maxlen=backlog)
+        self._cond = threading.Condition()
+        self._last_id = 0
+
+    @property
+    def last_id(self) -> int:
+        return self._last_id
+
+    def publish(
+        self, event_type: str, tenant: str | None = None, profile: str | None = None, **data: Any
+    ) -> CmaEvent:
+        with self._cond:
+            self._last_id += 1
+            event = CmaEvent(self._last_id, event_type, tenant, profile, data, time.time())
+            self._events.append(event)
+            self._cond.notify_all()
+        return event
+
+    def since(self, last_id: int) -> list[CmaEvent]:
+        """last_id より後のイベントを返す（保持件数を超えて古いものは失われる）。"""
+        with self._cond:
+            return [e for e in self._events if e.id > last_id]
+
+    def wait(self, last_id: int, timeout: float) -> list[CmaEvent]:
+        """last_id より後のイベントが来るまで最大 timeout 秒待って返す（無ければ空）。"""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self._last_id <= last_id:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return []
+                self._cond.wait(remaining)
+            return [e for e in self._events if e.id > last_id]
+
+
+# プロセス全体で共有するイベントバス
+cma_events = CmaEventBus()
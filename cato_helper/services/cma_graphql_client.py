@@ -1,41 +1,244 @@
 ﻿# cato_helper/services/cma_graphql_client.py
+"""CMA 向けの asyncio ネイティブな GraphQL クライアント。
+
+- httpx がある場合: httpx.AsyncClient（接続プール。h2 もあれば HTTP/2）で叩く
+- 無い場合: 使い回し中の requests.Session（cma_session.get_cma_session）を
+  asyncio.to_thread で叩く（スレッドは使うが、同時実行数は同じように制限される）
+
+execute はセマフォで同時実行数を制限するので、
+数百件を一度に投げても CMA 側に一斉にリクエストが飛ぶことはない。
+どちらの経路も resilience のリトライ・レート制限・サーキットブレーカーを通る。
+
+クライアントはイベントループに紐づくため、async_loop の共有ループ上で
+get_graphql_client(target) から取得して使う。
+"""
+
 from __future__ import annotations
 
-from typing import Any, Mapping
+import asyncio
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Final, Mapping
+
+from .cma_http import DEFAULT_TIMEOUT, post_graphql
+from .cma_session import CmaTarget, build_cma_headers, get_cma_session
+from .json_codec import parse_response
+from .metrics import record_graphql_call
+from .query_registry import template_for
+from .resilience import acall_with_retry
+
+# 1 CmaTarget あたりの同時実行数の上限
+CMA_ASYNC_MAX_CONCURRENCY: Final[int] = int(os.getenv("CMA_ASYNC_MAX_CONCURRENCY", "32"))
+
+# "0" で HTTP/2 を使わない（h2 パッケージが無い場合も HTTP/1.1 になる）
+CMA_HTTP2: Final[bool] = os.getenv("CMA_HTTP2", "1") == "1"
+
+# 接続プールに保持する接続数
+CMA_ASYNC_POOL_SIZE: Final[int] = int(os.getenv("CMA_ASYNC_POOL_SIZE", "32"))
+
+
+class CmaGraphQLError(RuntimeError):
+    """GraphQL の errors フィールドが返ってきた場合の例外。"""
+
+    def __init__(self, message: str, body: dict[str, Any]) -> None:
+        super().__init__(message)
+        self.body = body
 
-import requests
+
+class _PooledHttpClient:
+    """httpx.AsyncClient と、それを使って送信中のリクエスト数。
+
+    state ファイルが更新されて作り直した後も、送信中のリクエストが残っている間は閉じない
+    （retired にしておき、最後のリクエストが終わった時点で閉じる）。
+    """
+
+    def __init__(self, client: Any, mtime: float) -> None:
+        self.client = client
+        self.mtime = mtime
+        self.in_use = 0
+        self.retired = False
+
+    async def release(self) -> None:
+        self.in_use -= 1
+        if self.retired and self.in_use == 0:
+            await self.client.aclose()
+
+    async def retire(self) -> None:
+        self.retired = True
+        if self.in_use == 0:
+            await self.client.aclose()
+
+
+def _has_module(name: str) -> bool:
+    try:
+        __import__(name)
+    except ImportError:
+        return False
+    return True
 
 
 class CmaGraphQLClient:
-    """CMA 向け GraphQL クライアントの薄いラッパ。
+    """1 CmaTarget 分の非同期 GraphQL クライアント。
 
-    - エンドポイント URL
-    - 認証済みセッションの Cookie
+    使い方::
 
-    を受け取り、GraphQL クエリを実行するだけの小さなクラスです。
-    例外処理やエラー整形はここの責務にまとめておきます。
+        client = get_graphql_client(target)
+        body = await client.execute(query, {"siteId": "1"}, "siteInfo")
     """
 
-    def __init__(self, endpoint: str, cookies: Mapping[str, str] | None = None) -> None:
-        self.endpoint = endpoint
-        self.session = requests.Session()
-        if cookies:
-            self.session.cookies.update(cookies)
-
-    def execute(self, query: str, variables: dict[str, Any] | None = None) -> dict[str, Any]:
-        payload: dict[str, Any] = {
-            "query": query,
-            "variables": variables or {},
-        }
-        resp = self.session.post(self.endpoint, json=payload, timeout=30)
-        resp.raise_for_status()
-        data = resp.json()
+    def __init__(
+        self,
+        target: CmaTarget,
+        *,
+        max_concurrency: int = CMA_ASYNC_MAX_CONCURRENCY,
+        http2: bool = CMA_HTTP2,
+        timeout: float = DEFAULT_TIMEOUT,
+    ) -> None:
+        self.target = target
+        self.http2 = http2
+        self.timeout = timeout
+        self._semaphore = asyncio.Semaphore(max(1, max_concurrency))
+        # state ファイルの mtime ごとに作る httpx クライアント（再ログイン・サイレント更新で作り直す）
+        self._client: _PooledHttpClient | None = None
+        self._client_lock = asyncio.Lock()
+        self._use_httpx = _has_module("httpx")
+
+    async def execute(
+        self,
+        query: str,
+        variables: Mapping[str, Any] | None = None,
+        operation_name: str | None = None,
+        *,
+        raise_on_errors: bool = True,
+    ) -> dict[str, Any]:
+        """GraphQL を 1 件実行し、レスポンス全体（data / errors）を返す。
 
-        # GraphQL の errors フィールドがあれば、例外にして呼び出し元で拾ってもらう
-        errors = data.get("errors")
-        if errors:
-            # 単純に最初のエラーだけまとめる
-            msg = errors[0].get("message", "GraphQL error")
-            raise RuntimeError(f"GraphQL error: {msg}")
+        HTTP エラーは例外にする。raise_on_errors=True の場合は
+        GraphQL の errors も CmaGraphQLError にする（最初のエラーのメッセージを使う）。
+        """
+        template = template_for(operation_name, query)
+        async with self._semaphore:
+            if self._use_httpx:
+                data = await self._post_httpx(
+                    template.encode(variables), operation_name, idempotent=not template.mutation
+                )
+            else:
+                data = await asyncio.to_thread(self._post_requests, template.payload(variables))
 
+        errors = data.get("errors") if isinstance(data, dict) else None
+        if raise_on_errors and errors:
+            first = errors[0] if isinstance(errors[0], dict) else {}
+            raise CmaGraphQLError(f"GraphQL error: {first.get('message', 'GraphQL error')}", data)
         return data
+
+    async def aclose(self) -> None:
+        async with self._client_lock:
+            pooled, self._client = self._client, None
+        if pooled is not None:
+            await pooled.retire()
+
+    # --- 送信処理 ---
+
+    def _post_requests(self, payload: dict[str, Any]) -> dict[str, Any]:
+        resp = post_graphql(
+            get_cma_session(self.target),
+            self.target.graphql_url,
+            payload,
+            tenant=self.target.tenant,
+            timeout=self.timeout,
+        )
+        resp.raise_for_status()
+        return parse_response(resp)
+
+    @asynccontextmanager
+    async def _http_client(self) -> AsyncIterator[Any]:
+        """現在の state 用の httpx クライアントを、送信が終わるまで借りる。
+
+        state ファイルが更新されていたら新しいクライアントを作り、古いものは
+        借りているリクエストがすべて終わってから閉じる。
+        """
+        try:
+            mtime = self.target.state_file.stat().st_mtime
+        except FileNotFoundError as e:
+            raise RuntimeError("CMA state file not found") from e
+
+        async with self._client_lock:
+            pooled = self._client
+            if pooled is None or pooled.mtime != mtime:
+                import httpx
+
+                old = pooled
+                pooled = self._client = _PooledHttpClient(
+                    httpx.AsyncClient(
+                        headers=build_cma_headers(self.target),
+                        http2=self.http2 and _has_module("h2"),
+                        timeout=self.timeout,
+                        limits=httpx.Limits(
+                            max_connections=CMA_ASYNC_POOL_SIZE,
+                            max_keepalive_connections=CMA_ASYNC_POOL_SIZE,
+                        ),
+                    ),
+                    mtime,
+                )
+                if old is not None:
+                    await old.retire()
+            pooled.in_use += 1
+
+        try:
+            yield pooled.client
+        finally:
+            await pooled.release()
+
+    async def _post_httpx(
+        self, body: bytes, operation_name: str | None, *, idempotent: bool = True
+    ) -> dict[str, Any]:
+        async with self._http_client() as client:
+            return await self._send_httpx(client, body, operation_name, idempotent=idempotent)
+
+    async def _send_httpx(
+        self, client: Any, body: bytes, operation_name: str | None, *, idempotent: bool
+    ) -> dict[str, Any]:
+        import httpx
+
+        operation = operation_name or "unknown"
+        tenant = self.target.tenant
+
+        async def send(attempt: int) -> Any:
+            start = time.perf_counter()
+            try:
+                resp = await client.post(self.target.graphql_url, content=body)
+            except Exception:
+                record_graphql_call(
+                    tenant, operation, "error", time.perf_counter() - start, len(body), 0, retries=min(attempt, 1)
+                )
+                raise
+
+            record_graphql_call(
+                tenant,
+                operation,
+                resp.status_code,
+                time.perf_counter() - start,
+                len(body),
+                len(resp.content or b""),
+                retries=min(attempt, 1),
+            )
+            return resp
+
+        resp = await acall_with_retry(
+            send, key=tenant, retry_on=(httpx.TransportError,), idempotent=idempotent
+        )
+        resp.raise_for_status()
+        return parse_response(resp)
+
+
+# CmaTarget.key -> クライアント（共有ループ上でのみ使う）
+_clients: dict[str, CmaGraphQLClient] = {}
+
+
+def get_graphql_client(target: CmaTarget) -> CmaGraphQLClient:
+    """target 用のクライアントを返す（async_loop の共有ループ上から呼ぶ）。"""
+    client = _clients.get(target.key)
+    if client is None:
+        client = _clients[target.key] = CmaGraphQLClient(target)
+    return client
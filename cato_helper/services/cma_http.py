@@ -0,0 +1,72 @@
+﻿# cato_helper/services/cma_http.py
+"""CMA GraphQL への POST を 1 か所にまとめ、呼び出しごとの計測値を記録するモジュール。
+
+operationName・HTTP ステータス・送受信バイト数・所要時間を metrics に残すので、
+どのテナントのどの operation が遅いのかを /metrics から確認できる。
+
+一時的な 5xx / 429 / 接続エラーは resilience でリトライし、
+テナントごとのレート制限とサーキットブレーカーもここで掛ける。
+"""
+
+from __future__ import annotations
+
+import time
+from typing import Any, Mapping
+
+from .metrics import record_graphql_call
+from .query_registry import encode_payload, is_mutation
+from .resilience import call_with_retry
+
+DEFAULT_TIMEOUT: float = 30
+
+
+def post_graphql(
+    sess: Any,
+    url: str,
+    payload: Mapping[str, Any],
+    *,
+    tenant: str,
+    timeout: float = DEFAULT_TIMEOUT,
+) -> Any:
+    """GraphQL の payload を POST して requests.Response を返す。
+
+    ステータスの確認や JSON のパースは呼び出し側で行う。
+    通信自体に失敗した場合は status="error" として記録し、例外をそのまま投げる。
+    payload は query_registry のテンプレートでエンコードする（query 部分は毎回エンコードしない）。
+
+    一時的な失敗はリトライし、最後のレスポンスを返す（送信ごとに metrics へ記録する）。
+    サーキットが開いている場合は通信せずに resilience.CircuitOpenError を投げる。
+    """
+    from requests.exceptions import ConnectionError, Timeout
+
+    operation = str(payload.get("operationName") or "unknown")
+    body = encode_payload(payload)
+
+    def send(attempt: int) -> Any:
+        start = time.perf_counter()
+        try:
+            # セッションには Content-Type: application/json が設定済み
+            resp = sess.post(url, data=body, timeout=timeout)
+        except Exception:
+            record_graphql_call(
+                tenant, operation, "error", time.perf_counter() - start, len(body), 0, retries=min(attempt, 1)
+            )
+            raise
+
+        record_graphql_call(
+            tenant,
+            operation,
+            resp.status_code,
+            time.perf_counter() - start,
+            len(body),
+            len(resp.content or b""),
+            retries=min(attempt, 1),
+        )
+        return resp
+
+    return call_with_retry(
+        send,
+        key=tenant,
+        retry_on=(ConnectionError, Timeout),
+        idempotent=not is_mutation(str(payload.get("query") or "")),
+    )
@@ -1,6 +1,11 @@
 ﻿# cato_helper/services/cma_queries.py
 from __future__ import annotations
 
+import re
+from functools import lru_cache
+
+from .query_registry import register_query
+
 # CMA の GraphQL クエリ定義をまとめるモジュール。
 # 追加のクエリはこのファイルに増やしていく想定。
 
@@ -35,3 +40,51 @@ LOGIN_STATE_QUERY = (
     "  }\n"
     "}\n"
 )
+
+
+# payload の query 部分を事前にエンコードしておく（query_registry 参照）
+register_query("loginState", LOGIN_STATE_QUERY)
+
+
+@lru_cache(maxsize=64)
+def build_aliased_batch_query(
+    query: str,
+    operation_name: str,
+    var_name: str,
+    var_type: str,
+    count: int,
+    alias_prefix: str = "s",
+    batch_var_prefix: str = "id",
+) -> str:
+    """1 件取得用のクエリから、エイリアス付きでまとめて取得するクエリを組み立てる。
+
+    例えば siteInfo のクエリ（変数 $siteId）と count=2 を渡すと、
+    次のような 1 本の GraphQL ドキュメントになる::
+
+        query siteInfoBatch($id0: ID!, $id1: ID!) {
+          s0: siteInfo(id: $id0) { ... }
+          s1: siteInfo(id: $id1) { ... }
+        }
+
+    レスポンスの data は {"s0": {...}, "s1": {...}} の形になるので、
+    alias_prefix + 連番 で元の要素に対応付けられる。
+    """
+    if count < 1:
+        raise ValueError("count must be >= 1")
+
+    # 最上位の { ... } の中身（フィールド選択部分）だけを取り出す
+    selection = query[query.index("{") + 1 : query.rindex("}")].strip()
+    var_pattern = re.compile(r"\$" + re.escape(var_name) + r"\b")
+
+    var_defs: list[str] = []
+    fields: list[str] = []
+    for i in range(count):
+        batch_var = f"{batch_var_prefix}{i}"
+        var_defs.append(f"${batch_var}: {var_type}")
+        fields.append(f"  {alias_prefix}{i}: " + var_pattern.sub(f"${batch_var}", selection))
+
+    return (
+        f"query {operation_name}({', '.join(var_defs)}) {{\n"
+        + "\n".join(fields)
+        + "\n}\n"
+    )
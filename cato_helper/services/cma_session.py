@@ -7,6 +7,10 @@ Playwright を使って、
 
 また、ログイン後には GraphQL の loginState を叩き、
 ログイン先アカウントの accountName を取得するユーティリティも提供します。
+
+セッションは CmaTarget（テナント + ログインプロファイル）ごとに持ち、
+state ファイル・使い回す HTTP セッション・loginState のキャッシュもそれぞれ別になる。
+複数のテナントにログインしたままにしておき、再ログインせずに切り替えられる。
 """
 
 from __future__ import annotations
@@ -17,35 +21,158 @@ from typing import Any
 import json
 import os
 import re
+import threading
+import time
+from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Any, Final
+from typing import TYPE_CHECKING, Any, Final
+from urllib.parse import quote, unquote
 
-import requests
-from playwright.sync_api import TimeoutError as PlaywrightTimeoutError
-from playwright.sync_api import sync_playwright
+# requests と Playwright は import が重い（特に PyInstaller の onefile 版）ので、
+# 起動時には読み込まず、実際に使う関数の中で import する
+if TYPE_CHECKING:
+    import requests
 
+from .app_paths import get_base_dir
 from .cma_account_map import resolve_account_display_name
+from .cma_cache import invalidate_cma_cache
+from .cma_events import cma_events
+from .cma_http import post_graphql
+from .resilience import circuit_state
+from .file_lock import FileLock
+from .json_codec import parse_response
+from .metrics import CMA_LOGIN_STAGE_LATENCY, CMA_LOGINS, StageTimer
+from .prefix_index import prefix_indexes
+from .site_topology import site_topology
 
 # --- ログイン情報 / 設定値 ---
 
+# 既定のテナント（login_profiles.json のプロファイルに TENANT が無い場合もこれを使う）
 TENANT: Final[str] = os.getenv("CATO_TENANT", "kevoits")
 
 # 最初にアクセスする共通ログインポータル
 CC_LOGIN_URL: Final[str] = "https://cc.catonetworks.com"
 
-# ログイン完了判定に使うテナント CMA の URL パターン
-CMA_DASHBOARD_PATTERN: Final[str] = rf"https://{TENANT}\.cc\.catonetworks\.com/.*#/account/.*"
+# ローカルのシミュレータ（cato_helper.devtools.cma_simulator）で計測する場合などは
+# 環境変数 CATO_CMA_GRAPHQL_URL で GraphQL エンドポイントを（全テナント分）差し替えられる
+_GRAPHQL_URL_OVERRIDE: Final[str | None] = os.getenv("CATO_CMA_GRAPHQL_URL") or None
+
+# このツールと同じディレクトリ（PyInstaller 版は実行ファイルの隣）に state ファイルを置く。
+# サーバーモードで置き場所を固定したい場合などは環境変数 CATO_STATE_FILE で指定できる。
+# 既定のテナント以外 / プロファイル付きの state は、この隣に
+# cato_state@<テナント>@<プロファイル>.json の名前で置く
+STATE_FILE = Path(os.getenv("CATO_STATE_FILE") or get_base_dir() / "cato_state.json")
+
+
+@dataclass(frozen=True)
+class CmaTarget:
+    """CMA セッションの単位（テナント + login_profiles.json のプロファイル名）。"""
+
+    tenant: str
+    profile: str | None = None
+
+    @property
+    def key(self) -> str:
+        """キャッシュなどのキーに使う文字列（例: "kevoits/ops-a"）。"""
+        return f"{self.tenant}/{self.profile}" if self.profile else self.tenant
+
+    @property
+    def tenant_host(self) -> str:
+        return f"{self.tenant}.cc.catonetworks.com"
+
+    @property
+    def graphql_url(self) -> str:
+        return _GRAPHQL_URL_OVERRIDE or f"https://{self.tenant_host}/api/v1/graphql"
+
+    @property
+    def dashboard_pattern(self) -> str:
+        """ログイン完了判定に使うテナント CMA の URL パターン。"""
+        return rf"https://{re.escape(self.tenant)}\.cc\.catonetworks\.com/.*#/account/.*"
+
+    @property
+    def state_file(self) -> Path:
+        if self == DEFAULT_TARGET:
+            return STATE_FILE
+        parts = [quote(p, safe="") for p in (self.tenant, self.profile) if p]
+        return STATE_FILE.with_name(f"{STATE_FILE.stem}@{'@'.join(parts)}{STATE_FILE.suffix}")
 
-# GraphQL エンドポイント
-CMA_GRAPHQL_URL: Final[str] = f"https://{TENANT}.cc.catonetworks.com/api/v1/graphql"
 
-# このツールと同じディレクトリに state ファイルを置く
-STATE_FILE = Path("cato_state.json")
+# プロファイルを指定せずに使う、従来どおりの 1 テナント分のセッション
+DEFAULT_TARGET: Final[CmaTarget] = CmaTarget(TENANT)
+
+# 既定のテナントの値（従来の定数。テナントごとの値は CmaTarget から取る）
+CMA_DASHBOARD_PATTERN: Final[str] = DEFAULT_TARGET.dashboard_pattern
+CMA_GRAPHQL_URL: Final[str] = DEFAULT_TARGET.graphql_url
 
 LOGIN_PROFILE_FILE: Final[Path] = Path(__file__).with_name("login_profiles.json")
 
-# loginState のキャッシュ（プロセス内でのみ有効）
-_cached_login_state: dict[str, Any] | None = None
+
+@dataclass
+class _LoginStateCache:
+    """1 CmaTarget 分の loginState のキャッシュ（プロセス内でのみ有効）。"""
+
+    value: dict[str, Any] | None = None
+    # キャッシュした時刻（time.monotonic）と、その時点の state ファイルの mtime
+    at: float = 0.0
+    mtime: float | None = None
+    # 同時に来たリクエストがそれぞれ loginState を叩かないようにするためのロック
+    lock: threading.Lock = field(default_factory=threading.Lock)
+
+
+# CmaTarget.key -> loginState のキャッシュ
+_login_state_caches: dict[str, _LoginStateCache] = {}
+_login_state_caches_lock = threading.Lock()
+
+# loginState キャッシュの有効期間（秒）
+LOGIN_STATE_TTL_SECONDS: Final[float] = float(os.getenv("CMA_LOGIN_STATE_TTL", "600"))
+
+# --- ログイン / セッション更新の設定 ---
+
+# "1" ならまずヘッドレスでログインを試し、MFA / reCAPTCHA が出たときだけ画面付きでやり直す
+CMA_HEADLESS_LOGIN: Final[bool] = os.getenv("CMA_HEADLESS_LOGIN", "1") == "1"
+
+# ヘッドレスでダッシュボード到達を待つ最大時間（秒）。超えたら画面付きに切り替える
+CMA_HEADLESS_LOGIN_TIMEOUT: Final[float] = float(os.getenv("CMA_HEADLESS_LOGIN_TIMEOUT", "45"))
+
+# "1" なら、Cookie の期限が近づいたら保存済みの storage_state を使って裏で更新する
+CMA_SILENT_REFRESH: Final[bool] = os.getenv("CMA_SILENT_REFRESH", "1") == "1"
+
+# Cookie の期限まで残りこの秒数を切ったら更新する
+CMA_SILENT_REFRESH_MARGIN: Final[float] = float(os.getenv("CMA_SILENT_REFRESH_MARGIN", "900"))
+
+# 期限を確認する間隔（秒）
+CMA_SILENT_REFRESH_INTERVAL: Final[float] = float(os.getenv("CMA_SILENT_REFRESH_INTERVAL", "60"))
+
+# MFA / reCAPTCHA の画面が出ているかどうかの判定に使うセレクタ
+_INTERACTIVE_CHALLENGE_SELECTORS: Final[tuple[str, ...]] = (
+    'iframe[src*="recaptcha"]',
+    'iframe[title*="reCAPTCHA"]',
+    'input[name="code"]',
+    'input[name="otp"]',
+    'input[autocomplete="one-time-code"]',
+)
+
+# ログインとセッション更新で同時にブラウザを動かさないためのロック
+_playwright_lock = threading.Lock()
+
+_refresher_thread: threading.Thread | None = None
+_refresher_lock = threading.Lock()
+
+# このプロセスが最後に確認した state の世代（CmaTarget.key -> 世代。None は未確認）
+_seen_state_epochs: dict[str, str] | None = None
+_state_epochs_lock = threading.Lock()
+
+# --- HTTP セッション（接続プール）の設定 ---
+
+# 1 ホストあたりに保持するコネクション数。siteInfo の並列取得数以上にしておく。
+CMA_HTTP_POOL_SIZE: Final[int] = int(os.getenv("CMA_HTTP_POOL_SIZE", "16"))
+
+# Keep-Alive で TCP/TLS コネクションを使い回すかどうか（"0" で毎回切断）
+CMA_HTTP_KEEPALIVE: Final[bool] = os.getenv("CMA_HTTP_KEEPALIVE", "1") == "1"
+
+# CmaTarget ごとの使い回し用セッション: CmaTarget.key -> (state ファイルの mtime, Session)
+_pooled_sessions: dict[str, tuple[float, requests.Session]] = {}
+_pooled_sessions_lock = threading.Lock()
 
 
 
@@ -96,34 +223,126 @@ def resolve_login_profile(profile_name: str | None) -> tuple[str, str]:
     return str(email), str(password)
 
 
-def has_cma_state() -> bool:
+def _publish(event_type: str, target: CmaTarget, **data: Any) -> None:
+    """画面にログイン状態の変化を push する（cma_events 参照）。"""
+    cma_events.publish(event_type, target.tenant, target.profile, key=target.key, **data)
+
+
+# --- CmaTarget の解決 ---
+
+
+def _parse_state_file_name(path: Path) -> CmaTarget | None:
+    if path.name == STATE_FILE.name:
+        return DEFAULT_TARGET
+    prefix = f"{STATE_FILE.stem}@"
+    if not (path.name.startswith(prefix) and path.name.endswith(STATE_FILE.suffix)):
+        return None
+    parts = [unquote(p) for p in path.name[len(prefix) : -len(STATE_FILE.suffix)].split("@")]
+    if len(parts) == 1 and parts[0]:
+        return CmaTarget(parts[0])
+    if len(parts) == 2 and all(parts):
+        return CmaTarget(parts[0], parts[1])
+    return None
+
+
+def list_cma_targets() -> list[CmaTarget]:
+    """state ファイルが保存済み（ログイン済み）の CmaTarget を、新しくログインした順に返す。"""
+    directory = STATE_FILE.parent
+    if not directory.exists():
+        return []
+
+    found: list[tuple[float, CmaTarget]] = []
+    for path in directory.glob(f"{STATE_FILE.stem}*{STATE_FILE.suffix}"):
+        target = _parse_state_file_name(path)
+        if target is None:
+            continue
+        try:
+            found.append((path.stat().st_mtime, target))
+        except FileNotFoundError:
+            continue
+    found.sort(key=lambda item: item[0], reverse=True)
+    return [target for _, target in found]
+
+
+def resolve_target(
+    tenant: str | None = None, profile: str | None = None, *, latest_fallback: bool = True
+) -> CmaTarget:
+    """tenant / profile の指定から CmaTarget を決める。
+
+    - profile を指定した場合: そのプロファイル（テナントは指定 → プロファイルの TENANT → 既定の順）
+    - tenant だけ指定した場合: そのテナントでログイン済みのうち最後にログインしたもの
+    - どちらも無い場合: 最後にログインしたもの（無ければ DEFAULT_TARGET）
+
+    latest_fallback=False（サーバーモード）では「最後にログインしたもの」を使わない
+    （他のオペレーターのセッションかもしれないため）。tenant だけなら CmaTarget(tenant) そのもの。
+
+    Raises:
+        RuntimeError: 存在しないプロファイルを指定した場合。
+            latest_fallback=False で tenant / profile のどちらも無い場合。
+    """
+    if profile:
+        entry = load_login_profiles().get(profile)
+        if entry is None:
+            raise RuntimeError(f"指定されたプロファイル '{profile}' は存在しません。")
+        return CmaTarget(tenant or entry.get("TENANT") or TENANT, profile)
+
+    if not latest_fallback:
+        if not tenant:
+            raise RuntimeError("tenant または profile を指定してください。")
+        return CmaTarget(tenant)
+
+    logged_in = list_cma_targets()
+    if tenant:
+        for target in logged_in:
+            if target.tenant == tenant:
+                return target
+        return CmaTarget(tenant)
+    return logged_in[0] if logged_in else DEFAULT_TARGET
+
+
+def has_cma_state(target: CmaTarget | None = None) -> bool:
     """CMA ログイン済みセッションが保存済みかどうか。"""
-    return STATE_FILE.exists()
+    return (target or resolve_target()).state_file.exists()
 
 
-def cleanup_cma_state() -> None:
+def cleanup_cma_state(target: CmaTarget | None = None) -> None:
     """保存済みの CMA セッション情報を削除する。
 
-    app.py 終了時に呼び出されることを想定。
+    target を省略した場合は全 CmaTarget 分を削除する（app.py 終了時など）。
+    target を指定した場合は、その CmaTarget の GraphQL キャッシュなども合わせて破棄する。
     """
-    global _cached_login_state
-    _cached_login_state = None
+    if target is None:
+        targets = list_cma_targets()
+        invalidate_login_state()
+        invalidate_cma_session()
+    else:
+        targets = [target]
+        invalidate_target_caches(target)
+
+    for t in targets:
+        try:
+            if t.state_file.exists():
+                t.state_file.unlink()
+            # 他のワーカープロセスにもログアウトを知らせる
+            bump_state_epoch(t)
+        except Exception:
+            # 終了処理なので、失敗してもアプリには影響しないように握りつぶす
+            pass
+        _publish("logged_out", t)
 
-    try:
-        if STATE_FILE.exists():
-            STATE_FILE.unlink()
-    except Exception:
-        # 終了処理なので、失敗してもアプリには影響しないように握りつぶす
-        pass
 
+def build_cma_headers(target: CmaTarget = DEFAULT_TARGET) -> dict[str, str]:
+    """state ファイルの Cookie から、CMA の GraphQL を叩くときの HTTP ヘッダーを作る。
 
-def _build_requests_session_from_state() -> requests.Session:
-    if not STATE_FILE.exists():
+    requests.Session と非同期クライアント（cma_graphql_client）の両方で使う。
+    """
+    state_file = target.state_file
+    if not state_file.exists():
         raise RuntimeError("CMA state file not found")
 
-    state = json.loads(STATE_FILE.read_text(encoding="utf-8"))
+    state = json.loads(state_file.read_text(encoding="utf-8"))
 
-    tenant_host = f"{TENANT}.cc.catonetworks.com"
+    tenant_host = target.tenant_host
 
     # このリクエストで送りたい Cookie を手動で選別して 1 本のヘッダにする
     cookie_pairs: list[str] = []
@@ -147,8 +366,10 @@ def _build_requests_session_from_state() -> requests.Session:
 
     cookie_header = "; ".join(cookie_pairs)
 
-    sess = requests.Session()
-    sess.headers.update({
+    print("=== BUILT COOKIE HEADER ===")
+    print(cookie_header)
+
+    return {
         "Cookie": cookie_header,
         "Content-Type": "application/json",
         "Origin": f"https://{tenant_host}",
@@ -158,24 +379,90 @@ def _build_requests_session_from_state() -> requests.Session:
             "AppleWebKit/537.36 (KHTML, like Gecko) "
             "Chrome/142.0.0.0 Safari/537.36"
         ),
-    })
+    }
 
-    print("=== BUILT COOKIE HEADER ===")
-    print(cookie_header)
 
+def _build_requests_session_from_state(target: CmaTarget = DEFAULT_TARGET) -> requests.Session:
+    headers = build_cma_headers(target)
+
+    import requests
+
+    sess = requests.Session()
+    sess.headers.update(headers)
     return sess
 
 
+def _mount_pooled_adapter(sess: requests.Session) -> None:
+    """接続プールのサイズを調整した HTTPAdapter をセッションに差し込む。"""
+    from requests.adapters import HTTPAdapter
+
+    adapter = HTTPAdapter(
+        pool_connections=CMA_HTTP_POOL_SIZE,
+        pool_maxsize=CMA_HTTP_POOL_SIZE,
+    )
+    sess.mount("https://", adapter)
+    sess.mount("http://", adapter)
+
+    if not CMA_HTTP_KEEPALIVE:
+        sess.headers["Connection"] = "close"
+
+
+def get_cma_session(target: CmaTarget | None = None) -> requests.Session:
+    """CMA 向けの requests.Session をプロセス全体で使い回して返す。
+
+    - CmaTarget ごとに 1 本のセッション（接続プール）を保持する
+    - state ファイルの mtime が変わった場合（再ログインなど）だけ作り直す
+    - Werkzeug の threaded サーバから同時に呼ばれても安全なようにロックする
+    """
+    target = target or resolve_target()
+    try:
+        mtime = target.state_file.stat().st_mtime
+    except FileNotFoundError as e:
+        raise RuntimeError("CMA state file not found") from e
+
+    with _pooled_sessions_lock:
+        cached = _pooled_sessions.get(target.key)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+
+        sess = _build_requests_session_from_state(target)
+        _mount_pooled_adapter(sess)
+        _pooled_sessions[target.key] = (mtime, sess)
+
+    if cached is not None:
+        # 古いセッションのコネクションは閉じておく
+        cached[1].close()
+
+    return sess
+
+
+def invalidate_cma_session(target: CmaTarget | None = None) -> None:
+    """使い回し中のセッションを破棄する（ログアウト・再ログイン時用）。省略時は全て。"""
+    with _pooled_sessions_lock:
+        if target is None:
+            sessions = [sess for _, sess in _pooled_sessions.values()]
+            _pooled_sessions.clear()
+        else:
+            cached = _pooled_sessions.pop(target.key, None)
+            sessions = [cached[1]] if cached is not None else []
+
+    for sess in sessions:
+        try:
+            sess.close()
+        except Exception:
+            pass
+
 
 from .response_store import save_response
 from typing import Any
 
-def fetch_login_state() -> dict[str, Any]:
+def fetch_login_state(target: CmaTarget | None = None) -> dict[str, Any]:
     """GraphQL の loginState を叩いてログイン状態を取得する。"""
     print("=== FETCH_LOGIN_STATE CALLED ===")
 
-    sess = _build_requests_session_from_state()
-    print("Session built OK")
+    target = target or resolve_target()
+    sess = get_cma_session(target)
+    print("Session acquired OK")
 
     payload: dict[str, Any] = {
         "operationName": "loginState",
@@ -184,7 +471,7 @@ def fetch_login_state() -> dict[str, Any]:
     }
 
     try:
-        resp = sess.post(CMA_GRAPHQL_URL, json=payload, timeout=30)  # type: ignore[reportUnknownMemberType]
+        resp = post_graphql(sess, target.graphql_url, payload, tenant=target.tenant)
 
         print(">>> request url:", resp.request.url)
         print(">>> request headers:", resp.request.headers)
@@ -202,7 +489,7 @@ def fetch_login_state() -> dict[str, Any]:
 
     # まずは「生のレスポンス」を元に JSON を組み立てる
     try:
-        data = resp.json()
+        data = parse_response(resp)
         print("[fetch_login_state] JSON parsed OK")
     except Exception as e:
         print(f"[fetch_login_state] JSON parse error: {e!r}")
@@ -221,6 +508,9 @@ def fetch_login_state() -> dict[str, Any]:
         resp.raise_for_status()
     except Exception as e:
         print(f"[fetch_login_state] HTTP error: {e!r}")
+        if resp.status_code in (401, 403):
+            # Cookie の期限切れなどで、保存済みセッションが使えなくなっている
+            _publish("expired", target, message=str(e))
         # get_cma_status() から見えるように例外は投げ直す
         raise
 
@@ -230,42 +520,239 @@ def fetch_login_state() -> dict[str, Any]:
     else:
         login_state = {}
 
-    global _cached_login_state
-    _cached_login_state = login_state
+    cache = _login_state_cache(target)
+    previous = cache.value
+    cache.value = login_state
+    cache.at = time.monotonic()
+    cache.mtime = _state_file_mtime(target)
+
+    # アカウント名が分かった（変わった）ときだけ画面に知らせる
+    account_name = login_state.get("accountName") if isinstance(login_state, dict) else None
+    if account_name and (not previous or previous.get("accountName") != account_name):
+        _publish(
+            "account_resolved",
+            target,
+            status={
+                "logged_in": True,
+                "tenant": target.tenant,
+                "profile": target.profile,
+                "account_name": account_name,
+                "account_display_name": resolve_account_display_name(account_name),
+                "error": None,
+            },
+        )
+
+    return login_state
+
 
+def _state_file_mtime(target: CmaTarget = DEFAULT_TARGET) -> float | None:
+    try:
+        return target.state_file.stat().st_mtime
+    except FileNotFoundError:
+        return None
+
+
+def _login_state_cache(target: CmaTarget) -> _LoginStateCache:
+    with _login_state_caches_lock:
+        cache = _login_state_caches.get(target.key)
+        if cache is None:
+            cache = _login_state_caches[target.key] = _LoginStateCache()
+        return cache
+
+
+def _fresh_login_state(target: CmaTarget) -> dict[str, Any] | None:
+    """キャッシュ済みの loginState が有効期間内ならそれを返す。"""
+    cache = _login_state_cache(target)
+    login_state = cache.value
+    if not login_state:
+        return None
+    if time.monotonic() - cache.at >= LOGIN_STATE_TTL_SECONDS:
+        return None
+    # 別経路で再ログインされて state ファイルが変わっていたら取り直す
+    if cache.mtime != _state_file_mtime(target):
+        return None
     return login_state
 
 
-def get_cma_status() -> dict[str, Any]:
+def get_login_state(force_refresh: bool = False, target: CmaTarget | None = None) -> dict[str, Any]:
+    """キャッシュ済みの loginState を返す。無い・古い場合だけ GraphQL を叩く。
+
+    同時に複数のリクエストから呼ばれても、実際に loginState を叩くのは 1 回だけ。
+    """
+    target = target or resolve_target()
+    if not force_refresh:
+        login_state = _fresh_login_state(target)
+        if login_state is not None:
+            return login_state
+
+    with _login_state_cache(target).lock:
+        # ロック待ちの間に他のスレッドが取得済みならそれを使う
+        if not force_refresh:
+            login_state = _fresh_login_state(target)
+            if login_state is not None:
+                return login_state
+        return fetch_login_state(target)
+
+
+def get_login_context(force_refresh: bool = False, target: CmaTarget | None = None) -> dict[str, Any]:
+    """各 API で必要になるログイン先アカウントの情報だけを返す。
+
+    戻り値の例:
+        {
+            "accountID": "12345",
+            "accountName": "E221100280",
+            "elevatedAccountIds": [...]
+        }
+    """
+    login_state = get_login_state(force_refresh, target)
+    if not isinstance(login_state, dict):
+        login_state = {}
+    return {
+        "accountID": login_state.get("accountID"),
+        "accountName": login_state.get("accountName"),
+        "elevatedAccountIds": login_state.get("elevatedAccountIds") or [],
+    }
+
+
+def invalidate_login_state(target: CmaTarget | None = None) -> None:
+    """loginState のキャッシュを破棄する（ログアウト・再ログイン時用）。省略時は全て。"""
+    # 取得中のスレッドを待たずに消せるよう、ここでは各キャッシュのロックを取らない
+    with _login_state_caches_lock:
+        if target is None:
+            _login_state_caches.clear()
+        else:
+            _login_state_caches.pop(target.key, None)
+
+
+def invalidate_target_caches(target: CmaTarget) -> None:
+    """1 CmaTarget 分の loginState・セッション・GraphQL キャッシュ・Site 情報を破棄する。
+
+    GraphQL キャッシュのキーと Site 情報（CIDR 索引を含む）のスコープは、先頭に CmaTarget.key を使っている。
+    """
+    invalidate_login_state(target)
+    invalidate_cma_session(target)
+    invalidate_cma_cache(target.key)
+    site_topology.invalidate(target.key)
+    prefix_indexes.invalidate(target.key)
+
+
+# --- 複数プロセス（サーバーモードのワーカー）間での state の共有 ---
+#
+# loginState や使い回し中のセッションは state ファイルの mtime を見て作り直すが、
+# GraphQL レスポンスのキャッシュや Site ごとの取得済み情報はプロセスごとに持っている。
+# ログイン / ログアウトのたびに state ファイルの隣の「世代」ファイル（CmaTarget ごとの世代の JSON）を
+# 書き換え、各プロセスはリクエストの最初にそれを確認して、変わった CmaTarget のキャッシュを捨てる。
+
+
+def _state_sidecar(suffix: str) -> Path:
+    return STATE_FILE.with_name(STATE_FILE.name + suffix)
+
+
+def _browser_lock() -> FileLock:
+    """ログイン / セッション更新でブラウザを動かす処理を、プロセスをまたいで 1 つに絞るロック。"""
+    return FileLock(_state_sidecar(".lock"))
+
+
+def _read_state_epochs() -> dict[str, str]:
+    try:
+        epochs = json.loads(_state_sidecar(".epoch").read_text(encoding="utf-8"))
+    except (FileNotFoundError, OSError, ValueError):
+        return {}
+    return epochs if isinstance(epochs, dict) else {}
+
+
+# サイレント更新（Cookie の更新だけで、アカウントは変わらない）で進めた世代の印
+_REFRESH_EPOCH_SUFFIX: Final[str] = "-refresh"
+
+
+def bump_state_epoch(target: CmaTarget, *, refreshed: bool = False) -> None:
+    """target の state の世代を進め、他のプロセスに手元のキャッシュを捨てさせる。
+
+    refreshed=True（サイレント更新）の場合、他のプロセスはセッションと loginState だけを作り直し、
+    GraphQL キャッシュや Site 情報は残す。
+    """
+    global _seen_state_epochs
+    epoch_file = _state_sidecar(".epoch")
+    with FileLock(_state_sidecar(".epoch.lock")):
+        epochs = _read_state_epochs()
+        epochs[target.key] = f"{os.getpid()}-{time.time_ns()}" + (_REFRESH_EPOCH_SUFFIX if refreshed else "")
+        tmp_path = epoch_file.with_name(f"{epoch_file.name}.{os.getpid()}.tmp")
+        tmp_path.write_text(json.dumps(epochs), encoding="utf-8")
+        os.replace(tmp_path, epoch_file)
+
+    with _state_epochs_lock:
+        # 自分のキャッシュは呼び出し元で破棄済み
+        if _seen_state_epochs is not None:
+            _seen_state_epochs[target.key] = epochs[target.key]
+
+
+def sync_shared_state() -> None:
+    """他のプロセスでログイン / ログアウトされていたら、このプロセスのキャッシュを破棄する。"""
+    global _seen_state_epochs
+    epochs = _read_state_epochs()
+    with _state_epochs_lock:
+        seen = _seen_state_epochs
+        _seen_state_epochs = dict(epochs)
+    if seen is None or seen == epochs:
+        return
+
+    for key in set(epochs) | set(seen):
+        if epochs.get(key) == seen.get(key):
+            continue
+        tenant, _, profile = key.partition("/")
+        target = CmaTarget(tenant, profile or None)
+        if str(epochs.get(key, "")).endswith(_REFRESH_EPOCH_SUFFIX):
+            # サイレント更新: Cookie が変わっただけなので、セッションと loginState だけ作り直す
+            invalidate_login_state(target)
+            invalidate_cma_session(target)
+        else:
+            print(f"[CMA] 他のプロセスで {key} の state が更新されたため、キャッシュを破棄します。")
+            invalidate_target_caches(target)
+        # このプロセスの /cma/events に繋いでいる画面にも知らせる
+        _publish("state_changed", target, logged_in=target.state_file.exists())
+
+
+def get_cma_status(target: CmaTarget | None = None) -> dict[str, Any]:
     """CMA ログイン状態 + 表示用アカウント名を返す。
 
     戻り値の例:
         {
             "logged_in": true,
+            "tenant": "kevoits",
+            "profile": "ops-a",
             "account_name": "E221100280",
             "account_display_name": "E221100280（Altius Link 検証環境）",
+            "circuit": "closed",
             "error": null
         }
+
+    circuit はテナントのサーキットブレーカーの状態（open なら CMA への通信を一時停止中）。
     """
-    if not has_cma_state():
+    target = target or resolve_target()
+    status: dict[str, Any] = {
+        "tenant": target.tenant,
+        "profile": target.profile,
+        "circuit": circuit_state(target.tenant),
+    }
+
+    if not has_cma_state(target):
         return {
             "logged_in": False,
+            **status,
             "account_name": None,
             "account_display_name": None,
             "error": None,
         }
 
     try:
-        global _cached_login_state
-        login_state = _cached_login_state
-        if not login_state:
-            # まだ一度も取得していない場合だけ GraphQL を叩く
-            login_state = fetch_login_state()
+        # キャッシュが無い・古い場合だけ GraphQL を叩く
+        login_state = get_login_state(target=target)
         # login_state は dict を想定
         account_name = login_state.get("accountName") if isinstance(login_state, dict) else None
         display_name = resolve_account_display_name(account_name)
         return {
             "logged_in": True,
+            **status,
             "account_name": account_name,
             "account_display_name": display_name,
             "error": None,
@@ -274,34 +761,86 @@ def get_cma_status() -> dict[str, Any]:
         # ログインは多分できているが、loginState 取得に失敗した場合
         return {
             "logged_in": True,
+            **status,
             "account_name": None,
             "account_display_name": None,
             "error": str(e),
         }
 
 
-def login_via_playwright(profile_name: str | None) -> None:
+class InteractiveLoginRequired(Exception):
+    """ヘッドレスでは進めない（MFA / reCAPTCHA など、人の操作が必要な）場合に投げる。"""
+
+
+class RefreshSkipped(Exception):
+    """ログインや他のワーカーでの更新が動いていて、ヘッドレス更新を試みなかった場合に投げる。"""
+
+
+def login_via_playwright(profile_name: str | None, tenant: str | None = None) -> None:
     """Playwright を使って CMA にログインし、セッション情報を保存する。
 
-    - ブラウザウィンドウが立ち上がる（headless=False）ので、
-      reCAPTCHA や MFA が出た場合は手動で対応してください。
+    - まずヘッドレスで自動ログインを試す（CMA_HEADLESS_LOGIN="0" で無効）
+    - MFA / reCAPTCHA が出た、または時間内にダッシュボードへ到達しなかった場合は
+      ブラウザウィンドウ（headless=False）を立ち上げてやり直すので、手動で対応してください。
     - ログイン完了後、CMA ダッシュボード URL に到達したら
-      STATE_FILE に storage_state を保存して、ブラウザを閉じます。
+      そのプロファイル（CmaTarget）の state ファイルに storage_state を保存して、ブラウザを閉じます。
+    - テナントは tenant → プロファイルの TENANT → 既定（CATO_TENANT）の順に決まる。
     """
-    # ログインし直すので loginState キャッシュはクリア
-    global _cached_login_state
-    _cached_login_state = None
-
     email, password = resolve_login_profile(profile_name)
+    target = resolve_target(tenant, profile_name)
+
+    # ログインし直すので、この CmaTarget の loginState キャッシュ・使い回し中のセッション・
+    # GraphQL レスポンスのキャッシュ・Site ごとの取得済み情報はクリア（他のテナントの分は残す）
+    invalidate_target_caches(target)
+    _publish("login_started", target)
+
+    with _playwright_lock, _browser_lock():
+        try:
+            result = "interactive"
+            if CMA_HEADLESS_LOGIN:
+                try:
+                    _run_login_flow(target, email, password, headless=True)
+                    result = "headless"
+                except InteractiveLoginRequired as e:
+                    print(f"[CMA LOGIN] ヘッドレスでは完了できないため、ブラウザを表示してやり直します: {e}")
+            if result == "interactive":
+                _run_login_flow(target, email, password, headless=False)
+        except Exception as e:
+            CMA_LOGINS.inc(result="error")
+            _publish("login_failed", target, message=str(e))
+            raise
+        CMA_LOGINS.inc(result=result)
+        bump_state_epoch(target)
+    _publish("state_saved", target)
+
+    # 画面がアカウント名を取りに来なくて済むよう、ここで loginState まで取得しておく
+    # （取得できると account_resolved が publish される）
+    try:
+        get_login_state(force_refresh=True, target=target)
+    except Exception as e:  # noqa: BLE001
+        print(f"[CMA LOGIN] loginState の取得に失敗しました: {e!r}")
+
+
+def _run_login_flow(target: CmaTarget, email: str, password: str, headless: bool) -> None:
+    from playwright.sync_api import TimeoutError as PlaywrightTimeoutError
+    from playwright.sync_api import sync_playwright
+
+    # 段階ごとの所要時間を metrics に記録する（画面付きの ④ はユーザーの操作待ちを含む）
+    stages = StageTimer(CMA_LOGIN_STAGE_LATENCY, "stage")
 
     with sync_playwright() as p:
-        browser = p.chromium.launch(headless=False, slow_mo=150)
+        if headless:
+            browser = p.chromium.launch(headless=True)
+        else:
+            browser = p.chromium.launch(headless=False, slow_mo=150)
         context = browser.new_context()
         page = context.new_page()
+        stages.lap("launch")
 
         # ① https://cc.catonetworks.com にアクセス
         print("① cc.catonetworks.com にアクセス中...")
         page.goto(CC_LOGIN_URL)
+        stages.lap("portal")
 
         # ② メールアドレス入力 → Next ボタンクリック
         try:
@@ -320,6 +859,7 @@ def login_via_playwright(profile_name: str | None) -> None:
                 "　メール入力欄 or Next ボタンが見つからなかったので、このステップはスキップします。"
                 "（既にログイン済みかもしれません）"
             )
+        stages.lap("email")
 
         # ③ メール＋パスワード入力 → Log in クリック
         try:
@@ -327,7 +867,7 @@ def login_via_playwright(profile_name: str | None) -> None:
 
             page.wait_for_url(
                 re.compile(
-                    r"auth\.catonetworks\.com|auth\." + re.escape(TENANT) + r"\.catonetworks\.com"
+                    r"auth\.catonetworks\.com|auth\." + re.escape(target.tenant) + r"\.catonetworks\.com"
                 ),
                 timeout=30_000,
             )
@@ -353,18 +893,172 @@ def login_via_playwright(profile_name: str | None) -> None:
                 "　username/password フォームが表示されなかったので、このステップはスキップします。"
                 "（SSO などで既にログイン済みの可能性があります）"
             )
+        stages.lap("credentials")
 
         # ④ ログイン完了検知（CMA ダッシュボード URL）
         print("④ ログイン完了（CMA ダッシュボード）URL を待ちます...")
-        page.wait_for_url(
-            re.compile(CMA_DASHBOARD_PATTERN),
-            timeout=5 * 60 * 1000,
-        )
+        if headless:
+            try:
+                _wait_for_dashboard_headless(page, target)
+            finally:
+                stages.lap("dashboard")
+        else:
+            page.wait_for_url(
+                re.compile(target.dashboard_pattern),
+                timeout=5 * 60 * 1000,
+            )
+            stages.lap("dashboard")
         print("　CMA ダッシュボードに到達しました。ログイン完了とみなします。")
 
         # ログイン済みセッションを保存
-        context.storage_state(path=str(STATE_FILE))
-        print(f"　ログイン済みセッションを {STATE_FILE} に保存しました。")
+        _save_storage_state(context, target)
+        print(f"　ログイン済みセッションを {target.state_file} に保存しました。")
+        stages.lap("save_state")
 
         # ブラウザを閉じる
         browser.close()
+
+
+def _wait_for_dashboard_headless(page: Any, target: CmaTarget) -> None:
+    """ヘッドレスでダッシュボード到達を待つ。人の操作が要りそうなら InteractiveLoginRequired。"""
+    dashboard = re.compile(target.dashboard_pattern)
+    deadline = time.monotonic() + CMA_HEADLESS_LOGIN_TIMEOUT
+    while time.monotonic() < deadline:
+        if dashboard.match(page.url):
+            return
+        for selector in _INTERACTIVE_CHALLENGE_SELECTORS:
+            if page.query_selector(selector) is not None:
+                raise InteractiveLoginRequired(f"challenge detected ({selector})")
+        page.wait_for_timeout(500)
+    raise InteractiveLoginRequired(
+        f"dashboard not reached within {CMA_HEADLESS_LOGIN_TIMEOUT:.0f}s (url={page.url})"
+    )
+
+
+def _save_storage_state(context: Any, target: CmaTarget) -> None:
+    """storage_state を一時ファイルに書いてから置き換える。
+
+    書き込み途中の state ファイルを、他のスレッドのセッション構築に読ませないため。
+    """
+    state_file = target.state_file
+    tmp_path = state_file.with_name(state_file.name + ".tmp")
+    context.storage_state(path=str(tmp_path))
+    os.replace(tmp_path, state_file)
+
+
+# --- セッションのサイレント更新 ---
+
+
+def state_expires_in(target: CmaTarget = DEFAULT_TARGET) -> float | None:
+    """保存済み Cookie のうち、最も早く切れるものの残り秒数を返す。
+
+    期限付きの catonetworks.com の Cookie が無い（すべてセッション Cookie）場合は None。
+    """
+    try:
+        state = json.loads(target.state_file.read_text(encoding="utf-8"))
+    except (FileNotFoundError, ValueError):
+        return None
+
+    expiries = [
+        float(c["expires"])
+        for c in state.get("cookies", [])
+        if str(c.get("domain", "")).endswith("catonetworks.com")
+        and isinstance(c.get("expires"), (int, float))
+        and c["expires"] > 0
+    ]
+    if not expiries:
+        return None
+    return min(expiries) - time.time()
+
+
+def refresh_session_headless(target: CmaTarget = DEFAULT_TARGET) -> bool:
+    """保存済みの storage_state を読み込んだヘッドレスのブラウザで CMA を開き、Cookie を更新する。
+
+    ダッシュボードまで到達できたら state ファイルを保存し直して True を返す。
+    再ログイン（MFA など）が必要な状態だった場合や、更新に失敗した場合は False。
+    ログインや他のプロセスでの更新が動いている最中は、何もせずに RefreshSkipped を投げる
+    （失敗ではないので、呼び出し側は後でもう一度試してよい）。
+    """
+    state_file = target.state_file
+    if not state_file.exists():
+        return False
+    if not _playwright_lock.acquire(blocking=False):
+        raise RefreshSkipped("このプロセスでログインまたは更新の処理中です")
+    browser_lock = _browser_lock()
+    if not browser_lock.acquire(blocking=False):
+        _playwright_lock.release()
+        raise RefreshSkipped("他のワーカーでログインまたは更新の処理中です")
+
+    try:
+        from playwright.sync_api import sync_playwright
+
+        print(f"[CMA REFRESH] {target.key}: 保存済みセッションでヘッドレス更新を試みます...")
+        with sync_playwright() as p:
+            browser = p.chromium.launch(headless=True)
+            try:
+                context = browser.new_context(storage_state=str(state_file))
+                page = context.new_page()
+                page.goto(f"https://{target.tenant_host}/")
+                try:
+                    _wait_for_dashboard_headless(page, target)
+                except InteractiveLoginRequired as e:
+                    print(f"[CMA REFRESH] 更新できませんでした（再ログインが必要です）: {e}")
+                    CMA_LOGINS.inc(result="refresh_failed")
+                    _publish("expired", target, message=str(e))
+                    return False
+                _save_storage_state(context, target)
+            finally:
+                browser.close()
+    except Exception as e:  # noqa: BLE001
+        print(f"[CMA REFRESH] エラー: {e!r}")
+        CMA_LOGINS.inc(result="refresh_failed")
+        return False
+    finally:
+        browser_lock.release()
+        _playwright_lock.release()
+
+    # Cookie が変わったので、使い回し中のセッションと loginState を作り直す
+    # （他のワーカーには state の世代で、画面には state_saved で知らせる）
+    invalidate_login_state(target)
+    invalidate_cma_session(target)
+    bump_state_epoch(target, refreshed=True)
+    _publish("state_saved", target, refreshed=True)
+    print("[CMA REFRESH] セッションを更新しました。")
+    CMA_LOGINS.inc(result="refreshed")
+    return True
+
+
+def _refresh_loop() -> None:
+    # 更新に失敗した state ファイルの mtime（CmaTarget.key ごと）。
+    # ログインし直されるまで同じファイルでは再試行しない（ロック待ちで試せなかっただけなら次の周期で試す）
+    failed_mtimes: dict[str, float | None] = {}
+    while True:
+        time.sleep(CMA_SILENT_REFRESH_INTERVAL)
+        for target in list_cma_targets():
+            remaining = state_expires_in(target)
+            if remaining is None or remaining > CMA_SILENT_REFRESH_MARGIN:
+                continue
+            mtime = _state_file_mtime(target)
+            if mtime is not None and mtime == failed_mtimes.get(target.key):
+                continue
+            try:
+                refreshed = refresh_session_headless(target)
+            except RefreshSkipped as e:
+                print(f"[CMA REFRESH] {target.key}: 今回は更新を見送ります（{e}）")
+                continue
+            if not refreshed:
+                failed_mtimes[target.key] = mtime
+
+
+def start_session_refresher() -> None:
+    """Cookie の期限切れ前に裏でセッションを更新するスレッドを起動する（複数回呼んでも 1 本だけ）。"""
+    global _refresher_thread
+    if not CMA_SILENT_REFRESH:
+        return
+    with _refresher_lock:
+        if _refresher_thread is not None:
+            return
+        _refresher_thread = threading.Thread(
+            target=_refresh_loop, daemon=True, name="cma-session-refresher"
+        )
+        _refresher_thread.start()
@@ -0,0 +1,108 @@
+﻿# cato_helper/services/file_lock.py
+"""複数プロセス（サーバーモードのワーカー）の間で使う簡易ファイルロック。
+
+Windows では msvcrt.locking、それ以外では fcntl.flock を使う。
+ロックはファイルハンドル単位なので、同じプロセス内の別スレッドとも排他になる。
+"""
+
+from __future__ import annotations
+
+import os
+import time
+from pathlib import Path
+from types import TracebackType
+from typing import IO, Final
+
+# ロック取得をリトライする間隔（秒）
+_POLL_INTERVAL: Final[float] = 0.1
+
+
+def _try_lock(f: IO[bytes]) -> bool:
+    if os.name == "nt":
+        import msvcrt
+
+        try:
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+        except OSError:
+            return False
+        return True
+
+    import fcntl
+
+    try:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        return False
+    return True
+
+
+def _unlock(f: IO[bytes]) -> None:
+    if os.name == "nt":
+        import msvcrt
+
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+        return
+
+    import fcntl
+
+    fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+class FileLock:
+    """path をロックファイルとして使う排他ロック。
+
+    使い方::
+
+        with FileLock(path):
+            ...
+
+        lock = FileLock(path)
+        if lock.acquire(blocking=False):
+            try:
+                ...
+            finally:
+                lock.release()
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self._file: IO[bytes] | None = None
+
+    def acquire(self, blocking: bool = True, timeout: float | None = None) -> bool:
+        if self._file is not None:
+            raise RuntimeError(f"lock already held: {self.path}")
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        f = self.path.open("a+b")
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not _try_lock(f):
+            if not blocking or (deadline is not None and time.monotonic() >= deadline):
+                f.close()
+                return False
+            time.sleep(_POLL_INTERVAL)
+
+        self._file = f
+        return True
+
+    def release(self) -> None:
+        f = self._file
+        if f is None:
+            return
+        self._file = None
+        try:
+            _unlock(f)
+        finally:
+            f.close()
+
+    def __enter__(self) -> FileLock:
+        self.acquire()
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc: BaseException | None,
+        tb: TracebackType | None,
+    ) -> None:
+        self.release()
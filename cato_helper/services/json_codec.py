@@ -0,0 +1,75 @@
+﻿# cato_helper/services/json_codec.py
+"""GraphQL の送受信・キャッシュキー・Flask の応答（modules/json_provider）で使う JSON のエンコード / デコード。
+
+orjson がインストールされていればそれを使い、無ければ標準の json にフォールバックする。
+Site / Subnet が数千件あるアカウントでは JSON の処理が CPU 時間の大半を占めるため。
+
+- dumps は bytes を返す（区切りの空白なし・非 ASCII はそのまま UTF-8）
+- orjson で扱えない値（64bit を超える整数など）は標準の json で処理し直す
+- 環境変数 CMA_FAST_JSON=0 で常に標準の json を使う
+"""
+
+from __future__ import annotations
+
+import json
+import os
+from typing import Any, Callable, Final
+
+try:
+    import orjson  # type: ignore[import-not-found]
+except ImportError:  # pragma: no cover - orjson は任意
+    orjson = None
+
+# "0" で orjson を使わない
+CMA_FAST_JSON: Final[bool] = os.getenv("CMA_FAST_JSON", "1") == "1"
+
+HAVE_FAST_JSON: Final[bool] = CMA_FAST_JSON and orjson is not None
+
+
+def dumps(
+    obj: Any,
+    *,
+    sort_keys: bool = False,
+    indent: bool = False,
+    default: Callable[[Any], Any] | None = None,
+) -> bytes:
+    """obj を JSON の bytes にする。indent=True なら 2 スペースで整形する。"""
+    if HAVE_FAST_JSON:
+        option = orjson.OPT_NON_STR_KEYS
+        if default is not None:
+            # 日付・dataclass なども標準の json と同じく default で変換させる
+            option |= (
+                orjson.OPT_PASSTHROUGH_DATETIME
+                | orjson.OPT_PASSTHROUGH_DATACLASS
+                | orjson.OPT_PASSTHROUGH_SUBCLASS
+            )
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        try:
+            return orjson.dumps(obj, default=default, option=option)
+        except orjson.JSONEncodeError:
+            pass
+
+    return json.dumps(
+        obj,
+        ensure_ascii=False,
+        sort_keys=sort_keys,
+        indent=2 if indent else None,
+        separators=None if indent else (",", ":"),
+        default=default,
+    ).encode("utf-8")
+
+
+def loads(data: bytes | bytearray | memoryview | str) -> Any:
+    """JSON（bytes / str）をパースする。"""
+    if HAVE_FAST_JSON:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def parse_response(resp: Any) -> Any:
+    """requests / httpx のレスポンス本文を JSON としてパースする（resp.json() の代わり）。"""
+    return loads(resp.content)
+
@@ -0,0 +1,339 @@
+﻿# cato_helper/services/metrics.py
+"""処理時間や件数を集計する、プロセス内の簡易メトリクス。
+
+- Counter（単調増加する件数）と Histogram（所要時間などの分布）を提供する
+- Prometheus のテキスト形式（/metrics）で出力できる
+- 直近の観測値から p50 / p95 / p99 を計算した JSON サマリも出せる
+
+値はプロセスごとに持つ。サーバーモードで複数ワーカーを動かす場合は集計せず、
+const_labels の worker ラベル（pid）でワーカーごとの系列として出す
+（Prometheus 側で sum without (worker) などで合算する）。
+
+外部パッケージ（prometheus_client など）には依存しない。
+"""
+
+from __future__ import annotations
+
+import bisect
+import contextlib
+import math
+import threading
+import time
+from collections import deque
+from typing import Any, Final, Iterator
+
+# 所要時間（秒）用の既定のバケット境界
+DEFAULT_LATENCY_BUCKETS: Final[tuple[float, ...]] = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0,
+)
+
+# パーセンタイル計算用に、ラベルの組ごとに保持する直近の観測値の数
+_RESERVOIR_SIZE: Final[int] = 2048
+
+LabelValues = tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: tuple[str, ...], values: LabelValues, extra: dict[str, str] | None = None) -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.extend(f'{n}="{_escape(v)}"' for n, v in extra.items())
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, label_names: tuple[str, ...] = ()) -> None:
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self._lock = threading.Lock()
+
+    def _label_values(self, labels: dict[str, Any]) -> LabelValues:
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def render(self, const_labels: dict[str, str] | None = None) -> list[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, label_names: tuple[str, ...] = ()) -> None:
+        super().__init__(name, help_text, label_names)
+        self._values: dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: Any) -> None:
+        key = self._label_values(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self, const_labels: dict[str, str] | None = None) -> list[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [
+            f"{self.name}{_format_labels(self.label_names, k, const_labels)} {_format_value(v)}" for k, v in items
+        ]
+
+
+class _HistogramSeries:
+    def __init__(self, bucket_count: int) -> None:
+        self.bucket_counts = [0] * bucket_count
+        self.count = 0
+        self.total = 0.0
+        self.recent: deque[float] = deque(maxlen=_RESERVOIR_SIZE)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help_text: str,
+        label_names: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_LATENCY_BUCKETS,
+    ) -> None:
+        super().__init__(name, help_text, label_names)
+        self.buckets = tuple(sorted(buckets))
+        self._series: dict[LabelValues, _HistogramSeries] = {}
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = self._label_values(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = _HistogramSeries(len(self.buckets))
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                series.bucket_counts[index] += 1
+            series.count += 1
+            series.total += value
+            series.recent.append(value)
+
+    @contextlib.contextmanager
+    def time(self, **labels: Any) -> Iterator[None]:
+        """with ブロックの所要時間（秒）を記録する。"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self, const_labels: dict[str, str] | None = None) -> list[str]:
+        lines: list[str] = []
+        const_labels = const_labels or {}
+        with self._lock:
+            items = sorted(
+                (k, list(s.bucket_counts), s.count, s.total) for k, s in self._series.items()
+            )
+        for key, bucket_counts, count, total in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, bucket_counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.label_names, key, {**const_labels, "le": _format_value(bound)})
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.label_names, key, {**const_labels, "le": "+Inf"})
+            lines.append(f"{self.name}_bucket{labels} {count}")
+            labels = _format_labels(self.label_names, key, const_labels)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+    def summary(self) -> list[dict[str, Any]]:
+        """ラベルの組ごとに件数・平均・p50 / p95 / p99（直近の観測値から計算）を返す。"""
+        with self._lock:
+            items = [(k, s.count, s.total, sorted(s.recent)) for k, s in self._series.items()]
+
+        result: list[dict[str, Any]] = []
+        for key, count, total, recent in sorted(items):
+            result.append(
+                {
+                    "labels": dict(zip(self.label_names, key)),
+                    "count": count,
+                    "mean": total / count if count else None,
+                    "p50": _percentile(recent, 0.50),
+                    "p95": _percentile(recent, 0.95),
+                    "p99": _percentile(recent, 0.99),
+                }
+            )
+        return result
+
+
+def _percentile(sorted_values: list[float], q: float) -> float | None:
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, math.ceil(q * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+class MetricsRegistry:
+    def __init__(self) -> None:
+        self._metrics: dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+        # 全系列に付けるラベル（サーバーモードの worker など）
+        self.const_labels: dict[str, str] = {}
+
+    def counter(self, name: str, help_text: str, label_names: tuple[str, ...] = ()) -> Counter:
+        return self._register(Counter(name, help_text, label_names))  # type: ignore[return-value]
+
+    def histogram(
+        self,
+        name: str,
+        help_text: str,
+        label_names: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_LATENCY_BUCKETS,
+    ) -> Histogram:
+        return self._register(Histogram(name, help_text, label_names, buckets))  # type: ignore[return-value]
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def render_prometheus(self) -> str:
+        """Prometheus のテキスト形式（version 0.0.4）で全メトリクスを出力する。"""
+        lines: list[str] = []
+        with self._lock:
+            metrics = list(self._metrics.values())
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help_text}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render(self.const_labels))
+        return "\n".join(lines) + "\n"
+
+    def summary(self) -> dict[str, Any]:
+        """Histogram ごとのパーセンタイルをまとめた JSON 用の dict を返す。"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        summary: dict[str, Any] = {
+            metric.name: metric.summary()
+            for metric in metrics
+            if isinstance(metric, Histogram)
+        }
+        if self.const_labels:
+            summary["constLabels"] = dict(self.const_labels)
+        return summary
+
+
+registry = MetricsRegistry()
+
+PROMETHEUS_CONTENT_TYPE: Final[str] = "text/plain; version=0.0.4; charset=utf-8"
+
+# --- CMA GraphQL ---
+
+CMA_GRAPHQL_REQUESTS = registry.counter(
+    "cma_graphql_requests_total",
+    "CMA GraphQL requests by tenant, operation and HTTP status",
+    ("tenant", "operation", "status"),
+)
+CMA_GRAPHQL_LATENCY = registry.histogram(
+    "cma_graphql_request_seconds",
+    "CMA GraphQL request latency in seconds",
+    ("tenant", "operation"),
+)
+CMA_GRAPHQL_BYTES = registry.counter(
+    "cma_graphql_bytes_total",
+    "CMA GraphQL payload bytes sent (out) and received (in)",
+    ("tenant", "operation", "direction"),
+)
+CMA_GRAPHQL_RETRIES = registry.counter(
+    "cma_graphql_retries_total",
+    "CMA GraphQL request retries",
+    ("tenant", "operation"),
+)
+
+# --- リトライ / レート制限 / サーキットブレーカー（resilience） ---
+
+RESILIENCE_CIRCUIT_OPENS = registry.counter(
+    "cato_helper_circuit_opens_total",
+    "Times a circuit breaker opened after consecutive upstream failures",
+    ("key",),
+)
+RESILIENCE_RATE_LIMIT_WAIT = registry.histogram(
+    "cato_helper_rate_limit_wait_seconds",
+    "Time spent waiting for the per-destination rate limiter",
+    ("key",),
+)
+
+# --- Flask ---
+
+HTTP_REQUESTS = registry.counter(
+    "cato_helper_http_requests_total",
+    "HTTP requests handled by the tool, by route, method and status",
+    ("route", "method", "status"),
+)
+HTTP_LATENCY = registry.histogram(
+    "cato_helper_http_request_seconds",
+    "Time until the response headers are ready, by route and method",
+    ("route", "method"),
+)
+
+# --- Playwright ログイン ---
+
+CMA_LOGIN_STAGE_LATENCY = registry.histogram(
+    "cma_login_stage_seconds",
+    "Duration of each Playwright login stage",
+    ("stage",),
+)
+CMA_LOGINS = registry.counter(
+    "cma_logins_total",
+    "Playwright logins and silent session refreshes by result",
+    ("result",),
+)
+
+
+def record_graphql_call(
+    tenant: str,
+    operation: str,
+    status: int | str,
+    latency: float,
+    bytes_out: int,
+    bytes_in: int,
+    retries: int = 0,
+) -> None:
+    """CMA GraphQL 呼び出し 1 回分の計測値をまとめて記録する。"""
+    CMA_GRAPHQL_REQUESTS.inc(tenant=tenant, operation=operation, status=status)
+    CMA_GRAPHQL_LATENCY.observe(latency, tenant=tenant, operation=operation)
+    CMA_GRAPHQL_BYTES.inc(bytes_out, tenant=tenant, operation=operation, direction="out")
+    CMA_GRAPHQL_BYTES.inc(bytes_in, tenant=tenant, operation=operation, direction="in")
+    if retries:
+        CMA_GRAPHQL_RETRIES.inc(retries, tenant=tenant, operation=operation)
+
+
+class StageTimer:
+    """連続する処理段階の所要時間を、前回の区切りからの経過時間として記録する。
+
+    使い方::
+
+        stages = StageTimer(CMA_LOGIN_STAGE_LATENCY, "stage")
+        ...  # 段階 1
+        stages.lap("launch")
+        ...  # 段階 2
+        stages.lap("portal")
+    """
+
+    def __init__(self, histogram: Histogram, label: str) -> None:
+        self.histogram = histogram
+        self.label = label
+        self._last = time.perf_counter()
+
+    def lap(self, stage: str) -> float:
+        now = time.perf_counter()
+        elapsed = now - self._last
+        self._last = now
+        self.histogram.observe(elapsed, **{self.label: stage})
+        return elapsed
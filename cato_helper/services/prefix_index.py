@@ -0,0 +1,379 @@
+﻿# cato_helper/services/prefix_index.py
+"""Site の Subnet / Gateway と SDP IP Range を CIDR で引くための索引。
+
+static_route_init が平坦化した networks（cidr / gateway）と remoteIpRanges から、
+IPv4 / IPv6 それぞれのパス圧縮した 2 分木（Patricia trie）を作り、
+
+- longest_match : アドレス（またはプレフィックス）を含む、最も長いプレフィックス
+- covering      : 問い合わせを含む（同じか短い）プレフィックスすべて
+- covered       : 問い合わせに含まれる（同じか長い）プレフィックスすべて
+- overlaps      : 上の 2 つを合わせたもの（重なりがあるもの全部）
+
+を返す。木の深さは登録したプレフィックスの分岐点の数までなので、
+数万 Subnet のテナントでも 1 回の検索は数十マイクロ秒で終わる。
+
+索引は (CmaTarget.key, accountID) ごとに prefix_indexes に保持し、
+static_route_init で Site 情報を取り直すたびに作り直す。
+"""
+
+from __future__ import annotations
+
+import ipaddress
+import threading
+import time
+from typing import Any, Iterable, Iterator
+
+# remoteIpRanges のキー -> 表示名
+REMOTE_RANGE_LABELS: dict[str, str] = {
+    "default": "Default IP Range",
+    "dynamic": "Dynamic IP Range",
+    "static": "Static IP Range",
+}
+
+
+def parse_prefix(value: str) -> tuple[int, int, int]:
+    """"10.0.0.0/24" / "10.0.0.1"（ホスト扱い）/ "2001:db8::/32" を (バージョン, 整数, プレフィックス長) にする。
+
+    "10.0.0.1/24" のようにホスト部が立っていても、そのネットワーク（10.0.0.0/24）として扱う。
+    数万件を読み込むので、IPv4 は ipaddress を通さずに文字列から直接変換する。
+
+    Raises:
+        ValueError: IP アドレス / CIDR として解釈できない場合。
+    """
+    text = str(value).strip()
+    address, slash, length_text = text.partition("/")
+    parts = address.split(".")
+    if len(parts) == 4 and ":" not in text:
+        key = 0
+        for part in parts:
+            if not part.isdigit() or len(part) > 3:
+                raise ValueError(f"invalid IPv4 address: {value!r}")
+            octet = int(part)
+            if octet > 255:
+                raise ValueError(f"invalid IPv4 address: {value!r}")
+            key = (key << 8) | octet
+        length = 32
+        if slash:
+            if not length_text.isdigit() or int(length_text) > 32:
+                raise ValueError(f"invalid prefix length: {value!r}")
+            length = int(length_text)
+        return 4, key >> (32 - length) << (32 - length), length
+
+    network = ipaddress.ip_network(text, strict=False)
+    return network.version, int(network.network_address), network.prefixlen
+
+
+def format_prefix(version: int, key: int, length: int) -> str:
+    """(バージョン, 整数, プレフィックス長) を "10.0.0.0/24" 形式の文字列にする。"""
+    if version == 4:
+        return f"{key >> 24}.{(key >> 16) & 255}.{(key >> 8) & 255}.{key & 255}/{length}"
+    return f"{ipaddress.IPv6Address(key)}/{length}"
+
+
+class PrefixEntry:
+    """索引に登録した 1 件（どの Site / Interface のものか）。"""
+
+    __slots__ = ("version", "key", "length", "kind", "owner")
+
+    def __init__(self, version: int, key: int, length: int, kind: str, owner: dict[str, Any]) -> None:
+        self.version = version
+        self.key = key
+        self.length = length
+        self.kind = kind  # "subnet" / "gateway" / "remoteIpRange"
+        self.owner = owner
+
+    @property
+    def prefix(self) -> str:
+        # 文字列にするのは検索結果として返すときだけ
+        return format_prefix(self.version, self.key, self.length)
+
+    def to_dict(self) -> dict[str, Any]:
+        return {"prefix": self.prefix, "kind": self.kind, **self.owner}
+
+
+class _Node:
+    __slots__ = ("key", "length", "shift", "top", "children", "entries")
+
+    def __init__(self, key: int, length: int, width: int) -> None:
+        self.key = key
+        self.length = length
+        # key >> shift == top なら、このノードのプレフィックスに含まれる
+        self.shift = width - length
+        self.top = key >> self.shift
+        self.children: list[_Node | None] = [None, None]
+        self.entries: list[PrefixEntry] = []
+
+
+class PrefixTrie:
+    """1 つのアドレスファミリー（32 bit / 128 bit）分のパス圧縮 2 分木。
+
+    ノードの key はプレフィックス長より下のビットを 0 にした整数。
+    エントリを持たない分岐用のノードも作られる。
+    検索は数十万回呼ばれうるので、ループの中ではメソッド呼び出しを避けている。
+    """
+
+    def __init__(self, width: int) -> None:
+        self.width = width
+        self._root = _Node(0, 0, width)
+        self.size = 0
+
+    def _mask(self, key: int, length: int) -> int:
+        shift = self.width - length
+        return (key >> shift) << shift
+
+    def _bit(self, key: int, pos: int) -> int:
+        return (key >> (self.width - 1 - pos)) & 1
+
+    def _common_length(self, a: int, la: int, b: int, lb: int) -> int:
+        limit = min(la, lb)
+        diff = a ^ b
+        if diff == 0:
+            return limit
+        return min(limit, self.width - diff.bit_length())
+
+    def _new_node(self, key: int, length: int, entry: PrefixEntry | None = None) -> _Node:
+        node = _Node(key, length, self.width)
+        if entry is not None:
+            node.entries.append(entry)
+        return node
+
+    def insert(self, key: int, length: int, entry: PrefixEntry) -> None:
+        key = self._mask(key, length)
+        node = self._root
+        self.size += 1
+        while True:
+            if node.length == length:
+                node.entries.append(entry)
+                return
+
+            branch = (key >> (node.shift - 1)) & 1
+            child = node.children[branch]
+            if child is None:
+                node.children[branch] = self._new_node(key, length, entry)
+                return
+
+            if child.length <= length and key >> child.shift == child.top:
+                # child が新しいプレフィックスを含む → さらに下へ
+                node = child
+                continue
+
+            common = self._common_length(key, length, child.key, child.length)
+
+            if common == length:
+                # 新しいプレフィックスが child を含む → 間に差し込む
+                inner = self._new_node(key, length, entry)
+                inner.children[self._bit(child.key, length)] = child
+                node.children[branch] = inner
+                return
+
+            # 途中で分かれる → 分岐用のノードを作る
+            glue = self._new_node(self._mask(key, common), common)
+            glue.children[self._bit(key, common)] = self._new_node(key, length, entry)
+            glue.children[self._bit(child.key, common)] = child
+            node.children[branch] = glue
+            return
+
+    def covering(self, key: int, length: int) -> list[PrefixEntry]:
+        """(key, length) を含むエントリを、短いプレフィックスから順に返す。"""
+        found: list[PrefixEntry] = []
+        node: _Node | None = self._root
+        while node is not None and node.length <= length and key >> node.shift == node.top:
+            if node.entries:
+                found.extend(node.entries)
+            if node.length == length:
+                break
+            node = node.children[(key >> (node.shift - 1)) & 1]
+        return found
+
+    def longest_match(self, key: int, length: int) -> list[PrefixEntry]:
+        """(key, length) を含む最も長いプレフィックスのエントリ（同じプレフィックスが複数あれば全部）。"""
+        best: list[PrefixEntry] = []
+        node: _Node | None = self._root
+        while node is not None and node.length <= length and key >> node.shift == node.top:
+            if node.entries:
+                best = node.entries
+            if node.length == length:
+                break
+            node = node.children[(key >> (node.shift - 1)) & 1]
+        return list(best)
+
+    def covered(self, key: int, length: int) -> list[PrefixEntry]:
+        """(key, length) に含まれるエントリを、アドレス順（同じ位置なら短い順）に返す。"""
+        node: _Node | None = self._root
+        while node is not None and node.length < length:
+            if key >> node.shift != node.top:
+                return []
+            node = node.children[(key >> (node.shift - 1)) & 1]
+        if node is None or self._mask(node.key, length) != key:
+            return []
+        return list(self._walk(node))
+
+    def _walk(self, node: _Node) -> Iterator[PrefixEntry]:
+        stack = [node]
+        while stack:
+            current = stack.pop()
+            yield from current.entries
+            # 0 側から先に辿るよう、1 側を先に積む
+            for child in (current.children[1], current.children[0]):
+                if child is not None:
+                    stack.append(child)
+
+
+class PrefixIndex:
+    """IPv4 / IPv6 の PrefixTrie をまとめた索引。
+
+    問い合わせは parse_prefix が受け付ける文字列、または parse_prefix の戻り値で渡す。
+    """
+
+    def __init__(self) -> None:
+        self._tries = {4: PrefixTrie(32), 6: PrefixTrie(128)}
+        self.built_at = time.time()
+
+    def __len__(self) -> int:
+        return sum(trie.size for trie in self._tries.values())
+
+    def entries(self, version: int) -> list[PrefixEntry]:
+        """登録済みのエントリをアドレス順にすべて返す（route_validation などで配列にする用）。"""
+        trie = self._tries[version]
+        return trie.covered(0, 0)
+
+    def add(self, prefix: str | tuple[int, int, int], kind: str, owner: dict[str, Any]) -> None:
+        version, key, length = parse_prefix(prefix) if isinstance(prefix, str) else prefix
+        self._tries[version].insert(key, length, PrefixEntry(version, key, length, kind, owner))
+
+    def _query(self, value: str | tuple[int, int, int]) -> tuple[PrefixTrie, int, int]:
+        version, key, length = parse_prefix(value) if isinstance(value, str) else value
+        return self._tries[version], key, length
+
+    def longest_match(self, value: str | tuple[int, int, int]) -> list[PrefixEntry]:
+        trie, key, length = self._query(value)
+        return trie.longest_match(key, length)
+
+    def covering(self, value: str | tuple[int, int, int]) -> list[PrefixEntry]:
+        trie, key, length = self._query(value)
+        return trie.covering(key, length)
+
+    def covered(self, value: str | tuple[int, int, int]) -> list[PrefixEntry]:
+        trie, key, length = self._query(value)
+        return trie.covered(key, length)
+
+    def overlaps(self, value: str | tuple[int, int, int]) -> list[PrefixEntry]:
+        """問い合わせと 1 アドレスでも重なるエントリ（含む側 → 含まれる側の順）。"""
+        trie, key, length = self._query(value)
+        # 同じ長さのものは covered 側に入るので、含む側からは除く
+        wider = [e for e in trie.covering(key, length) if e.length < length]
+        return wider + trie.covered(key, length)
+
+    def lookup(self, value: str) -> dict[str, Any]:
+        """画面 / API 用に、longest / covering / covered / overlaps をまとめて返す。
+
+        Raises:
+            ValueError: value が IP アドレス / CIDR として解釈できない場合。
+        """
+        version, key, length = parse_prefix(value)
+        trie = self._tries[version]
+        covering = trie.covering(key, length)
+        covered = [e.to_dict() for e in trie.covered(key, length)]
+        return {
+            "query": format_prefix(version, key, length),
+            "longest": [e.to_dict() for e in trie.longest_match(key, length)],
+            "covering": [e.to_dict() for e in covering],
+            "covered": covered,
+            # 同じ長さのものは covered 側に入っている
+            "overlaps": [e.to_dict() for e in covering if e.length < length] + covered,
+        }
+
+
+def build_prefix_index(sites: Iterable[dict[str, Any]], remote_ip_ranges: dict[str, Any] | None) -> PrefixIndex:
+    """static_route_init の sites（平坦化済み networks を含む）と remoteIpRanges から索引を作る。
+
+    cidr / gateway が無い・解釈できない行は飛ばす。
+    """
+    index = PrefixIndex()
+    for site in sites:
+        if not isinstance(site, dict):
+            continue
+        for network in site.get("networks") or []:
+            owner = {
+                "siteId": site.get("id"),
+                "siteName": site.get("name"),
+                "interfaceId": network.get("interface_id"),
+                "interfaceName": network.get("interface_name"),
+                "subnetName": network.get("subnet_name"),
+                "type": network.get("type"),
+                "vlan": network.get("vlan"),
+            }
+            for kind, value in (("subnet", network.get("cidr")), ("gateway", network.get("gateway"))):
+                if not value:
+                    continue
+                try:
+                    if kind == "gateway":
+                        # Gateway は "10.0.0.1/24" 形式のこともあるので、ホストアドレスとして登録する
+                        version, key, _length = parse_prefix(str(value).partition("/")[0])
+                        prefix = (version, key, 32 if version == 4 else 128)
+                    else:
+                        prefix = parse_prefix(value)
+                except ValueError:
+                    continue
+                index.add(prefix, kind, owner)
+
+    for name, value in (remote_ip_ranges or {}).items():
+        if not value:
+            continue
+        try:
+            prefix = parse_prefix(value)
+        except ValueError:
+            continue
+        index.add(prefix, "remoteIpRange", {"rangeType": name, "label": REMOTE_RANGE_LABELS.get(name, name)})
+    return index
+
+
+class PrefixIndexStore:
+    """(CmaTarget.key, accountID) ごとに最新の PrefixIndex を保持する。
+
+    update では元データを預かるだけにして、索引は最初の get で作る
+    （static_route_init の応答を索引作りで遅らせないため）。
+    """
+
+    def __init__(self) -> None:
+        self._indexes: dict[tuple[str, str], PrefixIndex] = {}
+        self._pending: dict[tuple[str, str], tuple[list[dict[str, Any]], dict[str, Any] | None]] = {}
+        self._lock = threading.Lock()
+
+    def update(
+        self,
+        scope: tuple[str, str],
+        sites: Iterable[dict[str, Any]],
+        remote_ip_ranges: dict[str, Any] | None,
+    ) -> None:
+        with self._lock:
+            self._pending[scope] = (list(sites), remote_ip_ranges)
+            self._indexes.pop(scope, None)
+
+    def get(self, scope: tuple[str, str]) -> PrefixIndex | None:
+        """scope の索引を返す（元データが無ければ None）。"""
+        with self._lock:
+            index = self._indexes.get(scope)
+            if index is not None:
+                return index
+            pending = self._pending.pop(scope, None)
+            if pending is None:
+                return None
+            # 同じ scope の索引を二重に作らないよう、ロックを持ったまま作る
+            index = self._indexes[scope] = build_prefix_index(*pending)
+            return index
+
+    def invalidate(self, tenant: str | None = None) -> None:
+        """保持している索引を破棄する（tenant を指定した場合はそのテナントの分だけ）。"""
+        with self._lock:
+            if tenant is None:
+                self._indexes.clear()
+                self._pending.clear()
+                return
+            for store in (self._indexes, self._pending):
+                for scope in [s for s in store if s[0] == tenant]:
+                    del store[scope]
+
+
+# プロセス全体で共有する索引
+prefix_indexes = PrefixIndexStore()
@@ -0,0 +1,100 @@
+﻿# cato_helper/services/query_registry.py
+"""GraphQL の payload を、事前にエンコードしたテンプレートから組み立てるためのレジストリ。
+
+operationName と query（loginState なら 30 行近くある）は毎回同じなので、
+JSON エンコード済みの
+
+    {"operationName":"...","query":"...","variables":
+
+までを 1 回だけ作っておき、呼び出しごとには variables だけをエンコードして連結する。
+
+- register_query で登録したクエリは operationName で引ける（get_template）
+- 登録していないクエリ（エイリアス付きのバッチクエリなど）も、
+  encode_payload に渡せば (operationName, query) ごとにテンプレートを作って使い回す
+"""
+
+from __future__ import annotations
+
+from functools import lru_cache
+from typing import Any, Mapping
+
+from .json_codec import dumps
+
+
+class PayloadTemplate:
+    """1 つの (operationName, query) に対応する、エンコード済みの payload の前半部分。"""
+
+    __slots__ = ("operation_name", "query", "mutation", "_prefix")
+
+    def __init__(self, operation_name: str | None, query: str) -> None:
+        self.operation_name = operation_name
+        self.query = query
+        # mutation は冪等でないので、送信後の通信エラーではリトライしない（resilience）
+        self.mutation = is_mutation(query)
+        self._prefix = (
+            b'{"operationName":' + dumps(operation_name)
+            + b',"query":' + dumps(query)
+            + b',"variables":'
+        )
+
+    def encode(self, variables: Mapping[str, Any] | None = None) -> bytes:
+        """variables を差し込んだ payload 全体（JSON の bytes）を返す。"""
+        return self._prefix + dumps(dict(variables) if variables else {}) + b"}"
+
+    def payload(self, variables: Mapping[str, Any] | None = None) -> dict[str, Any]:
+        """同じ内容の payload を dict で返す（ログ出力などエンコード前の形が必要な場合用）。"""
+        return {
+            "operationName": self.operation_name,
+            "query": self.query,
+            "variables": dict(variables or {}),
+        }
+
+
+def is_mutation(query: str) -> bool:
+    """query が mutation（更新系の操作）かどうか。"""
+    return query.lstrip().startswith("mutation")
+
+
+# operationName -> 登録済みのテンプレート
+_registry: dict[str, PayloadTemplate] = {}
+
+
+def register_query(operation_name: str, query: str) -> PayloadTemplate:
+    """クエリを登録し、そのテンプレートを返す（モジュールの読み込み時に呼ぶ想定）。"""
+    template = PayloadTemplate(operation_name, query)
+    _registry[operation_name] = template
+    return template
+
+
+def get_template(operation_name: str) -> PayloadTemplate:
+    """登録済みのテンプレートを返す。
+
+    Raises:
+        KeyError: 登録されていない operationName の場合。
+    """
+    return _registry[operation_name]
+
+
+@lru_cache(maxsize=256)
+def _adhoc_template(operation_name: str | None, query: str) -> PayloadTemplate:
+    return PayloadTemplate(operation_name, query)
+
+
+def template_for(operation_name: str | None, query: str) -> PayloadTemplate:
+    """(operationName, query) のテンプレートを返す（登録済みならそれ、無ければ作って使い回す）。"""
+    if operation_name is not None:
+        template = _registry.get(operation_name)
+        if template is not None and (template.query is query or template.query == query):
+            return template
+    return _adhoc_template(operation_name, query)
+
+
+def encode_payload(payload: Mapping[str, Any]) -> bytes:
+    """{"operationName", "query", "variables"} の payload を JSON の bytes にする。
+
+    それ以外のキーを含む場合などは、テンプレートを使わずにそのままエンコードする。
+    """
+    query = payload.get("query")
+    if isinstance(query, str) and payload.keys() <= {"operationName", "query", "variables"}:
+        return template_for(payload.get("operationName"), query).encode(payload.get("variables"))
+    return dumps(dict(payload))
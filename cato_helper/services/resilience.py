@@ -0,0 +1,363 @@
+﻿# cato_helper/services/resilience.py
+"""CMA / Cato API への呼び出しを一時的な障害から守るためのモジュール。
+
+- リトライ        : 5xx・429・接続エラーを、ジッター付きの指数バックオフで再試行する
+                    （Retry-After ヘッダーがあればその秒数に従う）
+- レート制限      : 宛先（テナントなど）ごとのトークンバケットで、一斉に投げすぎないようにする
+- サーキットブレーカー : 連続して失敗したら、しばらくは通信せずにすぐ失敗させる
+
+同期版 call_with_retry と asyncio 版 acall_with_retry があり、
+どちらも「1 回分の送信処理」を渡して使う::
+
+    resp = call_with_retry(
+        lambda attempt: sess.post(url, data=body, timeout=30),
+        key=tenant,
+        retry_on=(requests.ConnectionError, requests.Timeout),
+    )
+
+送信処理は status_code / headers を持つレスポンスを返すこと（requests / httpx のどちらでもよい）。
+リトライし尽くした場合は最後のレスポンスをそのまま返すので、
+raise_for_status などは従来どおり呼び出し側で行う。
+"""
+
+from __future__ import annotations
+
+import asyncio
+import os
+import random
+import threading
+import time
+from dataclasses import dataclass
+from email.utils import parsedate_to_datetime
+from typing import Any, Awaitable, Callable, Final, TypeVar
+
+from .metrics import RESILIENCE_CIRCUIT_OPENS, RESILIENCE_RATE_LIMIT_WAIT
+
+R = TypeVar("R")
+
+# 1 回の呼び出しで送信する最大回数（初回を含む）。1 でリトライしない
+RETRY_MAX_ATTEMPTS: Final[int] = int(os.getenv("CMA_RETRY_MAX_ATTEMPTS", "4"))
+
+# バックオフの初期値・上限（秒）
+RETRY_BASE_DELAY: Final[float] = float(os.getenv("CMA_RETRY_BASE_DELAY", "0.5"))
+RETRY_MAX_DELAY: Final[float] = float(os.getenv("CMA_RETRY_MAX_DELAY", "8"))
+
+# Retry-After がこれより長い場合は待たずに諦める（秒）
+RETRY_AFTER_MAX: Final[float] = float(os.getenv("CMA_RETRY_AFTER_MAX", "30"))
+
+# 宛先ごとの 1 秒あたりの送信数と、瞬間的に許すバースト数。0 でレート制限しない
+RATE_LIMIT_PER_SEC: Final[float] = float(os.getenv("CMA_RATE_LIMIT_PER_SEC", "50"))
+RATE_LIMIT_BURST: Final[int] = int(os.getenv("CMA_RATE_LIMIT_BURST", "100"))
+
+# 連続何回の失敗でサーキットを開くか。0 でサーキットブレーカーを使わない
+BREAKER_FAILURE_THRESHOLD: Final[int] = int(os.getenv("CMA_BREAKER_THRESHOLD", "5"))
+
+# サーキットを開いてから、試しに 1 件通すまでの秒数
+BREAKER_RESET_SECONDS: Final[float] = float(os.getenv("CMA_BREAKER_RESET_SECONDS", "30"))
+
+# リトライする HTTP ステータス
+RETRY_STATUSES: Final[frozenset[int]] = frozenset({429, 500, 502, 503, 504})
+
+# サーバーが処理せずに断ったことがはっきりしているステータス。
+# 冪等でない呼び出し（mutation など）はこれらの場合だけリトライする
+_REJECTED_STATUSES: Final[frozenset[int]] = frozenset({429, 503})
+
+
+class CircuitOpenError(RuntimeError):
+    """サーキットが開いていて、通信せずに失敗させた場合の例外。"""
+
+    def __init__(self, key: str, retry_in: float) -> None:
+        super().__init__(f"{key} は一時的に利用できません（約 {retry_in:.0f} 秒後に再試行します）")
+        self.key = key
+        self.retry_in = retry_in
+
+
+def parse_retry_after(value: str | None) -> float | None:
+    """Retry-After ヘッダー（秒数 または HTTP-date）を待ち秒数にする。"""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, when.timestamp() - time.time())
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    """リトライの回数と待ち時間の決め方。"""
+
+    max_attempts: int = RETRY_MAX_ATTEMPTS
+    base_delay: float = RETRY_BASE_DELAY
+    max_delay: float = RETRY_MAX_DELAY
+    retry_after_max: float = RETRY_AFTER_MAX
+    retry_statuses: frozenset[int] = RETRY_STATUSES
+
+    def backoff(self, attempt: int) -> float:
+        """attempt 回目（0 始まり）の失敗後の待ち時間。
+
+        "full jitter"（0 〜 上限の一様乱数）にして、並列の呼び出しが同時に再送しないようにする。
+        """
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2**attempt)))
+
+    def retry_delay(
+        self,
+        attempt: int,
+        *,
+        idempotent: bool,
+        resp: Any = None,
+        error: BaseException | None = None,
+    ) -> float | None:
+        """リトライする場合は待ち秒数を、しない場合は None を返す。"""
+        if attempt + 1 >= self.max_attempts:
+            return None
+
+        if error is not None:
+            # 送信後に切れた可能性があるので、冪等な呼び出しだけ再送する
+            return self.backoff(attempt) if idempotent else None
+
+        statuses = self.retry_statuses if idempotent else self.retry_statuses & _REJECTED_STATUSES
+        if resp.status_code not in statuses:
+            return None
+
+        retry_after = parse_retry_after(resp.headers.get("Retry-After"))
+        if retry_after is None:
+            return self.backoff(attempt)
+        if retry_after > self.retry_after_max:
+            return None
+        return retry_after
+
+
+DEFAULT_POLICY: Final[RetryPolicy] = RetryPolicy()
+
+
+class TokenBucket:
+    """1 秒あたり rate 個補充され、最大 burst 個まで貯まるトークンバケット。
+
+    reserve() はトークンを 1 個予約し、使えるようになるまでの待ち秒数を返す
+    （トークンは負にもなる＝先の分を予約する）。同時に呼ばれても順番に間隔が空く。
+    """
+
+    def __init__(self, rate: float, burst: int) -> None:
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(float(self.burst), self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+
+class CircuitBreaker:
+    """連続失敗でサーキットを開き、reset_seconds 経過後に 1 件だけ試しに通す。
+
+    - closed    : 通常どおり通す
+    - open      : CircuitOpenError ですぐに失敗させる
+    - half_open : 試しの 1 件だけ通し、成功したら closed、失敗したら再び open にする
+    """
+
+    CLOSED: Final[str] = "closed"
+    OPEN: Final[str] = "open"
+    HALF_OPEN: Final[str] = "half_open"
+
+    def __init__(
+        self,
+        key: str,
+        failure_threshold: int = BREAKER_FAILURE_THRESHOLD,
+        reset_seconds: float = BREAKER_RESET_SECONDS,
+    ) -> None:
+        self.key = key
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self._failures = 0
+        self._opened_at: float | None = None
+        # half_open で試しの 1 件を通した時刻（応答が返らないまま放置されても、一定時間で次を通す）
+        self._probe_started: float | None = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._state_locked(time.monotonic())
+
+    def _state_locked(self, now: float) -> str:
+        if self._opened_at is None:
+            return self.CLOSED
+        if now - self._opened_at < self.reset_seconds:
+            return self.OPEN
+        return self.HALF_OPEN
+
+    def before_call(self) -> None:
+        """通信してよいか確認する。だめなら CircuitOpenError。"""
+        if self.failure_threshold <= 0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            state = self._state_locked(now)
+            if state == self.CLOSED:
+                return
+            if state == self.HALF_OPEN and (
+                self._probe_started is None or now - self._probe_started >= self.reset_seconds
+            ):
+                self._probe_started = now
+                return
+            assert self._opened_at is not None
+            retry_in = max(0.0, self._opened_at + self.reset_seconds - now)
+        raise CircuitOpenError(self.key, retry_in)
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probe_started = None
+
+    def record_failure(self) -> None:
+        if self.failure_threshold <= 0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self._failures += 1
+            was_open = self._opened_at is not None
+            if was_open or self._failures >= self.failure_threshold:
+                # half_open の試しが失敗した場合も、ここで開き直す
+                self._opened_at = now
+                self._probe_started = None
+        if not was_open and self._failures >= self.failure_threshold:
+            RESILIENCE_CIRCUIT_OPENS.inc(key=self.key)
+            print(f"[resilience] circuit opened: {self.key} ({self._failures} consecutive failures)")
+
+
+_registry_lock = threading.Lock()
+_buckets: dict[str, TokenBucket] = {}
+_breakers: dict[str, CircuitBreaker] = {}
+
+
+def get_rate_limiter(key: str) -> TokenBucket:
+    with _registry_lock:
+        bucket = _buckets.get(key)
+        if bucket is None:
+            bucket = _buckets[key] = TokenBucket(RATE_LIMIT_PER_SEC, RATE_LIMIT_BURST)
+        return bucket
+
+
+def get_circuit_breaker(key: str) -> CircuitBreaker:
+    with _registry_lock:
+        breaker = _breakers.get(key)
+        if breaker is None:
+            breaker = _breakers[key] = CircuitBreaker(key)
+        return breaker
+
+
+def circuit_state(key: str) -> str:
+    """key のサーキットの状態（まだ呼び出しが無ければ closed）。"""
+    with _registry_lock:
+        breaker = _breakers.get(key)
+    return breaker.state if breaker is not None else CircuitBreaker.CLOSED
+
+
+def _is_failure(resp: Any) -> bool:
+    """サーキットブレーカー上で「相手側の障害」とみなすか（429 は相手が生きているので数えない）。"""
+    return resp.status_code >= 500
+
+
+def call_with_retry(
+    send: Callable[[int], R],
+    *,
+    key: str,
+    retry_on: tuple[type[BaseException], ...],
+    idempotent: bool = True,
+    policy: RetryPolicy = DEFAULT_POLICY,
+) -> R:
+    """send(attempt) をレート制限・サーキットブレーカー・リトライ付きで呼ぶ（同期版）。
+
+    retry_on に含まれる例外（接続エラーなど）はリトライ対象とし、
+    それ以外の例外はそのまま投げる。
+    """
+    limiter = get_rate_limiter(key)
+    breaker = get_circuit_breaker(key)
+    attempt = 0
+    while True:
+        breaker.before_call()
+        wait = limiter.reserve()
+        if wait > 0:
+            RESILIENCE_RATE_LIMIT_WAIT.observe(wait, key=key)
+            time.sleep(wait)
+
+        try:
+            resp = send(attempt)
+        except retry_on as e:
+            breaker.record_failure()
+            delay = policy.retry_delay(attempt, idempotent=idempotent, error=e)
+            if delay is None or breaker.state == CircuitBreaker.OPEN:
+                raise
+            print(f"[resilience] {key}: {e!r}; retrying in {delay:.1f}s")
+        else:
+            if _is_failure(resp):
+                breaker.record_failure()
+            else:
+                breaker.record_success()
+            delay = policy.retry_delay(attempt, idempotent=idempotent, resp=resp)
+            if delay is None or breaker.state == CircuitBreaker.OPEN:
+                # サーキットが開いたら、それ以上は再送せずに最後の結果を返す
+                return resp
+            print(f"[resilience] {key}: HTTP {resp.status_code}; retrying in {delay:.1f}s")
+
+        time.sleep(delay)
+        attempt += 1
+
+
+async def acall_with_retry(
+    send: Callable[[int], Awaitable[R]],
+    *,
+    key: str,
+    retry_on: tuple[type[BaseException], ...],
+    idempotent: bool = True,
+    policy: RetryPolicy = DEFAULT_POLICY,
+) -> R:
+    """call_with_retry の asyncio 版。待ち時間は asyncio.sleep で待つ。"""
+    limiter = get_rate_limiter(key)
+    breaker = get_circuit_breaker(key)
+    attempt = 0
+    while True:
+        breaker.before_call()
+        wait = limiter.reserve()
+        if wait > 0:
+            RESILIENCE_RATE_LIMIT_WAIT.observe(wait, key=key)
+            await asyncio.sleep(wait)
+
+        try:
+            resp = await send(attempt)
+        except retry_on as e:
+            breaker.record_failure()
+            delay = policy.retry_delay(attempt, idempotent=idempotent, error=e)
+            if delay is None or breaker.state == CircuitBreaker.OPEN:
+                raise
+            print(f"[resilience] {key}: {e!r}; retrying in {delay:.1f}s")
+        else:
+            if _is_failure(resp):
+                breaker.record_failure()
+            else:
+                breaker.record_success()
+            delay = policy.retry_delay(attempt, idempotent=idempotent, resp=resp)
+            if delay is None or breaker.state == CircuitBreaker.OPEN:
+                # サーキットが開いたら、それ以上は再送せずに最後の結果を返す
+                return resp
+            print(f"[resilience] {key}: HTTP {resp.status_code}; retrying in {delay:.1f}s")
+
+        await asyncio.sleep(delay)
+        attempt += 1
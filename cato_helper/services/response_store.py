@@ -1,38 +1,54 @@
 ﻿from __future__ import annotations
 
 import atexit
-import json
+import gzip
+import os
+import queue
+import random
 import shutil
-import sys
+import threading
+import time
+from collections import deque
 from datetime import datetime
 from pathlib import Path
-from typing import Any
+from typing import Any, Final
 
+from .app_paths import RESPONSE_DIR
+from .capture_log import CaptureLogWriter
+from .json_codec import dumps
 
-def _get_base_dir() -> Path:
-    """
-    レスポンスを保存するベースディレクトリを返す。
-
-    - 通常の Python 実行時: プロジェクトルート（このファイルの親の親の親）
-        ROOT/
-          cato_helper/
-            services/
-              response_store.py  ← ここ
-    - PyInstaller --onefile 実行時:
-        実行ファイルと同じディレクトリ
-    """
-    # PyInstaller などで「凍結」している場合
-    if getattr(sys, "frozen", False):
-        # 実行ファイルのある場所
-        return Path(sys.executable).resolve().parent
 
-    # 通常のスクリプト実行時: プロジェクトルートを推定
-    # response_store.py -> services -> cato_helper -> ROOT
-    return Path(__file__).resolve().parents[2]
+# --- 保存方法の設定 ---
+
+# "1" なら書き込みは裏のスレッドで行い、API のレスポンスを待たせない
+RESPONSE_STORE_ASYNC: Final[bool] = os.getenv("CMA_RESPONSE_STORE_ASYNC", "1") == "1"
+
+# 圧縮方式: "none" / "gzip" / "zstd"（zstd は zstandard パッケージがある場合のみ）
+RESPONSE_STORE_COMPRESS: Final[str] = os.getenv("CMA_RESPONSE_STORE_COMPRESS", "none").lower()
+
+# "1" なら従来どおり indent=2 で整形して保存する（既定はコンパクト）
+RESPONSE_STORE_PRETTY: Final[bool] = os.getenv("CMA_RESPONSE_STORE_PRETTY", "0") == "1"
 
+# 保存する割合（0.0〜1.0）。1.0 なら全件保存
+RESPONSE_STORE_SAMPLE_RATE: Final[float] = float(os.getenv("CMA_RESPONSE_STORE_SAMPLE_RATE", "1.0"))
 
-# 例: <プロジェクトルート>/cma_responses
-RESPONSE_DIR = _get_base_dir() / "cma_responses"
+# 保存ディレクトリの合計サイズ上限（バイト）。超えたら古いファイルから消す。0 で無制限
+RESPONSE_STORE_MAX_BYTES: Final[int] = int(
+    os.getenv("CMA_RESPONSE_STORE_MAX_BYTES", str(200 * 1024 * 1024))
+)
+
+# 保存形式: "files"（1 レスポンス 1 ファイル）/ "segments"（追記専用ログ + 索引）
+# segments 形式は capture_log モジュールで読み出せる（圧縮設定は files 形式のみ有効）
+RESPONSE_STORE_FORMAT: Final[str] = os.getenv("CMA_RESPONSE_STORE_FORMAT", "files").lower()
+
+# 書き込み待ちキューの上限。溢れた分は API を待たせないよう捨てる
+RESPONSE_STORE_QUEUE_SIZE: Final[int] = int(os.getenv("CMA_RESPONSE_STORE_QUEUE_SIZE", "1000"))
+
+_EXTENSIONS: Final[dict[str, str]] = {
+    "none": ".json",
+    "gzip": ".json.gz",
+    "zstd": ".json.zst",
+}
 
 
 def _ensure_dir() -> Path:
@@ -40,23 +56,187 @@ def _ensure_dir() -> Path:
     return RESPONSE_DIR
 
 
-def save_response(name: str, data: Any) -> Path:
-    dir_path = _ensure_dir()
-    ts = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
-    filename = f"{name}_{ts}.json"
-    path = dir_path / filename
+def _encode(data: Any) -> bytes:
+    return dumps(data, indent=RESPONSE_STORE_PRETTY)
+
+
+def _compress(raw: bytes, method: str) -> bytes:
+    if method == "gzip":
+        return gzip.compress(raw, compresslevel=6)
+    if method == "zstd":
+        import zstandard  # type: ignore[import-not-found]
 
-    print(f"=== SAVE_RESPONSE CALLED ===")
-    print(f"Saving to: {path}")
+        return zstandard.ZstdCompressor(level=3).compress(raw)
+    return raw
 
-    with path.open("w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
 
+def _resolve_compression() -> str:
+    method = RESPONSE_STORE_COMPRESS
+    if method not in _EXTENSIONS:
+        print(f"[response_store] 未対応の圧縮方式なので無圧縮で保存します: {method!r}")
+        return "none"
+    if method == "zstd":
+        try:
+            import zstandard  # type: ignore[import-not-found]  # noqa: F401
+        except ImportError:
+            print("[response_store] zstandard が無いので gzip で保存します")
+            return "gzip"
+    return method
+
+
+class _ResponseWriter:
+    """レスポンス保存をまとめて引き受ける書き込み係。
+
+    - 非同期モードでは専用スレッドがキューから取り出して書き込む
+    - 保存ディレクトリの合計サイズを覚えておき、上限を超えたら古い順に消す
+    - segments 形式では、ファイルを作る代わりに capture_log に追記する
+    """
+
+    def __init__(self) -> None:
+        self.compression = _resolve_compression()
+        self.segmented = RESPONSE_STORE_FORMAT == "segments"
+        self._capture_log = CaptureLogWriter(RESPONSE_DIR) if self.segmented else None
+        self._queue: queue.Queue[tuple[str, Path, Any]] = queue.Queue(maxsize=RESPONSE_STORE_QUEUE_SIZE)
+        self._thread: threading.Thread | None = None
+        self._start_lock = threading.Lock()
+        # 書き込み済みファイル (path, size) を古い順に保持する
+        self._files: deque[tuple[Path, int]] = deque()
+        self._files_lock = threading.Lock()
+        self._total_bytes = 0
+        self._scanned = False
+        self._dropped = 0
+
+    @property
+    def extension(self) -> str:
+        return _EXTENSIONS[self.compression]
+
+    def path_for(self, name: str) -> Path:
+        """name のレスポンスの保存先を返す（segments 形式では書き込み先のセグメント）。"""
+        if self._capture_log is not None:
+            return self._capture_log.current_segment_path
+        ts = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+        return RESPONSE_DIR / f"{name}_{ts}{self.extension}"
+
+    def submit(self, name: str, path: Path, data: Any) -> None:
+        if not RESPONSE_STORE_ASYNC:
+            self._write(name, path, data)
+            return
+
+        self._ensure_thread()
+        try:
+            self._queue.put_nowait((name, path, data))
+        except queue.Full:
+            # デバッグ用の保存なので、詰まっている場合は API を優先して捨てる
+            self._dropped += 1
+            if self._dropped == 1 or self._dropped % 100 == 0:
+                print(f"[response_store] queue full, dropped {self._dropped} response(s)")
+
+    def flush(self, timeout: float = 10.0) -> None:
+        """キューに残っている書き込みが終わるまで待つ（最大 timeout 秒）。"""
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+    def reset(self) -> None:
+        """ディレクトリ削除後に、サイズ管理の情報を捨てる。"""
+        if self._capture_log is not None:
+            self._capture_log.close()
+        with self._files_lock:
+            self._files.clear()
+            self._total_bytes = 0
+            self._scanned = False
+
+    def _ensure_thread(self) -> None:
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, daemon=True, name="response-store-writer"
+                )
+                self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            name, path, data = self._queue.get()
+            try:
+                self._write(name, path, data)
+            except Exception as e:  # noqa: BLE001
+                # 保存に失敗しても API 自体には影響させない
+                print(f"[response_store] failed to save {path.name}: {e!r}")
+            finally:
+                self._queue.task_done()
+
+    def _write(self, name: str, path: Path, data: Any) -> None:
+        if self._capture_log is not None:
+            self._capture_log.append(name, data)
+            self._capture_log.enforce_limit(RESPONSE_STORE_MAX_BYTES)
+            return
+
+        _ensure_dir()
+        payload = _compress(_encode(data), self.compression)
+        path.write_bytes(payload)
+        print(f"[response_store] saved: {path}")
+
+        if RESPONSE_STORE_MAX_BYTES > 0:
+            # 同期モードではリクエストスレッドから同時に呼ばれるのでロックする
+            with self._files_lock:
+                self._track(path, len(payload))
+
+    def _track(self, path: Path, size: int) -> None:
+        if not self._scanned:
+            # 起動前から残っているファイルも含めて、古い順に並べておく
+            existing = sorted(
+                (p for p in RESPONSE_DIR.iterdir() if p.is_file() and p != path),
+                key=lambda p: p.stat().st_mtime,
+            )
+            for p in existing:
+                file_size = p.stat().st_size
+                self._files.append((p, file_size))
+                self._total_bytes += file_size
+            self._scanned = True
+
+        self._files.append((path, size))
+        self._total_bytes += size
+
+        while self._total_bytes > RESPONSE_STORE_MAX_BYTES and len(self._files) > 1:
+            old_path, old_size = self._files.popleft()
+            self._total_bytes -= old_size
+            try:
+                old_path.unlink()
+            except FileNotFoundError:
+                pass
+
+
+_writer = _ResponseWriter()
+
+
+def save_response(name: str, data: Any) -> Path | None:
+    """GraphQL のレスポンスをデバッグ / 解析用に保存する。
+
+    segments 形式の場合、戻り値は追記先のセグメントファイルになる。
+    書き込み自体は（既定では）裏のスレッドで行うので、戻り値のパスには
+    まだファイルが無い場合がある。サンプリングで保存しなかった場合は None。
+    """
+    if RESPONSE_STORE_SAMPLE_RATE < 1.0 and random.random() >= RESPONSE_STORE_SAMPLE_RATE:
+        return None
+
+    path = _writer.path_for(name)
+    _writer.submit(name, path, data)
     return path
 
 
+def flush_response_store(timeout: float = 10.0) -> None:
+    """書き込み待ちのレスポンスを保存し終えるまで待つ。"""
+    _writer.flush(timeout)
+
+
 def cleanup_response_store() -> None:
     """ツール終了時にレスポンス保存ディレクトリを削除する。"""
+    # 書き込み中のファイルが削除後に残らないよう、先にキューを掃き出す
+    flush_response_store()
+    # 開いたままのセグメントがあると Windows では削除できないので閉じておく
+    _writer.reset()
     if RESPONSE_DIR.exists():
         print(f"[response_store] cleanup: removing {RESPONSE_DIR}")
         shutil.rmtree(RESPONSE_DIR, ignore_errors=True)
@@ -0,0 +1,659 @@
+﻿# cato_helper/services/route_import.py
+"""Static Route の一括インポート（CSV / NDJSON / JSON）と、まとめて適用するジョブの管理。
+
+流れ:
+
+1. iter_import_rows でアップロードされたファイルを 1 行ずつ読んで Route の dict にする
+   （CSV / NDJSON はファイル全体を文字列にしない。JSON だけは全体を読む）
+2. RouteImportJob.read_rows で ROUTE_IMPORT_VALIDATE_CHUNK 行ずつ読み、そのたびに
+   ImportRowValidator で route_validation の検証器にかける（全行を読み終えるのを待たない）。
+   error の行は skipped、それ以外は pending にする（適用先は次ホップを含む Subnet の Interface）
+3. apply_job で pending / failed の行を Site ごとにまとめ、batch_size 件ずつの mutation
+   （送信は呼び出し側が渡す send_batch）を、最大 concurrency Site 並行で適用する。
+   1 Site の中は順番に送り、バッチが終わるごとに進捗を返してジョブを保存する
+
+ジョブは ROUTE_IMPORT_DIR に JSON で保存するので、切断や一部の失敗があっても
+同じジョブをもう一度 apply すれば残り（pending / failed）から再開できる。
+mutation はタイムアウト・切断時に反映されたか分からないため、送信中に切断された行は
+unknown にしておき、再開時は Site に同じ宛先の Subnet が既にある行を applied とみなして送らない。
+"""
+
+from __future__ import annotations
+
+import asyncio
+import csv
+import io
+import os
+import re
+import secrets
+import time
+from pathlib import Path
+from typing import IO, Any, AsyncIterator, Awaitable, Callable, Final, Iterator
+
+from .app_paths import ROUTE_IMPORT_DIR
+from .file_lock import FileLock
+from .json_codec import dumps, loads
+from .prefix_index import PrefixIndex, parse_prefix
+from .resilience import CircuitOpenError
+from .route_validation import ERROR, MAX_ROUTES_PER_CHECK, OK, WARNING, checker_for
+
+# 1 回の mutation でまとめて追加する Route の件数
+ROUTE_APPLY_BATCH_SIZE: Final[int] = int(os.getenv("CATO_ROUTE_APPLY_BATCH_SIZE", "20"))
+
+# 同時に適用する Site 数の上限（1 Site の中のバッチは順番に送る）
+ROUTE_APPLY_CONCURRENCY: Final[int] = int(os.getenv("CATO_ROUTE_APPLY_CONCURRENCY", "4"))
+
+# 1 ジョブで取り込める最大行数（検証器の上限と同じ）
+ROUTE_IMPORT_MAX_ROWS: Final[int] = MAX_ROUTES_PER_CHECK
+
+# アップロードを読みながら、この行数ごとに検証して結果を返す
+ROUTE_IMPORT_VALIDATE_CHUNK: Final[int] = int(os.getenv("CATO_ROUTE_IMPORT_VALIDATE_CHUNK", "500"))
+
+# 保存しておくジョブ数（古いものから消す）
+ROUTE_IMPORT_KEEP_JOBS: Final[int] = int(os.getenv("CATO_ROUTE_IMPORT_KEEP_JOBS", "50"))
+
+# 適用中にジョブを保存する最短間隔（秒）。バッチごとに数千行を書き直さないため
+_SAVE_INTERVAL: Final[float] = 1.0
+
+# 行の適用状態
+PENDING: Final[str] = "pending"
+APPLIED: Final[str] = "applied"
+FAILED: Final[str] = "failed"
+SKIPPED: Final[str] = "skipped"
+# 送信中に切断された（CMA 側で反映されたか分からない）。再開時に既存の Subnet と照合する
+UNKNOWN: Final[str] = "unknown"
+ROW_STATES: Final[tuple[str, ...]] = (PENDING, APPLIED, FAILED, SKIPPED, UNKNOWN)
+
+# 検証器の Route 同士の判定コード。アップロード内の重複・重なりは ImportRowValidator が
+# チャンクをまたいで判定し直すので、チャンク内だけの判定結果は使わない
+_IN_BATCH_CODES: Final[frozenset[str]] = frozenset({"duplicate_in_batch", "overlaps_in_batch"})
+
+# ファイル形式と、判定に使う拡張子 / Content-Type
+IMPORT_FORMATS: Final[dict[str, tuple[tuple[str, ...], tuple[str, ...]]]] = {
+    "csv": ((".csv", ".txt"), ("text/csv", "text/plain", "application/vnd.ms-excel")),
+    "ndjson": ((".ndjson", ".jsonl"), ("application/x-ndjson", "application/jsonl")),
+    "json": ((".json",), ("application/json",)),
+}
+
+# 列名（小文字・英数字だけにしたもの）-> Route のキー
+_COLUMN_ALIASES: Final[dict[str, str]] = {
+    "destination": "destination",
+    "dest": "destination",
+    "subnet": "destination",
+    "cidr": "destination",
+    "prefix": "destination",
+    "network": "destination",
+    "nexthop": "nextHop",
+    "gateway": "nextHop",
+    "via": "nextHop",
+    "siteid": "siteId",
+    "site": "siteName",
+    "sitename": "siteName",
+    "name": "name",
+    "routename": "name",
+}
+
+_JOB_ID_PATTERN = re.compile(r"^[0-9]{8}-[0-9]{6}-[0-9a-f]{6}$")
+_NON_ALNUM = re.compile(r"[^0-9a-z]")
+
+
+def detect_import_format(content_type: str | None, filename: str | None, requested: str | None = None) -> str:
+    """アップロードの形式（csv / ndjson / json）を決める。
+
+    requested（format パラメータ）> ファイル名の拡張子 > Content-Type の順に見る。
+
+    Raises:
+        ValueError: どの形式か判断できない場合。
+    """
+    if requested:
+        requested = requested.lower()
+        if requested not in IMPORT_FORMATS:
+            raise ValueError(f"unsupported import format: {requested}")
+        return requested
+
+    suffix = Path(filename or "").suffix.lower()
+    mimetype = (content_type or "").split(";")[0].strip().lower()
+    for fmt, (suffixes, _mimetypes) in IMPORT_FORMATS.items():
+        if suffix in suffixes:
+            return fmt
+    for fmt, (_suffixes, mimetypes) in IMPORT_FORMATS.items():
+        if mimetype in mimetypes:
+            return fmt
+    raise ValueError("cannot detect import format (use .csv / .ndjson / .json or format=...)")
+
+
+def _normalize_route(raw: Any) -> dict[str, Any]:
+    """1 行分の dict を、列名の揺れを吸収した Route の dict にする。"""
+    if not isinstance(raw, dict):
+        raise ValueError("row is not an object")
+    route: dict[str, Any] = {}
+    for key, value in raw.items():
+        target = _COLUMN_ALIASES.get(_NON_ALNUM.sub("", str(key or "").lower()))
+        if target is None or target in route:
+            continue
+        if isinstance(value, str):
+            value = value.strip()
+        if value not in (None, ""):
+            route[target] = value
+    return route
+
+
+def _iter_csv(stream: IO[bytes]) -> Iterator[tuple[int, dict[str, Any] | None, str | None]]:
+    text = io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+    try:
+        reader = csv.DictReader(text)
+        for raw in reader:
+            if not any((value or "").strip() for value in raw.values() if isinstance(value, str)):
+                continue
+            # 列数が多すぎる行は None キーに余りが入る
+            if None in raw:
+                yield reader.line_num, None, "列が多すぎます。"
+                continue
+            yield reader.line_num, _normalize_route(raw), None
+    finally:
+        # 元のストリームは呼び出し側が閉じる
+        text.detach()
+
+
+def _iter_ndjson(stream: IO[bytes]) -> Iterator[tuple[int, dict[str, Any] | None, str | None]]:
+    for line_no, line in enumerate(stream, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield line_no, _normalize_route(loads(line)), None
+        except ValueError as e:
+            yield line_no, None, f"JSON として解釈できません: {e}"
+
+
+def _iter_json(stream: IO[bytes]) -> Iterator[tuple[int, dict[str, Any] | None, str | None]]:
+    try:
+        document = loads(stream.read())
+    except ValueError as e:
+        raise ValueError(f"invalid JSON: {e}") from e
+    routes = document.get("routes") if isinstance(document, dict) else document
+    if not isinstance(routes, list):
+        raise ValueError("JSON must be a list of routes or {\"routes\": [...]}")
+    for i, raw in enumerate(routes, start=1):
+        try:
+            yield i, _normalize_route(raw), None
+        except ValueError as e:
+            yield i, None, str(e)
+
+
+def iter_import_rows(stream: IO[bytes], fmt: str) -> Iterator[tuple[int, dict[str, Any] | None, str | None]]:
+    """アップロードを 1 行ずつ (行番号, Route, 解釈エラー) にする。
+
+    CSV の列名は destination / nextHop / siteId / siteName / name（と subnet, gateway, site などの別名）。
+    NDJSON / JSON は同じキーを持つオブジェクト。JSON の場合だけ行番号は配列の何番目か（1 始まり）。
+
+    Raises:
+        ValueError: JSON 全体が壊れているなど、1 行も読めない場合。
+    """
+    if fmt == "csv":
+        return _iter_csv(stream)
+    if fmt == "ndjson":
+        return _iter_ndjson(stream)
+    if fmt == "json":
+        return _iter_json(stream)
+    raise ValueError(f"unsupported import format: {fmt}")
+
+
+def network_range_input(row: dict[str, Any]) -> dict[str, Any]:
+    """1 行分の Route を、CMA の Routed な Network Range の入力にする。"""
+    name = row.get("name") or "Route_" + str(row["destination"]).replace("/", "_").replace(":", "-")
+    return {
+        "name": name,
+        "rangeType": "Routed",
+        "subnet": row["destination"],
+        "gateway": row["nextHop"],
+    }
+
+
+class RouteImportJob:
+    """1 回分のインポート（行ごとの検証結果と適用状態）。
+
+    rows の 1 行は次の形の dict::
+
+        {"index": 0, "line": 2, "name": ..., "destination": "192.168.50.0/24", "nextHop": "10.0.1.254",
+         "siteId": ..., "siteName": ..., "status": "ok", "issues": [...],
+         "state": "pending", "targetSiteId": ..., "targetSiteName": ..., "interfaceId": ...,
+         "networkRangeId": None, "message": None}
+    """
+
+    def __init__(
+        self,
+        job_id: str,
+        target_key: str,
+        account_id: str,
+        *,
+        source: str = "",
+        strict: bool = False,
+        created_at: float | None = None,
+        updated_at: float | None = None,
+        rows: list[dict[str, Any]] | None = None,
+    ) -> None:
+        self.job_id = job_id
+        self.target_key = target_key
+        self.account_id = account_id
+        self.source = source
+        self.strict = strict
+        self.created_at = created_at or time.time()
+        self.updated_at = updated_at or self.created_at
+        self.rows: list[dict[str, Any]] = rows or []
+
+    @classmethod
+    def from_dict(cls, data: dict[str, Any]) -> RouteImportJob:
+        return cls(
+            data["jobId"],
+            data["targetKey"],
+            data["accountId"],
+            source=data.get("source") or "",
+            strict=bool(data.get("strict")),
+            created_at=data.get("createdAt"),
+            updated_at=data.get("updatedAt"),
+            rows=data.get("rows") or [],
+        )
+
+    def to_dict(self) -> dict[str, Any]:
+        return {**self.summary(), "targetKey": self.target_key, "accountId": self.account_id, "rows": self.rows}
+
+    def summary(self) -> dict[str, Any]:
+        """行を含まない、一覧・進捗表示用の集計。"""
+        validation = {OK: 0, WARNING: 0, ERROR: 0}
+        states = dict.fromkeys(ROW_STATES, 0)
+        for row in self.rows:
+            validation[row.get("status") or ERROR] += 1
+            states[row["state"]] += 1
+        return {
+            "jobId": self.job_id,
+            "source": self.source,
+            "strict": self.strict,
+            "createdAt": self.created_at,
+            "updatedAt": self.updated_at,
+            "rowCount": len(self.rows),
+            "validation": validation,
+            "states": states,
+        }
+
+    def add_row(self, line: int, route: dict[str, Any] | None, error: str | None = None) -> dict[str, Any]:
+        """読み込んだ 1 行を追加する（検証は ImportRowValidator で行う）。"""
+        route = route or {}
+        row: dict[str, Any] = {
+            "index": len(self.rows),
+            "line": line,
+            "name": route.get("name"),
+            "destination": route.get("destination"),
+            "nextHop": route.get("nextHop"),
+            "siteId": None if route.get("siteId") in (None, "") else str(route.get("siteId")),
+            "siteName": route.get("siteName"),
+            "status": None,
+            "issues": [],
+            "state": PENDING,
+            "message": None,
+        }
+        if error is not None:
+            row["issues"].append({"code": "invalid_row", "severity": ERROR, "message": error})
+        self.rows.append(row)
+        return row
+
+    def read_rows(
+        self, rows: Iterator[tuple[int, dict[str, Any] | None, str | None]], limit: int
+    ) -> list[dict[str, Any]]:
+        """iter_import_rows の続きから最大 limit 行を追加し、追加した行を返す（読み終えたら空）。
+
+        Raises:
+            ValueError / UnicodeDecodeError: ファイルが壊れていて読み進められない場合。
+        """
+        added: list[dict[str, Any]] = []
+        for line, route, error in rows:
+            added.append(self.add_row(line, route, error))
+            if len(added) >= limit:
+                break
+        return added
+
+    def applicable_rows(self) -> list[dict[str, Any]]:
+        """まだ適用していない（pending）か、前回失敗した（failed）か、結果が分からない（unknown）行。"""
+        return [row for row in self.rows if row["state"] in (PENDING, FAILED, UNKNOWN)]
+
+
+class ImportRowValidator:
+    """取り込んだ行を、読み込んだ順に少しずつ既存の Subnet / IP Range と突き合わせる。
+
+    既存のプレフィックスとの判定はチャンクごとに検証器（checker_for）でまとめて行い、
+    アップロード内の行同士の重複・重なりは、それまでに検証した行の索引で判定する
+    （後から出てきた方の行に付ける）。適用先（Site / Interface）もここで決める。
+    """
+
+    def __init__(self, index: PrefixIndex, strict: bool = False) -> None:
+        self.checker = checker_for(index)
+        self.strict = strict
+        # siteName だけが指定された行は、索引の Site 名から siteId を引く
+        self.site_ids: dict[str, str] = {}
+        for version in (4, 6):
+            for entry in index.entries(version):
+                if entry.kind == "subnet" and entry.owner.get("siteName"):
+                    self.site_ids.setdefault(str(entry.owner["siteName"]), str(entry.owner.get("siteId")))
+        self._seen = PrefixIndex()
+
+    def validate(self, rows: list[dict[str, Any]]) -> None:
+        """rows を検証して status / issues / 適用先 / state を埋める。
+
+        error の行（strict の場合は warning の行も）は skipped にする。
+        """
+        routes: list[dict[str, Any]] = []
+        for row in rows:
+            site_id = row["siteId"]
+            if site_id is None and row["siteName"]:
+                site_id = row["siteId"] = self.site_ids.get(str(row["siteName"]))
+                if site_id is None:
+                    row["issues"].append(
+                        {"code": "unknown_site", "severity": ERROR, "message": "指定された Site 名が見つかりません。"}
+                    )
+            routes.append(
+                {"destination": row["destination"], "nextHop": row["nextHop"], "siteId": site_id, "name": row["name"]}
+            )
+
+        report = self.checker.check(routes)
+        for row, result in zip(rows, report["results"]):
+            # 行として読めなかったものは、その理由だけを残す
+            unreadable = any(issue["code"] == "invalid_row" for issue in row["issues"])
+            if unreadable:
+                issues = row["issues"]
+            else:
+                issues = row["issues"] + [i for i in result["issues"] if i["code"] not in _IN_BATCH_CODES]
+                issues += self._upload_issues(row, result["destination"])
+            row["issues"] = issues
+            row["destination"] = result["destination"]
+            severities = {issue["severity"] for issue in issues}
+            row["status"] = ERROR if ERROR in severities else WARNING if WARNING in severities else OK
+
+            owner = result.get("nextHopSubnet") or {}
+            row["targetSiteId"] = None if owner.get("siteId") is None else str(owner["siteId"])
+            row["targetSiteName"] = owner.get("siteName")
+            row["interfaceId"] = owner.get("interfaceId")
+
+            if row["status"] == ERROR or (self.strict and row["status"] == WARNING):
+                row["state"] = SKIPPED
+            elif not row["interfaceId"]:
+                row["state"] = SKIPPED
+                row["message"] = "次ホップを含む Subnet の Interface ID が分かりません。"
+            else:
+                row["state"] = PENDING
+
+    def _upload_issues(self, row: dict[str, Any], destination: Any) -> list[dict[str, Any]]:
+        """それまでに検証した行との重複・重なり。"""
+        try:
+            prefix = parse_prefix(str(destination or ""))
+        except ValueError:
+            return []
+
+        issues: list[dict[str, Any]] = []
+        same = [e for e in self._seen.covering(prefix) if e.length == prefix[2]]
+        if same:
+            other = same[0].owner
+            issues.append(
+                {
+                    "code": "duplicate_in_batch",
+                    "severity": ERROR,
+                    "message": f"{other['line']} 行目と同じ宛先です。",
+                    "other": other["index"],
+                }
+            )
+            return issues
+
+        overlapping = self._seen.overlaps(prefix)
+        if overlapping:
+            other = min((e.owner for e in overlapping), key=lambda o: o["index"])
+            issues.append(
+                {
+                    "code": "overlaps_in_batch",
+                    "severity": WARNING,
+                    "message": f"{other['line']} 行目の宛先と重なっています。",
+                    "other": other["index"],
+                }
+            )
+        self._seen.add(prefix, "upload", {"index": row["index"], "line": row["line"]})
+        return issues
+
+
+class RouteImportStore:
+    """ジョブを 1 ジョブ 1 ファイルの JSON で保存する。
+
+    サーバーモードで複数ワーカーから同じジョブを同時に適用しないよう、
+    適用中は lock(job_id) のファイルロックを持つ。
+    """
+
+    def __init__(self, directory: Path, keep: int = ROUTE_IMPORT_KEEP_JOBS) -> None:
+        self.directory = directory
+        self.keep = keep
+
+    def new_job_id(self) -> str:
+        return f"{time.strftime('%Y%m%d-%H%M%S')}-{secrets.token_hex(3)}"
+
+    def path_for(self, job_id: str) -> Path:
+        """ジョブのファイルパス。
+
+        Raises:
+            KeyError: job_id の形式が正しくない場合（パスの組み立てに使わない）。
+        """
+        if not _JOB_ID_PATTERN.match(job_id):
+            raise KeyError(job_id)
+        return self.directory / f"{job_id}.json"
+
+    def lock(self, job_id: str) -> FileLock:
+        return FileLock(self.path_for(job_id).with_suffix(".lock"))
+
+    def load(self, job_id: str) -> RouteImportJob:
+        """
+        Raises:
+            KeyError: ジョブが無い場合。
+        """
+        path = self.path_for(job_id)
+        try:
+            data = path.read_bytes()
+        except FileNotFoundError as e:
+            raise KeyError(job_id) from e
+        return RouteImportJob.from_dict(loads(data))
+
+    def save(self, job: RouteImportJob) -> None:
+        self.write(job.job_id, dumps(job.to_dict()))
+
+    def write(self, job_id: str, data: bytes) -> None:
+        """エンコード済みのジョブを書き込む（途中で落ちても壊れないよう、一時ファイル経由で置き換える）。"""
+        path = self.path_for(job_id)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(f".{os.getpid()}.tmp")
+        tmp.write_bytes(data)
+        os.replace(tmp, path)
+
+    def list_jobs(self, target_key: str | None = None) -> list[dict[str, Any]]:
+        """保存済みのジョブの集計を新しい順に返す（target_key を指定した場合はその CmaTarget の分だけ）。"""
+        summaries: list[dict[str, Any]] = []
+        for path in sorted(self.directory.glob("*.json"), reverse=True):
+            try:
+                job = RouteImportJob.from_dict(loads(path.read_bytes()))
+            except Exception:  # noqa: BLE001
+                continue
+            if target_key is None or job.target_key == target_key:
+                summaries.append(job.summary())
+        return summaries
+
+    def prune(self) -> None:
+        """保存数の上限を超えた古いジョブを消す。"""
+        paths = sorted(self.directory.glob("*.json"), reverse=True)
+        for path in paths[max(0, self.keep) :]:
+            lock = FileLock(path.with_suffix(".lock"))
+            # 適用中のジョブは消さない
+            if not lock.acquire(blocking=False):
+                continue
+            try:
+                path.unlink(missing_ok=True)
+            finally:
+                lock.release()
+            path.with_suffix(".lock").unlink(missing_ok=True)
+
+
+# プロセス全体で共有するジョブの置き場所
+route_imports = RouteImportStore(ROUTE_IMPORT_DIR)
+
+
+# (Site ID, 行) を受け取り、行ごとの (networkRangeId, エラーメッセージ) を返す送信処理
+SendBatch = Callable[[str, list[dict[str, Any]]], Awaitable[list[tuple[str | None, str | None]]]]
+
+
+def _already_present(index: PrefixIndex, row: dict[str, Any]) -> bool:
+    """適用先の Site に、同じ宛先の Subnet が既にあるか。"""
+    try:
+        prefix = parse_prefix(str(row["destination"]))
+    except ValueError:
+        return False
+    return any(
+        entry.kind == "subnet" and entry.length == prefix[2] and str(entry.owner.get("siteId")) == row["targetSiteId"]
+        for entry in index.covering(prefix)
+    )
+
+
+async def apply_job(
+    job: RouteImportJob,
+    index: PrefixIndex,
+    send_batch: SendBatch,
+    *,
+    store: RouteImportStore = route_imports,
+    batch_size: int = ROUTE_APPLY_BATCH_SIZE,
+    concurrency: int = ROUTE_APPLY_CONCURRENCY,
+) -> AsyncIterator[dict[str, Any]]:
+    """pending / failed / unknown の行を Site ごとのバッチで適用し、進捗のレコードを返す。
+
+    返すレコード:
+    - {"type": "plan", "siteCount", "batchCount", "rowCount", "alreadyPresent", "unknownRechecked"}
+    - {"type": "batch", "siteId", "rows": [{"index", "state", "networkRangeId", "message"}], "progress"}
+    - {"type": "done", "job": 集計, "stopped": サーキットブレーカーで止めたか}
+
+    index は最新の既存 Subnet（再開時に、既に反映済みの行を見分けるのに使う）。
+    CMA 側のサーキットブレーカーが開いたら、残りのバッチは送らずに pending のまま止める。
+    クライアントの切断などで送信中のバッチを取り消した場合、その行は反映されたか分からないので
+    unknown にする（次の apply で既存の Subnet と照合し、無ければ送り直す）。
+    """
+    rows = job.applicable_rows()
+    already_present = 0
+    unknown_rechecked = 0
+    by_site: dict[str, list[dict[str, Any]]] = {}
+    for row in rows:
+        if row["state"] == UNKNOWN:
+            unknown_rechecked += 1
+        if _already_present(index, row):
+            row["state"] = APPLIED
+            row["message"] = "既に登録済みです。"
+            already_present += 1
+            continue
+        by_site.setdefault(row["targetSiteId"], []).append(row)
+
+    batch_size = max(1, batch_size)
+    batches = {
+        site_id: [site_rows[i : i + batch_size] for i in range(0, len(site_rows), batch_size)]
+        for site_id, site_rows in by_site.items()
+    }
+    total = sum(len(site_rows) for site_rows in by_site.values())
+    yield {
+        "type": "plan",
+        "siteCount": len(batches),
+        "batchCount": sum(len(site_batches) for site_batches in batches.values()),
+        "rowCount": total,
+        "alreadyPresent": already_present,
+        "unknownRechecked": unknown_rechecked,
+    }
+
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    queue: asyncio.Queue[tuple[str, list[dict[str, Any]]] | None] = asyncio.Queue()
+    # halted: サーキットブレーカーが開いて止めた / stop: 残りのバッチを送らない（切断時も立てる）
+    halted = asyncio.Event()
+    stop = asyncio.Event()
+
+    async def apply_site(site_id: str, site_batches: list[list[dict[str, Any]]]) -> None:
+        try:
+            # 同じ Site への変更は順番に送る
+            for batch in site_batches:
+                if stop.is_set():
+                    return
+                async with semaphore:
+                    if stop.is_set():
+                        return
+                    try:
+                        results = await send_batch(site_id, batch)
+                    except asyncio.CancelledError:
+                        # 送信中に取り消された。CMA 側で反映されたかは分からない
+                        for row in batch:
+                            row["state"] = UNKNOWN
+                            row["message"] = "送信中に中断されたため、反映されたか分かりません（再開時に確認します）。"
+                        raise
+                    except CircuitOpenError:
+                        # 送っていないので pending のまま。残りも送らない
+                        halted.set()
+                        stop.set()
+                        return
+                    except Exception as e:  # noqa: BLE001
+                        results = [(None, str(e) or type(e).__name__)] * len(batch)
+
+                if len(results) != len(batch):
+                    # 応答が欠けていた（一部のエイリアスが無いなど）。結果の無い行は失敗扱いにする
+                    print(f"[route_import] {site_id}: {len(batch)} 行に対して結果が {len(results)} 件でした")
+                    missing = (None, "CMA の応答にこの行の結果がありませんでした。")
+                    results = [*results[: len(batch)], *[missing] * (len(batch) - len(results))]
+
+                for row, (range_id, error) in zip(batch, results):
+                    if error is None:
+                        row["state"] = APPLIED
+                        row["networkRangeId"] = range_id
+                        row["message"] = None
+                    else:
+                        row["state"] = FAILED
+                        row["message"] = error
+                await queue.put((site_id, batch))
+        finally:
+            await queue.put(None)
+
+    async def save() -> None:
+        job.updated_at = time.time()
+        # 行はループ上で書き換えるので、エンコードまではループ上で行う
+        data = dumps(job.to_dict())
+        await asyncio.to_thread(store.write, job.job_id, data)
+
+    tasks = [asyncio.ensure_future(apply_site(site_id, site_batches)) for site_id, site_batches in batches.items()]
+    done = 0
+    running = len(tasks)
+    last_saved = time.monotonic()
+    try:
+        while running:
+            item = await queue.get()
+            if item is None:
+                running -= 1
+                continue
+            site_id, batch = item
+            done += len(batch)
+            if time.monotonic() - last_saved >= _SAVE_INTERVAL:
+                await save()
+                last_saved = time.monotonic()
+            yield {
+                "type": "batch",
+                "siteId": site_id,
+                "rows": [
+                    {
+                        "index": row["index"],
+                        "state": row["state"],
+                        "networkRangeId": row.get("networkRangeId"),
+                        "message": row["message"],
+                    }
+                    for row in batch
+                ],
+                "progress": {"done": done, "total": total},
+            }
+    finally:
+        # クライアントが切断した場合などは、送信前のバッチを止める（送信中のものは結果を待たずに unknown にする）
+        stop.set()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await save()
+
+    yield {"type": "done", "job": job.summary(), "stopped": halted.is_set()}
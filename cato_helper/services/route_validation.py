@@ -0,0 +1,420 @@
+﻿# cato_helper/services/route_validation.py
+"""追加予定の Static Route をまとめて検証するモジュール。
+
+数百〜数千件の Static Route を、既存の
+
+- 各 Site の Subnet / Gateway
+- SDP リモートユーザーの IP Range（Default / Dynamic / Static）
+
+と突き合わせ、1 件ごとに判定（ok / warning / error）と理由を返す。
+
+既存のプレフィックスは [start, end] の整数区間として start 順に並べ、
+「start が宛先の end 以下のものの中で、end の最大値が宛先の start 以上か」
+（累積最大値 + 二分探索）で重なりを判定する。
+NumPy があれば IPv4 の判定は searchsorted でまとめて行い、
+無い場合（と IPv6）は bisect で 1 件ずつ同じ判定をする。
+いずれも Route 数 × Subnet 数のループにはならない。
+
+重なりが見つかった Route だけ、prefix_index の索引から相手の Site などの詳細を引く。
+"""
+
+from __future__ import annotations
+
+import os
+import threading
+import weakref
+from bisect import bisect_left, bisect_right
+from itertools import accumulate
+from typing import Any, Final, Sequence
+
+from .prefix_index import PrefixEntry, PrefixIndex, format_prefix, parse_prefix
+
+# "0" で NumPy を使わない（結果は同じ。速度比較・切り分け用）
+ROUTE_CHECK_USE_NUMPY: Final[bool] = os.getenv("CATO_ROUTE_CHECK_NUMPY", "1") == "1"
+
+# 1 件の判定に付ける、重なった相手の詳細の最大件数
+MAX_CONFLICT_DETAILS: Final[int] = int(os.getenv("CATO_ROUTE_CHECK_MAX_DETAILS", "10"))
+
+# 一度に検証できる Route の最大件数
+MAX_ROUTES_PER_CHECK: Final[int] = int(os.getenv("CATO_ROUTE_CHECK_MAX_ROUTES", "20000"))
+
+_WIDTH: Final[dict[int, int]] = {4: 32, 6: 128}
+
+ERROR: Final[str] = "error"
+WARNING: Final[str] = "warning"
+OK: Final[str] = "ok"
+
+
+def _load_numpy() -> Any:
+    if not ROUTE_CHECK_USE_NUMPY:
+        return None
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+
+class _Intervals:
+    """1 アドレスファミリー・1 種別分の既存プレフィックス（start 昇順）。"""
+
+    def __init__(self, entries: list[PrefixEntry], width: int, np: Any) -> None:
+        entries = sorted(entries, key=lambda e: (e.key, e.length))
+        self.entries = entries
+        self.starts = [e.key for e in entries]
+        self.ends = ends = [e.key + (1 << (width - e.length)) - 1 for e in entries]
+        self.cummax = list(accumulate(ends, max))
+        # 完全一致の判定用（start とプレフィックス長の組を 1 つの整数にする）
+        self.keys = [e.key * 256 + e.length for e in entries]
+        self.np = np
+        if np is not None:
+            # IPv4 は int64 に収まるので、NumPy の配列にしておく
+            self.starts_array = np.array(self.starts, dtype=np.int64)
+            self.ends_array = np.array(self.ends, dtype=np.int64)
+            self.cummax_array = np.array(self.cummax, dtype=np.int64)
+            self.keys_array = np.array(self.keys, dtype=np.int64)
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def overlaps(self, starts: Sequence[int], ends: Sequence[int]) -> list[bool]:
+        """各区間 [starts[i], ends[i]] が、どれか 1 つの既存プレフィックスと重なるか。"""
+        if not self.entries:
+            return [False] * len(starts)
+        np = self.np
+        if np is not None:
+            hi = np.searchsorted(self.starts_array, np.asarray(ends, dtype=np.int64), side="right")
+            reach = self.cummax_array[np.maximum(hi - 1, 0)]
+            return ((hi > 0) & (reach >= np.asarray(starts, dtype=np.int64))).tolist()
+
+        result: list[bool] = []
+        for start, end in zip(starts, ends):
+            hi = bisect_right(self.starts, end)
+            result.append(hi > 0 and self.cummax[hi - 1] >= start)
+        return result
+
+    def nearest_containing(self, points: Sequence[int]) -> list[int]:
+        """各アドレスについて、start がそれ以下で最も近いプレフィックスが含んでいればその位置、無ければ -1。
+
+        Subnet が入れ子になっていなければ、これが含む Subnet そのものになる
+        （入れ子で外側にしか含まれない場合は -1 になるので、呼び出し側で索引から引き直す）。
+        """
+        if not self.entries:
+            return [-1] * len(points)
+        np = self.np
+        if np is not None:
+            wanted = np.asarray(points, dtype=np.int64)
+            pos = np.searchsorted(self.starts_array, wanted, side="right") - 1
+            hit = (pos >= 0) & (self.ends_array[np.maximum(pos, 0)] >= wanted)
+            return np.where(hit, pos, -1).tolist()
+
+        result: list[int] = []
+        for point in points:
+            pos = bisect_right(self.starts, point) - 1
+            result.append(pos if pos >= 0 and self.ends[pos] >= point else -1)
+        return result
+
+    def contains_exact(self, keys: Sequence[int]) -> list[bool]:
+        """各キー（start * 256 + プレフィックス長）と完全に同じプレフィックスがあるか。"""
+        if not self.entries:
+            return [False] * len(keys)
+        np = self.np
+        if np is not None:
+            wanted = np.asarray(keys, dtype=np.int64)
+            pos = np.searchsorted(self.keys_array, wanted)
+            found = self.keys_array[np.minimum(pos, len(self.keys) - 1)]
+            return ((pos < len(self.keys)) & (found == wanted)).tolist()
+
+        result: list[bool] = []
+        for key in keys:
+            pos = bisect_left(self.keys, key)
+            result.append(pos < len(self.keys) and self.keys[pos] == key)
+        return result
+
+
+class _FamilyTable:
+    """1 アドレスファミリー分の、種別ごとの区間。"""
+
+    def __init__(self, index: PrefixIndex, version: int, np: Any) -> None:
+        width = _WIDTH[version]
+        by_kind: dict[str, list[PrefixEntry]] = {"subnet": [], "gateway": [], "remoteIpRange": []}
+        for entry in index.entries(version):
+            by_kind.setdefault(entry.kind, []).append(entry)
+        self.subnets = _Intervals(by_kind["subnet"], width, np)
+        self.gateways = _Intervals(by_kind["gateway"], width, np)
+        self.remote_ranges = _Intervals(by_kind["remoteIpRange"], width, np)
+
+
+def _batch_overlaps(starts: list[int], ends: list[int], np: Any) -> tuple[list[bool], list[int]]:
+    """Route 同士の重なり。start 順で前にある Route と重なるものに True と相手の番号を返す。"""
+    count = len(starts)
+    if count < 2:
+        return [False] * count, [-1] * count
+
+    if np is not None:
+        s = np.asarray(starts, dtype=np.int64)
+        e = np.asarray(ends, dtype=np.int64)
+        # 同じ start なら広い方（end が大きい方）を先にする
+        order = np.lexsort((-e, s))
+        s_sorted, e_sorted = s[order], e[order]
+        cummax = np.maximum.accumulate(e_sorted)
+        # 累積最大値を持っている Route の位置（同じ値なら後ろのもの）
+        holder = np.maximum.accumulate(np.where(e_sorted == cummax, np.arange(count), 0))
+        overlap_sorted = np.zeros(count, dtype=bool)
+        overlap_sorted[1:] = cummax[:-1] >= s_sorted[1:]
+        partner_sorted = np.full(count, -1, dtype=np.int64)
+        partner_sorted[1:] = np.where(overlap_sorted[1:], order[holder[:-1]], -1)
+        overlap = np.zeros(count, dtype=bool)
+        partner = np.full(count, -1, dtype=np.int64)
+        overlap[order] = overlap_sorted
+        partner[order] = partner_sorted
+        return overlap.tolist(), partner.tolist()
+
+    order_list = sorted(range(count), key=lambda i: (starts[i], -ends[i]))
+    overlap_list = [False] * count
+    partner_list = [-1] * count
+    best_end = -1
+    best_index = -1
+    for i in order_list:
+        if best_index >= 0 and best_end >= starts[i]:
+            overlap_list[i] = True
+            partner_list[i] = best_index
+        if ends[i] >= best_end:
+            best_end = ends[i]
+            best_index = i
+    return overlap_list, partner_list
+
+
+def _conflict_details(index: PrefixIndex, parsed: tuple[int, int, int], kind: str) -> list[dict[str, Any]]:
+    return [e.to_dict() for e in index.overlaps(parsed) if e.kind == kind][:MAX_CONFLICT_DETAILS]
+
+
+def _issue(code: str, severity: str, message: str, **extra: Any) -> dict[str, Any]:
+    return {"code": code, "severity": severity, "message": message, **extra}
+
+
+class RouteConflictChecker:
+    """1 つの PrefixIndex（1 アカウント分の既存プレフィックス）に対する検証器。
+
+    区間の配列は最初の check で作り、同じ索引に対しては使い回す。
+    """
+
+    def __init__(self, index: PrefixIndex, use_numpy: bool = ROUTE_CHECK_USE_NUMPY) -> None:
+        self.index = index
+        self.np = _load_numpy() if use_numpy else None
+        # NumPy は IPv4 だけに使う（IPv6 は 128 bit で int64 に収まらない）
+        self._tables = {4: _FamilyTable(index, 4, self.np), 6: _FamilyTable(index, 6, None)}
+
+    @property
+    def engine(self) -> str:
+        return "numpy" if self.np is not None else "python"
+
+    def check(self, routes: Sequence[dict[str, Any]]) -> dict[str, Any]:
+        """routes（destination / nextHop / siteId / name）を検証し、Route ごとの判定を返す。
+
+        戻り値の例:
+            {
+                "summary": {"total": 2, "ok": 1, "warning": 0, "error": 1},
+                "engine": "numpy",
+                "results": [
+                    {"index": 0, "destination": "192.168.50.0/24", "nextHop": "10.0.1.254",
+                     "siteId": "100000", "status": "ok", "issues": []},
+                    ...
+                ]
+            }
+        """
+        results: list[dict[str, Any]] = []
+        # アドレスファミリーごとに (Route の番号, 宛先, 次ホップ) をまとめる
+        groups: dict[int, list[tuple[int, tuple[int, int, int], tuple[int, int, int] | None]]] = {4: [], 6: []}
+
+        for i, route in enumerate(routes):
+            route = route if isinstance(route, dict) else {}
+            result: dict[str, Any] = {
+                "index": i,
+                "name": route.get("name"),
+                "destination": route.get("destination"),
+                "nextHop": route.get("nextHop"),
+                "siteId": None if route.get("siteId") in (None, "") else str(route.get("siteId")),
+                "status": OK,
+                "issues": [],
+            }
+            results.append(result)
+
+            try:
+                destination = parse_prefix(str(route.get("destination") or ""))
+            except ValueError:
+                result["issues"].append(
+                    _issue("invalid_destination", ERROR, "宛先を IP アドレス / CIDR として解釈できません。")
+                )
+                continue
+            result["destination"] = format_prefix(*destination)
+
+            next_hop: tuple[int, int, int] | None = None
+            raw_next_hop = str(route.get("nextHop") or "").strip()
+            if raw_next_hop:
+                try:
+                    version, key, _length = parse_prefix(raw_next_hop.partition("/")[0])
+                    next_hop = (version, key, _WIDTH[version])
+                except ValueError:
+                    next_hop = None
+                if next_hop is None or next_hop[0] != destination[0]:
+                    result["issues"].append(
+                        _issue("invalid_next_hop", ERROR, "次ホップが宛先と同じ種類の IP アドレスではありません。")
+                    )
+                    next_hop = None
+            else:
+                result["issues"].append(_issue("missing_next_hop", ERROR, "次ホップが指定されていません。"))
+
+            groups[destination[0]].append((i, destination, next_hop))
+
+        for version, items in groups.items():
+            if items:
+                self._check_family(version, items, results)
+
+        summary = {"total": len(results), OK: 0, WARNING: 0, ERROR: 0}
+        for result in results:
+            severities = {issue["severity"] for issue in result["issues"]}
+            result["status"] = ERROR if ERROR in severities else WARNING if WARNING in severities else OK
+            summary[result["status"]] += 1
+
+        return {"summary": summary, "engine": self.engine, "results": results}
+
+    def _check_family(
+        self,
+        version: int,
+        items: list[tuple[int, tuple[int, int, int], tuple[int, int, int] | None]],
+        results: list[dict[str, Any]],
+    ) -> None:
+        table = self._tables[version]
+        width = _WIDTH[version]
+        np = self.np if version == 4 else None
+
+        starts = [dest[1] for _, dest, _ in items]
+        ends = [dest[1] + (1 << (width - dest[2])) - 1 for _, dest, _ in items]
+        keys = [dest[1] * 256 + dest[2] for _, dest, _ in items]
+
+        # --- 既存プレフィックスとの重なり（まとめて判定） ---
+        exact_subnet = table.subnets.contains_exact(keys)
+        overlap_subnet = table.subnets.overlaps(starts, ends)
+        overlap_remote = table.remote_ranges.overlaps(starts, ends)
+        overlap_gateway = table.gateways.overlaps(starts, ends)
+
+        # --- 次ホップが Site の Subnet 内か ---
+        hop_positions = [k for k, (_, _, hop) in enumerate(items) if hop is not None]
+        hops = [items[k][2][1] for k in hop_positions]  # type: ignore[index]
+        hop_local = dict(zip(hop_positions, table.subnets.overlaps(hops, hops)))
+        hop_subnet = dict(zip(hop_positions, table.subnets.nearest_containing(hops)))
+        hop_gateway = dict(zip(hop_positions, table.gateways.contains_exact([h * 256 + width for h in hops])))
+
+        # --- Route 同士 ---
+        first_seen: dict[int, int] = {}
+        batch_overlap, batch_partner = _batch_overlaps(starts, ends, np)
+
+        for k, (i, dest, hop) in enumerate(items):
+            result = results[i]
+            issues = result["issues"]
+
+            if exact_subnet[k]:
+                issues.append(
+                    _issue(
+                        "duplicate_site_subnet",
+                        ERROR,
+                        "宛先が既存の Site の Subnet と同じです。",
+                        conflicts=_conflict_details(self.index, dest, "subnet"),
+                    )
+                )
+            elif overlap_subnet[k]:
+                issues.append(
+                    _issue(
+                        "overlaps_site_subnet",
+                        ERROR,
+                        "宛先が既存の Site の Subnet と重なっています。",
+                        conflicts=_conflict_details(self.index, dest, "subnet"),
+                    )
+                )
+            elif overlap_gateway[k]:
+                issues.append(
+                    _issue(
+                        "contains_site_gateway",
+                        WARNING,
+                        "宛先に既存の Site の Gateway アドレスが含まれています。",
+                        conflicts=_conflict_details(self.index, dest, "gateway"),
+                    )
+                )
+
+            if overlap_remote[k]:
+                issues.append(
+                    _issue(
+                        "overlaps_remote_ip_range",
+                        ERROR,
+                        "宛先が SDP リモートユーザーの IP Range と重なっています。",
+                        conflicts=_conflict_details(self.index, dest, "remoteIpRange"),
+                    )
+                )
+
+            previous = first_seen.setdefault(keys[k], i)
+            if previous != i:
+                issues.append(
+                    _issue("duplicate_in_batch", ERROR, f"{previous + 1} 行目と同じ宛先です。", other=previous)
+                )
+            elif batch_overlap[k]:
+                other = items[batch_partner[k]][0]
+                issues.append(
+                    _issue(
+                        "overlaps_in_batch",
+                        WARNING,
+                        f"{other + 1} 行目の宛先と重なっています。",
+                        other=other,
+                    )
+                )
+
+            if hop is None:
+                continue
+            hop_start = hop[1]
+            if ends[k] >= hop_start >= starts[k]:
+                issues.append(
+                    _issue("next_hop_in_destination", ERROR, "次ホップが宛先の範囲内にあります。")
+                )
+            if not hop_local[k]:
+                issues.append(
+                    _issue("next_hop_not_local", ERROR, "次ホップがどの Site の Subnet にも含まれていません。")
+                )
+                continue
+            if hop_gateway[k]:
+                issues.append(
+                    _issue("next_hop_is_gateway", WARNING, "次ホップが Site の Gateway（Socket）のアドレスです。")
+                )
+
+            # 次ホップを含む Subnet の Site が、指定した Site と一致するか
+            if hop_subnet[k] >= 0:
+                owner_entry: PrefixEntry | None = table.subnets.entries[hop_subnet[k]]
+            else:
+                # 入れ子の Subnet の外側にだけ含まれる場合。covering は短い順なので最後が最も細かい
+                owners = [e for e in self.index.covering(hop) if e.kind == "subnet"]
+                owner_entry = owners[-1] if owners else None
+            if owner_entry is not None:
+                owner = owner_entry.owner
+                result["nextHopSubnet"] = owner_entry.to_dict()
+                site_id = result["siteId"]
+                if site_id is not None and str(owner.get("siteId")) != site_id:
+                    issues.append(
+                        _issue(
+                            "next_hop_other_site",
+                            ERROR,
+                            f"次ホップは別の Site（{owner.get('siteName')}）の Subnet にあります。",
+                        )
+                    )
+
+
+# PrefixIndex ごとの検証器（索引が作り直されたら、古い検証器も破棄される）
+_checkers: weakref.WeakKeyDictionary[PrefixIndex, RouteConflictChecker] = weakref.WeakKeyDictionary()
+_checkers_lock = threading.Lock()
+
+
+def checker_for(index: PrefixIndex) -> RouteConflictChecker:
+    """index 用の検証器を返す（区間の配列は索引ごとに 1 回だけ作る）。"""
+    with _checkers_lock:
+        checker = _checkers.get(index)
+        if checker is None:
+            checker = _checkers[index] = RouteConflictChecker(index)
+        return checker
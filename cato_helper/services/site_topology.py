@@ -0,0 +1,171 @@
+﻿# cato_helper/services/site_topology.py
+"""Site ごとの siteInfo を覚えておき、再読み込み時に差分だけ取り直すためのモジュール。
+
+accountSnapshotSites（Site ID と名前だけの軽い一覧）と、
+前回取得した siteInfo の内容ハッシュ・取得時刻を突き合わせて、
+
+- 追加された Site
+- 削除された Site
+- 名前が変わった Site / 取得から一定時間（鮮度）を過ぎた Site
+
+だけを取り直す。取り直した結果のハッシュが前回と同じなら「変更なし」とみなし、
+画面側も描画し直さなくて済むようにする。
+"""
+
+from __future__ import annotations
+
+import hashlib
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Final
+
+from .json_codec import dumps
+
+# 取得済みの siteInfo をそのまま使ってよい時間（秒）
+SITE_FRESHNESS_SECONDS: Final[float] = float(os.getenv("CMA_SITE_FRESHNESS_SECONDS", "300"))
+
+
+def hash_site_info(site_info: Any) -> str:
+    """siteInfo の内容ハッシュ（キー順に依存しない）を返す。"""
+    return hashlib.sha1(dumps(site_info, sort_keys=True, default=str)).hexdigest()
+
+
+@dataclass
+class _SiteEntry:
+    name: str
+    site_info: dict[str, Any]
+    content_hash: str
+    fetched_at: float
+
+
+@dataclass
+class TopologyPlan:
+    """今回の取得で何をすべきかをまとめたもの。"""
+
+    # 取り直す Site（追加・鮮度切れ・名前変更など）
+    fetch: list[tuple[str, str]] = field(default_factory=list)
+    # 前回の siteInfo をそのまま使える Site
+    reuse: list[tuple[str, str]] = field(default_factory=list)
+    added: list[str] = field(default_factory=list)
+    removed: list[str] = field(default_factory=list)
+
+
+class SiteTopologyTracker:
+    """(テナント, アカウント) ごとに、Site 単位の siteInfo とハッシュを保持する。"""
+
+    def __init__(self, freshness_seconds: float = SITE_FRESHNESS_SECONDS) -> None:
+        self.freshness_seconds = freshness_seconds
+        self._scopes: dict[tuple[str, str], dict[str, _SiteEntry]] = {}
+        self._lock = threading.Lock()
+
+    def plan(
+        self,
+        scope: tuple[str, str],
+        targets: list[tuple[str, str]],
+        refetch_all: bool = False,
+        max_age: float | None = None,
+    ) -> TopologyPlan:
+        """Site 一覧 (site_id, site_name) と保持中の情報を比べて、取得計画を立てる。
+
+        refetch_all=True の場合は、保持中の情報に関係なく全 Site を取り直す。
+        max_age を省略した場合は freshness_seconds を鮮度の基準にする。
+        """
+        max_age = self.freshness_seconds if max_age is None else max_age
+        now = time.monotonic()
+        plan = TopologyPlan()
+
+        with self._lock:
+            entries = self._scopes.get(scope, {})
+            current_ids = {site_id for site_id, _ in targets}
+
+            for site_id, site_name in targets:
+                entry = entries.get(site_id)
+                if entry is None:
+                    plan.added.append(site_id)
+                    plan.fetch.append((site_id, site_name))
+                elif refetch_all or entry.name != site_name or now - entry.fetched_at >= max_age:
+                    plan.fetch.append((site_id, site_name))
+                else:
+                    plan.reuse.append((site_id, site_name))
+
+            plan.removed = [site_id for site_id in entries if site_id not in current_ids]
+            for site_id in plan.removed:
+                del entries[site_id]
+
+        return plan
+
+    def record(self, scope: tuple[str, str], site_id: str, site_name: str, site_info: dict[str, Any]) -> bool:
+        """取得した siteInfo を保存する。前回から内容が変わった（または新規の）場合 True。"""
+        content_hash = hash_site_info(site_info)
+        with self._lock:
+            entries = self._scopes.setdefault(scope, {})
+            previous = entries.get(site_id)
+            entries[site_id] = _SiteEntry(
+                name=site_name,
+                site_info=site_info,
+                content_hash=content_hash,
+                fetched_at=time.monotonic(),
+            )
+        return previous is None or previous.content_hash != content_hash or previous.name != site_name
+
+    def get(self, scope: tuple[str, str], site_id: str) -> dict[str, Any] | None:
+        with self._lock:
+            entry = self._scopes.get(scope, {}).get(site_id)
+            return entry.site_info if entry is not None else None
+
+    def has_scope(self, scope: tuple[str, str]) -> bool:
+        with self._lock:
+            return bool(self._scopes.get(scope))
+
+    def export(self, scope: tuple[str, str]) -> dict[str, tuple[str, dict[str, Any], str, float]]:
+        """保持中の Site を site_id -> (名前, siteInfo, 内容ハッシュ, 取得時刻) で返す（topology_snapshot の保存用）。
+
+        取得時刻はプロセスをまたいで使えるよう、time.time() 基準に直して返す。
+        """
+        offset = time.time() - time.monotonic()
+        with self._lock:
+            return {
+                site_id: (entry.name, entry.site_info, entry.content_hash, entry.fetched_at + offset)
+                for site_id, entry in self._scopes.get(scope, {}).items()
+            }
+
+    def seed(
+        self,
+        scope: tuple[str, str],
+        entries: list[tuple[str, str, dict[str, Any], str, float]],
+    ) -> int:
+        """保存済みの (site_id, 名前, siteInfo, 内容ハッシュ, 取得時刻) で埋め直す。埋めた Site 数を返す。
+
+        再起動・再ログイン直後の 1 回目の取得でも、鮮度内の Site は取り直さずに済む。
+        既に情報を持っている scope には何もしない。
+        """
+        offset = time.time() - time.monotonic()
+        with self._lock:
+            if self._scopes.get(scope):
+                return 0
+            self._scopes[scope] = {
+                site_id: _SiteEntry(
+                    name=name, site_info=site_info, content_hash=content_hash, fetched_at=fetched_at - offset
+                )
+                for site_id, name, site_info, content_hash, fetched_at in entries
+                if isinstance(site_info, dict)
+            }
+            return len(self._scopes[scope])
+
+    def invalidate(self, tenant: str | None = None) -> None:
+        """保持している情報を破棄する（ログアウト・再ログイン時用）。
+
+        tenant を指定した場合は、スコープの先頭（テナント）が一致するものだけを破棄する。
+        """
+        with self._lock:
+            if tenant is None:
+                self._scopes.clear()
+                return
+            for scope in [s for s in self._scopes if isinstance(s, tuple) and s[0] == tenant]:
+                del self._scopes[scope]
+
+
+# プロセス全体で共有するトラッカー
+site_topology = SiteTopologyTracker()
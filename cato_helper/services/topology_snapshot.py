@@ -0,0 +1,281 @@
+﻿# cato_helper/services/topology_snapshot.py
+"""最後に取得したアカウントのトポロジ（Site / Interface / Subnet / IP Range）を SQLite に保存するモジュール。
+
+ツールの再起動や再ログインのたびに、全 Site の siteInfo を取り直さなくて済むようにする。
+
+- static_route_init の取得が終わるたびに save で保存する（内容ハッシュが変わった Site だけ書き直す）
+- 画面表示時は load で保存済みの内容をすぐに返し（保存時刻＝古さ付き）、
+  その間に通常の取得（再読み込み）を走らせる
+- site_entries の siteInfo と取得時刻で site_topology を埋め直すと、
+  鮮度内の Site は取り直さず、取り直した Site も内容が同じなら「変更なし」になる
+
+Site ごとの Network は 1 行ずつ networks テーブルに持ち、Site ID と CIDR に索引を張る。
+"""
+
+from __future__ import annotations
+
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Final
+
+from .app_paths import get_base_dir
+from .json_codec import dumps, loads
+
+# 保存先（既定: <プロジェクトルート>/topology_snapshot.sqlite3）
+TOPOLOGY_DB_PATH: Final[Path] = Path(os.getenv("CATO_TOPOLOGY_DB") or get_base_dir() / "topology_snapshot.sqlite3")
+
+# "0" で保存・読み込みともにしない
+TOPOLOGY_SNAPSHOT_ENABLED: Final[bool] = os.getenv("CATO_TOPOLOGY_SNAPSHOT", "1") == "1"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS snapshots (
+    target_key TEXT NOT NULL,
+    account_id TEXT NOT NULL,
+    saved_at REAL NOT NULL,
+    site_count INTEGER NOT NULL,
+    remote_ip_ranges TEXT,
+    PRIMARY KEY (target_key, account_id)
+);
+CREATE TABLE IF NOT EXISTS sites (
+    target_key TEXT NOT NULL,
+    account_id TEXT NOT NULL,
+    site_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    content_hash TEXT NOT NULL,
+    fetched_at REAL NOT NULL,
+    site_info TEXT NOT NULL,
+    PRIMARY KEY (target_key, account_id, site_id)
+);
+CREATE INDEX IF NOT EXISTS sites_site_id ON sites (site_id);
+CREATE TABLE IF NOT EXISTS networks (
+    target_key TEXT NOT NULL,
+    account_id TEXT NOT NULL,
+    site_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    interface_id TEXT,
+    interface_name TEXT,
+    subnet_name TEXT,
+    type TEXT,
+    cidr TEXT,
+    gateway TEXT,
+    vlan INTEGER,
+    dhcp_type TEXT
+);
+CREATE INDEX IF NOT EXISTS networks_site ON networks (target_key, account_id, site_id);
+CREATE INDEX IF NOT EXISTS networks_cidr ON networks (cidr);
+"""
+
+# networks テーブルの列と、static_route_init の networks のキーの対応
+_NETWORK_COLUMNS: Final[tuple[str, ...]] = (
+    "interface_id",
+    "interface_name",
+    "subnet_name",
+    "type",
+    "cidr",
+    "gateway",
+    "vlan",
+    "dhcp_type",
+)
+
+
+class TopologySnapshotStore:
+    """(CmaTarget.key, accountID) ごとに、最後に取得したトポロジを 1 つだけ保存する。
+
+    呼び出しごとに接続を開くので、どのスレッドから呼んでもよい（共有ループからは asyncio.to_thread で）。
+    サーバーモードの複数ワーカーから書き込む場合も、SQLite のロック（WAL）で排他される。
+    """
+
+    def __init__(self, path: Path, enabled: bool = True) -> None:
+        self.path = path
+        self.enabled = enabled
+        self._schema_ready = False
+        self._schema_lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=10.0)
+        with self._schema_lock:
+            if not self._schema_ready:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.executescript(_SCHEMA)
+                self._schema_ready = True
+        return conn
+
+    def save(
+        self,
+        target_key: str,
+        account_id: str,
+        sites: list[dict[str, Any]],
+        remote_ip_ranges: dict[str, Any] | None,
+        site_entries: dict[str, tuple[str, dict[str, Any], str, float]],
+    ) -> None:
+        """static_route_init の sites / remoteIpRanges を保存する。
+
+        site_entries は site_id -> (名前, siteInfo, 内容ハッシュ, 取得時刻)（site_topology.export）。
+        ここに無い Site（一度も取得できていない Site）は、前回保存した内容を残す。
+        remote_ip_ranges が None（取得失敗）の場合も前回の内容を残す。
+        """
+        if not self.enabled:
+            return
+
+        conn = self._connect()
+        try:
+            with conn:
+                scope = (target_key, account_id)
+                stored = dict(
+                    conn.execute(
+                        "SELECT site_id, content_hash FROM sites WHERE target_key = ? AND account_id = ?", scope
+                    ).fetchall()
+                )
+                current_ids: set[str] = set()
+                for position, site in enumerate(sites):
+                    site_id = str(site.get("id"))
+                    current_ids.add(site_id)
+                    entry = site_entries.get(site_id)
+                    if entry is None:
+                        # 取得に失敗した Site は、並び順だけ更新して前回の内容を使う
+                        conn.execute(
+                            "UPDATE sites SET position = ? WHERE target_key = ? AND account_id = ? AND site_id = ?",
+                            (position, *scope, site_id),
+                        )
+                        continue
+
+                    name, site_info, content_hash, fetched_at = entry
+                    if stored.get(site_id) == content_hash:
+                        conn.execute(
+                            "UPDATE sites SET position = ?, name = ?, fetched_at = ?"
+                            " WHERE target_key = ? AND account_id = ? AND site_id = ?",
+                            (position, name, fetched_at, *scope, site_id),
+                        )
+                        continue
+
+                    conn.execute(
+                        "INSERT OR REPLACE INTO sites"
+                        " (target_key, account_id, site_id, position, name, content_hash, fetched_at, site_info)"
+                        " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                        (*scope, site_id, position, name, content_hash, fetched_at, dumps(site_info).decode("utf-8")),
+                    )
+                    conn.execute(
+                        "DELETE FROM networks WHERE target_key = ? AND account_id = ? AND site_id = ?",
+                        (*scope, site_id),
+                    )
+                    conn.executemany(
+                        f"INSERT INTO networks (target_key, account_id, site_id, position, {', '.join(_NETWORK_COLUMNS)})"
+                        f" VALUES (?, ?, ?, ?{', ?' * len(_NETWORK_COLUMNS)})",
+                        [
+                            (*scope, site_id, i, *(network.get(column) for column in _NETWORK_COLUMNS))
+                            for i, network in enumerate(site.get("networks") or [])
+                        ],
+                    )
+
+                # 一覧から無くなった Site を消す
+                for site_id in set(stored) - current_ids:
+                    conn.execute(
+                        "DELETE FROM sites WHERE target_key = ? AND account_id = ? AND site_id = ?", (*scope, site_id)
+                    )
+                    conn.execute(
+                        "DELETE FROM networks WHERE target_key = ? AND account_id = ? AND site_id = ?",
+                        (*scope, site_id),
+                    )
+
+                conn.execute(
+                    "INSERT INTO snapshots (target_key, account_id, saved_at, site_count, remote_ip_ranges)"
+                    " VALUES (?, ?, ?, ?, ?)"
+                    " ON CONFLICT (target_key, account_id) DO UPDATE SET"
+                    " saved_at = excluded.saved_at, site_count = excluded.site_count,"
+                    " remote_ip_ranges = COALESCE(excluded.remote_ip_ranges, snapshots.remote_ip_ranges)",
+                    (
+                        *scope,
+                        time.time(),
+                        len(sites),
+                        None if remote_ip_ranges is None else dumps(remote_ip_ranges).decode("utf-8"),
+                    ),
+                )
+        finally:
+            conn.close()
+
+    def load(self, target_key: str, account_id: str | None = None) -> dict[str, Any] | None:
+        """保存済みのトポロジを static_route_init と同じ形（sites / remoteIpRanges）で返す。
+
+        account_id を省略した場合は、target_key で最後に保存したアカウントの分を返す。
+        保存されていなければ None。
+        """
+        if not self.enabled or not self.path.exists():
+            return None
+
+        conn = self._connect()
+        try:
+            query = "SELECT account_id, saved_at, remote_ip_ranges FROM snapshots WHERE target_key = ?"
+            params: tuple[str, ...] = (target_key,)
+            if account_id is not None:
+                query += " AND account_id = ?"
+                params += (account_id,)
+            row = conn.execute(query + " ORDER BY saved_at DESC LIMIT 1", params).fetchone()
+            if row is None:
+                return None
+            account_id, saved_at, remote_ip_ranges = row
+            scope = (target_key, account_id)
+
+            networks: dict[str, list[dict[str, Any]]] = {}
+            for site_id, *values in conn.execute(
+                f"SELECT site_id, {', '.join(_NETWORK_COLUMNS)} FROM networks"
+                " WHERE target_key = ? AND account_id = ? ORDER BY site_id, position",
+                scope,
+            ):
+                networks.setdefault(site_id, []).append(dict(zip(_NETWORK_COLUMNS, values)))
+
+            sites = [
+                {"id": site_id, "name": name, "networks": networks.get(site_id, [])}
+                for site_id, name in conn.execute(
+                    "SELECT site_id, name FROM sites WHERE target_key = ? AND account_id = ? ORDER BY position",
+                    scope,
+                )
+            ]
+        finally:
+            conn.close()
+
+        return {
+            "accountId": account_id,
+            "savedAt": saved_at,
+            "sites": sites,
+            "remoteIpRanges": loads(remote_ip_ranges) if remote_ip_ranges else {},
+        }
+
+    def site_entries(self, target_key: str, account_id: str) -> list[tuple[str, str, dict[str, Any], str, float]]:
+        """site_topology を埋め直す用に、(site_id, 名前, siteInfo, 内容ハッシュ, 取得時刻) を返す。"""
+        if not self.enabled or not self.path.exists():
+            return []
+
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                "SELECT site_id, name, site_info, content_hash, fetched_at FROM sites"
+                " WHERE target_key = ? AND account_id = ?",
+                (target_key, account_id),
+            ).fetchall()
+        finally:
+            conn.close()
+        return [
+            (site_id, name, loads(site_info), content_hash, fetched_at)
+            for site_id, name, site_info, content_hash, fetched_at in rows
+        ]
+
+    def expire(self, target_key: str) -> None:
+        """target_key の保存内容を「鮮度切れ」にする（Route を追加した後など。表示用には残す）。"""
+        if not self.enabled or not self.path.exists():
+            return
+
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute("UPDATE sites SET fetched_at = 0 WHERE target_key = ?", (target_key,))
+        finally:
+            conn.close()
+
+
+# プロセス全体で共有する保存先
+topology_snapshots = TopologySnapshotStore(TOPOLOGY_DB_PATH, enabled=TOPOLOGY_SNAPSHOT_ENABLED)
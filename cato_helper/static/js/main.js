@@ -26,6 +26,13 @@ document.addEventListener("DOMContentLoaded", () => {
         currentCmaProfileName = null;
     }
 
+    // 選択中のプロファイルのセッションを指定するクエリ（複数テナントに同時ログインできるため）
+    function cmaProfileQuery() {
+        return currentCmaProfileName
+            ? "?profile=" + encodeURIComponent(currentCmaProfileName)
+            : "";
+    }
+
     function setStatusClass(mode) {
         if (!cmaLoginStatus) return;
         cmaLoginStatus.classList.remove(
@@ -72,85 +79,240 @@ document.addEventListener("DOMContentLoaded", () => {
 
 
 
+    // 他のスクリプト（static_route.js など）にログイン状態を知らせる
+    function publishCmaStatus(data) {
+        window.catoCmaStatus = data;
+        document.dispatchEvent(new CustomEvent("cma-status", { detail: data }));
+    }
+
     // CMAログイン状態取得
     async function fetchCmaStatusOnce() {
         if (!cmaLoginStatus) return;
 
         try {
-            const res = await fetch("/cma/status");
+            const res = await fetch("/cma/status" + cmaProfileQuery());
+            if (res.status === 400 && !currentCmaProfileName) {
+                // サーバーモードではプロファイルの指定が必須（未選択なら未ログインとして表示する）
+                applyCmaStatus({ logged_in: false });
+                return;
+            }
             if (!res.ok) {
                 throw new Error("HTTP " + res.status);
             }
             const data = await res.json();
             console.log("CMA status:", data);
+            applyCmaStatus(data);
+        } catch (e) {
+            console.error("CMA status check error", e);
+            cmaLoginStatus.textContent = "状態確認エラー";
+            setStatusClass("login-status-off");
+            isCmaLoggedIn = false;
+            isCmaLoginInProgress = false;
+            updateLogoutButtonState();
+        }
+    }
 
-            if (data.logged_in) {
-                // ★ ログイン済み
-                isCmaLoggedIn = true;
-                isCmaLoginInProgress = false;
+    // /cma/status（または push されたイベント）の内容を画面に反映する
+    function applyCmaStatus(data) {
+        publishCmaStatus(data);
+        if (!cmaLoginStatus) return;
 
-                // ステータスタグには「環境名」を表示する
-                // 1) ログイン時に選択されたプロファイル名（= 環境名）
-                // 2) それが無ければサーバから返る account_display_name
-                // 3) どちらも無ければ従来どおり「ログイン済み」
-                let envLabel = currentCmaProfileName;
-                if (!envLabel && data.account_display_name) {
-                    envLabel = data.account_display_name;
-                }
-                if (!envLabel) {
-                    envLabel = "ログイン済み";
-                }
-                cmaLoginStatus.textContent = envLabel;
-                setStatusClass("login-status-on");
+        if (data.logged_in) {
+            // ★ ログイン済み
+            isCmaLoggedIn = true;
+            isCmaLoginInProgress = false;
 
-                // ログイン済みならプロファイルは “環境名だけ表示”
-                if (currentCmaProfileName && cmaProfileSelect) {
-                    applyLoggedInProfileView();
-                }
+            // ステータスタグには「環境名」を表示する
+            // 1) ログイン時に選択されたプロファイル名（= 環境名）
+            // 2) それが無ければサーバから返る account_display_name
+            // 3) どちらも無ければ従来どおり「ログイン済み」
+            let envLabel = currentCmaProfileName;
+            if (!envLabel && data.account_display_name) {
+                envLabel = data.account_display_name;
+            }
+            if (!envLabel) {
+                envLabel = "ログイン済み";
+            }
+            cmaLoginStatus.textContent = envLabel;
+            setStatusClass("login-status-on");
 
-                if (cmaStatusTimer) {
-                    clearInterval(cmaStatusTimer);
-                    cmaStatusTimer = null;
-                }
+            // ログイン済みならプロファイルは “環境名だけ表示”
+            if (currentCmaProfileName && cmaProfileSelect) {
+                applyLoggedInProfileView();
+            }
 
-                // ★ ログインボタンをグレー見た目に
-                if (cmaLoginButton) {
-                    cmaLoginButton.classList.add("btn-cma-login-logged-in");
-                }
+            if (cmaStatusTimer) {
+                clearInterval(cmaStatusTimer);
+                cmaStatusTimer = null;
+            }
+
+            // ★ ログインボタンをグレー見た目に
+            if (cmaLoginButton) {
+                cmaLoginButton.classList.add("btn-cma-login-logged-in");
+            }
+
+        } else {
+            // 未ログイン or ログイン中
+            isCmaLoggedIn = false;
+
+            // ★ 未ログイン扱いなのでセレクトボックスを表示状態に戻す
+            applyLoggedOutProfileView();
 
+            if (isCmaLoginInProgress) {
+                cmaLoginStatus.textContent = "ログイン中";
+                setStatusClass("login-status-processing");
             } else {
-                // 未ログイン or ログイン中
-                isCmaLoggedIn = false;
+                cmaLoginStatus.textContent = "未ログイン";
+                setStatusClass("login-status-off");
+            }
 
-                // ★ 未ログイン扱いなのでセレクトボックスを表示状態に戻す
-                applyLoggedOutProfileView();
+            // ★ 未ログイン時はグレー見た目クラスを外す
+            if (cmaLoginButton) {
+                cmaLoginButton.classList.remove("btn-cma-login-logged-in");
+            }
+        }
 
-                if (isCmaLoginInProgress) {
-                    cmaLoginStatus.textContent = "ログイン中";
-                    setStatusClass("login-status-processing");
-                } else {
-                    cmaLoginStatus.textContent = "未ログイン";
-                    setStatusClass("login-status-off");
+
+        updateLogoutButtonState();
+    }
+
+    // ==== ログイン状態の push（/cma/events） ====
+    // SSE の接続はサーバーのスレッドを 1 本占有するので、ログインの開始から完了（失敗）までの間だけ繋ぐ。
+    // それ以外のときは /cma/events/poll?wait=0（待たずに返る）を間隔を空けて叩き、
+    // タブが裏に回っている間は叩かない。EventSource が無いブラウザは従来どおりポーリングする
+    const canUseCmaEvents = typeof window.EventSource !== "undefined";
+    const cmaEventTypes = [
+        "login_started",
+        "state_saved",
+        "account_resolved",
+        "login_failed",
+        "expired",
+        "logged_out",
+        "state_changed",
+    ];
+    // ログイン中以外のときにイベントを取りに行く間隔（ミリ秒）
+    const cmaIdlePollInterval = 30000;
+    let cmaEventSource = null;
+    let cmaLastEventId = null;
+
+    function isEventForCurrentProfile(data) {
+        // プロファイル未選択なら、どのセッションのイベントでも反映する
+        return !currentCmaProfileName || !data.profile || data.profile === currentCmaProfileName;
+    }
+
+    function resetLoginButton() {
+        if (!cmaLoginButton) return;
+        cmaLoginButton.disabled = false;
+        cmaLoginButton.textContent = defaultCmaLoginText;
+    }
+
+    function handleCmaEvent(type, data) {
+        if (typeof data.id === "number") {
+            cmaLastEventId = data.id;
+        }
+        if (!isEventForCurrentProfile(data)) return;
+        console.log("CMA event:", type, data);
+
+        switch (type) {
+            case "login_started":
+                isCmaLoginInProgress = true;
+                applyCmaStatus({ logged_in: false });
+                // 別のタブなどで始まったログインも、完了をすぐ受け取れるよう SSE に切り替える
+                connectCmaEvents();
+                break;
+            case "account_resolved":
+                isCmaLoginInProgress = false;
+                disconnectCmaEvents();
+                applyCmaStatus(data.status);
+                resetLoginButton();
+                break;
+            case "state_saved":
+            case "state_changed":
+                // ログイン完了・他のワーカーでの変化は 1 回だけ取り直す
+                // （サーバー側の loginState キャッシュに乗るので、続く account_resolved と合わせても軽い）
+                fetchCmaStatusOnce();
+                break;
+            case "login_failed":
+                isCmaLoginInProgress = false;
+                disconnectCmaEvents();
+                applyCmaStatus({ logged_in: false });
+                if (cmaLoginStatus) {
+                    cmaLoginStatus.textContent = "ログイン失敗";
                 }
+                if (cmaProfileSelect) {
+                    cmaProfileSelect.disabled = false;
+                }
+                resetLoginButton();
+                break;
+            case "expired":
+            case "logged_out":
+                isCmaLoginInProgress = false;
+                disconnectCmaEvents();
+                applyCmaStatus({ logged_in: false });
+                if (cmaProfileSelect) {
+                    cmaProfileSelect.disabled = false;
+                }
+                resetLoginButton();
+                break;
+        }
+    }
 
-                // ★ 未ログイン時はグレー見た目クラスを外す
-                if (cmaLoginButton) {
-                    cmaLoginButton.classList.remove("btn-cma-login-logged-in");
+    // ログイン中だけ SSE で繋ぐ（既に繋いでいれば何もしない）
+    function connectCmaEvents() {
+        if (!canUseCmaEvents || cmaEventSource) return;
+        // 最後に受け取った id 以降を受け取る（ポーリングとの間に起きたイベントも取りこぼさない）
+        const query = cmaLastEventId !== null ? "?since=" + cmaLastEventId : "";
+        const source = new EventSource("/cma/events" + query);
+        cmaEventTypes.forEach((type) => {
+            source.addEventListener(type, (ev) => {
+                try {
+                    handleCmaEvent(type, JSON.parse(ev.data));
+                } catch (e) {
+                    console.warn("CMA event parse error", e);
                 }
-            }
+            });
+        });
+        // 切断時は EventSource が自動で繋ぎ直す（Last-Event-ID で取りこぼしも受け取る）
+        cmaEventSource = source;
+    }
 
+    function disconnectCmaEvents() {
+        if (!cmaEventSource) return;
+        cmaEventSource.close();
+        cmaEventSource = null;
+    }
 
-            updateLogoutButtonState();
+    // ログイン中以外のときのイベント取得（サーバー側で待たないので、スレッドを握らない）
+    async function pollCmaEventsOnce() {
+        if (cmaEventSource || document.hidden) return;
+        try {
+            const query = cmaLastEventId !== null ? "?wait=0&since=" + cmaLastEventId : "";
+            const res = await fetch("/cma/events/poll" + query);
+            if (!res.ok) {
+                throw new Error("HTTP " + res.status);
+            }
+            const data = await res.json();
+            (data.events || []).forEach((event) => handleCmaEvent(event.type, event));
+            if (!cmaEventSource) {
+                cmaLastEventId = data.last_id;
+            }
         } catch (e) {
-            console.error("CMA status check error", e);
-            cmaLoginStatus.textContent = "状態確認エラー";
-            setStatusClass("login-status-off");
-            isCmaLoggedIn = false;
-            isCmaLoginInProgress = false;
-            updateLogoutButtonState();
+            console.warn("CMA event poll error", e);
         }
     }
 
+    function startCmaEventPolling() {
+        if (!canUseCmaEvents) return;
+        pollCmaEventsOnce();
+        setInterval(pollCmaEventsOnce, cmaIdlePollInterval);
+        // 裏に回っていたタブが表に戻ったら、その間の変化をすぐ取りに行く
+        document.addEventListener("visibilitychange", () => {
+            if (!document.hidden) {
+                pollCmaEventsOnce();
+            }
+        });
+    }
+
     // プロファイル一覧読み込み（未ログイン時に選択できるようにする）
     async function loadCmaProfiles() {
         if (!cmaProfileSelect) return;
@@ -201,6 +363,7 @@ document.addEventListener("DOMContentLoaded", () => {
     if (cmaLoginStatus) {
         fetchCmaStatusOnce();
     }
+    startCmaEventPolling();
     loadCmaProfiles();
     updateLogoutButtonState();
 
@@ -239,6 +402,11 @@ document.addEventListener("DOMContentLoaded", () => {
                 }
                 updateLogoutButtonState();
 
+                // SSE を繋ぐときの起点にする id（まだ分からなければ先に取っておく）
+                if (cmaLastEventId === null) {
+                    await pollCmaEventsOnce();
+                }
+
                 const response = await fetch("/cma/login", {
                     method: "POST",
                     headers: {
@@ -257,8 +425,10 @@ document.addEventListener("DOMContentLoaded", () => {
                     cmaLoginButton.disabled = false;
                     cmaLoginButton.textContent = defaultCmaLoginText;
                 } else if (data.status === "started") {
-                    // ログイン中 → 5秒ごとにステータスをポーリング
-                    if (!cmaStatusTimer) {
+                    // ログイン中 → 完了は /cma/events で届く（完了・失敗まで SSE で繋ぐ）。
+                    // EventSource が使えない場合だけ 5秒ごとにステータスをポーリング
+                    connectCmaEvents();
+                    if (!canUseCmaEvents && !cmaStatusTimer) {
                         cmaStatusTimer = setInterval(fetchCmaStatusOnce, 5000);
                     }
                 } else if (data.status === "error") {
@@ -309,7 +479,8 @@ document.addEventListener("DOMContentLoaded", () => {
                     cmaStatusTimer = null;
                 }
 
-                const res = await fetch("/cma/logout", { method: "POST" });
+                // 選択中のプロファイルのセッションだけログアウトする
+                const res = await fetch("/cma/logout" + cmaProfileQuery(), { method: "POST" });
                 if (!res.ok) {
                     throw new Error("ログアウトに失敗しました。");
                 }
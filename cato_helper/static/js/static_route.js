@@ -1,6 +1,14 @@
 // cato_helper/static/js/static_route.js
 
 document.addEventListener("DOMContentLoaded", () => {
+    // トップ画面でログインしたプロファイル（複数テナントに同時ログインできるため、使うセッションを指定する）
+    let cmaProfileName = null;
+    try {
+        cmaProfileName = window.localStorage.getItem("cato_helper_cma_profile_name");
+    } catch (e) {
+        cmaProfileName = null;
+    }
+
     // --- Network / Account タブを CMA ログイン必須にする ---
 
     function attachCmaGuardToLinks() {
@@ -12,8 +20,21 @@ document.addEventListener("DOMContentLoaded", () => {
                 // 通常の画面遷移を一旦止める
                 ev.preventDefault();
 
+                // main.js が /cma/status と /cma/events で把握している状態があればそれを使う
+                const known = window.catoCmaStatus;
+                if (known) {
+                    if (known.logged_in) {
+                        window.location.href = link.getAttribute("href") || "#";
+                    } else {
+                        alert("CMA にログインしてからこのメニューを利用してください。");
+                    }
+                    return;
+                }
+
                 try {
-                    const res = await fetch("/cma/status");
+                    const res = await fetch(
+                        "/cma/status" + (cmaProfileName ? "?profile=" + encodeURIComponent(cmaProfileName) : "")
+                    );
                     if (!res.ok) {
                         throw new Error("HTTP " + res.status);
                     }
@@ -56,71 +77,154 @@ document.addEventListener("DOMContentLoaded", () => {
         }
     }
 
+    // 描画済みの Site ブロック（siteId -> <details>）。再読み込み時の差分描画に使う
+    const siteBlocks = new Map();
+
+    function showNoSitesMessage() {
+        const p = document.createElement("p");
+        p.style.fontSize = "14px";
+        p.style.color = "#666";
+        p.textContent = "Site 情報が見つかりませんでした。";
+        sitesContainer.appendChild(p);
+    }
+
+    // 1 Site 分の <details> ブロックを組み立てる
+    function buildSiteBlock(site) {
+        const details = document.createElement("details");
+        details.className = "static-route-site-block";
+        details.dataset.siteId = site.id;
+
+        const summary = document.createElement("summary");
+        summary.textContent = site.name || `Site (${site.id})`;
+        summary.style.cursor = "pointer";
+        summary.style.padding = "4px 0";
+        summary.style.fontWeight = "600";
+
+        details.appendChild(summary);
+
+        const table = document.createElement("table");
+        table.className = "table";
+        table.innerHTML = `
+            <thead>
+                <tr>
+                    <th>Interface</th>
+                    <th>Type</th>
+                    <th>CIDR</th>
+                    <th>Gateway</th>
+                    <th>VLAN</th>
+                    <th>DHCP</th>
+                    <th>Name</th>
+                </tr>
+            </thead>
+            <tbody>
+                ${
+                    (site.networks || [])
+                        .map(
+                            (n) => `
+                    <tr>
+                        <td>${n.interface_name || ""}</td>
+                        <td>${n.type || ""}</td>
+                        <td>${n.cidr || ""}</td>
+                        <td>${n.gateway || ""}</td>
+                        <td>${n.vlan ?? ""}</td>
+                        <td>${n.dhcp_type || ""}</td>
+                        <td>${n.subnet_name || ""}</td>
+                    </tr>
+                `
+                        )
+                        .join("") ||
+                    `<tr><td colspan="7">Network 情報がありません。</td></tr>`
+                }
+            </tbody>
+        `;
+
+        details.appendChild(table);
+        return details;
+    }
+
+    // ストリーミング取得中に、まだ届いていない Site の仮ブロックを表示する
+    function buildPendingSiteBlock(site) {
+        const details = document.createElement("details");
+        details.className = "static-route-site-block";
+        details.dataset.siteId = site.id;
+
+        const summary = document.createElement("summary");
+        summary.textContent = `${site.name || `Site (${site.id})`}（取得中...）`;
+        summary.style.padding = "4px 0";
+        summary.style.color = "#999";
+
+        details.appendChild(summary);
+        return details;
+    }
+
     function renderSites(sites) {
         if (!sitesContainer) return;
 
         sitesContainer.innerHTML = "";
+        siteBlocks.clear();
 
         if (!sites || !sites.length) {
-            const p = document.createElement("p");
-            p.style.fontSize = "14px";
-            p.style.color = "#666";
-            p.textContent = "Site 情報が見つかりませんでした。";
-            sitesContainer.appendChild(p);
+            showNoSitesMessage();
             return;
         }
 
         sites.forEach((site) => {
-            const details = document.createElement("details");
-            details.className = "static-route-site-block";
-
-            const summary = document.createElement("summary");
-            summary.textContent = site.name || `Site (${site.id})`;
-            summary.style.cursor = "pointer";
-            summary.style.padding = "4px 0";
-            summary.style.fontWeight = "600";
+            const block = buildSiteBlock(site);
+            siteBlocks.set(String(site.id), block);
+            sitesContainer.appendChild(block);
+        });
+    }
 
-            details.appendChild(summary);
+    // Site 一覧（ID / 名前だけ）が届いた時点で、並び順どおりにブロックを並べる。
+    // 描画済みの Site は既存のブロックをそのまま使い、それ以外は仮ブロックにする。
+    // 一覧に無くなった（削除された）Site のブロックはここで消える。
+    function renderPendingSites(sites) {
+        if (!sitesContainer) return;
 
-            const table = document.createElement("table");
-            table.className = "table";
-            table.innerHTML = `
-                <thead>
-                    <tr>
-                        <th>Interface</th>
-                        <th>Type</th>
-                        <th>CIDR</th>
-                        <th>Gateway</th>
-                        <th>VLAN</th>
-                        <th>DHCP</th>
-                        <th>Name</th>
-                    </tr>
-                </thead>
-                <tbody>
-                    ${
-                        (site.networks || [])
-                            .map(
-                                (n) => `
-                        <tr>
-                            <td>${n.interface_name || ""}</td>
-                            <td>${n.type || ""}</td>
-                            <td>${n.cidr || ""}</td>
-                            <td>${n.gateway || ""}</td>
-                            <td>${n.vlan ?? ""}</td>
-                            <td>${n.dhcp_type || ""}</td>
-                            <td>${n.subnet_name || ""}</td>
-                        </tr>
-                    `
-                            )
-                            .join("") ||
-                        `<tr><td colspan="7">Network 情報がありません。</td></tr>`
-                    }
-                </tbody>
-            `;
+        const nextBlocks = new Map();
+        const fragment = document.createDocumentFragment();
 
-            details.appendChild(table);
-            sitesContainer.appendChild(details);
+        (sites || []).forEach((site) => {
+            const siteId = String(site.id);
+            const existing = siteBlocks.get(siteId);
+            if (existing) {
+                nextBlocks.set(siteId, existing);
+                fragment.appendChild(existing);
+            } else {
+                fragment.appendChild(buildPendingSiteBlock(site));
+            }
         });
+
+        sitesContainer.innerHTML = "";
+        siteBlocks.clear();
+        nextBlocks.forEach((block, siteId) => siteBlocks.set(siteId, block));
+
+        if (!sites || !sites.length) {
+            showNoSitesMessage();
+            return;
+        }
+
+        sitesContainer.appendChild(fragment);
+    }
+
+    // 届いた Site のブロックを差し替える。
+    // changed === false で描画済みの場合は、前回から変わっていないので何もしない。
+    function renderSiteAt(index, site, changed) {
+        if (!sitesContainer) return;
+
+        const siteId = String(site.id);
+        const current = sitesContainer.children[index];
+        if (changed === false && current && siteBlocks.get(siteId) === current) {
+            return;
+        }
+
+        const block = buildSiteBlock(site);
+        siteBlocks.set(siteId, block);
+        if (current) {
+            sitesContainer.replaceChild(block, current);
+        } else {
+            sitesContainer.appendChild(block);
+        }
     }
 
     function renderIpRanges(ranges) {
@@ -142,21 +246,97 @@ document.addEventListener("DOMContentLoaded", () => {
         });
     }
 
-    async function fetchStaticRouteInit() {
-        setStatus("データを取得しています...");
+    function showLoginRequired() {
+        setStatus("CMA にログインしてから利用してください。");
         if (sitesContainer) {
+            sitesContainer.innerHTML =
+                '<p style="font-size: 14px; color: #c00;">CMA にログインしてから利用してください。</p>';
+        }
+    }
+
+    // 1 行 1 レコードの NDJSON を読み進め、レコードごとに onRecord を呼ぶ
+    async function readNdjson(res, onRecord) {
+        const reader = res.body.getReader();
+        const decoder = new TextDecoder("utf-8");
+        let buffer = "";
+
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+
+            buffer += decoder.decode(value, { stream: true });
+            let newlineIndex;
+            while ((newlineIndex = buffer.indexOf("\n")) >= 0) {
+                const line = buffer.slice(0, newlineIndex).trim();
+                buffer = buffer.slice(newlineIndex + 1);
+                if (line) {
+                    onRecord(JSON.parse(line));
+                }
+            }
+        }
+
+        const rest = (buffer + decoder.decode()).trim();
+        if (rest) {
+            onRecord(JSON.parse(rest));
+        }
+    }
+
+    function formatAge(seconds) {
+        if (seconds < 60) return "1 分以内";
+        if (seconds < 3600) return `${Math.floor(seconds / 60)} 分前`;
+        if (seconds < 86400) return `${Math.floor(seconds / 3600)} 時間前`;
+        return `${Math.floor(seconds / 86400)} 日前`;
+    }
+
+    // 前回保存したトポロジを表示する。表示できたら取得中の状態表示に添える注記を返す
+    async function showTopologySnapshot() {
+        try {
+            const params = new URLSearchParams();
+            if (cmaProfileName) params.set("profile", cmaProfileName);
+            const query = params.toString();
+
+            const res = await fetch("/api/network/static-route/snapshot" + (query ? "?" + query : ""));
+            if (!res.ok) return "";
+            const json = await res.json();
+            if (json.status !== "ok") return "";
+
+            renderSites(json.sites || []);
+            renderIpRanges(json.remoteIpRanges || {});
+            return `（表示中のデータは ${formatAge(json.snapshot.ageSeconds)} に保存したものです）`;
+        } catch (e) {
+            console.error("topology snapshot error", e);
+            return "";
+        }
+    }
+
+    // forceRefresh = true のときはサーバ側のキャッシュを使わずに取り直す
+    async function fetchStaticRouteInit(forceRefresh = false) {
+        // 初回は前回保存したデータを先に表示し、その間に最新の情報を取得する
+        let snapshotNote = "";
+        if (!forceRefresh && !siteBlocks.size) {
+            snapshotNote = await showTopologySnapshot();
+        }
+
+        setStatus("データを取得しています..." + snapshotNote);
+        if (sitesContainer && !siteBlocks.size) {
+            // 初回だけ「取得中」表示にする（再読み込み時は描画済みの内容を残す）
             sitesContainer.innerHTML =
                 '<p style="font-size: 14px; color: #666;">データ取得中...</p>';
         }
 
+        // ReadableStream が使えないブラウザでは、従来どおり一括取得にする
+        const canStream = typeof ReadableStream !== "undefined" && typeof TextDecoder !== "undefined";
+
         try {
-            const res = await fetch("/api/network/static-route/init");
+            const params = new URLSearchParams();
+            if (forceRefresh) params.set("refresh", "1");
+            if (canStream) params.set("stream", "ndjson");
+            if (cmaProfileName) params.set("profile", cmaProfileName);
+            const query = params.toString();
+
+            const res = await fetch("/api/network/static-route/init" + (query ? "?" + query : ""));
             if (res.status === 401) {
-                setStatus("CMA にログインしてから利用してください。");
-                if (sitesContainer) {
-                    sitesContainer.innerHTML =
-                        '<p style="font-size: 14px; color: #c00;">CMA にログインしてから利用してください。</p>';
-                }
+                showLoginRequired();
                 return;
             }
             if (!res.ok) {
@@ -164,25 +344,388 @@ document.addEventListener("DOMContentLoaded", () => {
                 return;
             }
 
-            const json = await res.json();
-            if (json.status !== "ok") {
-                setStatus("データ取得に失敗しました: " + (json.message || "Unknown error"));
+            const contentType = res.headers.get("Content-Type") || "";
+            if (!canStream || !res.body || !contentType.includes("ndjson")) {
+                const json = await res.json();
+                if (json.status !== "ok") {
+                    setStatus("データ取得に失敗しました: " + (json.message || "Unknown error"));
+                    return;
+                }
+
+                renderSites(json.sites || []);
+                renderIpRanges(json.remoteIpRanges || {});
+                setStatus("データ取得が完了しました。");
                 return;
             }
 
-            renderSites(json.sites || []);
-            renderIpRanges(json.remoteIpRanges || {});
-            setStatus("データ取得が完了しました。");
+            // ストリーミング: IP Range → 各 Site の順に、届いたものから描画する
+            let total = 0;
+            let received = 0;
+            const errors = [];
+            let changes = null;
+
+            await readNdjson(res, (record) => {
+                switch (record.type) {
+                    case "meta":
+                        total = record.siteCount || 0;
+                        renderPendingSites(record.sites || []);
+                        setStatus(`Site 情報を取得しています... (0 / ${total})` + snapshotNote);
+                        break;
+                    case "ipRanges":
+                        renderIpRanges(record.remoteIpRanges || {});
+                        break;
+                    case "site":
+                        received += 1;
+                        renderSiteAt(record.index, record.site, record.changed);
+                        setStatus(`Site 情報を取得しています... (${received} / ${total})` + snapshotNote);
+                        break;
+                    case "error":
+                        errors.push(record.message);
+                        break;
+                    case "done":
+                        changes = record.changes || null;
+                        break;
+                    default:
+                        break;
+                }
+            });
+
+            if (errors.length) {
+                setStatus("一部のデータ取得に失敗しました: " + errors.join(" / "));
+            } else if (forceRefresh && changes) {
+                const added = (changes.added || []).length;
+                const removed = (changes.removed || []).length;
+                const updated = (changes.updated || []).length;
+                setStatus(
+                    `データ取得が完了しました。（追加 ${added} / 削除 ${removed} / 変更 ${updated}）`
+                );
+            } else {
+                setStatus("データ取得が完了しました。");
+            }
         } catch (e) {
             console.error("static route init error", e);
             setStatus("データ取得中にエラーが発生しました。");
         }
     }
 
+    // --- IP / CIDR 検索（既存の Subnet / Gateway / IP Range との重なり） ---
+
+    const lookupForm = document.getElementById("prefix-lookup-form");
+    const lookupInput = document.getElementById("prefix-lookup-input");
+    const lookupResult = document.getElementById("prefix-lookup-result");
+
+    const LOOKUP_KIND_LABELS = {
+        subnet: "Subnet",
+        gateway: "Gateway",
+        remoteIpRange: "IP Range",
+    };
+
+    function describeLookupEntry(entry) {
+        if (entry.kind === "remoteIpRange") {
+            return entry.label || entry.rangeType || "";
+        }
+        return [entry.siteName, entry.interfaceName, entry.subnetName].filter(Boolean).join(" / ");
+    }
+
+    // 問い合わせとの関係: 一致 / 含む（問い合わせより広い）/ 含まれる（問い合わせより狭い）
+    function lookupRelation(entry, queryLength) {
+        const length = Number(String(entry.prefix).split("/")[1]);
+        if (length === queryLength) return "一致";
+        return length < queryLength ? "含む" : "含まれる";
+    }
+
+    function renderLookupResults(results) {
+        if (!lookupResult) return;
+        lookupResult.innerHTML = "";
+
+        results.forEach((result) => {
+            const heading = document.createElement("div");
+            heading.style.fontWeight = "600";
+            heading.style.marginTop = "8px";
+            heading.textContent = result.query;
+            lookupResult.appendChild(heading);
+
+            const overlaps = result.overlaps || [];
+            if (!overlaps.length) {
+                const p = document.createElement("p");
+                p.style.color = "#080";
+                p.textContent = "重なる Subnet / Gateway / IP Range はありません。";
+                lookupResult.appendChild(p);
+                return;
+            }
+
+            const queryLength = Number(String(result.query).split("/")[1]);
+            const table = document.createElement("table");
+            table.className = "table";
+            const tbody = document.createElement("tbody");
+            overlaps.forEach((entry) => {
+                const tr = document.createElement("tr");
+                [
+                    lookupRelation(entry, queryLength),
+                    LOOKUP_KIND_LABELS[entry.kind] || entry.kind,
+                    entry.prefix,
+                    describeLookupEntry(entry),
+                ].forEach((text) => {
+                    const td = document.createElement("td");
+                    td.textContent = text;
+                    tr.appendChild(td);
+                });
+                tbody.appendChild(tr);
+            });
+            table.appendChild(tbody);
+            lookupResult.appendChild(table);
+        });
+    }
+
+    async function lookupPrefixes(text) {
+        const queries = text.split(/[\s,]+/).filter(Boolean);
+        if (!queries.length || !lookupResult) return;
+
+        const params = new URLSearchParams();
+        queries.forEach((q) => params.append("q", q));
+        if (cmaProfileName) params.set("profile", cmaProfileName);
+
+        lookupResult.textContent = "検索しています...";
+        try {
+            const res = await fetch("/api/network/prefix-lookup?" + params.toString());
+            const json = await res.json();
+            if (!res.ok || json.status !== "ok") {
+                lookupResult.textContent = "検索に失敗しました: " + (json.message || "HTTP " + res.status);
+                return;
+            }
+            renderLookupResults(json.results || []);
+        } catch (e) {
+            console.error("prefix lookup error", e);
+            lookupResult.textContent = "検索中にエラーが発生しました。";
+        }
+    }
+
+    if (lookupForm && lookupInput) {
+        lookupForm.addEventListener("submit", (ev) => {
+            ev.preventDefault();
+            lookupPrefixes(lookupInput.value);
+        });
+    }
+
+    // --- Static Route 一括インポート（検証 → Site ごとのバッチ適用） ---
+
+    const importForm = document.getElementById("route-import-form");
+    const importFile = document.getElementById("route-import-file");
+    const importStrict = document.getElementById("route-import-strict");
+    const importApplyBtn = document.getElementById("route-import-apply");
+    const importStatus = document.getElementById("route-import-status");
+    const importProgress = document.getElementById("route-import-progress");
+    const importRows = document.getElementById("route-import-rows");
+
+    // 問題のある行の表に出す最大件数
+    const IMPORT_MAX_LISTED_ROWS = 200;
+
+    const IMPORT_STATE_LABELS = {
+        pending: "未適用",
+        applied: "追加済み",
+        failed: "失敗",
+        skipped: "対象外",
+        unknown: "結果不明",
+    };
+
+    let importJobId = null;
+    let importRowsByIndex = new Map();
+
+    function setImportStatus(message) {
+        if (importStatus) importStatus.textContent = message;
+    }
+
+    function describeImportJob(job) {
+        const v = job.validation || {};
+        const s = job.states || {};
+        return (
+            `${job.source || "アップロード"}: ${job.rowCount} 行` +
+            `（検証 ok ${v.ok || 0} / warning ${v.warning || 0} / error ${v.error || 0}）` +
+            ` 追加済み ${s.applied || 0} / 未適用 ${s.pending || 0} / 失敗 ${s.failed || 0} / 対象外 ${s.skipped || 0}` +
+            // 送信中に中断された行（次の「適用」で CMA 側にあるか確認してから送り直す）
+            (s.unknown ? ` / 結果不明 ${s.unknown}` : "")
+        );
+    }
+
+    // 追加済み以外で、理由のある行（error / warning / 失敗）だけを表にする
+    function renderImportRows() {
+        if (!importRows) return;
+        importRows.innerHTML = "";
+
+        const rows = [...importRowsByIndex.values()].filter(
+            (row) => row.state !== "applied" && (row.state !== "pending" || row.status === "warning")
+        );
+        if (!rows.length) return;
+
+        const table = document.createElement("table");
+        table.className = "table";
+        const thead = document.createElement("thead");
+        thead.innerHTML =
+            "<tr><th>行</th><th>宛先</th><th>次ホップ</th><th>Site</th><th>状態</th><th>理由</th></tr>";
+        table.appendChild(thead);
+
+        const tbody = document.createElement("tbody");
+        rows.slice(0, IMPORT_MAX_LISTED_ROWS).forEach((row) => {
+            const reasons = (row.issues || []).map((issue) => issue.message);
+            if (row.message) reasons.push(row.message);
+
+            const tr = document.createElement("tr");
+            [
+                row.line,
+                row.destination || "-",
+                row.nextHop || "-",
+                row.targetSiteName || row.siteName || row.siteId || "-",
+                IMPORT_STATE_LABELS[row.state] || row.state,
+                reasons.join(" / "),
+            ].forEach((text) => {
+                const td = document.createElement("td");
+                td.textContent = text;
+                tr.appendChild(td);
+            });
+            tbody.appendChild(tr);
+        });
+        table.appendChild(tbody);
+        importRows.appendChild(table);
+
+        if (rows.length > IMPORT_MAX_LISTED_ROWS) {
+            const p = document.createElement("p");
+            p.style.color = "#666";
+            p.textContent = `ほか ${rows.length - IMPORT_MAX_LISTED_ROWS} 行`;
+            importRows.appendChild(p);
+        }
+    }
+
+    function updateImportJob(job) {
+        const s = job.states || {};
+        setImportStatus(describeImportJob(job));
+        if (importApplyBtn) importApplyBtn.disabled = !((s.pending || 0) + (s.failed || 0) + (s.unknown || 0));
+    }
+
+    async function uploadRoutes() {
+        const file = importFile && importFile.files[0];
+        if (!file) {
+            setImportStatus("ファイルを選択してください。");
+            return;
+        }
+
+        const params = new URLSearchParams();
+        if (importStrict && importStrict.checked) params.set("strict", "1");
+        if (cmaProfileName) params.set("profile", cmaProfileName);
+        const body = new FormData();
+        body.append("file", file);
+
+        importJobId = null;
+        if (importApplyBtn) importApplyBtn.disabled = true;
+        if (importProgress) importProgress.style.display = "none";
+        setImportStatus("読み込んで検証しています...");
+        try {
+            const res = await fetch("/api/network/static-route/import?" + params.toString(), {
+                method: "POST",
+                body,
+            });
+            const json = await res.json();
+            if (!res.ok || json.status !== "ok") {
+                setImportStatus("取り込みに失敗しました: " + (json.message || "HTTP " + res.status));
+                return;
+            }
+            importJobId = json.job.jobId;
+            importRowsByIndex = new Map((json.rows || []).map((row) => [row.index, row]));
+            updateImportJob(json.job);
+            renderImportRows();
+        } catch (e) {
+            console.error("route import error", e);
+            setImportStatus("取り込み中にエラーが発生しました。");
+        }
+    }
+
+    function applyImportRecord(record) {
+        if (record.type === "plan") {
+            if (importProgress) {
+                importProgress.max = Math.max(1, record.rowCount);
+                importProgress.value = 0;
+                importProgress.style.display = "";
+            }
+            setImportStatus(`${record.siteCount} Site / ${record.rowCount} 行を追加しています...`);
+        } else if (record.type === "batch") {
+            record.rows.forEach((update) => {
+                const row = importRowsByIndex.get(update.index);
+                if (row) Object.assign(row, update);
+            });
+            if (importProgress) importProgress.value = record.progress.done;
+            setImportStatus(`追加しています... ${record.progress.done} / ${record.progress.total} 行`);
+        } else if (record.type === "done") {
+            updateImportJob(record.job);
+            if (record.stopped) {
+                setImportStatus(
+                    describeImportJob(record.job) + "（CMA 側のエラーが続いたため中断しました。時間をおいて再開してください）"
+                );
+            }
+            renderImportRows();
+        } else if (record.type === "error") {
+            setImportStatus("適用に失敗しました: " + record.message);
+        }
+    }
+
+    async function applyImportJob() {
+        if (!importJobId) return;
+
+        const canStream = typeof ReadableStream !== "undefined" && typeof TextDecoder !== "undefined";
+        const params = new URLSearchParams();
+        if (canStream) params.set("stream", "ndjson");
+        if (cmaProfileName) params.set("profile", cmaProfileName);
+
+        if (importApplyBtn) importApplyBtn.disabled = true;
+        setImportStatus("適用を開始しています...");
+        try {
+            const res = await fetch(
+                `/api/network/static-route/import/${encodeURIComponent(importJobId)}/apply?` + params.toString(),
+                { method: "POST" }
+            );
+            if (!res.ok || !canStream) {
+                const json = await res.json();
+                if (!res.ok || json.status !== "ok") {
+                    setImportStatus("適用に失敗しました: " + (json.message || "HTTP " + res.status));
+                    if (importApplyBtn) importApplyBtn.disabled = false;
+                    return;
+                }
+                // 一括応答には行ごとの結果が無いので、ジョブを取り直して表示する
+                const detail = await (
+                    await fetch(`/api/network/static-route/import/${encodeURIComponent(importJobId)}?` + params.toString())
+                ).json();
+                importRowsByIndex = new Map((detail.rows || []).map((row) => [row.index, row]));
+                applyImportRecord({ type: "done", job: json.job, stopped: json.stopped });
+            } else {
+                await readNdjson(res, applyImportRecord);
+            }
+        } catch (e) {
+            console.error("route import apply error", e);
+            setImportStatus("適用中にエラーが発生しました。もう一度「適用」を押すと残りから再開します。");
+            if (importApplyBtn) importApplyBtn.disabled = false;
+        }
+
+        // 追加した Route を一覧に反映する
+        fetchStaticRouteInit(true);
+    }
+
+    if (importForm) {
+        importForm.addEventListener("submit", (ev) => {
+            ev.preventDefault();
+            uploadRoutes();
+        });
+    }
+
+    if (importApplyBtn) {
+        importApplyBtn.addEventListener("click", (ev) => {
+            ev.preventDefault();
+            applyImportJob();
+        });
+    }
+
     if (reloadBtn) {
         reloadBtn.addEventListener("click", (ev) => {
             ev.preventDefault();
-            fetchStaticRouteInit();
+            // 再読み込みボタンは常に CMA から取り直す
+            fetchStaticRouteInit(true);
         });
     }
 
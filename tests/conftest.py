@@ -0,0 +1,87 @@
+﻿# tests/conftest.py
+"""テスト共通の fixture。
+
+リポジトリ直下で ``python -m pytest`` を実行する（cato_helper を import できるように）。
+CMA には繋がず、GraphQL は devtools.cma_simulator の Flask アプリに投げる。
+"""
+
+from __future__ import annotations
+
+import types
+from typing import Any, Callable
+
+import pytest
+
+from cato_helper.devtools.cma_simulator import SyntheticTopology, create_simulator_app
+
+
+class FakeClock:
+    """time.monotonic / time.time / time.sleep の代わり。sleep は待たずに時計を進める。"""
+
+    def __init__(self, start: float = 1000.0) -> None:
+        self.now = start
+        self.sleeps: list[float] = []
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def time(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+    def advance(self, seconds: float) -> None:
+        self.now += seconds
+
+
+@pytest.fixture
+def fake_clock(monkeypatch: pytest.MonkeyPatch) -> Callable[[Any], FakeClock]:
+    """fake_clock(module) で、そのモジュールが使う time を FakeClock に差し替える。"""
+    clock = FakeClock()
+
+    def install(module: Any) -> FakeClock:
+        monkeypatch.setattr(
+            module,
+            "time",
+            types.SimpleNamespace(monotonic=clock.monotonic, time=clock.time, sleep=clock.sleep),
+        )
+        return clock
+
+    return install
+
+
+class SimulatorGraphQLClient:
+    """cma_graphql_client.CmaGraphQLClient の代わりに、シミュレータへ GraphQL を投げる。"""
+
+    def __init__(self, http: Any) -> None:
+        self.http = http
+        self.calls: list[tuple[str | None, dict[str, Any]]] = []
+
+    async def execute(
+        self,
+        query: str,
+        variables: dict[str, Any] | None = None,
+        operation_name: str | None = None,
+        *,
+        raise_on_errors: bool = True,
+    ) -> dict[str, Any]:
+        self.calls.append((operation_name, dict(variables or {})))
+        resp = self.http.post(
+            "/api/v1/graphql",
+            json={"query": query, "variables": variables or {}, "operationName": operation_name},
+        )
+        return resp.get_json()
+
+
+@pytest.fixture
+def topology() -> SyntheticTopology:
+    # Site 5 件 × Interface 2 × Subnet 2（10.0.0.0/24 から順に重ならない /24）
+    return SyntheticTopology(sites=5, interfaces=2, subnets=2)
+
+
+@pytest.fixture
+def simulator_client(topology: SyntheticTopology) -> SimulatorGraphQLClient:
+    app = create_simulator_app(topology, seed=0)
+    return SimulatorGraphQLClient(app.test_client())
@@ -0,0 +1,197 @@
+﻿# tests/test_cma_cache.py
+from __future__ import annotations
+
+import asyncio
+from typing import Any
+
+from cato_helper.services import cma_cache
+from cato_helper.services.cma_cache import GraphQLResponseCache, make_cache_key
+
+
+def _key(tenant: str = "t1", name: str = "op", variables: dict[str, Any] | None = None) -> tuple[str, ...]:
+    return make_cache_key(tenant, "acc", name, variables)
+
+
+class _Loader:
+    """呼ばれた回数を数え、呼ばれるたびに違う値を返す loader。"""
+
+    def __init__(self, prefix: str = "v") -> None:
+        self.prefix = prefix
+        self.calls = 0
+
+    async def __call__(self) -> str:
+        self.calls += 1
+        return f"{self.prefix}{self.calls}"
+
+
+def _cache(**kwargs: Any) -> GraphQLResponseCache:
+    options: dict[str, Any] = {"operation_ttls": {"op": 10.0}, "stale_seconds": 5.0, "enabled": True}
+    options.update(kwargs)
+    return GraphQLResponseCache(**options)
+
+
+def test_make_cache_key_normalizes_variable_order() -> None:
+    assert make_cache_key("t", "a", "op", {"b": 1, "a": 2}) == make_cache_key("t", "a", "op", {"a": 2, "b": 1})
+    assert make_cache_key("t", None, "op", None) == ("t", "", "op", "{}")
+
+
+def test_hit_within_ttl_and_reload_after_stale_window(fake_clock: Any) -> None:
+    clock = fake_clock(cma_cache)
+    cache = _cache()
+    loader = _Loader()
+
+    async def run() -> None:
+        assert await cache.aget_or_load(_key(), "op", loader) == "v1"
+        clock.advance(9)
+        assert await cache.aget_or_load(_key(), "op", loader) == "v1"
+        assert loader.calls == 1
+        # TTL（10 秒）+ stale（5 秒）を過ぎたら、その場で取り直す
+        clock.advance(7)
+        assert await cache.aget_or_load(_key(), "op", loader) == "v2"
+        assert loader.calls == 2
+
+    asyncio.run(run())
+
+
+def test_stale_while_revalidate_returns_old_value_and_refreshes_once(fake_clock: Any) -> None:
+    clock = fake_clock(cma_cache)
+    cache = _cache()
+    loader = _Loader()
+
+    async def run() -> None:
+        await cache.aget_or_load(_key(), "op", loader)
+        clock.advance(12)
+        # 古い値を返し、裏の取り直しは 1 キーにつき 1 本だけ
+        assert await cache.aget_or_load(_key(), "op", loader) == "v1"
+        assert await cache.aget_or_load(_key(), "op", loader) == "v1"
+        await asyncio.gather(*cache._refresh_tasks)
+        assert loader.calls == 2
+        assert await cache.aget_or_load(_key(), "op", loader) == "v2"
+
+    asyncio.run(run())
+
+
+def test_force_refresh_and_should_cache() -> None:
+    cache = _cache()
+    loader = _Loader()
+
+    async def run() -> None:
+        await cache.aget_or_load(_key(), "op", loader)
+        assert await cache.aget_or_load(_key(), "op", loader, force_refresh=True) == "v2"
+        assert await cache.aget_or_load(_key(), "op", loader) == "v2"
+
+        # should_cache が False の値は保存しない
+        other = _Loader("e")
+        await cache.aget_or_load(_key(name="op", variables={"x": 1}), "op", other, should_cache=lambda v: False)
+        await cache.aget_or_load(_key(name="op", variables={"x": 1}), "op", other, should_cache=lambda v: False)
+        assert other.calls == 2
+
+    asyncio.run(run())
+
+
+def test_disabled_and_zero_ttl_bypass_cache() -> None:
+    disabled = _cache(enabled=False)
+    no_ttl = _cache(operation_ttls={"op": 0.0})
+    loader = _Loader()
+
+    async def run() -> None:
+        for cache in (disabled, no_ttl):
+            await cache.aget_or_load(_key(), "op", loader)
+            await cache.aget_or_load(_key(), "op", loader)
+
+    asyncio.run(run())
+    assert loader.calls == 4
+
+
+def test_lru_evicts_least_recently_used() -> None:
+    cache = _cache(max_entries=2)
+
+    async def run() -> None:
+        a, b, c = _Loader("a"), _Loader("b"), _Loader("c")
+        await cache.aget_or_load(_key(variables={"k": "a"}), "op", a)
+        await cache.aget_or_load(_key(variables={"k": "b"}), "op", b)
+        # a を使ったので、次に追い出されるのは b
+        await cache.aget_or_load(_key(variables={"k": "a"}), "op", a)
+        await cache.aget_or_load(_key(variables={"k": "c"}), "op", c)
+        await cache.aget_or_load(_key(variables={"k": "a"}), "op", a)
+        await cache.aget_or_load(_key(variables={"k": "b"}), "op", b)
+        assert (a.calls, b.calls, c.calls) == (1, 2, 1)
+
+    asyncio.run(run())
+
+
+def test_byte_bound_evicts_and_skips_oversized_values() -> None:
+    # 1 件あたり JSON で約 1000 バイトの値を 2 件分まで
+    cache = _cache(max_bytes=2100)
+    value = "x" * 1000
+
+    async def load() -> str:
+        return value
+
+    async def run() -> None:
+        for k in range(3):
+            await cache.aget_or_load(_key(variables={"k": k}), "op", load)
+        assert len(cache._entries) == 2
+        assert cache._total_bytes <= 2100
+        assert _key(variables={"k": 0}) not in cache._entries
+
+        async def huge() -> str:
+            return "y" * 5000
+
+        await cache.aget_or_load(_key(variables={"k": "huge"}), "op", huge)
+        assert _key(variables={"k": "huge"}) not in cache._entries
+        assert len(cache._entries) == 2
+
+    asyncio.run(run())
+
+
+def test_invalidate_tenant_drops_only_that_tenant() -> None:
+    cache = _cache()
+
+    async def run() -> None:
+        await cache.aget_or_load(_key("t1"), "op", _Loader())
+        await cache.aget_or_load(_key("t2"), "op", _Loader())
+        cache.invalidate("t1")
+        assert _key("t1") not in cache._entries
+        assert _key("t2") in cache._entries
+        cache.invalidate()
+        assert not cache._entries
+        assert cache._total_bytes == 0
+
+    asyncio.run(run())
+
+
+def test_in_flight_load_respects_per_tenant_generation() -> None:
+    cache = _cache()
+
+    async def run() -> None:
+        release = asyncio.Event()
+
+        def blocking(value: str) -> Any:
+            async def load() -> str:
+                await release.wait()
+                return value
+
+            return load
+
+        t1 = asyncio.ensure_future(cache.aget_or_load(_key("t1"), "op", blocking("old-t1")))
+        t2 = asyncio.ensure_future(cache.aget_or_load(_key("t2"), "op", blocking("t2")))
+        await asyncio.sleep(0)
+        # t1 の取得中に t1 だけ消去した。t1 の古い結果は保存せず、t2 の結果は保存する
+        cache.invalidate("t1")
+        release.set()
+        assert await t1 == "old-t1"
+        assert await t2 == "t2"
+        assert _key("t1") not in cache._entries
+        assert cache._entries[_key("t2")].value == "t2"
+
+        # 全体の消去では、どのテナントの取得中の結果も保存しない
+        release.clear()
+        t3 = asyncio.ensure_future(cache.aget_or_load(_key("t3"), "op", blocking("t3")))
+        await asyncio.sleep(0)
+        cache.invalidate()
+        release.set()
+        await t3
+        assert _key("t3") not in cache._entries
+
+    asyncio.run(run())
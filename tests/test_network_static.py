@@ -0,0 +1,97 @@
+﻿# tests/test_network_static.py
+from __future__ import annotations
+
+import asyncio
+from typing import Any
+
+import pytest
+
+from cato_helper.modules.api import network_static
+from cato_helper.services.cma_cache import GraphQLResponseCache
+from cato_helper.services.cma_session import CmaTarget
+
+_TARGET = CmaTarget("simulator", "test")
+
+
+@pytest.fixture
+def graphql(monkeypatch: pytest.MonkeyPatch, simulator_client: Any) -> Any:
+    """network_static の GraphQL をシミュレータに向け、キャッシュとレスポンス保存を切り離す。"""
+    monkeypatch.setattr(network_static, "get_graphql_client", lambda target: simulator_client)
+    monkeypatch.setattr(network_static, "save_response", lambda name, body: None)
+    monkeypatch.setattr(network_static, "response_cache", GraphQLResponseCache(enabled=True))
+    return simulator_client
+
+
+class _FixedClient:
+    """決まった応答を返す GraphQL クライアント（部分的なエラーの形を作るため）。"""
+
+    def __init__(self, body: dict[str, Any]) -> None:
+        self.body = body
+
+    async def execute(self, query: str, variables: Any = None, operation_name: Any = None, **kwargs: Any) -> Any:
+        return self.body
+
+
+def _fetch(site_ids: list[str], force_refresh: bool = False) -> dict[str, Any]:
+    return asyncio.run(network_static._fetch_site_info_batch(_TARGET, site_ids, "acc", force_refresh))
+
+
+def test_batch_maps_aliases_back_to_sites(graphql: Any) -> None:
+    site_ids = ["100003", "100000", "100004"]
+    results = _fetch(site_ids)
+    assert list(results) == site_ids
+    assert {site_id: info["id"] for site_id, info in results.items()} == {s: s for s in site_ids}
+    assert results["100000"]["interfaces"][0]["subnets"][0]["subnet"]["id"] == "10.0.0.0/24"
+
+    # 1 リクエストで、s0..sN の順に id0..idN を送っている
+    assert graphql.calls == [("siteInfoBatch", {"id0": "100003", "id1": "100000", "id2": "100004"})]
+
+
+def test_batch_attributes_errors_to_the_failing_site(graphql: Any) -> None:
+    results = _fetch(["100001", "999", "100002"])
+    assert results["100001"]["id"] == "100001"
+    assert results["100002"]["id"] == "100002"
+    assert isinstance(results["999"], RuntimeError)
+    assert "999" in str(results["999"])
+
+
+def test_batch_uses_path_head_for_nested_errors(monkeypatch: pytest.MonkeyPatch) -> None:
+    body = {
+        "data": {"s0": {"id": "1"}, "s1": None, "s2": None},
+        "errors": [
+            # エイリアスより深い path でも、先頭のエイリアスの Site に振り分ける
+            {"message": "interface lookup failed", "path": ["s1", "interfaces", 0]},
+            {"message": "upstream timeout"},
+        ],
+    }
+    monkeypatch.setattr(network_static, "get_graphql_client", lambda target: _FixedClient(body))
+    monkeypatch.setattr(network_static, "save_response", lambda name, body: None)
+    monkeypatch.setattr(network_static, "response_cache", GraphQLResponseCache(enabled=True))
+
+    results = _fetch(["1", "2", "3"])
+    assert results["1"] == {"id": "1"}
+    assert str(results["2"]) == "interface lookup failed"
+    # path の無いエラーは、データが返らなかった Site に付ける
+    assert str(results["3"]) == "upstream timeout"
+
+
+def test_single_site_uses_plain_site_info(graphql: Any) -> None:
+    results = _fetch(["100002"])
+    assert results["100002"]["name"] == "SIM-Site-0002"
+    assert graphql.calls == [("siteInfo", {"siteId": "100002"})]
+
+    # 見つからない Site は例外オブジェクトで返す（呼び出し側でエラー行にする）
+    assert isinstance(_fetch(["999"])["999"], Exception)
+
+
+def test_batch_responses_are_cached_unless_partial(graphql: Any) -> None:
+    _fetch(["100000", "100001"])
+    _fetch(["100000", "100001"])
+    assert len(graphql.calls) == 1
+    _fetch(["100000", "100001"], force_refresh=True)
+    assert len(graphql.calls) == 2
+
+    # 一部の Site がエラーの応答はキャッシュしない
+    _fetch(["100000", "999"])
+    _fetch(["100000", "999"])
+    assert len(graphql.calls) == 4
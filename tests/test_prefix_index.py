@@ -0,0 +1,89 @@
+﻿# tests/test_prefix_index.py
+from __future__ import annotations
+
+import pytest
+
+from cato_helper.services.prefix_index import PrefixIndex, build_prefix_index, format_prefix, parse_prefix
+
+
+def _prefixes(entries: list) -> list[str]:
+    return [e.prefix for e in entries]
+
+
+@pytest.fixture
+def index() -> PrefixIndex:
+    index = PrefixIndex()
+    for prefix in ("10.0.0.0/8", "10.1.0.0/16", "10.1.2.0/24", "10.2.0.0/16", "192.168.0.0/24", "2001:db8::/32"):
+        index.add(prefix, "subnet", {"name": prefix})
+    return index
+
+
+def test_parse_prefix() -> None:
+    assert parse_prefix("10.0.0.0/24") == (4, 0x0A000000, 24)
+    # ホスト部が立っていてもネットワークとして扱う。/ が無ければホスト
+    assert parse_prefix("10.0.0.1/24") == parse_prefix("10.0.0.0/24")
+    assert parse_prefix("10.0.0.1") == (4, 0x0A000001, 32)
+    version, key, length = parse_prefix("2001:db8::1/32")
+    assert (version, length) == (6, 32)
+    assert format_prefix(version, key, length) == "2001:db8::/32"
+    for bad in ("", "10.0.0.0/33", "10.0.0.256", "not-an-ip"):
+        with pytest.raises(ValueError):
+            parse_prefix(bad)
+
+
+def test_covering_returns_shorter_prefixes_in_order(index: PrefixIndex) -> None:
+    assert _prefixes(index.covering("10.1.2.0/24")) == ["10.0.0.0/8", "10.1.0.0/16", "10.1.2.0/24"]
+    assert _prefixes(index.covering("10.1.2.3")) == ["10.0.0.0/8", "10.1.0.0/16", "10.1.2.0/24"]
+    assert _prefixes(index.covering("10.3.0.0/16")) == ["10.0.0.0/8"]
+    assert index.covering("172.16.0.0/12") == []
+
+
+def test_longest_match(index: PrefixIndex) -> None:
+    assert _prefixes(index.longest_match("10.1.2.200")) == ["10.1.2.0/24"]
+    assert _prefixes(index.longest_match("10.1.9.1")) == ["10.1.0.0/16"]
+    assert _prefixes(index.longest_match("2001:db8:1::1")) == ["2001:db8::/32"]
+    assert index.longest_match("11.0.0.1") == []
+
+
+def test_covered_and_overlaps(index: PrefixIndex) -> None:
+    assert _prefixes(index.covered("10.0.0.0/8")) == ["10.0.0.0/8", "10.1.0.0/16", "10.1.2.0/24", "10.2.0.0/16"]
+    assert _prefixes(index.covered("10.1.0.0/15")) == ["10.1.0.0/16", "10.1.2.0/24"]
+    # 含む側 → 含まれる側の順。同じ長さのものは含まれる側に 1 回だけ入る
+    assert _prefixes(index.overlaps("10.1.0.0/16")) == ["10.0.0.0/8", "10.1.0.0/16", "10.1.2.0/24"]
+    assert index.overlaps("192.168.1.0/24") == []
+    assert _prefixes(index.overlaps("192.168.0.128/25")) == ["192.168.0.0/24"]
+
+
+def test_families_are_separate(index: PrefixIndex) -> None:
+    assert len(index) == 6
+    assert _prefixes(index.entries(6)) == ["2001:db8::/32"]
+    assert index.covering("::/0") == []
+
+
+def test_lookup(index: PrefixIndex) -> None:
+    result = index.lookup("10.1.2.0/25")
+    assert result["query"] == "10.1.2.0/25"
+    assert [e["prefix"] for e in result["longest"]] == ["10.1.2.0/24"]
+    assert [e["prefix"] for e in result["overlaps"]] == ["10.0.0.0/8", "10.1.0.0/16", "10.1.2.0/24"]
+    assert result["covered"] == []
+
+
+def test_build_prefix_index_from_sites() -> None:
+    sites = [
+        {
+            "id": "1",
+            "name": "Tokyo",
+            "networks": [
+                {"interface_id": "if1", "cidr": "10.0.1.0/24", "gateway": "10.0.1.1/24"},
+                {"interface_id": "if1", "cidr": "bogus", "gateway": None},
+            ],
+        },
+        "not-a-site",
+    ]
+    index = build_prefix_index(sites, {"default": "172.16.0.0/16", "static": None})
+    kinds = sorted((e.kind, e.prefix) for e in index.entries(4))
+    assert kinds == [("gateway", "10.0.1.1/32"), ("remoteIpRange", "172.16.0.0/16"), ("subnet", "10.0.1.0/24")]
+    subnet = index.longest_match("10.0.1.50")[0]
+    assert subnet.owner["siteName"] == "Tokyo"
+    remote = index.covering("172.16.3.4")[0]
+    assert remote.owner["label"] == "Default IP Range"
@@ -0,0 +1,202 @@
+﻿# tests/test_resilience.py
+from __future__ import annotations
+
+import asyncio
+import itertools
+from email.utils import formatdate
+from typing import Any
+
+import pytest
+
+from cato_helper.services import resilience
+from cato_helper.services.resilience import (
+    CircuitBreaker,
+    CircuitOpenError,
+    RetryPolicy,
+    TokenBucket,
+    acall_with_retry,
+    call_with_retry,
+    parse_retry_after,
+)
+
+# バックオフは 0 秒（待ち時間は Retry-After の分だけになる）
+_POLICY = RetryPolicy(max_attempts=4, base_delay=0.0, max_delay=0.0, retry_after_max=30.0)
+
+_keys = itertools.count()
+
+
+def _key() -> str:
+    # レート制限・サーキットブレーカーは key ごとにプロセス全体で共有されるので、テストごとに分ける
+    return f"test-resilience-{next(_keys)}"
+
+
+class _Resp:
+    def __init__(self, status_code: int, headers: dict[str, str] | None = None) -> None:
+        self.status_code = status_code
+        self.headers = headers or {}
+
+
+class _Sender:
+    """決めた順にレスポンス（または例外）を返す送信処理。"""
+
+    def __init__(self, *outcomes: Any) -> None:
+        self.outcomes = list(outcomes)
+        self.attempts: list[int] = []
+
+    def __call__(self, attempt: int) -> Any:
+        self.attempts.append(attempt)
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, BaseException):
+            raise outcome
+        return outcome
+
+
+def test_parse_retry_after(fake_clock: Any) -> None:
+    clock = fake_clock(resilience)
+    assert parse_retry_after("3") == 3.0
+    assert parse_retry_after("-1") == 0.0
+    assert parse_retry_after(None) is None
+    assert parse_retry_after("soon") is None
+    assert parse_retry_after(formatdate(clock.now + 10, usegmt=True)) == pytest.approx(10, abs=1)
+
+
+def test_retries_5xx_then_returns_success(fake_clock: Any) -> None:
+    clock = fake_clock(resilience)
+    send = _Sender(_Resp(502), _Resp(503), _Resp(200))
+    resp = call_with_retry(send, key=_key(), retry_on=(ConnectionError,), policy=_POLICY)
+    assert resp.status_code == 200
+    assert send.attempts == [0, 1, 2]
+    assert clock.sleeps == [0.0, 0.0]
+
+
+def test_retry_after_is_honored_and_capped(fake_clock: Any) -> None:
+    clock = fake_clock(resilience)
+    send = _Sender(_Resp(429, {"Retry-After": "2"}), _Resp(200))
+    assert call_with_retry(send, key=_key(), retry_on=(), policy=_POLICY).status_code == 200
+    assert clock.sleeps == [2.0]
+
+    # retry_after_max より長い Retry-After は待たずに、その応答を返す
+    send = _Sender(_Resp(429, {"Retry-After": "120"}))
+    assert call_with_retry(send, key=_key(), retry_on=(), policy=_POLICY).status_code == 429
+    assert send.attempts == [0]
+
+
+def test_gives_up_after_max_attempts(fake_clock: Any) -> None:
+    fake_clock(resilience)
+    send = _Sender(*[_Resp(500)] * 3)
+    policy = RetryPolicy(max_attempts=3, base_delay=0.0, max_delay=0.0)
+    assert call_with_retry(send, key=_key(), retry_on=(), policy=policy).status_code == 500
+    assert send.attempts == [0, 1, 2]
+
+
+def test_non_idempotent_retries_only_rejected_statuses(fake_clock: Any) -> None:
+    fake_clock(resilience)
+    # 500 は処理されたかもしれないので再送しない
+    send = _Sender(_Resp(500))
+    assert call_with_retry(send, key=_key(), retry_on=(), idempotent=False, policy=_POLICY).status_code == 500
+    assert send.attempts == [0]
+
+    # 503 / 429 は処理前に断られているので再送する
+    send = _Sender(_Resp(503), _Resp(200))
+    assert call_with_retry(send, key=_key(), retry_on=(), idempotent=False, policy=_POLICY).status_code == 200
+
+    # 送信後の通信エラーは再送しない
+    send = _Sender(ConnectionError("reset"))
+    with pytest.raises(ConnectionError):
+        call_with_retry(send, key=_key(), retry_on=(ConnectionError,), idempotent=False, policy=_POLICY)
+    assert send.attempts == [0]
+
+
+def test_connection_errors_are_retried_when_idempotent(fake_clock: Any) -> None:
+    fake_clock(resilience)
+    send = _Sender(ConnectionError("reset"), _Resp(200))
+    assert call_with_retry(send, key=_key(), retry_on=(ConnectionError,), policy=_POLICY).status_code == 200
+
+    # retry_on に無い例外はそのまま投げる
+    send = _Sender(ValueError("bug"))
+    with pytest.raises(ValueError):
+        call_with_retry(send, key=_key(), retry_on=(ConnectionError,), policy=_POLICY)
+
+
+def test_async_retry(monkeypatch: pytest.MonkeyPatch) -> None:
+    sleeps: list[float] = []
+
+    async def fake_sleep(seconds: float) -> None:
+        sleeps.append(seconds)
+
+    monkeypatch.setattr(resilience.asyncio, "sleep", fake_sleep)
+    outcomes = [_Resp(429, {"Retry-After": "1"}), _Resp(200)]
+
+    async def send(attempt: int) -> Any:
+        return outcomes.pop(0)
+
+    resp = asyncio.run(acall_with_retry(send, key=_key(), retry_on=(), policy=_POLICY))
+    assert resp.status_code == 200
+    assert sleeps == [1.0]
+
+
+def test_token_bucket_allows_burst_then_spaces_calls(fake_clock: Any) -> None:
+    clock = fake_clock(resilience)
+    bucket = TokenBucket(rate=10, burst=3)
+    assert [bucket.reserve() for _ in range(3)] == [0.0, 0.0, 0.0]
+    # 4 件目以降は 1/rate 秒ずつ先の分を予約する
+    assert bucket.reserve() == pytest.approx(0.1)
+    assert bucket.reserve() == pytest.approx(0.2)
+    clock.advance(1.0)
+    assert bucket.reserve() == 0.0
+
+    assert TokenBucket(rate=0, burst=1).reserve() == 0.0
+
+
+def test_circuit_breaker_transitions(fake_clock: Any) -> None:
+    clock = fake_clock(resilience)
+    breaker = CircuitBreaker(_key(), failure_threshold=3, reset_seconds=30)
+    for _ in range(2):
+        breaker.before_call()
+        breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    with pytest.raises(CircuitOpenError) as excinfo:
+        breaker.before_call()
+    assert excinfo.value.retry_in == pytest.approx(30)
+
+    # reset_seconds 経過後は試しの 1 件だけ通す
+    clock.advance(30)
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    breaker.before_call()
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+    # 試しが失敗したら開き直す
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+
+    clock.advance(30)
+    breaker.before_call()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.before_call()
+
+
+def test_circuit_breaker_stops_retries_and_rejects_calls(fake_clock: Any, monkeypatch: pytest.MonkeyPatch) -> None:
+    fake_clock(resilience)
+    key = _key()
+    monkeypatch.setitem(resilience._breakers, key, CircuitBreaker(key, failure_threshold=2, reset_seconds=30))
+    send = _Sender(_Resp(500), _Resp(500), _Resp(500))
+    # 2 回目の失敗でサーキットが開いたら、それ以上は再送しない
+    assert call_with_retry(send, key=key, retry_on=(), policy=_POLICY).status_code == 500
+    assert send.attempts == [0, 1]
+    assert resilience.circuit_state(key) == CircuitBreaker.OPEN
+
+    with pytest.raises(CircuitOpenError):
+        call_with_retry(_Sender(_Resp(200)), key=key, retry_on=(), policy=_POLICY)
+
+
+def test_429_does_not_count_as_failure(fake_clock: Any) -> None:
+    fake_clock(resilience)
+    key = _key()
+    send = _Sender(*[_Resp(429, {"Retry-After": "0"})] * 4)
+    call_with_retry(send, key=key, retry_on=(), policy=_POLICY)
+    assert resilience.circuit_state(key) == CircuitBreaker.CLOSED
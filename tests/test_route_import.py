@@ -0,0 +1,279 @@
+﻿# tests/test_route_import.py
+from __future__ import annotations
+
+import asyncio
+import io
+from pathlib import Path
+from typing import Any
+
+import pytest
+
+from cato_helper.services.prefix_index import PrefixIndex, build_prefix_index
+from cato_helper.services.route_import import (
+    APPLIED,
+    FAILED,
+    PENDING,
+    SKIPPED,
+    UNKNOWN,
+    ImportRowValidator,
+    RouteImportJob,
+    RouteImportStore,
+    apply_job,
+    detect_import_format,
+    iter_import_rows,
+)
+from cato_helper.services.resilience import CircuitOpenError
+
+
+def _rows(data: bytes, fmt: str) -> list[tuple[int, dict[str, Any] | None, str | None]]:
+    return list(iter_import_rows(io.BytesIO(data), fmt))
+
+
+@pytest.fixture
+def index() -> PrefixIndex:
+    sites = [
+        {"id": "1", "name": "Tokyo", "networks": [{"interface_id": "if1", "cidr": "10.0.1.0/24", "gateway": "10.0.1.1"}]},
+        {"id": "2", "name": "Osaka", "networks": [{"interface_id": "if2", "cidr": "10.0.2.0/24", "gateway": "10.0.2.1"}]},
+    ]
+    return build_prefix_index(sites, {})
+
+
+@pytest.fixture
+def store(tmp_path: Path) -> RouteImportStore:
+    return RouteImportStore(tmp_path)
+
+
+def _job(*routes: tuple[str, str], state: str = PENDING) -> RouteImportJob:
+    """適用先まで決まった行を持つジョブ（routes は (宛先, Site ID)）。"""
+    job = RouteImportJob("20260101-000000-abcdef", "tenant", "acc")
+    for line, (destination, site_id) in enumerate(routes, start=2):
+        row = job.add_row(line, {"destination": destination, "nextHop": "10.0.1.254"})
+        row.update(state=state, status="ok", targetSiteId=site_id, interfaceId=f"if{site_id}")
+    return job
+
+
+def _apply(job: RouteImportJob, index: PrefixIndex, send: Any, store: RouteImportStore, **kwargs: Any) -> list[dict[str, Any]]:
+    async def run() -> list[dict[str, Any]]:
+        return [record async for record in apply_job(job, index, send, store=store, **kwargs)]
+
+    return asyncio.run(run())
+
+
+# --- 形式の判定と読み込み ---
+
+
+def test_detect_import_format() -> None:
+    assert detect_import_format(None, "routes.CSV") == "csv"
+    assert detect_import_format("application/x-ndjson; charset=utf-8", "upload") == "ndjson"
+    assert detect_import_format("text/csv", "routes.json") == "json"
+    assert detect_import_format("text/csv", None, requested="NDJSON") == "ndjson"
+    with pytest.raises(ValueError):
+        detect_import_format("application/octet-stream", "routes.bin")
+    with pytest.raises(ValueError):
+        detect_import_format(None, None, requested="xml")
+
+
+def test_csv_rows_use_column_aliases() -> None:
+    data = (
+        "﻿Subnet,Gateway,Site Name,Route Name\n"
+        "192.168.50.0/24, 10.0.1.254 ,Tokyo,to-dc\n"
+        ",,,\n"
+        "192.168.51.0/24,10.0.1.254,Tokyo,x,extra\n"
+    ).encode("utf-8")
+    rows = _rows(data, "csv")
+    assert rows[0] == (
+        2,
+        {"destination": "192.168.50.0/24", "nextHop": "10.0.1.254", "siteName": "Tokyo", "name": "to-dc"},
+        None,
+    )
+    # 空行は飛ばし、列が多すぎる行はエラーにする（行番号はファイルの行）
+    assert rows[1][0] == 4
+    assert rows[1][1] is None and rows[1][2]
+    assert len(rows) == 2
+
+
+def test_ndjson_rows_report_bad_lines() -> None:
+    data = b'{"destination": "192.168.50.0/24", "next_hop": "10.0.1.254", "siteId": 1}\n\nnot json\n'
+    rows = _rows(data, "ndjson")
+    assert rows[0] == (1, {"destination": "192.168.50.0/24", "nextHop": "10.0.1.254", "siteId": 1}, None)
+    assert rows[1][0] == 3
+    assert rows[1][1] is None and "JSON" in rows[1][2]
+
+
+def test_json_rows_accept_list_or_routes_key() -> None:
+    listed = _rows(b'[{"destination": "192.168.50.0/24"}, 5]', "json")
+    assert listed[0] == (1, {"destination": "192.168.50.0/24"}, None)
+    assert listed[1][0] == 2 and listed[1][1] is None
+    wrapped = _rows(b'{"routes": [{"subnet": "192.168.50.0/24"}]}', "json")
+    assert wrapped == [(1, {"destination": "192.168.50.0/24"}, None)]
+    with pytest.raises(ValueError):
+        _rows(b'{"routes": ', "json")
+    with pytest.raises(ValueError):
+        _rows(b'{"other": []}', "json")
+
+
+def test_read_rows_reads_in_chunks() -> None:
+    job = RouteImportJob("20260101-000000-abcdef", "tenant", "acc")
+    lines = "".join(f'{{"destination": "192.168.{i}.0/24"}}\n' for i in range(5)).encode()
+    rows = iter_import_rows(io.BytesIO(lines), "ndjson")
+    assert [len(job.read_rows(rows, 2)) for _ in range(4)] == [2, 2, 1, 0]
+    assert [row["index"] for row in job.rows] == [0, 1, 2, 3, 4]
+
+
+# --- 検証 ---
+
+
+def test_validator_detects_duplicates_across_chunks(index: PrefixIndex) -> None:
+    job = RouteImportJob("20260101-000000-abcdef", "tenant", "acc")
+    validator = ImportRowValidator(index)
+    first = [
+        job.add_row(2, {"destination": "192.168.50.0/24", "nextHop": "10.0.1.254", "siteName": "Tokyo"}),
+        job.add_row(3, {"destination": "192.168.60.0/24", "nextHop": "10.0.2.254"}),
+    ]
+    validator.validate(first)
+    second = [
+        job.add_row(4, {"destination": "192.168.50.0/24", "nextHop": "10.0.1.254"}),
+        job.add_row(5, {"destination": "192.168.60.128/25", "nextHop": "10.0.2.254"}),
+        job.add_row(6, {"destination": "192.168.70.0/24", "nextHop": "10.0.1.254", "siteName": "Nagoya"}),
+    ]
+    validator.validate(second)
+
+    assert first[0]["siteId"] == "1"
+    assert [(r["state"], r["targetSiteId"], r["interfaceId"]) for r in first] == [
+        (PENDING, "1", "if1"),
+        (PENDING, "2", "if2"),
+    ]
+
+    duplicate, overlap, unknown_site = second
+    assert [i["code"] for i in duplicate["issues"]] == ["duplicate_in_batch"]
+    assert duplicate["issues"][0]["message"].startswith("2 行目")
+    assert duplicate["state"] == SKIPPED
+    assert [i["code"] for i in overlap["issues"]] == ["overlaps_in_batch"]
+    assert overlap["issues"][0]["other"] == first[1]["index"]
+    assert (overlap["status"], overlap["state"]) == ("warning", PENDING)
+    assert "unknown_site" in {i["code"] for i in unknown_site["issues"]}
+    assert unknown_site["state"] == SKIPPED
+
+
+def test_strict_validator_skips_warnings(index: PrefixIndex) -> None:
+    job = RouteImportJob("20260101-000000-abcdef", "tenant", "acc", strict=True)
+    validator = ImportRowValidator(index, strict=True)
+    rows = [
+        job.add_row(2, {"destination": "192.168.50.0/24", "nextHop": "10.0.1.254"}),
+        job.add_row(3, {"destination": "192.168.50.0/25", "nextHop": "10.0.1.254"}),
+        job.add_row(4, None, "列が多すぎます。"),
+    ]
+    validator.validate(rows)
+    assert [r["state"] for r in rows] == [PENDING, SKIPPED, SKIPPED]
+    assert [i["code"] for i in rows[2]["issues"]] == ["invalid_row"]
+
+
+# --- 適用 ---
+
+
+def test_apply_sends_batches_and_saves(index: PrefixIndex, store: RouteImportStore) -> None:
+    job = _job(("192.168.50.0/24", "1"), ("192.168.51.0/24", "1"), ("192.168.52.0/24", "1"), ("192.168.60.0/24", "2"))
+    sent: list[tuple[str, list[str]]] = []
+
+    async def send(site_id: str, batch: list[dict[str, Any]]) -> list[tuple[str | None, str | None]]:
+        sent.append((site_id, [row["destination"] for row in batch]))
+        return [(f"nr-{row['index']}", None) if row["index"] != 1 else (None, "rejected") for row in batch]
+
+    records = _apply(job, index, send, store, batch_size=2)
+    assert records[0]["type"] == "plan"
+    assert (records[0]["batchCount"], records[0]["rowCount"]) == (3, 4)
+    assert records[-1]["type"] == "done"
+    assert records[-1]["job"]["states"] == {PENDING: 0, APPLIED: 3, FAILED: 1, SKIPPED: 0, UNKNOWN: 0}
+    assert sorted(sent) == [
+        ("1", ["192.168.50.0/24", "192.168.51.0/24"]),
+        ("1", ["192.168.52.0/24"]),
+        ("2", ["192.168.60.0/24"]),
+    ]
+    assert job.rows[1]["message"] == "rejected"
+    assert store.load(job.job_id).summary()["states"][APPLIED] == 3
+
+
+def test_missing_results_mark_rows_failed(index: PrefixIndex, store: RouteImportStore) -> None:
+    job = _job(("192.168.50.0/24", "1"), ("192.168.51.0/24", "1"), ("192.168.52.0/24", "1"))
+
+    async def send(site_id: str, batch: list[dict[str, Any]]) -> list[tuple[str | None, str | None]]:
+        return [("nr-0", None)]
+
+    records = _apply(job, index, send, store, batch_size=3)
+    assert [row["state"] for row in job.rows] == [APPLIED, FAILED, FAILED]
+    assert job.rows[2]["message"]
+    assert records[-2]["progress"] == {"done": 3, "total": 3}
+
+
+def test_cancelled_batch_marks_rows_unknown(index: PrefixIndex, store: RouteImportStore) -> None:
+    job = _job(("192.168.50.0/24", "1"), ("192.168.51.0/24", "1"), ("192.168.60.0/24", "2"))
+    started = asyncio.Event()
+
+    async def send(site_id: str, batch: list[dict[str, Any]]) -> list[tuple[str | None, str | None]]:
+        started.set()
+        # 応答が返らないうちにクライアントが切断する
+        await asyncio.Event().wait()
+        return []
+
+    async def run() -> None:
+        async def consume() -> None:
+            async for _record in apply_job(job, index, send, store=store, batch_size=10):
+                pass
+
+        task = asyncio.ensure_future(consume())
+        await started.wait()
+        await asyncio.sleep(0)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(run())
+    assert {row["state"] for row in job.rows} == {UNKNOWN}
+    assert all(row["message"] for row in job.rows)
+    # 切断時もジョブは保存され、再開時に unknown の行が対象になる
+    saved = store.load(job.job_id)
+    assert saved.summary()["states"][UNKNOWN] == 3
+    assert len(saved.applicable_rows()) == 3
+
+
+def test_resume_rechecks_unknown_rows(index: PrefixIndex, store: RouteImportStore) -> None:
+    job = _job(("192.168.50.0/24", "1"), ("192.168.51.0/24", "1"), ("192.168.60.0/24", "2"), state=UNKNOWN)
+    job.rows.append({**job.rows[0], "index": 3, "destination": "192.168.99.0/24", "state": APPLIED})
+    # 切断前に 192.168.50.0/24 だけは CMA に反映されていた
+    index.add("192.168.50.0/24", "subnet", {"siteId": "1", "siteName": "Tokyo"})
+    sent: list[str] = []
+
+    async def send(site_id: str, batch: list[dict[str, Any]]) -> list[tuple[str | None, str | None]]:
+        sent.extend(row["destination"] for row in batch)
+        return [("nr", None)] * len(batch)
+
+    records = _apply(job, index, send, store)
+    plan = records[0]
+    assert (plan["unknownRechecked"], plan["alreadyPresent"], plan["rowCount"]) == (3, 1, 2)
+    assert sorted(sent) == ["192.168.51.0/24", "192.168.60.0/24"]
+    assert [row["state"] for row in job.rows] == [APPLIED] * 4
+    assert job.rows[0]["message"] == "既に登録済みです。"
+
+
+def test_same_prefix_on_another_site_is_not_already_present(index: PrefixIndex, store: RouteImportStore) -> None:
+    job = _job(("192.168.50.0/24", "2"), state=UNKNOWN)
+    index.add("192.168.50.0/24", "subnet", {"siteId": "1"})
+    sent: list[str] = []
+
+    async def send(site_id: str, batch: list[dict[str, Any]]) -> list[tuple[str | None, str | None]]:
+        sent.append(site_id)
+        return [("nr", None)]
+
+    _apply(job, index, send, store)
+    assert sent == ["2"]
+
+
+def test_circuit_open_stops_remaining_batches(index: PrefixIndex, store: RouteImportStore) -> None:
+    job = _job(("192.168.50.0/24", "1"), ("192.168.51.0/24", "1"))
+
+    async def send(site_id: str, batch: list[dict[str, Any]]) -> list[tuple[str | None, str | None]]:
+        raise CircuitOpenError("cma", 30)
+
+    records = _apply(job, index, send, store, batch_size=1)
+    assert records[-1]["stopped"] is True
+    assert [row["state"] for row in job.rows] == [PENDING, PENDING]
@@ -0,0 +1,82 @@
+﻿# tests/test_route_validation.py
+from __future__ import annotations
+
+from typing import Any
+
+import pytest
+
+from cato_helper.services.prefix_index import PrefixIndex, build_prefix_index
+from cato_helper.services.route_validation import ERROR, OK, WARNING, RouteConflictChecker
+
+
+@pytest.fixture
+def index() -> PrefixIndex:
+    sites = [
+        {"id": "1", "name": "Tokyo", "networks": [{"interface_id": "if1", "cidr": "10.0.1.0/24", "gateway": "10.0.1.1"}]},
+        {"id": "2", "name": "Osaka", "networks": [{"interface_id": "if2", "cidr": "10.0.2.0/24", "gateway": "10.0.2.1"}]},
+    ]
+    return build_prefix_index(sites, {"default": "172.16.0.0/16"})
+
+
+# (宛先, 次ホップ, 指定した Site, 期待する判定コード)
+_CASES: list[tuple[str, str | None, str | None, set[str]]] = [
+    ("192.168.50.0/24", "10.0.1.254", "1", set()),
+    ("10.0.2.0/24", "10.0.1.254", None, {"duplicate_site_subnet"}),
+    ("10.0.1.0/25", "10.0.1.254", None, {"overlaps_site_subnet"}),
+    ("172.16.5.0/24", "10.0.1.254", None, {"overlaps_remote_ip_range"}),
+    ("192.168.50.0/24", "10.0.1.254", None, {"duplicate_in_batch"}),
+    ("192.168.50.0/25", "10.0.1.254", None, {"overlaps_in_batch"}),
+    ("192.168.60.0/24", "10.9.9.9", None, {"next_hop_not_local"}),
+    ("192.168.61.0/24", "10.0.1.1", None, {"next_hop_is_gateway"}),
+    ("192.168.62.0/24", "10.0.2.5", "1", {"next_hop_other_site"}),
+    ("192.168.63.0/24", "192.168.63.1", None, {"next_hop_in_destination", "next_hop_not_local"}),
+    ("192.168.64.0/24", None, None, {"missing_next_hop"}),
+    ("192.168.65.0/24", "2001:db8::1", None, {"invalid_next_hop"}),
+    ("nope", "10.0.1.254", None, {"invalid_destination"}),
+]
+
+
+def _routes() -> list[dict[str, Any]]:
+    return [{"destination": d, "nextHop": h, "siteId": s} for d, h, s, _ in _CASES]
+
+
+@pytest.mark.parametrize("use_numpy", [True, False])
+def test_issue_codes(index: PrefixIndex, use_numpy: bool) -> None:
+    report = RouteConflictChecker(index, use_numpy=use_numpy).check(_routes())
+    codes = [{issue["code"] for issue in result["issues"]} for result in report["results"]]
+    assert codes == [expected for *_, expected in _CASES]
+
+
+def test_statuses_and_summary(index: PrefixIndex) -> None:
+    report = RouteConflictChecker(index).check(_routes())
+    statuses = [result["status"] for result in report["results"]]
+    assert statuses[0] == OK
+    # Route 同士の重なり・次ホップが Gateway は警告、それ以外は error
+    assert statuses[5] == WARNING
+    assert statuses[7] == WARNING
+    assert statuses[1] == ERROR
+    assert report["summary"] == {
+        "total": len(_CASES),
+        OK: statuses.count(OK),
+        WARNING: statuses.count(WARNING),
+        ERROR: statuses.count(ERROR),
+    }
+
+
+def test_next_hop_subnet_and_conflict_details(index: PrefixIndex) -> None:
+    results = RouteConflictChecker(index).check(_routes())["results"]
+    owner = results[0]["nextHopSubnet"]
+    assert (owner["prefix"], owner["siteId"], owner["interfaceId"]) == ("10.0.1.0/24", "1", "if1")
+
+    conflict = results[1]["issues"][0]["conflicts"][0]
+    assert (conflict["prefix"], conflict["siteName"]) == ("10.0.2.0/24", "Osaka")
+
+    duplicate = results[4]["issues"][0]
+    assert duplicate["other"] == 0
+    assert results[0]["destination"] == "192.168.50.0/24"
+
+
+def test_destination_is_normalized(index: PrefixIndex) -> None:
+    result = RouteConflictChecker(index).check([{"destination": "192.168.70.9/24", "nextHop": "10.0.1.254"}])
+    assert result["results"][0]["destination"] == "192.168.70.0/24"
+    assert result["results"][0]["status"] == OK
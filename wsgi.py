@@ -0,0 +1,13 @@
+﻿# wsgi.py
+"""WSGI サーバー（gunicorn / waitress-serve など）から読み込むエントリポイント。
+
+例::
+
+    gunicorn -w 4 --threads 8 -b 0.0.0.0:5000 wsgi:app
+    waitress-serve --threads 8 --listen 0.0.0.0:5000 wsgi:app
+"""
+from cato_helper import create_app
+from cato_helper.config import ServerConfig
+
+# サーバーモード（/shutdown と終了ボタンを無効にする）
+app = create_app(ServerConfig)